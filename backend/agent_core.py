@@ -1,20 +1,40 @@
 import os
 import sys
+import json
+import time
+import hashlib
 import logging
 import google.generativeai as genai
 import contextvars
-from typing import List, Dict, Optional, Any
+from typing import List, Dict, Optional, Any, Tuple
 from database import FirestoreClient
 from utils import GEMINI_NATIVE_MIME_TYPES, TEXT_PARSABLE_MIME_TYPES
 from services.calendar_service import calendar_service
+from services.tool_runtime import ToolContext, ToolRuntime
+from services.transcript_service import transcript_service, parse_video_id
+from services.video_matcher import VideoMatcher
+from services.token_budget import ContextAssembler, estimate_tokens, TOOL_DECLARATION_TOKENS
+from services.metrics import KNOWLEDGE_REFRESH, MODEL_FALLBACK_REPLIES, record_model_call
+from services.tracing import tracer
+from services.response_cache import ResponseCache
+from services.model_router import ModelRouter
+from services.model_client import ModelClient, FALLBACK_REPLY
+from services.usage_tracker import usage_tracker
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 # Context Variable for User ID
+# Legacy: only used when tools are invoked directly. The chat loop passes a ToolContext explicitly.
 user_context = contextvars.ContextVar("user_context", default=None)
 
+# Maximum number of model round trips spent on function calls for a single user message
+MAX_TOOL_ROUNDS = 5
+
+# Reply-model calls that must answer in text (last tool round, follow-ups)
+NO_TOOL_CALLS = {"function_calling_config": {"mode": "NONE"}}
+
 DEFAULT_IDENTITY = """
 1. IDENTIDADE E MISSÃO (CAP. 5)
 Você é o "André Digital", a Extensão Oficial da Autoridade e do Método Dólarize 2.0.
@@ -132,8 +152,8 @@ Instruction for the Agent: "Se a dúvida for sobre como fazer Pix, diga: 'No Mó
   -> POSTURA: "André tem uma reunião às 14h, mas consigo te encaixar às 15:30. Funciona para você?"
 
 9. INTEGRAÇÃO DE VÍDEOS (YOUTUBE TRANSCRIPTION)
-Você tem acesso a um catálogo dinâmico de vídeos da "Central de Vídeos Inteligente" (fornecido na seção CATÁLOGO DE VÍDEOS abaixo, se disponível).
-- Você DEVE monitorar a conversa para identificar se o contexto (trigger_context) de algum dos vídeos disponíveis foi atingido.
+Você tem acesso a um catálogo dinâmico de vídeos da "Central de Vídeos Inteligente". Os vídeos relevantes para cada mensagem são fornecidos junto com ela no bloco VÍDEOS CANDIDATOS PARA ESTA MENSAGEM, se houver.
+- Você DEVE verificar se o contexto (Gatilho) de algum dos vídeos candidatos foi atingido.
 - Se o gatilho for atingido E o usuário for classificado como Perfil A ou Perfil B, você DEVE:
   1. Usar a ferramenta `recommend_video(video_id)` para obter o link do vídeo.
   2. Recomendar o vídeo de forma entusiasmada.
@@ -144,6 +164,103 @@ Você tem acesso a um catálogo dinâmico de vídeos da "Central de Vídeos Inte
 # Define the Base System Prompt for "André Digital"
 SYSTEM_PROMPT = DEFAULT_IDENTITY + DEFAULT_PERSONALITY + DEFAULT_NUCLEAR + DEFAULT_LOGIC
 
+# --- Internal analysis models ---
+# Lean instructions + native JSON schemas for the internal calls (see ModelRouter.register_profile).
+# The transcript goes in the user turn; everything static lives here and is sent once per model.
+
+_NULLABLE_STRING = {"type": "string", "nullable": True}
+
+QUALIFICATION_INSTRUCTION = """
+Você analisa conversas entre André Digital (mentor da Dolarize) e leads interessados em dolarização.
+Com base no histórico recebido, extraia:
+- dor_principal: o que mais incomoda o usuário.
+- maturidade: Iniciante, Já investe ou Avançado.
+- compromisso: se busca um método ou é apenas curiosidade.
+- classificacao_lead: "Perfil A (Qualificado/Quente)", "Perfil B (Morno/Em educação)" ou "Perfil C (Frio/Curioso)".
+Se não houver informação suficiente para algum campo, use null.
+"""
+
+QUALIFICATION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "dor_principal": _NULLABLE_STRING,
+        "maturidade": _NULLABLE_STRING,
+        "compromisso": _NULLABLE_STRING,
+        "classificacao_lead": {
+            "type": "string",
+            "format": "enum",
+            "enum": ["Perfil A (Qualificado/Quente)", "Perfil B (Morno/Em educação)", "Perfil C (Frio/Curioso)"],
+            "nullable": True
+        },
+    },
+    "required": ["dor_principal", "maturidade", "compromisso", "classificacao_lead"],
+}
+
+STRATEGY_INSTRUCTION = """
+Você gera insights para o time de vendas da Dolarize a partir do histórico de conversa de um lead:
+- summary: resumo de 3 frases da interação até agora.
+- objection: por que o lead ainda não comprou (ex: preço, medo, falta de tempo, desconfiança).
+- sales_angle: como o vendedor humano deve abordar este lead para fechar a venda (específico e tático).
+"""
+
+STRATEGY_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "summary": {"type": "string"},
+        "objection": {"type": "string"},
+        "sales_angle": {"type": "string"},
+    },
+    "required": ["summary", "objection", "sales_angle"],
+}
+
+EXTRACTION_INSTRUCTION = """
+Extraia da mensagem do usuário:
+- nome: apenas se o usuário se apresentar (ex: "Sou o João", "Me chamo Maria").
+- email: apenas se houver um e-mail válido.
+Use null para o que não estiver na mensagem.
+"""
+
+EXTRACTION_SCHEMA = {
+    "type": "object",
+    "properties": {"nome": _NULLABLE_STRING, "email": _NULLABLE_STRING},
+    "required": ["nome", "email"],
+}
+
+SUMMARY_INSTRUCTION = """
+Você mantém o resumo interno das conversas entre André Digital (mentor da Dolarize) e um usuário.
+Responda APENAS com o texto do resumo, em terceira pessoa.
+"""
+
+
+def _json_profile(instruction: str, schema: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "system_instruction": instruction.strip(),
+        "generation_config": {"response_mime_type": "application/json", "response_schema": schema, "temperature": 0.2},
+    }
+
+
+ANALYSIS_PROFILES = {
+    "qualification": _json_profile(QUALIFICATION_INSTRUCTION, QUALIFICATION_SCHEMA),
+    "insights": _json_profile(STRATEGY_INSTRUCTION, STRATEGY_SCHEMA),
+    "extraction": _json_profile(EXTRACTION_INSTRUCTION, EXTRACTION_SCHEMA),
+    "summary": {"system_instruction": SUMMARY_INSTRUCTION.strip()},
+}
+
+
+def parse_json_response(text: str) -> Dict[str, Any]:
+    """
+    Parses the JSON answer of an analysis model. Schema-constrained responses are plain
+    JSON; a markdown code fence is tolerated for models/routes without schema support.
+    """
+    text = (text or "").strip()
+    if text.startswith("```"):
+        text = text.split("\n", 1)[1] if "\n" in text else ""
+        text = text.rsplit("```", 1)[0]
+    result = json.loads(text)
+    if not isinstance(result, dict):
+        raise ValueError(f"Expected a JSON object, got {type(result).__name__}")
+    return result
+
 def initialize_genai() -> bool:
     """
     Initializes the Google Generative AI client with robust error handling and telemetry.
@@ -199,27 +316,50 @@ class AgentCore:
         self.db = None
         self.model = None
         self.video_catalogue = {}
+        self.video_matcher = VideoMatcher()
         self.active_knowledge_files = []
         self.active_persona_files = []
+        self.tool_runtime = ToolRuntime()
+        self.context_assembler = ContextAssembler()
+        self.system_tokens = estimate_tokens(SYSTEM_PROMPT)
+        self.response_cache = ResponseCache()
+        # Lean models for internal purposes; genai is resolved at call time so tests can patch it
+        self.model_client = ModelClient()
+        self.router = ModelRouter(model_factory=lambda **kwargs: genai.GenerativeModel(**kwargs))
+        for purpose, profile in ANALYSIS_PROFILES.items():
+            self.router.register_profile(purpose, **profile)
+        # Reply models (system prompt + tools) by model name, for the response fallback chain
+        self._reply_model_kwargs: Dict[str, Any] = {"system_instruction": SYSTEM_PROMPT}
+        self._reply_models: Dict[str, Any] = {}
 
         try:
             self.db = FirestoreClient()
         except Exception as e:
             logger.error(f"Failed to initialize FirestoreClient in AgentCore: {e}")
 
+        if self.db and transcript_service.db is None:
+            # Share the Firestore handle with the transcript cache
+            transcript_service.db = self.db
+
         if is_genai_configured:
             # Initialize with knowledge base if possible, otherwise default
             self.refresh_knowledge_base()
             if self.model is None:
                  # Fallback if refresh failed completely (shouldn't happen as it has try/except)
                  self.model = genai.GenerativeModel(
-                    model_name='gemini-2.5-flash',
+                    model_name=self.router.primary("response"),
                     system_instruction=SYSTEM_PROMPT
                 )
         else:
             self.model = None
             logger.error("AgentCore initialized without a valid GenAI configuration.")
 
+    def _context_from_user_var(self) -> ToolContext:
+        """
+        Builds a ToolContext for direct (non-runtime) tool calls using the legacy user_context variable.
+        """
+        return ToolContext(user_id=user_context.get(), db=self.db, calendar=calendar_service)
+
     def recommend_video(self, video_id: str):
         """
         Retrieves the URL for a specific video recommendation.
@@ -230,12 +370,7 @@ class AgentCore:
         Returns:
             A string containing the video title and URL.
         """
-        # We need to access the catalogue.
-        video = self.video_catalogue.get(video_id)
-        if video:
-            return f"Vídeo Recomendado: {video['title']}\nLink: {video['url']}"
-        else:
-            return "Vídeo não encontrado."
+        return self._run_recommend_video(self._context_from_user_var(), video_id)
 
     def check_calendar_availability(self, date_preference: str = "today") -> str:
         """
@@ -245,27 +380,7 @@ class AgentCore:
         Returns:
             Natural language string with slots.
         """
-        user_id = user_context.get()
-        if not user_id:
-            return "Erro: Não consegui identificar seu usuário."
-
-        # Gatekeeper Logic (Redundant check, but good for safety)
-        try:
-            user = self.db.get_user(user_id)
-            classification = user.get("classificacao_lead", "") if user else ""
-            if "C" in classification or "Curioso" in classification:
-                return "Desculpe, no momento a agenda do André está fechada para novos agendamentos externos. Posso te ajudar com o material gravado?"
-        except Exception as e:
-            logger.error(f"Error checking user profile for calendar: {e}")
-
-        try:
-            # We need the credentials of the ACCOUNT OWNER (Admin), not the Lead.
-            # For this MVP, we assume a single admin account 'admin_user' holds the calendar token.
-            tenant_id = "admin_user"
-            return calendar_service.get_free_slots(tenant_id, date_preference)
-        except Exception as e:
-            logger.error(f"Error checking calendar: {e}")
-            return "Tive um problema técnico ao acessar a agenda. Tente novamente em alguns instantes."
+        return self._run_check_calendar_availability(self._context_from_user_var(), date_preference)
 
     def book_sales_call(self, lead_email: str, preferred_time: str) -> str:
         """
@@ -276,17 +391,7 @@ class AgentCore:
         Returns:
             Confirmation message with link.
         """
-        user_id = user_context.get()
-        if not user_id:
-            return "Erro: Contexto inválido."
-
-        try:
-            # Use Admin credentials to create the event
-            tenant_id = "admin_user"
-            return calendar_service.create_meeting(tenant_id, lead_email, preferred_time)
-        except Exception as e:
-            logger.error(f"Error booking meeting: {e}")
-            return "Não consegui confirmar o agendamento agora. Por favor, verifique se o horário ainda está livre."
+        return self._run_book_sales_call(self._context_from_user_var(), lead_email, preferred_time)
 
     def youtube_transcription_tool(self, url: str) -> str:
         """
@@ -298,26 +403,79 @@ class AgentCore:
         Returns:
             The raw text transcript of the video or an error message.
         """
-        from youtube_transcript_api import YouTubeTranscriptApi
-        import urllib.parse as urlparse
+        return self._run_youtube_transcription_tool(self._context_from_user_var(), url)
+
+    def extract_lead_info(self, name: Optional[str] = None, email: Optional[str] = None, phone: Optional[str] = None, pain_point: Optional[str] = None, profile_category: Optional[str] = None) -> str:
+        """
+        Updates the lead information in the CRM.
+
+        Args:
+            name: The user's name.
+            email: The user's email address.
+            phone: The user's phone number.
+            pain_point: The user's main financial struggle (e.g., "Fear", "Inflation").
+            profile_category: The classification (A_ESTRUTURADO, B_EM_CONSTRUCAO, C_CURIOSO).
+
+        Returns:
+            A status message.
+        """
+        return self._run_extract_lead_info(
+            self._context_from_user_var(),
+            name=name,
+            email=email,
+            phone=phone,
+            pain_point=pain_point,
+            profile_category=profile_category
+        )
+
+    # --- Tool handlers (executed by ToolRuntime with an explicit ToolContext) ---
+
+    def _run_recommend_video(self, ctx: ToolContext, video_id: str) -> str:
+        video = self.video_catalogue.get(video_id)
+        if video:
+            return f"Vídeo Recomendado: {video['title']}\nLink: {video['url']}"
+        else:
+            return "Vídeo não encontrado."
+
+    def _run_check_calendar_availability(self, ctx: ToolContext, date_preference: str = "today") -> str:
+        if not ctx.user_id:
+            return "Erro: Não consegui identificar seu usuário."
+
+        # Gatekeeper Logic (Redundant check, but good for safety).
+        # Uses the profile the request handler already loaded instead of another read.
+        classification = ctx.get_profile().get("classificacao_lead", "") or ""
+        if "C" in classification or "Curioso" in classification:
+            return "Desculpe, no momento a agenda do André está fechada para novos agendamentos externos. Posso te ajudar com o material gravado?"
+
+        try:
+            # We need the credentials of the ACCOUNT OWNER (Admin), not the Lead.
+            # For this MVP, we assume a single admin account 'admin_user' holds the calendar token.
+            tenant_id = "admin_user"
+            return (ctx.calendar or calendar_service).get_free_slots(tenant_id, date_preference)
+        except Exception as e:
+            logger.error(f"Error checking calendar: {e}")
+            return "Tive um problema técnico ao acessar a agenda. Tente novamente em alguns instantes."
+
+    def _run_book_sales_call(self, ctx: ToolContext, lead_email: str, preferred_time: str) -> str:
+        if not ctx.user_id:
+            return "Erro: Contexto inválido."
 
         try:
-            # Extract video ID from URL
-            parsed = urlparse.urlparse(url)
-            video_id = ""
-            if "youtube.com" in parsed.netloc:
-                qs = urlparse.parse_qs(parsed.query)
-                if "v" in qs:
-                    video_id = qs["v"][0]
-            elif "youtu.be" in parsed.netloc:
-                video_id = parsed.path.lstrip("/")
+            # Use Admin credentials to create the event
+            tenant_id = "admin_user"
+            return (ctx.calendar or calendar_service).create_meeting(tenant_id, lead_email, preferred_time)
+        except Exception as e:
+            logger.error(f"Error booking meeting: {e}")
+            return "Não consegui confirmar o agendamento agora. Por favor, verifique se o horário ainda está livre."
 
+    def _run_youtube_transcription_tool(self, ctx: ToolContext, url: str) -> str:
+        try:
+            video_id = parse_video_id(url)
             if not video_id:
                 return "Erro: Não foi possível identificar o ID do vídeo na URL fornecida."
 
-            # Fetch transcript (trying pt then en as fallback)
-            transcript_list = YouTubeTranscriptApi.get_transcript(video_id, languages=['pt', 'en'])
-            full_text = " ".join([item['text'] for item in transcript_list])
+            # Served from the transcript cache (memory -> Firestore -> YouTube), trying pt then en
+            full_text = transcript_service.get_transcript(video_id)
 
             # Truncate if too long to fit in context (~10k chars should be safe)
             if len(full_text) > 10000:
@@ -329,25 +487,13 @@ class AgentCore:
             logger.error(f"Error fetching YouTube transcript: {e}")
             return f"Erro ao acessar a transcrição do vídeo: {str(e)}"
 
-    def extract_lead_info(self, name: Optional[str] = None, email: Optional[str] = None, phone: Optional[str] = None, pain_point: Optional[str] = None, profile_category: Optional[str] = None) -> str:
-        """
-        Updates the lead information in the CRM.
-
-        Args:
-            name: The user's name.
-            email: The user's email address.
-            phone: The user's phone number.
-            pain_point: The user's main financial struggle (e.g., "Fear", "Inflation").
-            profile_category: The classification (A_ESTRUTURADO, B_EM_CONSTRUCAO, C_CURIOSO).
-
-        Returns:
-            A status message.
-        """
-        user_id = user_context.get()
+    def _run_extract_lead_info(self, ctx: ToolContext, name: Optional[str] = None, email: Optional[str] = None, phone: Optional[str] = None, pain_point: Optional[str] = None, profile_category: Optional[str] = None) -> str:
+        user_id = ctx.user_id
         if not user_id:
             logger.warning("extract_lead_info called without user context.")
             return "Erro: Contexto do usuário não encontrado."
 
+        db = ctx.db or self.db
         try:
             # Determine status/tags logic based on profile_category or other info.
             # If the tool is called, we can tag them as "Interessado". They become "Aluno" when they pay via Stripe.
@@ -362,7 +508,9 @@ class AgentCore:
                 "status": status_tag
             }
             # Remove None values is handled by save_lead, but we pass them anyway as kwargs defaults are None
-            self.db.save_lead(data)
+            db.save_lead(data)
+            # Later tools in the same turn (e.g. calendar gatekeeper) see the new classification
+            ctx.update_profile(data)
             return "Informações do lead atualizadas com sucesso."
         except Exception as e:
             logger.error(f"Error in extract_lead_info: {e}")
@@ -435,6 +583,7 @@ class AgentCore:
             logger.warning(f"Unknown asset type for {display_name} (MIME: {mime_type}). Skipping.")
 
 
+    @KNOWLEDGE_REFRESH.time()
     def refresh_knowledge_base(self):
         """
         Refreshes the knowledge base by fetching active files and re-initializing the model.
@@ -462,7 +611,9 @@ class AgentCore:
 
         video_prompt_section = ""
         self.video_catalogue = {} # Reset
+        self.video_matcher = VideoMatcher()
         tools_list = []
+        self.tool_runtime.clear()
 
         if self.db:
             try:
@@ -477,30 +628,32 @@ class AgentCore:
                         logger.error(f"Error processing RAG file record {record.get('id', 'unknown')}: {e}")
 
                 # Fetch Videos for Tool Calling
+                # Only the rules live in the system instruction. The catalogue itself is matched
+                # locally per message and just the candidate videos are injected into the turn.
                 try:
                     videos = self.db.get_videos()
                     if videos:
                         video_prompt_section += "\n\n--- CATÁLOGO DE VÍDEOS (FERRAMENTA DISPONÍVEL) ---\n"
                         video_prompt_section += "Você tem acesso à ferramenta `recommend_video(video_id)`. "
-                        video_prompt_section += "Use esta ferramenta quando o contexto da conversa corresponder a um dos itens abaixo, "
+                        video_prompt_section += "Quando a mensagem do usuário trouxer um bloco 'VÍDEOS CANDIDATOS PARA ESTA MENSAGEM', "
+                        video_prompt_section += "use esta ferramenta se o contexto da conversa corresponder ao Gatilho de um dos itens, "
                         video_prompt_section += "MAS APENAS SE O USUÁRIO FOR PERFIL A OU B (Qualificado/Morno).\n"
                         video_prompt_section += "Leads Perfil C (Frio/Curioso) NÃO devem receber vídeos, a menos que o contexto seja técnico (suporte).\n"
-                        video_prompt_section += "ATENÇÃO: Conforme a Regra 9, ao recomendar um vídeo, você deve usar `youtube_transcription_tool` na URL do vídeo e responder usando a transcrição exata.\n\n"
-                        video_prompt_section += "IDs DISPONÍVEIS:\n"
+                        video_prompt_section += "Use SOMENTE IDs listados nesse bloco. Se não houver bloco, não recomende vídeos.\n"
+                        video_prompt_section += "ATENÇÃO: Conforme a Regra 9, ao recomendar um vídeo, você deve usar `youtube_transcription_tool` na URL do vídeo e responder usando a transcrição exata.\n"
+                        video_prompt_section += "---------------------------------------------------\n"
 
                         for v in videos:
                             v_id = v.get("id")
                             title = v.get("title", "Sem Título")
-                            trigger = v.get("trigger_context", "Geral")
                             url = v.get("url", "")
-
                             self.video_catalogue[v_id] = {"title": title, "url": url}
-                            video_prompt_section += f"- ID: {v_id} | Título: {title} | Gatilho: {trigger}\n"
 
-                        video_prompt_section += "---------------------------------------------------\n"
+                        self.video_matcher = VideoMatcher(videos)
 
                         # Enable the tool
                         tools_list.append(self.recommend_video)
+                        self.tool_runtime.register("recommend_video", self._run_recommend_video)
 
                 except Exception as e:
                     logger.error(f"Error fetching videos: {e}")
@@ -514,6 +667,13 @@ class AgentCore:
         tools_list.append(self.book_sales_call)
         tools_list.append(self.youtube_transcription_tool)
 
+        # The public methods above only provide the declarations the model sees;
+        # execution goes through the runtime so handlers receive an explicit ToolContext.
+        self.tool_runtime.register("extract_lead_info", self._run_extract_lead_info)
+        self.tool_runtime.register("check_calendar_availability", self._run_check_calendar_availability)
+        self.tool_runtime.register("book_sales_call", self._run_book_sales_call)
+        self.tool_runtime.register("youtube_transcription_tool", self._run_youtube_transcription_tool)
+
         logger.info(f"Initializing Agent with {len(self.active_persona_files)} persona files, {len(self.active_knowledge_files)} knowledge files, and {len(tools_list)} tools.")
 
         # Construct Hybrid System Instruction - PURE TEXT ONLY
@@ -538,23 +698,57 @@ class AgentCore:
         if video_prompt_section:
             system_instruction_parts.append(video_prompt_section)
 
+        # Fixed per-request cost, used by the context assembler to budget the rest of the turn
+        self.system_tokens = estimate_tokens(system_instruction_parts) + TOOL_DECLARATION_TOKENS * len(tools_list)
+
+        # Cached answers were generated with the previous prompt and files
+        self.response_cache.set_version(self._knowledge_version(system_instruction_parts, tools_list))
+
+        # Fallback models of the reply chain are built from the same settings on first use
+        self._reply_models = {}
         try:
+            self._reply_model_kwargs = {
+                "system_instruction": system_instruction_parts,
+                "tools": tools_list if tools_list else None
+            }
             self.model = genai.GenerativeModel(
-                model_name='gemini-2.5-flash',
-                system_instruction=system_instruction_parts,
-                tools=tools_list if tools_list else None
+                model_name=self.router.primary("response"),
+                **self._reply_model_kwargs
             )
         except Exception as e:
              logger.error(f"Error initializing GenerativeModel with knowledge base: {e}")
              # Fallback to text only (using the determined core prompt)
+             self._reply_model_kwargs = {"system_instruction": core_prompt}
              self.model = genai.GenerativeModel(
-                model_name='gemini-2.5-flash',
-                system_instruction=core_prompt
+                model_name=self.router.primary("response"),
+                **self._reply_model_kwargs
             )
-
-    def start_chat(self, history: Optional[List[Dict[str, str]]] = None):
+             self.system_tokens = estimate_tokens(core_prompt)
+
+    def _knowledge_version(self, system_instruction_parts: List[str], tools_list: List[Any]) -> str:
+        """Fingerprint of everything the model answers from: prompt, tools and context files."""
+        digest = hashlib.sha256()
+        for part in system_instruction_parts + [t.__name__ for t in tools_list]:
+            digest.update(str(part).encode("utf-8"))
+        for f in self.active_persona_files + self.active_knowledge_files:
+            # Text files by content, native Gemini files by their files/ name
+            digest.update(str(f if isinstance(f, str) else getattr(f, "name", "")).encode("utf-8"))
+        return digest.hexdigest()[:16]
+
+    def _reply_model(self, model_name: str):
+        """Reply model (system prompt + tools) for a model of the response chain."""
+        if model_name == self.router.primary("response"):
+            return self.model
+        model = self._reply_models.get(model_name)
+        if model is None:
+            model = self._reply_models[model_name] = genai.GenerativeModel(model_name=model_name, **self._reply_model_kwargs)
+        return model
+
+    def start_chat(self, history: Optional[List[Dict[str, str]]] = None, model_name: Optional[str] = None):
         """
-        Starts a chat session.
+        Starts a chat session (on the primary reply model unless model_name is given).
+        Function calls are executed by generate_response through the ToolRuntime,
+        so automatic function calling is disabled on the session.
         """
         if self.model is None:
             logger.error("Attempted to start chat without initialized model.")
@@ -563,16 +757,116 @@ class AgentCore:
         if history is None:
             history = []
 
-        # Enable automatic function calling if tools are present
-        return self.model.start_chat(history=history, enable_automatic_function_calling=True)
+        model = self._reply_model(model_name) if model_name else self.model
+        return model.start_chat(history=history)
+
+    def _generate(self, purpose: str, prompt: Any):
+        """generate_content for internal purposes, on the purpose's lean models with fallback."""
+        return self.router.run(
+            purpose,
+            lambda model_name: self._call_model(
+                purpose, self.router.lean_model(purpose, model_name).generate_content, prompt, model_name=model_name
+            )
+        )
+
+    def _generate_in_persona(self, purpose: str, prompt: Any):
+        """
+        generate_content for customer-facing text outside a chat (follow-ups): on the reply
+        models, so the André persona and hard rules apply, along the purpose's chain, in text only.
+        """
+        return self.router.run(
+            purpose,
+            lambda model_name: self._call_model(
+                purpose, self._reply_model(model_name).generate_content, prompt,
+                model_name=model_name, tool_config=NO_TOOL_CALLS
+            )
+        )
+
+    def _call_model(self, purpose: str, call, *args, model_name: Optional[str] = None, **kwargs):
+        """
+        Single choke point for Gemini calls: times each call, records it by purpose
+        (response, qualification, extraction, followup, insights, summary) and
+        charges its token usage to the current user. The ModelClient applies the
+        purpose's deadline, retries and model_name's circuit breaker.
+        """
+        start = time.perf_counter()
+        status = "ok"
+        with tracer.start_span(f"model.{purpose}", {"gen_ai.system": "gemini", "gen_ai.operation.purpose": purpose}) as span:
+            try:
+                response = self.model_client.call(purpose, call, *args, model_name=model_name, **kwargs)
+                usage = usage_tracker.record(purpose, response, model_name=model_name)
+                if usage:
+                    span.set_attributes({
+                        "gen_ai.usage.input_tokens": usage["prompt_tokens"],
+                        "gen_ai.usage.output_tokens": usage["output_tokens"]
+                    })
+                return response
+            except Exception:
+                status = "error"
+                raise
+            finally:
+                record_model_call(purpose, status, time.perf_counter() - start)
+
+    @staticmethod
+    def _extract_function_calls(response) -> List[Tuple[str, Dict[str, Any]]]:
+        """
+        Returns the (name, args) function calls contained in a model response.
+        """
+        calls = []
+        try:
+            parts = response.parts
+        except Exception:
+            return calls
+
+        for part in parts:
+            fc = getattr(part, "function_call", None)
+            if fc and getattr(fc, "name", None):
+                calls.append((fc.name, dict(fc.args) if fc.args else {}))
+        return calls
+
+    @staticmethod
+    def _build_function_responses(results: List[Tuple[str, Any]]):
+        """
+        Packs tool results into a single content message for the model.
+        """
+        return genai.protos.Content(
+            role="function",
+            parts=[
+                genai.protos.Part(
+                    function_response=genai.protos.FunctionResponse(name=name, response={"result": result})
+                )
+                for name, result in results
+            ]
+        )
+
+    def match_video_candidates(self, user_message: str, history: Optional[List[Dict[str, Any]]] = None) -> str:
+        """
+        Matches the message (plus the previous user turn, for context) against the video catalogue.
+        Returns the prompt block listing the candidates, or "" when nothing matches.
+        """
+        if not len(self.video_matcher):
+            return ""
+
+        text = user_message
+        for msg in reversed(history or []):
+            if msg.get("role") == "user":
+                parts = msg.get("parts", [])
+                text += " " + " ".join(p for p in parts if isinstance(p, str))
+                break
+
+        return VideoMatcher.format_candidates(self.video_matcher.match(text))
 
-    def generate_response(self, user_message: str, history: List[Dict[str, str]] = []) -> str:
+    def generate_response(self, user_message: str, history: List[Dict[str, str]] = [], user_id: Optional[str] = None, user_profile: Optional[Dict[str, Any]] = None, summary: Optional[str] = None) -> str:
         """
         Generates a response from the agent.
 
         Args:
             user_message: The latest message from the user.
             history: The conversation history (list of dicts with 'role' and 'parts').
+            user_id: The user the tools act on. Falls back to the legacy user_context variable.
+            user_profile: The user profile already loaded by the caller ({} if the user is new).
+                          If None, tools load it lazily on first use.
+            summary: Rolling summary of the turns older than the history sent.
 
         Returns:
             The agent's text response.
@@ -581,25 +875,87 @@ class AgentCore:
             logger.error("generate_response called but GenAI is not configured.")
             return "Erro: O sistema de IA não está disponível no momento (Chave de API inválida ou ausente)."
 
-        try:
-            # Create a chat session with the provided history and enable auto function calling
-            chat = self.model.start_chat(history=history, enable_automatic_function_calling=True)
+        ctx = ToolContext(
+            user_id=user_id or user_context.get(),
+            user_profile=user_profile,
+            db=self.db,
+            calendar=calendar_service
+        )
 
-            # Construct message payload with context injection
-            # Inject files into the current turn
-            message_payload = [user_message]
+        with tracer.start_span("agent.generate_response", {"user.id": ctx.user_id, "history.messages": len(history)}) as span, \
+                usage_tracker.attribute_to(ctx.user_id):
+            try:
+                # FAQ-style openers from new users are answered from the cache
+                cache_terms = self.response_cache.cache_terms(user_message, history, summary)
+                cached = self.response_cache.get(cache_terms)
+                if cached is not None:
+                    span.set_attribute("response_cache.hit", True)
+                    return cached
+
+                # Candidate videos for this turn (matched locally against trigger_context)
+                candidates_block = self.match_video_candidates(user_message, history)
+                extra_parts = [candidates_block] if candidates_block else []
+
+                # Fit knowledge files and history into the token budget (persona files first)
+                with tracer.start_span("context.assemble"):
+                    assembled = self.context_assembler.assemble(
+                        user_message,
+                        history,
+                        system_tokens=self.system_tokens,
+                        context_files=self.active_persona_files + self.active_knowledge_files,
+                        summary=summary,
+                        extra_parts=extra_parts
+                    )
+                if assembled.summary:
+                    extra_parts.append(f"\n--- RESUMO DA CONVERSA ATÉ AQUI ---\n{assembled.summary}\n")
+
+                # Construct message payload with context injection
+                # Inject files into the current turn
+                message_payload = [user_message] + extra_parts + assembled.context_files
+
+                self.context_assembler.log_accounting(
+                    assembled.accounting,
+                    user_id=ctx.user_id,
+                    exact_counter=lambda: self._call_model(
+                        "token_count", self.model.count_tokens,
+                        assembled.history + [{"role": "user", "parts": message_payload}],
+                        model_name=self.router.primary("response")
+                    ).total_tokens
+                )
 
-            if self.active_persona_files:
-                message_payload.extend(self.active_persona_files)
+                # The first send falls back along the reply chain (and may be hedged, each run on
+                # its own chat session); tool rounds stay on the model that answered
+                def first_turn(model_name: str):
+                    chat = self.start_chat(history=assembled.history, model_name=model_name)
+                    return chat, model_name, self._call_model("response", chat.send_message, message_payload, model_name=model_name)
 
-            if self.active_knowledge_files:
-                message_payload.extend(self.active_knowledge_files)
+                chat, model_name, response = self.router.run(
+                    "response", lambda name: self.model_client.hedged("response", lambda: first_turn(name))
+                )
 
-            response = chat.send_message(message_payload)
-            return response.text
-        except Exception as e:
-            logger.error(f"Error generating response: {e}")
-            return f"DEBUG ERROR: {str(e)}"
+                # Function calling loop: run every call of a turn in parallel, then hand the results back
+                tool_rounds = 0
+                calls = self._extract_function_calls(response)
+                while calls:
+                    tool_rounds += 1
+                    results = self.tool_runtime.run_calls(calls, ctx)
+                    # Out of tool rounds: the last turn must answer in text
+                    last_round = tool_rounds >= MAX_TOOL_ROUNDS
+                    extra = {"tool_config": NO_TOOL_CALLS} if last_round else {}
+                    response = self._call_model("response", chat.send_message, self._build_function_responses(results), model_name=model_name, **extra)
+                    calls = [] if last_round else self._extract_function_calls(response)
+
+                span.set_attributes({"context.tokens": assembled.accounting["total"], "agent.tool_rounds": tool_rounds})
+                # Answers that needed tools depend on the user, not just the question
+                if tool_rounds == 0:
+                    self.response_cache.put(cache_terms, response.text)
+                return response.text
+            except Exception as e:
+                span.record_exception(e)
+                logger.error(f"Error generating response: {e}")
+                # Never show internal errors to the customer
+                MODEL_FALLBACK_REPLIES.inc()
+                return FALLBACK_REPLY
 
     @staticmethod
     def format_history(raw_history: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
@@ -634,53 +990,16 @@ class AgentCore:
         if not is_genai_configured or self.model is None:
             return {}
 
-        analysis_prompt = """
-        ANÁLISE DE LEAD - INTERNO
-        Com base no histórico da conversa acima, extraia as seguintes informações sobre o usuário:
-        1. Dor Principal (O que mais incomoda?)
-        2. Maturidade (Iniciante, Já investe, Avançado?)
-        3. Compromisso (Busca método ou apenas curiosidade?)
-        4. Classificação ("Perfil A (Qualificado/Quente)", "Perfil B (Morno/Em educação)", ou "Perfil C (Frio/Curioso)")
-
-        Responda APENAS em formato JSON:
-        {
-            "dor_principal": "...",
-            "maturidade": "...",
-            "compromisso": "...",
-            "classificacao_lead": "..."
-        }
-        Se não houver informação suficiente para algum campo, preencha com null.
-        """
-
         try:
-            # We create a new chat just for analysis to not pollute the main context
-            # or simply send the whole history as a prompt.
-            # Sending history as context is easier.
-
-            # Construct the full prompt
+            # Static instructions and the JSON schema live on the lean qualification model
             full_prompt = "Histórico da conversa:\n"
             for msg in history:
                 role = "Usuário" if msg["role"] == "user" else "André"
                 content = msg["parts"][0] if isinstance(msg["parts"], list) else msg["parts"]
                 full_prompt += f"{role}: {content}\n"
 
-            full_prompt += f"\n{analysis_prompt}"
-
-            response = self.model.generate_content(full_prompt)
-
-            # Parse JSON from response
-            import json
-            import re
-
-            text = response.text
-            # Extract JSON block if wrapped in markdown code blocks
-            match = re.search(r"\{.*\}", text, re.DOTALL)
-            if match:
-                json_str = match.group(0)
-                return json.loads(json_str)
-            else:
-                # Try to parse the whole text if no code block
-                return json.loads(text)
+            response = self._generate("qualification", full_prompt)
+            return parse_json_response(response.text)
 
         except Exception as e:
             logger.error(f"Error analyzing lead: {e}")
@@ -693,22 +1012,6 @@ class AgentCore:
         if not is_genai_configured or self.model is None:
             return {}
 
-        strategy_prompt = """
-        ANÁLISE ESTRATÉGICA DE VENDAS - INTERNO
-        Com base no histórico da conversa, gere os seguintes insights para o time de vendas:
-
-        1. Resumo (summary): Um resumo de 3 frases da interação até agora.
-        2. Objeção Principal (objection): Por que o lead ainda não comprou? (Ex: Preço, Medo, Falta de tempo, Desconfiança).
-        3. Ângulo de Venda (sales_angle): Como o vendedor humano deve abordar este lead para fechar a venda? (Seja específico e tático).
-
-        Responda APENAS em formato JSON estrito:
-        {
-            "summary": "...",
-            "objection": "...",
-            "sales_angle": "..."
-        }
-        """
-
         try:
             full_prompt = "Histórico da conversa:\n"
             for msg in history:
@@ -718,27 +1021,13 @@ class AgentCore:
                 content = parts[0] if isinstance(parts, list) and parts else str(parts)
                 full_prompt += f"{role}: {content}\n"
 
-            full_prompt += f"\n{strategy_prompt}"
-
-            response = self.model.generate_content(full_prompt)
-
-            import json
-            import re
-
-            text = response.text
-            match = re.search(r"\{.*\}", text, re.DOTALL)
-            if match:
-                return json.loads(match.group(0))
-            else:
-                return json.loads(text)
+            response = self._generate("insights", full_prompt)
+            return parse_json_response(response.text)
 
         except Exception as e:
             logger.error(f"Error analyzing lead strategy: {e}")
-            return {
-                "summary": "Erro ao gerar análise.",
-                "objection": "Não identificado.",
-                "sales_angle": "Verifique o histórico manualmente."
-            }
+            # Nothing is stored; the previous insights stay (marked stale) until a refresh succeeds
+            return {}
 
     def generate_followup_message(self, user_profile: Dict[str, Any]) -> str:
         """
@@ -767,50 +1056,61 @@ class AgentCore:
         """
 
         try:
-            response = self.model.generate_content(prompt)
+            # Sent to the lead: persona prompt, not the lean internal-analysis models
+            response = self._generate_in_persona("followup", prompt)
             return response.text.strip()
         except Exception as e:
             logger.error(f"Error generating follow-up: {e}")
             return "Olá! Gostaria de retomar nossa conversa sobre sua proteção patrimonial?"
 
-    def extract_contact_info(self, user_message: str) -> Dict[str, Optional[str]]:
+    def summarize_conversation(self, history: List[Dict[str, Any]], previous_summary: Optional[str] = None) -> Optional[str]:
         """
-        Extracts name and email from the user's message using a lightweight prompt.
+        Folds older turns into the rolling conversation summary.
+        Returns the new summary, or None if it couldn't be generated.
         """
-        if not is_genai_configured or self.model is None:
-            return {}
+        if not is_genai_configured or self.model is None or not history:
+            return None
+
+        transcript = ""
+        for msg in history:
+            role = "Usuário" if msg["role"] == "user" else "André"
+            content = " ".join(str(p) for p in msg["parts"]) if isinstance(msg["parts"], list) else msg["parts"]
+            transcript += f"{role}: {content}\n"
+
+        prompt = f"""
+        RESUMO DE CONVERSA - INTERNO
+        Atualize o resumo da conversa entre André Digital e o usuário.
 
-        extraction_prompt = """
-        Analise a mensagem do usuário abaixo e extraia:
-        1. Nome (se o usuário se apresentar, ex: "Sou o João", "Me chamo Maria").
-        2. E-mail (se houver um e-mail válido).
+        Resumo anterior:
+        {previous_summary or "(nenhum)"}
 
-        Responda APENAS em formato JSON:
-        {
-            "nome": "...",   // ou null
-            "email": "..."   // ou null
-        }
+        Novas mensagens:
+        {transcript}
 
-        Mensagem:
+        Escreva um único resumo atualizado (máximo 150 palavras) em terceira pessoa, mantendo:
+        - Dados pessoais e objetivos que o usuário revelou.
+        - Dores, objeções e dúvidas em aberto.
+        - O que já foi explicado ou recomendado (vídeos, produtos, agendamentos).
+        Responda APENAS com o texto do resumo.
         """
 
         try:
-            full_prompt = f"{extraction_prompt}\n{user_message}"
-            response = self.model.generate_content(full_prompt)
-
-            # Parse JSON
-            import json
-            import re
-
-            text = response.text
-            # Extract JSON block if wrapped in markdown code blocks
-            match = re.search(r"\{.*\}", text, re.DOTALL)
-            if match:
-                json_str = match.group(0)
-                return json.loads(json_str)
-            else:
-                 # Try to parse the whole text if no code block
-                 return json.loads(text)
+            response = self._generate("summary", prompt)
+            return response.text.strip() or None
+        except Exception as e:
+            logger.error(f"Error summarizing conversation: {e}")
+            return None
+
+    def extract_contact_info(self, user_message: str) -> Dict[str, Optional[str]]:
+        """
+        Extracts name and email from the user's message using a lightweight prompt.
+        """
+        if not is_genai_configured or self.model is None:
+            return {}
+
+        try:
+            response = self._generate("extraction", f"Mensagem:\n{user_message}")
+            return parse_json_response(response.text)
 
         except Exception as e:
             logger.error(f"Error extracting contact info: {e}")
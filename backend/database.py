@@ -1,22 +1,301 @@
 import firebase_admin
 from firebase_admin import credentials, firestore, storage
 from google.cloud import firestore as google_firestore
-from typing import List, Dict, Any, Optional
+from google.api_core.exceptions import NotFound, FailedPrecondition
+from typing import List, Dict, Any, Optional, Callable, Iterator
 import os
+import time
+import hashlib
 import datetime
+import logging
+
+logger = logging.getLogger(__name__)
 
 # Configuration
 max_followups = 3
 
+# Chat storage: "interactions" (one 'interacoes_chat' document per turn) or "chunks"
+# (per-user 'conversas/{user_id}/chunks/{seq}' documents holding CHAT_CHUNK_SIZE turns each).
+# Switch to "chunks" after running scripts/migrate_chat_layout.py.
+CHAT_STORAGE_LAYOUT = os.environ.get("CHAT_STORAGE_LAYOUT", "interactions")
+CHAT_CHUNK_SIZE = int(os.environ.get("CHAT_CHUNK_SIZE", "20"))
+
+# Follow-up and knowledge base listings can filter on follow_up_count / type server-side,
+# but legacy documents missing those fields would be skipped. Until
+# scripts/backfill_query_fields.py has run, they are found by scanning and filtering in
+# memory; set to "false" after the backfill to switch to the indexed queries.
+LEGACY_QUERY_FALLBACK = os.environ.get("LEGACY_QUERY_FALLBACK", "true").lower() == "true"
+
+# Fields merge_users never copies from the merged-away user onto the canonical one
+MERGE_KEEP_TARGET_FIELDS = {
+    "id", "merged_into", "merged_at", "merged_user_ids", "identities_linked", "verified_identities",
+    "follow_up_count", "turns_since_summary", "turns_since_insights", "summary_covered_until", "last_interaction_timestamp",
+}
+
+# Documents fetched per query by the export iterators (iter_users, iter_chat_interactions)
+EXPORT_PAGE_SIZE = int(os.environ.get("EXPORT_PAGE_SIZE", "500"))
+
+# Lesson fields mirrored into the per-user 'progresso_resumo' document
+LESSON_SUMMARY_FIELDS = ("modulo", "aula", "status", "resultado_quiz_pontuacao", "updated_at")
+
+# Observers notified after every Firestore operation: fn(op, collection, documents, seconds).
+# op is "read", "query", "write" or "delete"; seconds is None for batched writes that
+# shared a round trip already reported. Registered by the app (e.g. services.metrics).
+_operation_observers: List[Callable[[str, str, int, Optional[float]], None]] = []
+
+
+def add_operation_observer(observer: Callable[[str, str, int, Optional[float]], None]) -> None:
+    """Registers a callback for Firestore operation accounting."""
+    if observer not in _operation_observers:
+        _operation_observers.append(observer)
+
+
+def _notify(op: str, collection: str, documents: int, seconds: Optional[float]) -> None:
+    for observer in _operation_observers:
+        try:
+            observer(op, collection, documents, seconds)
+        except Exception:
+            pass
+
+
+def normalize_email(email: Any) -> Optional[str]:
+    """Lowercased, trimmed email; None if it doesn't look like one."""
+    if not isinstance(email, str):
+        return None
+    email = email.strip().lower()
+    return email if "@" in email and " " not in email else None
+
+
+def normalize_phone(phone: Any) -> Optional[str]:
+    """Digits only (WhatsApp user ids use the same form); None if too short to be a phone."""
+    if phone is None:
+        return None
+    digits = "".join(ch for ch in str(phone) if ch.isdigit())
+    return digits if len(digits) >= 8 else None
+
+
+def lesson_progress_id(user_id: str, modulo: str, aula: str) -> str:
+    """Deterministic 'progresso_aulas' document id for one user's lesson (titles may contain '/')."""
+    digest = hashlib.sha1(f"{modulo}\x1f{aula}".encode("utf-8")).hexdigest()[:20]
+    return f"{user_id}_{digest}"
+
+
+class _Metered:
+    """Transparent wrapper around a Firestore object; anything not overridden is passed through."""
+    __slots__ = ("_raw", "_collection")
+
+    def __init__(self, raw: Any, collection: str):
+        self._raw = raw
+        self._collection = collection
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._raw, name)
+
+
+def _unwrap(obj: Any) -> Any:
+    return obj._raw if isinstance(obj, _Metered) else obj
+
+
+def _collection_id(path: str) -> str:
+    # Subcollections are accounted under their id, not the per-user path ("conversas/u1/chunks" -> "chunks")
+    return str(path).rsplit("/", 1)[-1]
+
+
+class _MeteredSnapshot(_Metered):
+    __slots__ = ()
+
+    @property
+    def reference(self) -> "_MeteredDocument":
+        return _MeteredDocument(self._raw.reference, self._collection)
+
+
+class _MeteredDocument(_Metered):
+    __slots__ = ()
+
+    def _timed(self, op: str, method: str, *args, **kwargs) -> Any:
+        start = time.perf_counter()
+        result = getattr(self._raw, method)(*args, **kwargs)
+        _notify(op, self._collection, 1, time.perf_counter() - start)
+        return result
+
+    def get(self, *args, **kwargs) -> _MeteredSnapshot:
+        return _MeteredSnapshot(self._timed("read", "get", *args, **kwargs), self._collection)
+
+    def set(self, *args, **kwargs) -> Any:
+        return self._timed("write", "set", *args, **kwargs)
+
+    def create(self, *args, **kwargs) -> Any:
+        return self._timed("write", "create", *args, **kwargs)
+
+    def update(self, *args, **kwargs) -> Any:
+        return self._timed("write", "update", *args, **kwargs)
+
+    def delete(self, *args, **kwargs) -> Any:
+        return self._timed("delete", "delete", *args, **kwargs)
+
+    def collection(self, collection_id: str) -> "_MeteredCollection":
+        return _MeteredCollection(self._raw.collection(collection_id), _collection_id(collection_id))
+
+
+class _MeteredQuery(_Metered):
+    __slots__ = ()
+
+    def _chain(self, method: str, *args, **kwargs) -> "_MeteredQuery":
+        args = tuple(_unwrap(a) for a in args)
+        return _MeteredQuery(getattr(self._raw, method)(*args, **kwargs), self._collection)
+
+    def where(self, *args, **kwargs):
+        return self._chain("where", *args, **kwargs)
+
+    def order_by(self, *args, **kwargs):
+        return self._chain("order_by", *args, **kwargs)
+
+    def limit(self, *args, **kwargs):
+        return self._chain("limit", *args, **kwargs)
+
+    def offset(self, *args, **kwargs):
+        return self._chain("offset", *args, **kwargs)
+
+    def select(self, *args, **kwargs):
+        return self._chain("select", *args, **kwargs)
+
+    def start_at(self, *args, **kwargs):
+        return self._chain("start_at", *args, **kwargs)
+
+    def start_after(self, *args, **kwargs):
+        return self._chain("start_after", *args, **kwargs)
+
+    def end_at(self, *args, **kwargs):
+        return self._chain("end_at", *args, **kwargs)
+
+    def end_before(self, *args, **kwargs):
+        return self._chain("end_before", *args, **kwargs)
+
+    def stream(self, *args, **kwargs):
+        start = time.perf_counter()
+        return self._stream(self._raw.stream(*args, **kwargs), start)
+
+    def _stream(self, docs: Any, start: float):
+        count = 0
+        try:
+            for doc in docs:
+                count += 1
+                yield _MeteredSnapshot(doc, self._collection)
+        finally:
+            # Firestore bills at least one read per query, even when nothing matches
+            _notify("query", self._collection, max(count, 1), time.perf_counter() - start)
+
+    def get(self, *args, **kwargs) -> List[_MeteredSnapshot]:
+        return list(self.stream(*args, **kwargs))
+
+
+class _MeteredCollection(_MeteredQuery):
+    __slots__ = ()
+
+    def document(self, *args, **kwargs) -> _MeteredDocument:
+        return _MeteredDocument(self._raw.document(*args, **kwargs), self._collection)
+
+    def add(self, *args, **kwargs) -> Any:
+        start = time.perf_counter()
+        result = self._raw.add(*args, **kwargs)
+        _notify("write", self._collection, 1, time.perf_counter() - start)
+        if isinstance(result, tuple) and len(result) == 2:
+            return result[0], _MeteredDocument(result[1], self._collection)
+        return result
+
+
+class _MeteredBatch(_Metered):
+    __slots__ = ("_pending",)
+
+    def __init__(self, raw: Any):
+        super().__init__(raw, "")
+        self._pending: List[tuple] = []
+
+    def _queue(self, method: str, op: str, reference: Any, *args, **kwargs) -> "_MeteredBatch":
+        getattr(self._raw, method)(_unwrap(reference), *args, **kwargs)
+        collection = reference._collection if isinstance(reference, _Metered) else _collection_id(getattr(getattr(reference, "parent", None), "id", "unknown"))
+        self._pending.append((op, collection))
+        return self
+
+    def set(self, reference: Any, *args, **kwargs):
+        return self._queue("set", "write", reference, *args, **kwargs)
+
+    def create(self, reference: Any, *args, **kwargs):
+        return self._queue("create", "write", reference, *args, **kwargs)
+
+    def update(self, reference: Any, *args, **kwargs):
+        return self._queue("update", "write", reference, *args, **kwargs)
+
+    def delete(self, reference: Any, *args, **kwargs):
+        return self._queue("delete", "delete", reference, *args, **kwargs)
+
+    def commit(self, *args, **kwargs) -> Any:
+        start = time.perf_counter()
+        result = self._raw.commit(*args, **kwargs)
+        seconds = time.perf_counter() - start
+        counts: Dict[tuple, int] = {}
+        for key in self._pending:
+            counts[key] = counts.get(key, 0) + 1
+        # One round trip for the whole batch, reported with the first group
+        for index, ((op, collection), documents) in enumerate(counts.items()):
+            _notify(op, collection, documents, seconds if index == 0 else None)
+        self._pending = []
+        return result
+
+
+class _MeteredClient(_Metered):
+    """Firestore client wrapper that reports every operation to the registered observers."""
+    __slots__ = ()
+
+    def __init__(self, raw: Any):
+        super().__init__(raw, "")
+
+    def collection(self, collection_path: str) -> _MeteredCollection:
+        return _MeteredCollection(self._raw.collection(collection_path), _collection_id(collection_path))
+
+    def document(self, document_path: str) -> _MeteredDocument:
+        return _MeteredDocument(self._raw.document(document_path), _collection_id(str(document_path).rsplit("/", 1)[0]))
+
+    def batch(self) -> _MeteredBatch:
+        return _MeteredBatch(self._raw.batch())
+
+    def get_all(self, references: Any, *args, **kwargs) -> List[_MeteredSnapshot]:
+        """Batched document reads in one round trip; snapshots may come back in any order."""
+        start = time.perf_counter()
+        snapshots = list(self._raw.get_all([_unwrap(r) for r in references], *args, **kwargs))
+        seconds = time.perf_counter() - start
+        collections = [_collection_id(snapshot.reference.parent.id) for snapshot in snapshots]
+        counts: Dict[str, int] = {}
+        for collection in collections:
+            counts[collection] = counts.get(collection, 0) + 1
+        for index, (collection, documents) in enumerate(counts.items()):
+            _notify("read", collection, documents, seconds if index == 0 else None)
+        return [_MeteredSnapshot(snapshot, collection) for snapshot, collection in zip(snapshots, collections)]
+
 class FirestoreClient:
-    def __init__(self, service_account_path: Optional[str] = None):
+    def __init__(self, service_account_path: Optional[str] = None, backend: Optional[Any] = None):
         """
         Initializes the Firestore client.
 
         Args:
             service_account_path: Path to the service account JSON key.
                                   If None, it uses the application default credentials.
+            backend: Optional storage backend exposing the Firestore client API
+                     (e.g. memory_store.InMemoryFirestore). If None and FIRESTORE_BACKEND=memory,
+                     the process-wide in-memory store is used instead of Firestore.
         """
+        self.chat_layout = CHAT_STORAGE_LAYOUT
+        self.chat_chunk_size = CHAT_CHUNK_SIZE
+        self.legacy_query_fallback = LEGACY_QUERY_FALLBACK
+
+        if backend is None and os.environ.get("FIRESTORE_BACKEND", "").lower() == "memory":
+            from memory_store import get_shared_store
+            backend = get_shared_store()
+
+        if backend is not None:
+            self.db = _MeteredClient(backend)
+            return
+
         if not firebase_admin._apps:
             if service_account_path and os.path.exists(service_account_path):
                 cred = credentials.Certificate(service_account_path)
@@ -25,7 +304,7 @@ class FirestoreClient:
                 # Use Application Default Credentials (ADC)
                 firebase_admin.initialize_app()
 
-        self.db = firestore.client()
+        self.db = _MeteredClient(firestore.client())
 
     def save_user(self, user_data: Dict[str, Any]) -> str:
         """
@@ -47,6 +326,7 @@ class FirestoreClient:
         if not user_id:
             raise ValueError("User ID is required in user_data")
 
+        self._index_identities(user_id, email=user_data.get("email"), phone=user_data.get("telefone"))
         doc_ref = self.db.collection("usuarios").document(user_id)
         doc_ref.set(user_data, merge=True)
         return user_id
@@ -73,6 +353,7 @@ class FirestoreClient:
         if not clean_data:
             return user_id  # Nothing to update
 
+        self._index_identities(user_id, email=clean_data.get("email"), phone=clean_data.get("telefone"))
         doc_ref = self.db.collection("usuarios").document(user_id)
         doc_ref.set(clean_data, merge=True)
         return user_id
@@ -88,6 +369,9 @@ class FirestoreClient:
 
         if reset_followup_count:
             update_data["follow_up_count"] = 0
+            # The user sent a message: counts towards the next conversation summary and insights refresh
+            update_data["turns_since_summary"] = google_firestore.Increment(1)
+            update_data["turns_since_insights"] = google_firestore.Increment(1)
         elif increment_followup_count:
             update_data["follow_up_count"] = google_firestore.Increment(1)
 
@@ -95,6 +379,39 @@ class FirestoreClient:
             update_data, merge=True
         )
 
+    def save_conversation_summary(self, user_id: str, summary: Optional[str], covered_until: Optional[str]) -> None:
+        """
+        Stores the rolling conversation summary and resets the turn counter.
+        covered_until is the timestamp of the newest interaction folded into the summary.
+        """
+        self.db.collection("usuarios").document(user_id).set({
+            "conversation_summary": summary,
+            "summary_covered_until": covered_until,
+            "summary_updated_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "turns_since_summary": 0
+        }, merge=True)
+
+    def save_lead_insights(self, user_id: str, insights: Dict[str, Any], classification: Optional[str]) -> None:
+        """
+        Stores the lead's sales insights with their staleness markers: the classification
+        they were generated for and the turn counter, which restarts at zero.
+        """
+        self.db.collection("usuarios").document(user_id).set({
+            "insights_summary": insights.get("summary"),
+            "insights_objection": insights.get("objection"),
+            "insights_sales_angle": insights.get("sales_angle"),
+            "insights_classification": classification,
+            "insights_generated_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "insights_attempted_at": None,
+            "turns_since_insights": 0
+        }, merge=True)
+
+    def save_lead_insights_failure(self, user_id: str) -> None:
+        """Records a failed insights analysis, so retries wait out a cooldown (see services/lead_insights.py)."""
+        self.db.collection("usuarios").document(user_id).set({
+            "insights_attempted_at": datetime.datetime.now(datetime.timezone.utc).isoformat()
+        }, merge=True)
+
     def add_tag(self, user_id: str, tag: str) -> None:
         """
         Adds a tag to the user profile if it doesn't already exist.
@@ -115,6 +432,7 @@ class FirestoreClient:
             update_data["email"] = email
 
         if update_data:
+            self._index_identities(user_id, email=email)
             self.db.collection("usuarios").document(user_id).set(
                 update_data, merge=True
             )
@@ -127,11 +445,275 @@ class FirestoreClient:
             {"bot_paused": paused}, merge=True
         )
 
-    def update_user_status_by_email(self, email: str, status: str, additional_data: Optional[Dict[str, Any]] = None) -> bool:
+    def _index_identities(self, user_id: str, email: Any = None, phone: Any = None) -> None:
+        """
+        Points the 'identity_index' entries ('email:<normalized>', 'phone:<digits>') at user_id.
+        Written before the user document, so a user holding an email is always findable.
+        user_ids keeps every user seen with the identity (duplicates to merge).
+        """
+        keys = []
+        if normalize_email(email):
+            keys.append(("email", normalize_email(email)))
+        if normalize_phone(phone):
+            keys.append(("phone", normalize_phone(phone)))
+        if not keys:
+            return
+
+        batch = self.db.batch()
+        for reference, data in self._identity_writes(user_id, keys):
+            batch.set(reference, data, merge=True)
+        batch.commit()
+
+    def _identity_writes(self, user_id: str, keys: List[tuple]) -> List[tuple]:
+        """(reference, merge data) pairs pointing the (kind, value) identity keys at user_id."""
+        timestamp = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        return [
+            (self.db.collection("identity_index").document(f"{kind}:{value}"), {
+                "kind": kind,
+                "value": value,
+                "user_id": user_id,
+                "user_ids": google_firestore.ArrayUnion([user_id]),
+                "updated_at": timestamp
+            })
+            for kind, value in keys
+        ]
+
+    def _lookup_identity(self, kind: str, value: Optional[str]) -> Optional[Dict[str, Any]]:
+        if not value:
+            return None
+        doc = self.db.collection("identity_index").document(f"{kind}:{value}").get()
+        return doc.to_dict() if doc.exists else None
+
+    def find_user_id_by_email(self, email: str) -> Optional[str]:
+        """Single document read in 'identity_index'."""
+        entry = self._lookup_identity("email", normalize_email(email))
+        return entry.get("user_id") if entry else None
+
+    def find_user_id_by_phone(self, phone: str) -> Optional[str]:
+        """Single document read in 'identity_index'."""
+        entry = self._lookup_identity("phone", normalize_phone(phone))
+        return entry.get("user_id") if entry else None
+
+    def find_user_ids_by_identity(self, keys: List[str]) -> Dict[str, str]:
+        """
+        Batched identity lookup: {key: user id} for the keys ('email:<normalized>',
+        'phone:<digits>') that are indexed. One round trip for up to 500 keys at a time.
+        """
+        found = {}
+        keys = list(dict.fromkeys(keys))
+        for start in range(0, len(keys), 500):
+            references = [self.db.collection("identity_index").document(key) for key in keys[start:start + 500]]
+            for snapshot in self.db.get_all(references):
+                entry = snapshot.to_dict() if snapshot.exists else None
+                if entry and entry.get("user_id"):
+                    found[snapshot.id] = entry["user_id"]
+        return found
+
+    def get_users(self, user_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Batched user read: {user id: data} for the ids that exist. One round trip for up to 500 ids at a time."""
+        found = {}
+        user_ids = list(dict.fromkeys(user_ids))
+        for start in range(0, len(user_ids), 500):
+            references = [self.db.collection("usuarios").document(user_id) for user_id in user_ids[start:start + 500]]
+            for snapshot in self.db.get_all(references):
+                if snapshot.exists:
+                    found[snapshot.id] = snapshot.to_dict()
+        return found
+
+    def user_writes(self, user_id: str, data: Dict[str, Any], keys: List[str]) -> List[tuple]:
+        """
+        Stages a merge of data into the user document plus the 'identity_index' entries for
+        keys ('email:<normalized>', 'phone:<digits>'), as (reference, merge data) pairs for
+        commit_writes. Bulk writers use this to put many users in one batch.
+        """
+        return self._identity_writes(user_id, [tuple(key.split(":", 1)) for key in keys]) + [
+            (self.db.collection("usuarios").document(user_id), data)
+        ]
+
+    def commit_writes(self, writes: List[tuple]) -> None:
+        """Commits staged (reference, merge data) pairs as one atomic batch (at most 500 writes)."""
+        batch = self.db.batch()
+        for reference, data in writes:
+            batch.set(reference, data, merge=True)
+        batch.commit()
+
+    def get_identity(self, key: str) -> Optional[Dict[str, Any]]:
+        """Reads an 'identity_index' entry by key ('email:<normalized>' or 'phone:<digits>')."""
+        kind, _, value = key.partition(":")
+        return self._lookup_identity(kind, value)
+
+    def mark_identities_linked(self, user_id: str, keys: List[str]) -> None:
+        """Records identity keys already checked for duplicate users."""
+        self.db.collection("usuarios").document(user_id).set(
+            {"identities_linked": google_firestore.ArrayUnion(keys)}, merge=True
+        )
+
+    def verify_identity(self, user_id: str, kind: str, value: Any) -> Optional[str]:
+        """
+        Records an identity the channel itself vouches for (the WhatsApp sender phone,
+        the Stripe checkout email) in the user's verified_identities. Only verified
+        identities are merged automatically (see services/identity.py).
+        The key is cleared from identities_linked so the next link re-checks it.
+        Returns the identity key, or None if the value doesn't normalize.
+        """
+        value = normalize_email(value) if kind == "email" else normalize_phone(value)
+        if not value:
+            return None
+        key = f"{kind}:{value}"
+        batch = self.db.batch()
+        for reference, data in self._identity_writes(user_id, [(kind, value)]):
+            batch.set(reference, data, merge=True)
+        batch.set(self.db.collection("usuarios").document(user_id), {
+            "verified_identities": google_firestore.ArrayUnion([key]),
+            "identities_linked": google_firestore.ArrayRemove([key])
+        }, merge=True)
+        batch.commit()
+        return key
+
+    def queue_merge_request(self, source_id: str, target_id: str, key: str) -> bool:
+        """
+        Queues a merge of source into target for admin confirmation ('merge_requests').
+        One request per user pair; returns False if it was already queued (or decided).
+        """
+        reference = self.db.collection("merge_requests").document(f"{source_id}__{target_id}")
+        if reference.get().exists:
+            return False
+        reference.set({
+            "source_id": source_id,
+            "target_id": target_id,
+            "key": key,
+            "status": "pending",
+            "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat()
+        })
+        return True
+
+    def get_merge_requests(self, status: str = "pending", limit: int = 100) -> List[Dict[str, Any]]:
+        query = self.db.collection("merge_requests").where(
+            field_path="status", op_string="==", value=status
+        ).limit(limit)
+        return [{"id": doc.id, **doc.to_dict()} for doc in query.stream()]
+
+    def resolve_merge_request(self, request_id: str, approve: bool) -> Optional[Dict[str, Any]]:
+        """
+        Approves (merges the users) or rejects a pending merge request.
+        Returns the updated request, or None if it doesn't exist.
+        """
+        reference = self.db.collection("merge_requests").document(request_id)
+        doc = reference.get()
+        if not doc.exists:
+            return None
+        request = doc.to_dict()
+        if request.get("status") != "pending":
+            return {"id": request_id, **request}
+        update = {
+            "status": "approved" if approve else "rejected",
+            "resolved_at": datetime.datetime.now(datetime.timezone.utc).isoformat()
+        }
+        if approve:
+            update["merged"] = self.merge_users(request["source_id"], request["target_id"])
+        reference.set(update, merge=True)
+        return {"id": request_id, **request, **update}
+
+    def merge_users(self, source_id: str, target_id: str) -> bool:
+        """
+        Folds the source user into the target (canonical) user:
+        - chat history moves to the target;
+        - profile fields missing on the target are filled from the source, tags are combined;
+        - identity index entries point at the target;
+        - the source document becomes a stub with merged_into, so its channel id resolves to the target.
+        Returns False if there was nothing to merge.
+        """
+        if not source_id or source_id == target_id:
+            return False
+        source = self.get_user(source_id) or {}
+        if source.get("merged_into"):
+            return False
+        target = self.get_user(target_id) or {}
+        timestamp = datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+        # 1. History. Source chunks are only deleted once the target chunks and the
+        # stub below are committed, so a failure in between never loses history.
+        source_chunks = []
+        if self.chat_layout == "chunks":
+            moved = []
+            for doc in self._chat_chunks(source_id).stream():
+                moved.extend(dict(i, id_usuario=target_id, merged_from=source_id) for i in doc.to_dict().get("interacoes") or [])
+                source_chunks.append(doc.reference)
+            if moved:
+                existing = [i for doc in self._chat_chunks(target_id).stream() for i in doc.to_dict().get("interacoes") or []]
+                self.write_chat_chunks(target_id, existing + moved)
+        else:
+            docs = list(self.db.collection("interacoes_chat").where(field_path="id_usuario", op_string="==", value=source_id).stream())
+            for start in range(0, len(docs), 500):
+                batch = self.db.batch()
+                for doc in docs[start:start + 500]:
+                    batch.update(doc.reference, {"id_usuario": target_id, "merged_from": source_id})
+                batch.commit()
+
+        # 2. Profile, identity index and source stub in one batch
+        fill = {
+            k: v for k, v in source.items()
+            if k not in MERGE_KEEP_TARGET_FIELDS and v not in (None, "", [], {}) and target.get(k) in (None, "", [], {})
+        }
+        if source.get("tags"):
+            # ArrayUnion rejects an empty list
+            fill["tags"] = google_firestore.ArrayUnion(source["tags"])
+        if source.get("verified_identities"):
+            fill["verified_identities"] = google_firestore.ArrayUnion(source["verified_identities"])
+        fill.update({
+            "merged_user_ids": google_firestore.ArrayUnion([source_id] + (source.get("merged_user_ids") or [])),
+            # Both conversations now feed the summary and the insights
+            "turns_since_summary": google_firestore.Increment(source.get("turns_since_summary") or 0),
+            "insights_classification": None,
+        })
+        if (source.get("last_interaction_timestamp") or "") > (target.get("last_interaction_timestamp") or ""):
+            fill["last_interaction_timestamp"] = source["last_interaction_timestamp"]
+        batch = self.db.batch()
+        batch.set(self.db.collection("usuarios").document(target_id), fill, merge=True)
+        for kind, value in (("email", normalize_email(source.get("email"))), ("phone", normalize_phone(source.get("telefone"))),
+                            ("email", normalize_email(target.get("email"))), ("phone", normalize_phone(target.get("telefone")))):
+            if value:
+                batch.set(self.db.collection("identity_index").document(f"{kind}:{value}"), {
+                    "kind": kind, "value": value, "user_id": target_id,
+                    "user_ids": google_firestore.ArrayUnion([target_id]), "updated_at": timestamp
+                }, merge=True)
+        batch.set(self.db.collection("usuarios").document(source_id), {"merged_into": target_id, "merged_at": timestamp}, merge=True)
+        # The target's own follow-up covers the merged lead
+        batch.delete(self.db.collection("follow_up_queue").document(f"{source_id}_inactivity_check"))
+        batch.commit()
+
+        for start in range(0, len(source_chunks), 500):
+            batch = self.db.batch()
+            for reference in source_chunks[start:start + 500]:
+                batch.delete(reference)
+            batch.commit()
+        return True
+
+    def update_user_status_by_email(self, email: str, status: str, additional_data: Optional[Dict[str, Any]] = None,
+                                    verify_email: bool = False) -> bool:
         """
         Updates a user's status based on their email.
+        verify_email records the email as verified (see verify_identity), e.g. a Stripe checkout email.
         Returns True if user found and updated, False otherwise.
         """
+        update_data = {"status": status}
+        if additional_data:
+            update_data.update(additional_data)
+        if verify_email and normalize_email(email):
+            key = f"email:{normalize_email(email)}"
+            update_data["verified_identities"] = google_firestore.ArrayUnion([key])
+            update_data["identities_linked"] = google_firestore.ArrayRemove([key])
+
+        user_id = self.find_user_id_by_email(email)
+        if user_id:
+            try:
+                self.db.collection("usuarios").document(user_id).update(update_data)
+                return True
+            except NotFound:
+                # Index entry left by a user write that never landed
+                pass
+
+        # Users saved before the index existed (see scripts/backfill_identity_index.py)
         users_ref = self.db.collection("usuarios")
         query = users_ref.where(field_path="email", op_string="==", value=email).limit(1)
         docs = list(query.stream())
@@ -140,11 +722,8 @@ class FirestoreClient:
             return False
 
         doc = docs[0]
-        update_data = {"status": status}
-        if additional_data:
-            update_data.update(additional_data)
-
         doc.reference.set(update_data, merge=True)
+        self._index_identities(doc.id, email=email)
         return True
 
     def add_to_followup_queue(self, user_id: str, trigger_type: str, reason: str) -> None:
@@ -232,6 +811,16 @@ class FirestoreClient:
             users.append(u)
         return users
 
+    def get_users_by_classification(self, classifications: List[str]) -> List[Dict[str, Any]]:
+        """Retrieves users whose classificacao_lead is one of the given values (at most 30)."""
+        query = self.db.collection("usuarios").where(field_path="classificacao_lead", op_string="in", value=classifications)
+        users = []
+        for doc in query.stream():
+            u = doc.to_dict()
+            u["id"] = doc.id
+            users.append(u)
+        return users
+
     def get_user(self, user_id: str) -> Optional[Dict[str, Any]]:
         """Retrieves a user profile by ID."""
         doc_ref = self.db.collection("usuarios").document(user_id)
@@ -256,13 +845,86 @@ class FirestoreClient:
             "analise_emocional": "Ansioso",
             "precisa_intervencao_humana": false
         }
+
+        With the "chunks" layout the interaction is appended to the user's latest
+        chunk instead, and the chunk id is returned.
         """
+        if self.chat_layout == "chunks":
+            return self._append_chat_chunk(interaction_data)
+
         # We allow Firestore to generate the ID for the interaction document
         update_time, doc_ref = self.db.collection("interacoes_chat").add(interaction_data)
         return doc_ref.id
 
+    def _chat_chunks(self, user_id: str):
+        return self.db.collection("conversas").document(user_id).collection("chunks")
+
+    def _append_chat_chunk(self, interaction_data: Dict[str, Any]) -> str:
+        user_id = interaction_data.get("id_usuario")
+        if not user_id:
+            raise ValueError("id_usuario is required in interaction_data")
+
+        chunks = self._chat_chunks(user_id)
+        latest = list(chunks.order_by("seq", direction=google_firestore.Query.DESCENDING).limit(1).stream())
+        seq, new_chunk = 0, True
+        if latest:
+            current = latest[0].to_dict()
+            seq = current.get("seq", 0)
+            new_chunk = current.get("count", 0) >= self.chat_chunk_size
+            if new_chunk:
+                seq += 1
+
+        # Concurrent turns may both land in a chunk that was about to roll over; the size is a soft limit
+        chunk_id = f"{seq:06d}"
+        timestamp = interaction_data.get("timestamp") or datetime.datetime.now(datetime.timezone.utc).isoformat()
+        chunk_data = {
+            "id_usuario": user_id,
+            "seq": seq,
+            "interacoes": google_firestore.ArrayUnion([interaction_data]),
+            "count": google_firestore.Increment(1),
+            "updated_at": timestamp
+        }
+        if new_chunk:
+            chunk_data["first_timestamp"] = timestamp
+        chunks.document(chunk_id).set(chunk_data, merge=True)
+        return chunk_id
+
+    def write_chat_chunks(self, user_id: str, interactions: List[Dict[str, Any]]) -> int:
+        """
+        Replaces a user's chunks with the given interactions (any order), in batched writes.
+        Used by the layout migration. Returns the number of chunks written.
+        """
+        ordered = sorted(interactions, key=lambda i: i.get("timestamp") or "")
+        chunks = self._chat_chunks(user_id)
+        size = max(self.chat_chunk_size, 1)
+        groups = [ordered[start:start + size] for start in range(0, len(ordered), size)]
+        for start in range(0, len(groups), 500):
+            batch = self.db.batch()
+            for seq, group in enumerate(groups[start:start + 500], start=start):
+                batch.set(chunks.document(f"{seq:06d}"), {
+                    "id_usuario": user_id,
+                    "seq": seq,
+                    "interacoes": group,
+                    "count": len(group),
+                    "first_timestamp": group[0].get("timestamp"),
+                    "updated_at": group[-1].get("timestamp")
+                })
+            batch.commit()
+        return len(groups)
+
     def get_chat_history(self, user_id: str, limit: int = 10) -> List[Dict[str, Any]]:
         """Retrieves the chat history for a specific user, ordered by timestamp descending."""
+        if self.chat_layout == "chunks":
+            # The newest chunk may be nearly empty, so one extra chunk covers the window
+            query = (
+                self._chat_chunks(user_id)
+                .order_by("seq", direction=google_firestore.Query.DESCENDING)
+                .limit(-(-limit // max(self.chat_chunk_size, 1)) + 1)
+            )
+            interactions = [i for doc in query.stream() for i in (doc.to_dict().get("interacoes") or [])]
+            interactions.sort(key=lambda i: i.get("timestamp") or "", reverse=True)
+            return interactions[:limit]
+
         query = (
             self.db.collection("interacoes_chat")
             .where(field_path="id_usuario", op_string="==", value=user_id)
@@ -272,6 +934,47 @@ class FirestoreClient:
         docs = query.stream()
         return [doc.to_dict() for doc in docs]
 
+    def get_chat_history_page(self, user_id: str, limit: int = 20, before: Optional[str] = None,
+                              after: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        One page of a user's chat history, newest first.
+
+        before / after are exclusive timestamp cursors: before pages back to older
+        interactions, after returns the `limit` interactions right after the cursor.
+        Without cursors it returns the most recent page.
+        """
+        if self.chat_layout == "chunks":
+            chunks = self._chat_chunks(user_id)
+            chunk_limit = -(-limit // max(self.chat_chunk_size, 1)) + 1
+            if after:
+                query = chunks.where(field_path="updated_at", op_string=">", value=after).order_by("updated_at")
+            elif before:
+                query = (
+                    chunks.where(field_path="first_timestamp", op_string="<", value=before)
+                    .order_by("first_timestamp", direction=google_firestore.Query.DESCENDING)
+                )
+            else:
+                query = chunks.order_by("seq", direction=google_firestore.Query.DESCENDING)
+            interactions = [
+                i for doc in query.limit(chunk_limit).stream() for i in (doc.to_dict().get("interacoes") or [])
+                if (not before or (i.get("timestamp") or "") < before) and (not after or (i.get("timestamp") or "") > after)
+            ]
+            interactions.sort(key=lambda i: i.get("timestamp") or "", reverse=True)
+            return interactions[-limit:] if after else interactions[:limit]
+
+        query = self.db.collection("interacoes_chat").where(field_path="id_usuario", op_string="==", value=user_id)
+        if after:
+            query = (
+                query.where(field_path="timestamp", op_string=">", value=after)
+                .order_by("timestamp", direction=google_firestore.Query.ASCENDING)
+            )
+        else:
+            if before:
+                query = query.where(field_path="timestamp", op_string="<", value=before)
+            query = query.order_by("timestamp", direction=google_firestore.Query.DESCENDING)
+        interactions = [doc.to_dict() for doc in query.limit(limit).stream()]
+        return interactions[::-1] if after else interactions
+
     def save_lesson_progress(self, progress_data: Dict[str, Any]) -> None:
         """
         Saves or updates lesson progress in 'progresso_aulas'.
@@ -293,22 +996,45 @@ class FirestoreClient:
         if not all([user_id, modulo, aula]):
             raise ValueError("id_usuario, modulo, and aula are required for lesson progress")
 
-        collection_ref = self.db.collection("progresso_aulas")
-        query = (
-            collection_ref
-            .where(field_path="id_usuario", op_string="==", value=user_id)
-            .where(field_path="modulo", op_string="==", value=modulo)
-            .where(field_path="aula", op_string="==", value=aula)
-        )
-        docs = list(query.stream())
+        # The document id is derived from (user, module, lesson): saving is an idempotent
+        # upsert without a lookup query, and concurrent saves can't create duplicates.
+        progress_id = lesson_progress_id(user_id, modulo, aula)
+        data = dict(progress_data, updated_at=datetime.datetime.now(datetime.timezone.utc).isoformat())
 
-        if docs:
-            # Update existing
-            doc_ref = docs[0].reference
-            doc_ref.set(progress_data, merge=True)
-        else:
-            # Create new
-            collection_ref.add(progress_data)
+        batch = self.db.batch()
+        batch.set(self.db.collection("progresso_aulas").document(progress_id), data, merge=True)
+        batch.set(self.db.collection("progresso_resumo").document(user_id),
+                  self._lesson_summary_update(user_id, {progress_id: data}), merge=True)
+        batch.commit()
+
+    @staticmethod
+    def _lesson_summary_update(user_id: str, lessons: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+        """Merge payload for 'progresso_resumo/{user_id}': one map entry per lesson, keyed by progress id."""
+        return {
+            "id_usuario": user_id,
+            "aulas": {
+                progress_id: {k: lesson[k] for k in LESSON_SUMMARY_FIELDS if k in lesson}
+                for progress_id, lesson in lessons.items()
+            },
+            "updated_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        }
+
+    def get_lesson_progress_summary(self, user_id: str) -> Dict[str, Any]:
+        """
+        Dashboard view of a user's progress from the single 'progresso_resumo' document:
+        lessons (newest first) plus totals, without querying 'progresso_aulas'.
+        """
+        doc = self.db.collection("progresso_resumo").document(user_id).get()
+        lessons = list(((doc.to_dict() or {}).get("aulas") or {}).values()) if doc.exists else []
+        lessons.sort(key=lambda lesson: lesson.get("updated_at") or "", reverse=True)
+        scores = [l["resultado_quiz_pontuacao"] for l in lessons if isinstance(l.get("resultado_quiz_pontuacao"), (int, float))]
+        return {
+            "id_usuario": user_id,
+            "total_aulas": len(lessons),
+            "aulas_concluidas": sum(1 for lesson in lessons if lesson.get("status") == "concluido"),
+            "media_quiz": round(sum(scores) / len(scores), 1) if scores else None,
+            "aulas": lessons,
+        }
 
     def get_lesson_progress(self, user_id: str) -> List[Dict[str, Any]]:
         """Retrieves all lesson progress for a user."""
@@ -316,6 +1042,96 @@ class FirestoreClient:
         docs = query.stream()
         return [doc.to_dict() for doc in docs]
 
+    def _paginate(self, query: Any, page_size: int, start_after: Any = None) -> Iterator[Dict[str, Any]]:
+        """
+        Yields the query's documents (with 'id') one page at a time, resuming each page
+        after the last snapshot seen: only one page is ever held in memory.
+        The query must end with order_by("__name__") so the cursor is unambiguous.
+        """
+        cursor = start_after
+        while True:
+            page = query.start_after(cursor) if cursor is not None else query
+            docs = list(page.limit(page_size).stream())
+            for doc in docs:
+                data = doc.to_dict() or {}
+                data["id"] = doc.id
+                yield data
+            if len(docs) < page_size:
+                return
+            cursor = docs[-1]
+
+    def _export_cursor(self, collection: str, start_after: Optional[str]) -> Any:
+        # Resuming from a document id: its snapshot carries every order_by value
+        if not start_after:
+            return None
+        snapshot = self.db.collection(collection).document(start_after).get()
+        if not snapshot.exists:
+            raise ValueError(f"Unknown start_after document: {start_after}")
+        return snapshot
+
+    def iter_users(self, status: Optional[str] = None, classification: Optional[str] = None,
+                   active_since: Optional[str] = None, start_after: Optional[str] = None,
+                   page_size: int = EXPORT_PAGE_SIZE) -> Iterator[Dict[str, Any]]:
+        """
+        Streams user profiles for exports, filtered server-side.
+        Ordered by last interaction when active_since is given, otherwise by id;
+        start_after is the id of the last user already received.
+        """
+        query = self.db.collection("usuarios")
+        if status:
+            query = query.where(field_path="status", op_string="==", value=status)
+        if classification:
+            query = query.where(field_path="classificacao_lead", op_string="==", value=classification)
+        if active_since:
+            query = (
+                query.where(field_path="last_interaction_timestamp", op_string=">=", value=active_since)
+                .order_by("last_interaction_timestamp")
+            )
+        query = query.order_by("__name__")
+        return self._paginate(query, page_size, self._export_cursor("usuarios", start_after))
+
+    def iter_chat_interactions(self, user_id: Optional[str] = None, since: Optional[str] = None,
+                               until: Optional[str] = None, origem: Optional[str] = None,
+                               start_after: Optional[str] = None,
+                               page_size: int = EXPORT_PAGE_SIZE) -> Iterator[Dict[str, Any]]:
+        """
+        Streams chat interactions for exports, oldest first, one page at a time.
+        since / until bound the timestamp (inclusive / exclusive). start_after is the id
+        of the last interaction received, or in the "chunks" layout (where interactions
+        have no ids of their own) the last user whose conversation was fully received.
+        """
+        def matches(interaction: Dict[str, Any]) -> bool:
+            timestamp = interaction.get("timestamp") or ""
+            return (
+                (not since or timestamp >= since) and (not until or timestamp < until)
+                and (not origem or interaction.get("origem") == origem)
+            )
+
+        if self.chat_layout == "chunks":
+            user_ids = [user_id] if user_id else (u["id"] for u in self.iter_users(start_after=start_after, page_size=page_size))
+            for uid in user_ids:
+                chunks = self._chat_chunks(uid).order_by("seq").order_by("__name__")
+                for chunk in self._paginate(chunks, max(page_size // max(self.chat_chunk_size, 1), 1)):
+                    for interaction in chunk.get("interacoes") or []:
+                        if matches(interaction):
+                            yield interaction
+            return
+
+        query = self.db.collection("interacoes_chat")
+        if user_id:
+            query = query.where(field_path="id_usuario", op_string="==", value=user_id)
+        elif origem:
+            # Served by the (origem, timestamp) index; with a user id it is filtered below
+            query = query.where(field_path="origem", op_string="==", value=origem)
+        if since:
+            query = query.where(field_path="timestamp", op_string=">=", value=since)
+        if until:
+            query = query.where(field_path="timestamp", op_string="<", value=until)
+        query = query.order_by("timestamp").order_by("__name__")
+        for interaction in self._paginate(query, page_size, self._export_cursor("interacoes_chat", start_after)):
+            if matches(interaction):
+                yield interaction
+
     def get_all_users(self) -> List[Dict[str, Any]]:
         """Retrieves all user profiles."""
         docs = self.db.collection("usuarios").stream()
@@ -363,7 +1179,25 @@ class FirestoreClient:
         cutoff_time = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(hours=hours_inactive)
         cutoff_iso = cutoff_time.isoformat()
 
-        # Query users where last_interaction_timestamp < cutoff_iso
+        if not self.legacy_query_fallback:
+            # Equality-style 'in' plus one range filter: served by the
+            # (follow_up_count, last_interaction_timestamp) composite index
+            query = (
+                self.db.collection("usuarios")
+                .where(field_path="follow_up_count", op_string="in", value=list(range(max_followups)))
+                .where(field_path="last_interaction_timestamp", op_string="<", value=cutoff_iso)
+            )
+            try:
+                users = []
+                for doc in query.stream():
+                    user_data = doc.to_dict()
+                    user_data["id"] = doc.id
+                    users.append(user_data)
+                return users
+            except FailedPrecondition as e:
+                logger.warning(f"Follow-up index not ready, scanning instead: {e}")
+
+        # Legacy scan: users without follow_up_count only match in memory
         query = (
             self.db.collection("usuarios")
             .where(field_path="last_interaction_timestamp", op_string="<", value=cutoff_iso)
@@ -395,9 +1229,25 @@ class FirestoreClient:
 
     def get_knowledge_files(self, file_type: Optional[str] = None) -> List[Dict[str, Any]]:
         """Retrieves all active knowledge base files, optionally filtered by type."""
-        # We fetch all and filter in memory to handle legacy documents without 'type' field
-        # defaulting to 'knowledge'. Also avoids index issues.
-        query = self.db.collection("knowledge_base").order_by("created_at", direction=google_firestore.Query.DESCENDING)
+        collection = self.db.collection("knowledge_base")
+        if file_type and not self.legacy_query_fallback:
+            # Served by the (type, created_at DESC) composite index
+            query = (
+                collection.where(field_path="type", op_string="==", value=file_type)
+                .order_by("created_at", direction=google_firestore.Query.DESCENDING)
+            )
+            try:
+                files = []
+                for doc in query.stream():
+                    f = doc.to_dict()
+                    f["id"] = doc.id
+                    files.append(f)
+                return files
+            except FailedPrecondition as e:
+                logger.warning(f"Knowledge base index not ready, scanning instead: {e}")
+
+        # Unfiltered listing, or legacy scan: documents without 'type' default to 'knowledge'
+        query = collection.order_by("created_at", direction=google_firestore.Query.DESCENDING)
         docs = query.stream()
 
         files = []
@@ -557,3 +1407,75 @@ class FirestoreClient:
     def delete_video(self, video_id: str) -> None:
         """Deletes a video record."""
         self.db.collection("videos").document(video_id).delete()
+
+    def increment_usage_rollups(self, rollups: List[Dict[str, Any]]) -> None:
+        """
+        Adds token usage to the daily per-user documents in 'usage_rollups'
+        ('<day>_<user_id>'), in batched writes using field increments.
+        Each rollup is {"day", "user_id", "totals": {...}, "by_purpose": {purpose: {...}}}.
+        """
+        for start in range(0, len(rollups), 500):
+            batch = self.db.batch()
+            for rollup in rollups[start:start + 500]:
+                doc_id = f"{rollup['day']}_{rollup['user_id']}".replace("/", "_")
+                data = {
+                    "day": rollup["day"],
+                    "user_id": rollup["user_id"],
+                    "updated_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                    "by_purpose": {
+                        purpose: {name: google_firestore.Increment(value) for name, value in totals.items()}
+                        for purpose, totals in rollup.get("by_purpose", {}).items()
+                    }
+                }
+                for name, value in rollup.get("totals", {}).items():
+                    data[name] = google_firestore.Increment(value)
+                batch.set(self.db.collection("usage_rollups").document(doc_id), data, merge=True)
+            batch.commit()
+
+    def get_usage_rollups(self, since_day: str) -> List[Dict[str, Any]]:
+        """Retrieves the usage rollups for days >= since_day ('YYYY-MM-DD')."""
+        query = self.db.collection("usage_rollups").where(field_path="day", op_string=">=", value=since_day)
+        return [doc.to_dict() for doc in query.stream()]
+
+    def increment_analytics_rollups(self, rollups: List[Dict[str, Any]]) -> None:
+        """
+        Adds event counts to the 'analytics_rollups' documents ('<granularity>_<bucket>',
+        e.g. 'hour_2026-01-01T13', 'day_2026-01-01') in batched writes using field increments.
+        Each rollup is {"granularity", "bucket", "counters": {event: {dimension: count}}}.
+        """
+        for start in range(0, len(rollups), 500):
+            batch = self.db.batch()
+            for rollup in rollups[start:start + 500]:
+                data = {
+                    "granularity": rollup["granularity"],
+                    "bucket": rollup["bucket"],
+                    "updated_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                }
+                for event, values in rollup.get("counters", {}).items():
+                    data[event] = {dimension: google_firestore.Increment(count) for dimension, count in values.items()}
+                doc_id = f"{rollup['granularity']}_{rollup['bucket']}"
+                batch.set(self.db.collection("analytics_rollups").document(doc_id), data, merge=True)
+            batch.commit()
+
+    def get_analytics_rollups(self, granularity: str, since_bucket: str) -> List[Dict[str, Any]]:
+        """Retrieves the analytics rollups of one granularity for buckets >= since_bucket."""
+        query = (
+            self.db.collection("analytics_rollups")
+            .where(field_path="granularity", op_string="==", value=granularity)
+            .where(field_path="bucket", op_string=">=", value=since_bucket)
+        )
+        return [doc.to_dict() for doc in query.stream()]
+
+    def get_cached_transcript(self, cache_id: str) -> Optional[Dict[str, Any]]:
+        """Retrieves a cached YouTube transcript from 'youtube_transcripts'."""
+        doc = self.db.collection("youtube_transcripts").document(cache_id).get()
+        if doc.exists:
+            return doc.to_dict()
+        return None
+
+    def save_cached_transcript(self, cache_id: str, transcript_data: Dict[str, Any]) -> None:
+        """
+        Saves a YouTube transcript to 'youtube_transcripts'.
+        cache_id is '<video_id>_<languages>' (e.g. 'dQw4w9WgXcQ_pt-en').
+        """
+        self.db.collection("youtube_transcripts").document(cache_id).set(transcript_data)
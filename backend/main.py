@@ -1,21 +1,34 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks, UploadFile, File, Form
+from fastapi import FastAPI, HTTPException, BackgroundTasks, UploadFile, File, Form, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.concurrency import run_in_threadpool
-from fastapi.responses import RedirectResponse
+from fastapi.responses import RedirectResponse, PlainTextResponse, StreamingResponse, FileResponse
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
-from agent_core import agent, SYSTEM_PROMPT, user_context
-from database import FirestoreClient
+from agent_core import agent, SYSTEM_PROMPT
+from database import FirestoreClient, add_operation_observer
 from routers import webhooks
 from services.calendar_service import calendar_service
+from services.transcript_service import transcript_service, parse_video_id
+from services.conversation_summary import summary_service
+from services.lead_insights import insights_service
+from services.identity import identity_service
+from services import metrics
+from services.tracing import tracer, traced_task, new_message_id, parse_traceparent
+from services.usage_tracker import usage_tracker
+from services.analytics import analytics, GRANULARITIES
+from services import crm_export
+from services.lead_import import lead_importer, read_rows, DUPLICATE_POLICIES
 from utils import FileParser
+import io
 import os
+import re
+import uuid
 import datetime
+import time
 import shutil
 import tempfile
 import logging
 import google.generativeai as genai
-from youtube_transcript_api import YouTubeTranscriptApi
 import stripe
 
 # Configure logging
@@ -36,6 +49,24 @@ app.add_middleware(
 # Include Webhooks Router
 app.include_router(webhooks.router)
 
+# Metrics: Firestore operations are reported by the client wrapper, routes by the middleware below
+add_operation_observer(metrics.record_firestore_operation)
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Route template (e.g. /admin/users/{user_id}) keeps label cardinality bounded
+        route = request.scope.get("route")
+        path = getattr(route, "path", "unmatched")
+        metrics.HTTP_REQUESTS.inc(method=request.method, route=path, status=str(status))
+        metrics.HTTP_LATENCY.observe(time.perf_counter() - start, method=request.method, route=path)
+
 # Initialize Firestore
 try:
     db = FirestoreClient()
@@ -43,6 +74,13 @@ except Exception as e:
     logger.error(f"Failed to initialize FirestoreClient in main: {e}")
     db = None
 
+@app.on_event("shutdown")
+def flush_usage_rollups():
+    # Usage and analytics are buffered between flushes; don't lose the tail on redeploys
+    if db:
+        usage_tracker.flush(db)
+        analytics.flush(db)
+
 class ChatRequest(BaseModel):
     message: str
     user_id: str
@@ -58,139 +96,209 @@ class CheckoutRequest(BaseModel):
     user_id: str
     price_id: Optional[str] = None
 
-def process_background_tasks(user_id: str, message: str, history: List[Dict[str, Any]]):
+def process_background_tasks(user_id: str, message: str, history: List[Dict[str, Any]],
+                             previous_classification: Optional[str] = None):
     """
     Background task to handle entity extraction and lead qualification.
+    previous_classification is the lead's classification before this turn (for analytics).
     """
-    # 1. Entity Extraction
-    try:
-        contact_info = agent.extract_contact_info(message)
-        if contact_info and (contact_info.get("nome") or contact_info.get("email")):
-            db.update_user_contact_info(
-                user_id,
-                name=contact_info.get("nome"),
-                email=contact_info.get("email")
-            )
-    except Exception as e:
-        logger.error(f"Error in background entity extraction: {e}", exc_info=True)
+    with usage_tracker.attribute_to(user_id):
+        # 1. Entity Extraction
+        try:
+            with tracer.start_span("analysis.extraction"):
+                contact_info = agent.extract_contact_info(message)
+                if contact_info and (contact_info.get("nome") or contact_info.get("email")):
+                    db.update_user_contact_info(
+                        user_id,
+                        name=contact_info.get("nome"),
+                        email=contact_info.get("email")
+                    )
+        except Exception as e:
+            logger.error(f"Error in background entity extraction: {e}", exc_info=True)
 
-    # 2. Lead Qualification
-    try:
-        analysis = agent.analyze_lead_qualification(history)
-        if analysis:
-            # Merge ID into analysis to save
-            analysis["id"] = user_id
-            db.save_user(analysis)
-    except Exception as e:
-        logger.error(f"Error in background lead qualification: {e}", exc_info=True)
-
-    # 3. Hot Lead Notification
-    try:
-        # Fetch latest user data to check cumulative state (Name + Email + Classification)
-        user_data = db.get_user(user_id)
-        if user_data:
-            classification = user_data.get("classificacao_lead", "")
-            email = user_data.get("email")
-            name = user_data.get("nome", "Unknown")
-
-            # Check if Perfil A and Email exists
-            is_hot = False
-            if isinstance(classification, str) and ("A" in classification or "Quente" in classification or "Qualificado" in classification):
-                is_hot = True
-
-            if is_hot and email:
-                 # Trigger Notification
-                 logger.info(f"🔥 HOT LEAD ALERT: {name} ({email}) has been classified as PERFIL A.")
-                 # Future: Send SMTP email here
-    except Exception as e:
-        logger.error(f"Error in hot lead notification: {e}", exc_info=True)
+        # 2. Lead Qualification
+        try:
+            with tracer.start_span("analysis.qualification"):
+                analysis = agent.analyze_lead_qualification(history)
+                if analysis:
+                    # Merge ID into analysis to save
+                    analysis["id"] = user_id
+                    db.save_user(analysis)
+        except Exception as e:
+            logger.error(f"Error in background lead qualification: {e}", exc_info=True)
+
+        # 3. Hot Lead Notification
+        user_data = None
+        try:
+            with tracer.start_span("analysis.hot_lead"):
+                # Fetch latest user data to check cumulative state (Name + Email + Classification)
+                user_data = db.get_user(user_id)
+                if user_data:
+                    classification = user_data.get("classificacao_lead", "")
+                    analytics.record_classification(previous_classification, classification)
+                    email = user_data.get("email")
+                    name = user_data.get("nome", "Unknown")
+
+                    # Check if Perfil A and Email exists
+                    is_hot = False
+                    if isinstance(classification, str) and ("A" in classification or "Quente" in classification or "Qualificado" in classification):
+                        is_hot = True
+
+                    if is_hot and email:
+                         # Trigger Notification
+                         logger.info(f"🔥 HOT LEAD ALERT: {name} ({email}) has been classified as PERFIL A.")
+                         # Future: Send SMTP email here
+        except Exception as e:
+            logger.error(f"Error in hot lead notification: {e}", exc_info=True)
+
+        # 4. Schedule Follow-up Check
+        try:
+            with tracer.start_span("followup.schedule"):
+                # Schedule a check in 24 hours from now
+                # Uses upsert (user_id + trigger_type) to debounce: pushes the check forward on every interaction.
+                trigger_time = (datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=24)).isoformat()
+                db.add_scheduled_followup(user_id, trigger_time, reason="24h Inactivity Check")
+        except Exception as e:
+            logger.error(f"Error scheduling follow-up: {e}", exc_info=True)
+
+        # 5. Rolling conversation summary (only every N turns)
+        try:
+            with tracer.start_span("analysis.summary"):
+                summary_service.update_summary(db, agent, user_id, user_data)
+        except Exception as e:
+            logger.error(f"Error updating conversation summary: {e}", exc_info=True)
+
+        # 6. Lead insights for the admin page (A/B leads, once stale)
+        try:
+            with tracer.start_span("analysis.insights"):
+                insights_service.update_if_due(db, agent, user_id, user_data)
+        except Exception as e:
+            logger.error(f"Error refreshing lead insights: {e}", exc_info=True)
+
+        # 7. Merge with other channels' leads sharing this email / phone (runs last: may move the user)
+        try:
+            with tracer.start_span("identity.link"):
+                identity_service.link(db, user_id, user_data)
+        except Exception as e:
+            logger.error(f"Error linking user identities: {e}", exc_info=True)
 
-    # 4. Schedule Follow-up Check
+    # 8. Token usage and analytics rollups (batched; written every N events or seconds)
     try:
-        # Schedule a check in 24 hours from now
-        # Uses upsert (user_id + trigger_type) to debounce: pushes the check forward on every interaction.
-        trigger_time = (datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=24)).isoformat()
-        db.add_scheduled_followup(user_id, trigger_time, reason="24h Inactivity Check")
+        usage_tracker.flush_if_due(db)
+        analytics.flush_if_due(db)
     except Exception as e:
-        logger.error(f"Error scheduling follow-up: {e}", exc_info=True)
+        logger.error(f"Error flushing usage rollups: {e}", exc_info=True)
 
 @app.get("/")
 async def root():
     return {"message": "Dolarize API is running"}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus text exposition of the app's metrics."""
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
 @app.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest, background_tasks: BackgroundTasks):
-    # Set User Context for this request to allow tools to access user_id
-    token = user_context.set(request.user_id)
-    try:
-        # Check User Pause Status & Tier
-        user_data = db.get_user(request.user_id)
-        current_classification = user_data.get("classificacao_lead", "") if user_data else ""
-
-        # Determine User Tier
-        user_tier = "C" # Default / Welcome
-        if isinstance(current_classification, str):
-            if "A" in current_classification or "Quente" in current_classification or "Qualificado" in current_classification:
-                user_tier = "A"
-            elif "B" in current_classification or "Morno" in current_classification:
-                user_tier = "B"
-
-        if user_data and user_data.get("bot_paused", False):
-            # Bot is paused. Save user message but do not reply.
+async def chat(request: ChatRequest, background_tasks: BackgroundTasks, http_request: Request, http_response: Response):
+    # One trace per turn; the message id correlates every span, including the background analysis.
+    message_id = new_message_id()
+    http_response.headers["X-Message-ID"] = message_id
+    with tracer.start_span(
+        "chat.turn",
+        {"user.id": request.user_id, "channel": "web_chat"},
+        parent=parse_traceparent(http_request.headers.get("traceparent")),
+        message_id=message_id
+    ) as span, usage_tracker.attribute_to(request.user_id):
+        try:
+            # Check User Pause Status & Tier
+            with tracer.start_span("user.load"):
+                user_data = db.get_user(request.user_id)
+                # Channel ids merged into another lead resolve to the canonical user
+                user_id, user_data = identity_service.resolve(db, request.user_id, user_data)
+            current_classification = user_data.get("classificacao_lead", "") if user_data else ""
+            analytics.record("messages", "web_chat")
+            if user_data is None:
+                analytics.record("new_leads", "web_chat")
+
+            # Determine User Tier
+            user_tier = "C" # Default / Welcome
+            if isinstance(current_classification, str):
+                if "A" in current_classification or "Quente" in current_classification or "Qualificado" in current_classification:
+                    user_tier = "A"
+                elif "B" in current_classification or "Morno" in current_classification:
+                    user_tier = "B"
+
+            if user_data and user_data.get("bot_paused", False):
+                # Bot is paused. Save user message but do not reply.
+                new_interaction = {
+                    "id_usuario": user_id,
+                    "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                    "origem": "web_chat",
+                    "mensagens": [
+                        {"role": "user", "content": request.message}
+                    ],
+                    "analise_emocional": "Neutro",
+                    "precisa_intervencao_humana": True
+                }
+                db.save_chat_interaction(new_interaction)
+                db.update_user_interaction(user_id, reset_followup_count=True)
+
+                # Return empty response to indicate no reply
+                return ChatResponse(response="", user_tier=user_tier)
+
+            # 1. Fetch recent history (older turns are covered by the rolling summary)
+            with tracer.start_span("history.fetch"):
+                raw_history = db.get_chat_history(user_id, limit=summary_service.recent_interactions)
+
+                # 2. Format history for Gemini using the robust helper
+                gemini_history = agent.format_history(raw_history)
+
+            # 3. Generate response
+            # Tools receive the already-loaded profile ({} for new users) instead of re-reading it.
+            # Generation is a blocking call (model + tool round trips): keep it off the event loop.
+            response_text = await run_in_threadpool(
+                agent.generate_response,
+                request.message,
+                gemini_history,
+                user_id=user_id,
+                user_profile=user_data or {},
+                summary=summary_service.get_summary(user_data)
+            )
+
+            # 4. Save interaction
             new_interaction = {
-                "id_usuario": request.user_id,
+                "id_usuario": user_id,
                 "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
                 "origem": "web_chat",
                 "mensagens": [
-                    {"role": "user", "content": request.message}
+                    {"role": "user", "content": request.message},
+                    {"role": "agent", "content": response_text}
                 ],
-                "analise_emocional": "Neutro",
-                "precisa_intervencao_humana": True
+                "analise_emocional": "Neutro", # Placeholder
+                "precisa_intervencao_humana": False
             }
-            db.save_chat_interaction(new_interaction)
-            db.update_user_interaction(request.user_id, reset_followup_count=True)
-
-            # Return empty response to indicate no reply
-            return ChatResponse(response="", user_tier=user_tier)
-
-        # 1. Fetch history
-        raw_history = db.get_chat_history(request.user_id, limit=20)
+            with tracer.start_span("chat.save"):
+                db.save_chat_interaction(new_interaction)
 
-        # 2. Format history for Gemini using the robust helper
-        gemini_history = agent.format_history(raw_history)
+                # 5. Update User State & Analysis (Async via BackgroundTasks)
+                # Reset follow-up count as user interacted
+                db.update_user_interaction(user_id, reset_followup_count=True)
 
-        # 3. Generate response
-        response_text = agent.generate_response(request.message, gemini_history)
+            # Add current interaction to history for analysis
+            gemini_history.append({"role": "user", "parts": [request.message]})
+            gemini_history.append({"role": "model", "parts": [response_text]})
 
-        # 4. Save interaction
-        new_interaction = {
-            "id_usuario": request.user_id,
-            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
-            "origem": "web_chat",
-            "mensagens": [
-                {"role": "user", "content": request.message},
-                {"role": "agent", "content": response_text}
-            ],
-            "analise_emocional": "Neutro", # Placeholder
-            "precisa_intervencao_humana": False
-        }
-        db.save_chat_interaction(new_interaction)
-
-        # 5. Update User State & Analysis (Async via BackgroundTasks)
-        # Reset follow-up count as user interacted
-        db.update_user_interaction(request.user_id, reset_followup_count=True)
-
-        # Add current interaction to history for analysis
-        gemini_history.append({"role": "user", "parts": [request.message]})
-        gemini_history.append({"role": "model", "parts": [response_text]})
-
-        # Add background tasks for Entity Extraction and Lead Qualification
-        background_tasks.add_task(process_background_tasks, request.user_id, request.message, gemini_history)
+            # Add background tasks for Entity Extraction and Lead Qualification
+            background_tasks.add_task(
+                metrics.queued_task("chat_analysis", traced_task("background.analysis", process_background_tasks)),
+                user_id, request.message, gemini_history, current_classification
+            )
 
-        return ChatResponse(response=response_text, user_tier=user_tier)
-    except Exception as e:
-        logger.error(f"Error in chat endpoint: {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail=str(e))
+            return ChatResponse(response=response_text, user_tier=user_tier)
+        except Exception as e:
+            span.record_exception(e)
+            logger.error(f"Error in chat endpoint: {e}", exc_info=True)
+            raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/admin/users/{user_id}/toggle-bot")
 async def toggle_bot_pause(user_id: str, request: ToggleBotRequest):
@@ -200,6 +308,34 @@ async def toggle_bot_pause(user_id: str, request: ToggleBotRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/admin/merge-requests")
+async def get_merge_requests(status: str = "pending", limit: int = 100):
+    """
+    Leads sharing an email or phone that no channel verified (e.g. typed in chat).
+    They are only merged once an admin approves the request.
+    """
+    try:
+        return await run_in_threadpool(db.get_merge_requests, status, limit)
+    except Exception as e:
+        logger.error(f"Error listing merge requests: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/admin/merge-requests/{request_id}/{decision}")
+async def resolve_merge_request(request_id: str, decision: str):
+    """decision: 'approve' merges the source lead into the target lead, 'reject' keeps them apart."""
+    if decision not in ("approve", "reject"):
+        raise HTTPException(status_code=400, detail="decision must be 'approve' or 'reject'")
+    try:
+        request = await run_in_threadpool(db.resolve_merge_request, request_id, decision == "approve")
+        if request is None:
+            raise HTTPException(status_code=404, detail="Merge request not found")
+        return request
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error resolving merge request {request_id}: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
 class FollowUpRequest(BaseModel):
     hours_inactive: int = 24
 
@@ -308,6 +444,10 @@ async def trigger_followup_check(request: FollowUpRequest):
                 if not user:
                     db.mark_followup_processed(task_id, status="failed_user_not_found")
                     continue
+                if user.get("merged_into"):
+                    # The canonical user has its own follow-up
+                    db.mark_followup_processed(task_id, status="skipped_merged")
+                    continue
 
                 # Here we would implement the specific logic based on task['trigger_type']
                 # e.g., if trigger_type == 'inactivity_check': check if still inactive and send message.
@@ -322,7 +462,9 @@ async def trigger_followup_check(request: FollowUpRequest):
                             # User is still inactive, check follow-up count
                             follow_up_count = user.get("follow_up_count", 0)
                             if follow_up_count < 2:  # Allow Follow-up 1 and Follow-up 2
-                                followup_msg = agent.generate_followup_message(user)
+                                with usage_tracker.attribute_to(user_id):
+                                    # Blocking (scheduler slot, retries): keep it off the event loop
+                                    followup_msg = await run_in_threadpool(agent.generate_followup_message, user)
                                 if followup_msg:
                                     # Save to interaction history
                                     new_interaction = {
@@ -342,6 +484,7 @@ async def trigger_followup_check(request: FollowUpRequest):
 
                                     # We attempt to dispatch via MetaService if we have the phone number
                                     phone = user.get("telefone")
+                                    analytics.record("followups_sent", "whatsapp" if phone else "web_chat")
                                     if phone:
                                         from services.meta_service import meta_service
                                         await meta_service.send_whatsapp_message(phone, followup_msg)
@@ -353,6 +496,7 @@ async def trigger_followup_check(request: FollowUpRequest):
                 logger.error(f"Error processing task {task_id}: {inner_e}")
                 db.mark_followup_processed(task_id, status="failed_error")
 
+        analytics.flush_if_due(db)
         return {"message": f"Follow-up check completed. Processed {processed_count} tasks."}
     except Exception as e:
         logger.error(f"Error in follow-up check: {e}", exc_info=True)
@@ -365,6 +509,114 @@ async def get_users():
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def export_response(name: str, rows_factory, fields: List[str], format: str) -> StreamingResponse:
+    """Streams rows from a paginated Firestore iterator; the export is never held in memory."""
+    media_type, extension = crm_export.FORMATS[format]
+    rows = crm_export.prime(rows_factory())
+    filename = f"{name}_{datetime.datetime.now(datetime.timezone.utc).strftime('%Y%m%d_%H%M%S')}.{extension}"
+    return StreamingResponse(
+        crm_export.encode_rows(rows, fields, format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@app.get("/admin/export/users")
+async def export_users(format: str = "csv", fields: Optional[str] = None, status: Optional[str] = None,
+                       classification: Optional[str] = None, active_since: Optional[str] = None,
+                       start_after: Optional[str] = None):
+    """
+    Streams leads as CSV or NDJSON. fields is a comma-separated column list;
+    start_after (the last id received) resumes an interrupted export.
+    """
+    if format not in crm_export.FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {sorted(crm_export.FORMATS)}")
+    try:
+        return await run_in_threadpool(
+            export_response, "users",
+            lambda: db.iter_users(status=status, classification=classification,
+                                  active_since=active_since, start_after=start_after),
+            crm_export.parse_fields(fields, crm_export.USER_EXPORT_FIELDS), format
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error exporting users: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/admin/export/conversations")
+async def export_conversations(format: str = "ndjson", fields: Optional[str] = None, user_id: Optional[str] = None,
+                               since: Optional[str] = None, until: Optional[str] = None,
+                               origem: Optional[str] = None, start_after: Optional[str] = None):
+    """
+    Streams chat interactions (oldest first) as CSV or NDJSON, optionally for one user,
+    a channel (origem) and a [since, until) timestamp range.
+    """
+    if format not in crm_export.FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {sorted(crm_export.FORMATS)}")
+    try:
+        return await run_in_threadpool(
+            export_response, "conversations",
+            lambda: db.iter_chat_interactions(user_id=user_id, since=since, until=until,
+                                              origem=origem, start_after=start_after),
+            crm_export.parse_fields(fields, crm_export.CONVERSATION_EXPORT_FIELDS), format
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error exporting conversations: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Rejected-row files of admin lead imports, downloadable via /admin/import/{job_id}/rejected
+IMPORT_REJECTS_DIR = os.environ.get("IMPORT_REJECTS_DIR", os.path.join(tempfile.gettempdir(), "lead_imports"))
+
+def run_lead_import(file: UploadFile, fmt: str, job_id: str, on_duplicate: str, source: str, dry_run: bool) -> Dict[str, Any]:
+    os.makedirs(IMPORT_REJECTS_DIR, exist_ok=True)
+    rejected_path = os.path.join(IMPORT_REJECTS_DIR, f"{job_id}.csv")
+    # The upload is read as a text stream, row by row
+    source_stream = io.TextIOWrapper(file.file, encoding="utf-8-sig", newline="")
+    try:
+        with open(rejected_path, "w", newline="", encoding="utf-8") as rejected:
+            report = lead_importer.run(db, read_rows(source_stream, fmt), rejected=rejected,
+                                       on_duplicate=on_duplicate, source=source, dry_run=dry_run)
+    finally:
+        source_stream.detach()
+    if not report["rejected"]:
+        os.remove(rejected_path)
+    if report["imported"] and not dry_run:
+        analytics.record("new_leads", "import", count=report["imported"])
+    return report
+
+@app.post("/admin/import/leads")
+async def import_leads(file: UploadFile = File(...), format: Optional[str] = Form(None),
+                       on_duplicate: str = Form("skip"), source: str = Form("import"), dry_run: bool = Form(False)):
+    """
+    Bulk lead import from a CSV (with header) or NDJSON file. Returns the import report
+    (counts, throughput) and, if rows were rejected, the URL of the rejected-rows CSV.
+    on_duplicate="merge" only fills in fields an existing user is missing; it never overwrites.
+    """
+    fmt = format or ("ndjson" if (file.filename or "").endswith((".ndjson", ".jsonl")) else "csv")
+    if fmt not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be csv or ndjson")
+    if on_duplicate not in DUPLICATE_POLICIES:
+        raise HTTPException(status_code=400, detail=f"on_duplicate must be one of {list(DUPLICATE_POLICIES)}")
+    try:
+        job_id = uuid.uuid4().hex
+        report = await run_in_threadpool(run_lead_import, file, fmt, job_id, on_duplicate, source, dry_run)
+        report["job_id"] = job_id
+        if report["rejected"]:
+            report["rejected_url"] = f"/admin/import/{job_id}/rejected"
+        return report
+    except Exception as e:
+        logger.error(f"Error importing leads: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/admin/import/{job_id}/rejected")
+async def get_rejected_import_rows(job_id: str):
+    path = os.path.join(IMPORT_REJECTS_DIR, f"{job_id}.csv")
+    if not re.fullmatch(r"[0-9a-f]{32}", job_id) or not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="No rejected rows for this import")
+    return FileResponse(path, media_type="text/csv", filename=f"rejected_{job_id}.csv")
+
 @app.get("/admin/stats")
 async def get_dashboard_stats():
     """
@@ -376,10 +628,41 @@ async def get_dashboard_stats():
         logger.error(f"Error in stats endpoint: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/admin/users/{user_id}/history", response_model=List[Dict[str, Any]])
-async def get_user_history(user_id: str):
+# Fields kept by the lightweight history view (view=list)
+HISTORY_LIST_FIELDS = ("timestamp", "origem", "precisa_intervencao_humana")
+HISTORY_PREVIEW_CHARS = 140
+
+
+def history_list_item(interaction: Dict[str, Any]) -> Dict[str, Any]:
+    """Projection of an interaction for history listings: metadata, message count and a short preview."""
+    messages = interaction.get("mensagens") or []
+    item = {field: interaction.get(field) for field in HISTORY_LIST_FIELDS}
+    item["message_count"] = len(messages)
+    preview = (messages[-1].get("content") or "") if messages and isinstance(messages[-1], dict) else ""
+    item["preview"] = preview[:HISTORY_PREVIEW_CHARS]
+    return item
+
+
+@app.get("/admin/users/{user_id}/history")
+async def get_user_history(user_id: str, limit: int = 20, before: Optional[str] = None,
+                           after: Optional[str] = None, view: str = "full"):
+    """
+    Chat history, newest first, one page at a time.
+    Pass `before` (older page) or `after` (newer page) with the cursors returned by
+    the previous page. view=list returns a lightweight projection of each interaction.
+    """
     try:
-        return db.get_chat_history(user_id, limit=50)
+        limit = min(max(limit, 1), 100)
+        # One extra item tells whether there is another page in that direction
+        items = await run_in_threadpool(db.get_chat_history_page, user_id, limit=limit + 1, before=before, after=after)
+        has_more = len(items) > limit
+        items = items[-limit:] if after else items[:limit]
+        return {
+            "items": [history_list_item(i) for i in items] if view == "list" else items,
+            "before": items[-1].get("timestamp") if items else before,
+            "after": items[0].get("timestamp") if items else after,
+            "has_more": has_more
+        }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -509,22 +792,14 @@ class YouTubeIngestRequest(BaseModel):
 async def ingest_youtube_video(request: YouTubeIngestRequest):
     try:
         # Extract video ID
-        video_id = None
-        if "v=" in request.url:
-            video_id = request.url.split("v=")[1].split("&")[0]
-        elif "youtu.be/" in request.url:
-            video_id = request.url.split("youtu.be/")[1].split("?")[0]
+        video_id = parse_video_id(request.url)
 
         if not video_id:
             raise HTTPException(status_code=400, detail="Invalid YouTube URL")
 
-        # Get transcript
+        # Get transcript (served from the transcript cache when the video was already seen)
         try:
-            def fetch_transcript():
-                transcript_list = YouTubeTranscriptApi.get_transcript(video_id, languages=['pt', 'en'])
-                return " ".join([item['text'] for item in transcript_list])
-
-            full_text = await run_in_threadpool(fetch_transcript)
+            full_text = await run_in_threadpool(transcript_service.get_transcript, video_id)
 
             # Check length (e.g. 50,000 chars ~ 10k tokens)
             if len(full_text) > 50000:
@@ -627,7 +902,7 @@ async def list_videos():
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/admin/videos")
-async def add_video(video: VideoRequest):
+async def add_video(video: VideoRequest, background_tasks: BackgroundTasks):
     try:
         video_data = video.model_dump()
         video_id = db.save_video(video_data)
@@ -635,13 +910,16 @@ async def add_video(video: VideoRequest):
         # Refresh Agent to update tools
         agent.refresh_knowledge_base()
 
+        # Warm the transcript cache so the first recommendation doesn't wait on YouTube
+        background_tasks.add_task(metrics.queued_task("transcript_prewarm", transcript_service.prewarm), video_data["url"])
+
         return {"id": video_id, **video_data}
     except Exception as e:
         logger.error(f"Error adding video: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.put("/admin/videos/{video_id}")
-async def update_video(video_id: str, video: VideoRequest):
+async def update_video(video_id: str, video: VideoRequest, background_tasks: BackgroundTasks):
     try:
         video_data = video.model_dump()
         video_data["id"] = video_id
@@ -650,6 +928,9 @@ async def update_video(video_id: str, video: VideoRequest):
         # Refresh Agent to update tools
         agent.refresh_knowledge_base()
 
+        # URL may have changed; warming is a no-op when already cached
+        background_tasks.add_task(metrics.queued_task("transcript_prewarm", transcript_service.prewarm), video_data["url"])
+
         return {"id": video_id, **video_data}
     except Exception as e:
         logger.error(f"Error updating video: {e}", exc_info=True)
@@ -669,57 +950,26 @@ async def delete_video(video_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/admin/lead/{user_id}/insights")
-async def get_lead_insights(user_id: str):
+async def get_lead_insights(user_id: str, background_tasks: BackgroundTasks):
+    """
+    Lead profile and its precomputed sales insights, in one document read.
+    Stale or missing insights are served as they are (see insights_status) and
+    regenerated in the background, unless a recent attempt failed; the timeline is paged via /admin/users/{user_id}/history.
+    """
     try:
-        # 1. Get User
-        user = db.get_user(user_id)
+        user = await run_in_threadpool(db.get_user, user_id)
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
 
-        # 2. Check for existing insights
-        # Stored as top-level keys with 'insights_' prefix
-        has_insights = user.get("insights_summary") and user.get("insights_objection") and user.get("insights_sales_angle")
-
-        insights = {
-            "summary": user.get("insights_summary"),
-            "objection": user.get("insights_objection"),
-            "sales_angle": user.get("insights_sales_angle")
-        }
-
-        # 3. Fetch History (needed for timeline anyway)
-        raw_history = db.get_chat_history(user_id, limit=50)
-
-        # If missing insights and we have history, generate them
-        if not has_insights and raw_history:
-            # Format history for Agent
-            gemini_history = agent.format_history(raw_history)
-
-            # Run Analysis (in threadpool to avoid blocking)
-            new_insights = await run_in_threadpool(agent.analyze_lead_strategy, gemini_history)
-
-            # Save to DB
-            if new_insights:
-                update_data = {
-                    "id": user_id,
-                    "insights_summary": new_insights.get("summary"),
-                    "insights_objection": new_insights.get("objection"),
-                    "insights_sales_angle": new_insights.get("sales_angle"),
-                    "insights_generated_at": datetime.datetime.now(datetime.timezone.utc).isoformat()
-                }
-                db.save_user(update_data)
-
-                # Update local variable
-                insights = {
-                    "summary": new_insights.get("summary"),
-                    "objection": new_insights.get("objection"),
-                    "sales_angle": new_insights.get("sales_angle")
-                }
+        status = insights_service.status(user_id, user)
+        if status["stale"] and not status["refreshing"] and not status["retry_cooldown"]:
+            background_tasks.add_task(metrics.queued_task("lead_insights", insights_service.refresh), db, agent, user_id, user)
+            status["refreshing"] = True
 
-        # 4. Return Composite Object
         return {
             "user": user,
-            "insights": insights,
-            "history": raw_history
+            "insights": insights_service.get_insights(user),
+            "insights_status": status
         }
 
     except HTTPException:
@@ -728,6 +978,58 @@ async def get_lead_insights(user_id: str):
         logger.error(f"Error fetching lead insights: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/admin/insights/precompute")
+async def precompute_lead_insights(background_tasks: BackgroundTasks, stale_only: bool = True, limit: Optional[int] = None):
+    """
+    Bulk job (e.g. nightly from a scheduler): generates insights for every A/B lead,
+    only the stale ones unless stale_only=false. Runs in the background.
+    """
+    background_tasks.add_task(
+        metrics.queued_task("lead_insights_precompute", insights_service.precompute), db, agent,
+        stale_only=stale_only, limit=limit
+    )
+    return {"message": "Lead insights precompute started."}
+
+@app.get("/admin/usage")
+async def get_usage_report(days: int = 7, top: int = 20):
+    """
+    Token usage and estimated cost over the last `days` days (including today):
+    totals, per purpose (response, qualification, ...) and the top users by cost.
+    """
+    try:
+        since_day = (datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=max(days, 1) - 1)).strftime("%Y-%m-%d")
+        rollups = await run_in_threadpool(db.get_usage_rollups, since_day)
+        # Usage not yet flushed to Firestore is included so the report is current
+        rollups.extend(usage_tracker.pending_rollups())
+        report = usage_tracker.summarize(rollups, top_n=top)
+        report["since"] = since_day
+        return report
+    except Exception as e:
+        logger.error(f"Error building usage report: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/admin/analytics")
+async def get_analytics(granularity: str = "day", periods: Optional[int] = None):
+    """
+    Time series of chat volume per channel, new leads, classification transitions,
+    follow-ups sent and Stripe conversions over the last `periods` buckets
+    (default: 30 days or 48 hours), read from the hourly/daily rollups.
+    """
+    if granularity not in GRANULARITIES:
+        raise HTTPException(status_code=400, detail=f"granularity must be one of {sorted(GRANULARITIES)}")
+    try:
+        periods = max(1, min(periods or (30 if granularity == "day" else 48), 366 if granularity == "day" else 24 * 14))
+        now = datetime.datetime.now(datetime.timezone.utc)
+        step = datetime.timedelta(days=1) if granularity == "day" else datetime.timedelta(hours=1)
+        since = now - step * (periods - 1)
+        rollups = await run_in_threadpool(db.get_analytics_rollups, granularity, since.strftime(GRANULARITIES[granularity]))
+        # Counts not yet flushed to Firestore are included so the series is current
+        rollups.extend(analytics.pending_rollups(granularity))
+        return analytics.series(rollups, granularity, since, now)
+    except Exception as e:
+        logger.error(f"Error building analytics: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/admin/qa-simulations/latest")
 async def get_latest_qa_simulation():
     try:
@@ -0,0 +1,551 @@
+"""
+In-memory storage backend exposing the subset of the Firestore client API used by FirestoreClient.
+
+Lets the whole app run (and be benchmarked) offline: queries are evaluated with
+Firestore semantics, every round trip can carry an injected latency, and reads,
+writes and round trips are counted per collection.
+
+Enable it with FIRESTORE_BACKEND=memory (optionally FIRESTORE_LATENCY_MS=<ms>)
+or pass an instance to FirestoreClient(backend=...).
+"""
+import os
+import copy
+import time
+import random
+import string
+import datetime
+import threading
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+try:
+    from google.api_core.exceptions import NotFound
+except ImportError:  # pragma: no cover - google-api-core ships with firebase-admin
+    class NotFound(Exception):
+        pass
+
+try:
+    from google.cloud.firestore_v1 import transforms as _transforms
+    _DELETE_FIELD = _transforms.DELETE_FIELD
+    _SERVER_TIMESTAMP = _transforms.SERVER_TIMESTAMP
+except ImportError:  # pragma: no cover
+    _DELETE_FIELD = _SERVER_TIMESTAMP = object()
+
+DESCENDING = "DESCENDING"
+ASCENDING = "ASCENDING"
+
+# Firestore orders values of different types by type first
+_TYPE_ORDER = {type(None): 0, bool: 1, int: 2, float: 2, datetime.datetime: 3, str: 4, bytes: 5, list: 7, dict: 8}
+
+
+def _sort_key(value: Any) -> Tuple[int, Any]:
+    rank = _TYPE_ORDER.get(type(value), 6)
+    if rank in (6, 7, 8):
+        return rank, str(value)
+    return rank, value
+
+
+def _new_id() -> str:
+    return "".join(random.choices(string.ascii_letters + string.digits, k=20))
+
+
+def _get_field(data: Dict[str, Any], field_path: str) -> Tuple[bool, Any]:
+    """Resolves a dotted field path. Returns (found, value)."""
+    current: Any = data
+    for part in field_path.split("."):
+        if not isinstance(current, dict) or part not in current:
+            return False, None
+        current = current[part]
+    return True, current
+
+
+def _apply_value(current: Any, value: Any) -> Any:
+    """Resolves field transforms (Increment, ArrayUnion, ArrayRemove, SERVER_TIMESTAMP)."""
+    kind = type(value).__name__
+    if kind == "Increment":
+        base = current if isinstance(current, (int, float)) and not isinstance(current, bool) else 0
+        return base + value.value
+    if kind == "ArrayUnion":
+        result = list(current) if isinstance(current, list) else []
+        for item in value.values:
+            if item not in result:
+                result.append(item)
+        return result
+    if kind == "ArrayRemove":
+        result = list(current) if isinstance(current, list) else []
+        return [item for item in result if item not in value.values]
+    if value is _SERVER_TIMESTAMP:
+        return datetime.datetime.now(datetime.timezone.utc)
+    if isinstance(value, dict):
+        return {k: _apply_value(None, v) for k, v in value.items() if v is not _DELETE_FIELD}
+    return copy.deepcopy(value)
+
+
+def _merge_into(target: Dict[str, Any], data: Dict[str, Any]) -> None:
+    """set(..., merge=True): nested maps are merged field by field."""
+    for key, value in data.items():
+        if value is _DELETE_FIELD:
+            target.pop(key, None)
+        elif isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge_into(target[key], value)
+        else:
+            target[key] = _apply_value(target.get(key), value)
+
+
+def _update_path(target: Dict[str, Any], field_path: str, value: Any) -> None:
+    """update(): dotted keys address nested fields."""
+    parts = field_path.split(".")
+    for part in parts[:-1]:
+        if not isinstance(target.get(part), dict):
+            target[part] = {}
+        target = target[part]
+    if value is _DELETE_FIELD:
+        target.pop(parts[-1], None)
+    else:
+        target[parts[-1]] = _apply_value(target.get(parts[-1]), value)
+
+
+def _matches(data: Dict[str, Any], doc_id: str, field_path: str, op: str, value: Any) -> bool:
+    if field_path == "__name__":
+        found, current = True, doc_id
+        value = value.id if hasattr(value, "id") and not isinstance(value, str) else value
+    else:
+        found, current = _get_field(data, field_path)
+
+    if op == "!=":
+        return found and current is not None and current != value
+    if op == "not-in":
+        return found and current is not None and current not in value
+    if not found:
+        return False
+    if op == "==":
+        return current == value
+    if op == "in":
+        return current in value
+    if op == "array_contains":
+        return isinstance(current, list) and value in current
+    if op == "array_contains_any":
+        return isinstance(current, list) and any(v in current for v in value)
+    if op in ("<", "<=", ">", ">="):
+        # Range filters only match values of the same type
+        if _sort_key(current)[0] != _sort_key(value)[0]:
+            return False
+        if op == "<":
+            return current < value
+        if op == "<=":
+            return current <= value
+        if op == ">":
+            return current > value
+        return current >= value
+    raise ValueError(f"Unsupported operator: {op}")
+
+
+class OperationStats:
+    """Round trips, documents read/written/deleted, per collection."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.collections: Dict[str, Dict[str, int]] = {}
+
+    def record(self, collection: str, reads: int = 0, writes: int = 0, deletes: int = 0, round_trips: int = 1) -> None:
+        # Subcollections are accounted under their collection id ("conversas/u1/chunks" -> "chunks")
+        name = collection.rsplit("/", 1)[-1]
+        with self._lock:
+            stats = self.collections.setdefault(name, {"round_trips": 0, "reads": 0, "writes": 0, "deletes": 0})
+            stats["round_trips"] += round_trips
+            stats["reads"] += reads
+            stats["writes"] += writes
+            stats["deletes"] += deletes
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            collections = copy.deepcopy(self.collections)
+        totals = {"round_trips": 0, "reads": 0, "writes": 0, "deletes": 0}
+        for stats in collections.values():
+            for key in totals:
+                totals[key] += stats[key]
+        return {"totals": totals, "collections": collections}
+
+
+class MemoryDocumentSnapshot:
+    def __init__(self, reference: "MemoryDocumentReference", data: Optional[Dict[str, Any]]):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+
+    @property
+    def exists(self) -> bool:
+        return self._data is not None
+
+    def to_dict(self) -> Optional[Dict[str, Any]]:
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field_path: str) -> Any:
+        found, value = _get_field(self._data or {}, field_path)
+        if not found:
+            raise KeyError(field_path)
+        return copy.deepcopy(value)
+
+
+class MemoryDocumentReference:
+    def __init__(self, store: "InMemoryFirestore", collection_path: str, doc_id: str):
+        self._store = store
+        self._collection_path = collection_path
+        self.id = doc_id
+
+    @property
+    def path(self) -> str:
+        return f"{self._collection_path}/{self.id}"
+
+    @property
+    def parent(self) -> "MemoryCollectionReference":
+        return MemoryCollectionReference(self._store, self._collection_path)
+
+    def collection(self, collection_id: str) -> "MemoryCollectionReference":
+        return MemoryCollectionReference(self._store, f"{self.path}/{collection_id}")
+
+    def get(self) -> MemoryDocumentSnapshot:
+        self._store._round_trip()
+        data = self._store._read(self._collection_path, self.id)
+        self._store.stats.record(self._collection_path, reads=1)
+        return MemoryDocumentSnapshot(self, data)
+
+    def set(self, document_data: Dict[str, Any], merge: bool = False) -> None:
+        self._store._round_trip()
+        self._store._write_set(self._collection_path, self.id, document_data, merge)
+        self._store.stats.record(self._collection_path, writes=1)
+
+    def create(self, document_data: Dict[str, Any]) -> None:
+        self._store._round_trip()
+        if self._store._read(self._collection_path, self.id) is not None:
+            raise ValueError(f"Document already exists: {self.path}")
+        self._store._write_set(self._collection_path, self.id, document_data, False)
+        self._store.stats.record(self._collection_path, writes=1)
+
+    def update(self, field_updates: Dict[str, Any]) -> None:
+        self._store._round_trip()
+        self._store._write_update(self._collection_path, self.id, field_updates)
+        self._store.stats.record(self._collection_path, writes=1)
+
+    def delete(self) -> None:
+        self._store._round_trip()
+        self._store._delete(self._collection_path, self.id)
+        self._store.stats.record(self._collection_path, deletes=1)
+
+
+class MemoryQuery:
+    def __init__(self, store: "InMemoryFirestore", collection_path: str):
+        self._store = store
+        self._collection_path = collection_path
+        self._filters: List[Tuple[str, str, Any]] = []
+        self._orders: List[Tuple[str, str]] = []
+        self._limit: Optional[int] = None
+        self._offset = 0
+        self._start_after: Optional[Any] = None
+        self._start_at: Optional[Any] = None
+
+    def _copy(self) -> "MemoryQuery":
+        query = MemoryQuery(self._store, self._collection_path)
+        query._filters = list(self._filters)
+        query._orders = list(self._orders)
+        query._limit = self._limit
+        query._offset = self._offset
+        query._start_after = self._start_after
+        query._start_at = self._start_at
+        return query
+
+    def where(self, field_path: Optional[str] = None, op_string: Optional[str] = None, value: Any = None, filter: Any = None) -> "MemoryQuery":
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        query = self._copy()
+        query._filters.append((field_path, op_string, value))
+        return query
+
+    def order_by(self, field_path: str, direction: str = ASCENDING) -> "MemoryQuery":
+        query = self._copy()
+        query._orders.append((field_path, str(direction)))
+        return query
+
+    def limit(self, count: int) -> "MemoryQuery":
+        query = self._copy()
+        query._limit = count
+        return query
+
+    def offset(self, num_to_skip: int) -> "MemoryQuery":
+        query = self._copy()
+        query._offset = num_to_skip
+        return query
+
+    def start_after(self, document_fields_or_snapshot: Any) -> "MemoryQuery":
+        query = self._copy()
+        query._start_after = document_fields_or_snapshot
+        return query
+
+    def start_at(self, document_fields_or_snapshot: Any) -> "MemoryQuery":
+        query = self._copy()
+        query._start_at = document_fields_or_snapshot
+        return query
+
+    def _order_values(self, doc_id: str, data: Dict[str, Any]) -> List[Any]:
+        values = []
+        for field_path, _ in self._orders:
+            values.append(doc_id if field_path == "__name__" else _get_field(data, field_path)[1])
+        return values
+
+    def _cursor_values(self, cursor: Any) -> List[Any]:
+        if isinstance(cursor, MemoryDocumentSnapshot):
+            return self._order_values(cursor.id, cursor._data or {})
+        if isinstance(cursor, dict):
+            return [cursor.get(field_path) for field_path, _ in self._orders]
+        return list(cursor)
+
+    def _compare(self, left: List[Any], right: List[Any]) -> int:
+        for (_, direction), a, b in zip(self._orders, left, right):
+            ka, kb = _sort_key(a), _sort_key(b)
+            if ka == kb:
+                continue
+            result = -1 if ka < kb else 1
+            return -result if direction == DESCENDING else result
+        return 0
+
+    def _run(self) -> List[MemoryDocumentSnapshot]:
+        docs = self._store._scan(self._collection_path)
+        matched = [
+            (doc_id, data) for doc_id, data in docs
+            if all(_matches(data, doc_id, f, op, v) for f, op, v in self._filters)
+        ]
+
+        # Documents missing an order_by field are excluded, as in Firestore
+        for field_path, _ in self._orders:
+            if field_path != "__name__":
+                matched = [(doc_id, data) for doc_id, data in matched if _get_field(data, field_path)[0]]
+
+        # Default order is by document id; explicit orders take precedence
+        matched.sort(key=lambda item: item[0])
+        for field_path, direction in reversed(self._orders):
+            matched.sort(
+                key=lambda item: _sort_key(item[0] if field_path == "__name__" else _get_field(item[1], field_path)[1]),
+                reverse=direction == DESCENDING
+            )
+
+        if self._start_after is not None or self._start_at is not None:
+            cursor = self._cursor_values(self._start_after if self._start_after is not None else self._start_at)
+            strict = self._start_after is not None
+            matched = [
+                (doc_id, data) for doc_id, data in matched
+                if (self._compare(self._order_values(doc_id, data), cursor) > 0) or
+                   (not strict and self._compare(self._order_values(doc_id, data), cursor) == 0)
+            ]
+
+        matched = matched[self._offset:]
+        if self._limit is not None:
+            matched = matched[:self._limit]
+
+        return [
+            MemoryDocumentSnapshot(MemoryDocumentReference(self._store, self._collection_path, doc_id), data)
+            for doc_id, data in matched
+        ]
+
+    def stream(self):
+        self._store._round_trip()
+        results = self._run()
+        # Firestore bills at least one read per query, even with no results
+        self._store.stats.record(self._collection_path, reads=max(len(results), 1))
+        return iter(results)
+
+    def get(self) -> List[MemoryDocumentSnapshot]:
+        return list(self.stream())
+
+
+class MemoryCollectionReference(MemoryQuery):
+    def __init__(self, store: "InMemoryFirestore", path: str):
+        super().__init__(store, path)
+
+    @property
+    def id(self) -> str:
+        return self._collection_path.rsplit("/", 1)[-1]
+
+    def document(self, document_id: Optional[str] = None) -> MemoryDocumentReference:
+        return MemoryDocumentReference(self._store, self._collection_path, document_id or _new_id())
+
+    def add(self, document_data: Dict[str, Any], document_id: Optional[str] = None) -> Tuple[datetime.datetime, MemoryDocumentReference]:
+        doc_ref = self.document(document_id)
+        doc_ref.set(document_data)
+        return datetime.datetime.now(datetime.timezone.utc), doc_ref
+
+    def list_documents(self) -> List[MemoryDocumentReference]:
+        return [self.document(doc_id) for doc_id, _ in self._store._scan(self._collection_path)]
+
+
+class MemoryWriteBatch:
+    """Buffers writes and applies them atomically in a single round trip on commit()."""
+
+    MAX_WRITES = 500
+
+    def __init__(self, store: "InMemoryFirestore"):
+        self._store = store
+        self._writes: List[Tuple[str, MemoryDocumentReference, Any, bool]] = []
+
+    def _add(self, op: str, reference: MemoryDocumentReference, data: Any = None, merge: bool = False) -> "MemoryWriteBatch":
+        if len(self._writes) >= self.MAX_WRITES:
+            raise ValueError(f"A batch can contain at most {self.MAX_WRITES} writes")
+        self._writes.append((op, reference, copy.deepcopy(data), merge))
+        return self
+
+    def set(self, reference: MemoryDocumentReference, document_data: Dict[str, Any], merge: bool = False) -> "MemoryWriteBatch":
+        return self._add("set", reference, document_data, merge)
+
+    def update(self, reference: MemoryDocumentReference, field_updates: Dict[str, Any]) -> "MemoryWriteBatch":
+        return self._add("update", reference, field_updates)
+
+    def delete(self, reference: MemoryDocumentReference) -> "MemoryWriteBatch":
+        return self._add("delete", reference)
+
+    def __len__(self) -> int:
+        return len(self._writes)
+
+    def commit(self) -> List[Any]:
+        self._store._round_trip()
+        if not self._writes:
+            return []
+        with self._store._lock:
+            # Validate first so a failing update leaves nothing half-applied
+            for op, reference, _, _ in self._writes:
+                if op == "update" and self._store._read(reference._collection_path, reference.id) is None:
+                    raise NotFound(f"No document to update: {reference.path}")
+            for index, (op, reference, data, merge) in enumerate(self._writes):
+                if op == "set":
+                    self._store._write_set(reference._collection_path, reference.id, data, merge)
+                elif op == "update":
+                    self._store._write_update(reference._collection_path, reference.id, data)
+                else:
+                    self._store._delete(reference._collection_path, reference.id)
+                self._store.stats.record(
+                    reference._collection_path,
+                    writes=0 if op == "delete" else 1,
+                    deletes=1 if op == "delete" else 0,
+                    # The whole batch is one round trip, accounted to the first write's collection
+                    round_trips=1 if index == 0 else 0
+                )
+        results = [datetime.datetime.now(datetime.timezone.utc)] * len(self._writes)
+        self._writes = []
+        return results
+
+
+class InMemoryFirestore:
+    """
+    Thread-safe in-memory stand-in for google.cloud.firestore.Client.
+
+    Args:
+        latency_ms: Latency injected into every round trip (get, set, update, delete, query, batch commit).
+        jitter_ms: Uniform random jitter added on top of latency_ms.
+    """
+
+    def __init__(self, latency_ms: float = 0.0, jitter_ms: float = 0.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.stats = OperationStats()
+        self._lock = threading.RLock()
+        self._collections: Dict[str, Dict[str, Dict[str, Any]]] = {}
+
+    # --- Client API ---
+
+    def collection(self, collection_path: str) -> MemoryCollectionReference:
+        return MemoryCollectionReference(self, collection_path)
+
+    def document(self, document_path: str) -> MemoryDocumentReference:
+        collection_path, doc_id = document_path.rsplit("/", 1)
+        return MemoryDocumentReference(self, collection_path, doc_id)
+
+    def batch(self) -> MemoryWriteBatch:
+        return MemoryWriteBatch(self)
+
+    def get_all(self, references: Iterable[MemoryDocumentReference], field_paths: Any = None,
+                transaction: Any = None) -> Iterator[MemoryDocumentSnapshot]:
+        """Batched document reads: one round trip, one read per document (missing ones included)."""
+        references = list(references)
+        self._round_trip()
+        snapshots = []
+        for index, reference in enumerate(references):
+            data = self._read(reference._collection_path, reference.id)
+            self.stats.record(reference._collection_path, reads=1, round_trips=1 if index == 0 else 0)
+            snapshots.append(MemoryDocumentSnapshot(reference, data))
+        return iter(snapshots)
+
+    def collections(self) -> List[MemoryCollectionReference]:
+        with self._lock:
+            return [self.collection(path) for path in self._collections if "/" not in path]
+
+    # --- Helpers for tests and benchmarks ---
+
+    def reset(self) -> None:
+        """Drops all data and counters."""
+        with self._lock:
+            self._collections = {}
+        self.stats.reset()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return self.stats.snapshot()
+
+    def dump(self) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        with self._lock:
+            return copy.deepcopy(self._collections)
+
+    # --- Storage primitives ---
+
+    def _round_trip(self) -> None:
+        delay = self.latency_ms + (random.uniform(0, self.jitter_ms) if self.jitter_ms else 0)
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+    def _read(self, collection_path: str, doc_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            data = self._collections.get(collection_path, {}).get(doc_id)
+            return copy.deepcopy(data) if data is not None else None
+
+    def _scan(self, collection_path: str) -> List[Tuple[str, Dict[str, Any]]]:
+        with self._lock:
+            return copy.deepcopy(list(self._collections.get(collection_path, {}).items()))
+
+    def _write_set(self, collection_path: str, doc_id: str, data: Dict[str, Any], merge: bool) -> None:
+        with self._lock:
+            docs = self._collections.setdefault(collection_path, {})
+            if merge and doc_id in docs:
+                _merge_into(docs[doc_id], data)
+            else:
+                docs[doc_id] = {}
+                _merge_into(docs[doc_id], data)
+
+    def _write_update(self, collection_path: str, doc_id: str, field_updates: Dict[str, Any]) -> None:
+        with self._lock:
+            doc = self._collections.get(collection_path, {}).get(doc_id)
+            if doc is None:
+                raise NotFound(f"No document to update: {collection_path}/{doc_id}")
+            for field_path, value in field_updates.items():
+                _update_path(doc, field_path, value)
+
+    def _delete(self, collection_path: str, doc_id: str) -> None:
+        with self._lock:
+            self._collections.get(collection_path, {}).pop(doc_id, None)
+
+
+_shared_store: Optional[InMemoryFirestore] = None
+_shared_lock = threading.Lock()
+
+
+def get_shared_store() -> InMemoryFirestore:
+    """
+    Process-wide store, so every FirestoreClient created with FIRESTORE_BACKEND=memory
+    (main, webhooks, agent) sees the same data.
+    """
+    global _shared_store
+    with _shared_lock:
+        if _shared_store is None:
+            _shared_store = InMemoryFirestore(
+                latency_ms=float(os.environ.get("FIRESTORE_LATENCY_MS", "0")),
+                jitter_ms=float(os.environ.get("FIRESTORE_LATENCY_JITTER_MS", "0"))
+            )
+        return _shared_store
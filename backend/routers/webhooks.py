@@ -9,8 +9,15 @@ import os
 import logging
 import datetime
 from agent_core import agent
-from database import FirestoreClient
+from database import FirestoreClient, normalize_phone
 from services.meta_service import meta_service
+from services.conversation_summary import summary_service
+from services.lead_insights import insights_service
+from services.identity import identity_service
+from services.metrics import queued_task
+from services.tracing import tracer, new_message_id
+from services.usage_tracker import usage_tracker
+from services.analytics import analytics
 import stripe
 
 # Initialize Router
@@ -90,7 +97,7 @@ async def telegram_webhook(request: Request, background_tasks: BackgroundTasks):
         raise HTTPException(status_code=400, detail="Invalid JSON")
 
     # Delegate to background task
-    background_tasks.add_task(process_telegram_payload, payload)
+    background_tasks.add_task(queued_task("telegram_message", process_telegram_payload), payload)
     return {"status": "ok"}
 
 @router.post("/webhook/meta")
@@ -108,7 +115,7 @@ async def receive_webhook(request: Request, background_tasks: BackgroundTasks):
         raise HTTPException(status_code=400, detail="Invalid JSON")
 
     # Delegate to background task
-    background_tasks.add_task(process_meta_payload, payload)
+    background_tasks.add_task(queued_task("meta_message", process_meta_payload), payload)
 
     return {"status": "ok"}
 
@@ -140,7 +147,7 @@ async def stripe_webhook(request: Request, background_tasks: BackgroundTasks):
             raise HTTPException(status_code=400, detail="Invalid signature")
 
     # Delegate to background task
-    background_tasks.add_task(process_stripe_event, event)
+    background_tasks.add_task(queued_task("stripe_event", process_stripe_event), event)
 
     return {"status": "success"}
 
@@ -181,7 +188,11 @@ async def process_stripe_event(event: Dict[str, Any]):
                                  "payment_date": timestamp,
                                  "payment_provider": "stripe"
                              })
+                             if customer_email:
+                                 # Stripe verified the checkout email: the lead can be merged on it
+                                 db.verify_identity(user_id, "email", customer_email)
                              updated = True
+                             analytics.record("conversions", "stripe")
                              logger.info(f"User {user_id} upgraded to Aluno via ID.")
                          else:
                              logger.warning(f"Payment received with user_id {user_id} but user not found in DB.")
@@ -195,9 +206,11 @@ async def process_stripe_event(event: Dict[str, Any]):
                                 "payment_date": timestamp,
                                 "payment_provider": "stripe",
                                 "nome": customer_name # Update name if available
-                            }
+                            },
+                            verify_email=True
                         )
                         if updated:
+                            analytics.record("conversions", "stripe")
                             logger.info(f"User {customer_email} upgraded to Aluno via Email.")
                         else:
                             logger.warning(f"Payment received for {customer_email} but user not found in DB.")
@@ -241,7 +254,7 @@ async def process_meta_payload(payload: Dict[str, Any]):
                         text_body = msg.get("text", {}).get("body")
 
                         if user_id and text_body:
-                            await handle_message(user_id, text_body, "whatsapp")
+                            await handle_message(user_id, text_body, "whatsapp", message_id=msg.get("id"))
 
             # Instagram Logic
             elif object_type == "instagram":
@@ -252,7 +265,7 @@ async def process_meta_payload(payload: Dict[str, Any]):
                     text_body = message_obj.get("text")
 
                     if user_id and text_body:
-                         await handle_message(user_id, text_body, "instagram")
+                         await handle_message(user_id, text_body, "instagram", message_id=message_obj.get("mid"))
 
             # Generic Page Logic (Messenger or unexpected structure)
             elif object_type == "page":
@@ -263,7 +276,7 @@ async def process_meta_payload(payload: Dict[str, Any]):
                      text_body = message_obj.get("text")
 
                      if user_id and text_body:
-                         await handle_message(user_id, text_body, "facebook_page")
+                         await handle_message(user_id, text_body, "facebook_page", message_id=message_obj.get("mid"))
 
     except Exception as e:
         logger.error(f"Error processing webhook payload: {e}")
@@ -287,64 +300,119 @@ async def process_telegram_payload(payload: Dict[str, Any]):
     except Exception as e:
         logger.error(f"Error processing Telegram payload: {e}")
 
-async def handle_message(user_id: str, text: str, platform: str):
+async def handle_message(user_id: str, text: str, platform: str, message_id: Optional[str] = None):
     """
     Core logic to handle the incoming message.
+    message_id is the platform's message id; every span of this turn is tagged with it.
     """
-    try:
-        logger.info(f"Handling message from {user_id} on {platform}: {text}")
-
-        if not db:
-            logger.error("Firestore client not initialized.")
-            return
-
-        # 1. Fetch History
-        # We use the user_id (phone or IGSID) as the Firestore document ID.
-        # This assumes phone numbers are unique enough (they are) and IGSIDs are unique (they are).
-        raw_history = await run_in_threadpool(db.get_chat_history, user_id, limit=20)
-
-        # Convert to Gemini format
-        gemini_history = agent.format_history(raw_history)
-
-        # 2. Generate Response
-        # Note: 'gemini_history' might be empty for new users.
-        # AgentCore handles system prompt injection (via system_instruction or fallback).
-        # We run this in a threadpool as it is a blocking sync call.
-        response_text = await run_in_threadpool(agent.generate_response, text, gemini_history)
-
-        # 3. Save Interaction (User Message + Agent Response)
-        new_interaction = {
-            "id_usuario": user_id,
-            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
-            "origem": platform,
-            "mensagens": [
-                {"role": "user", "content": text},
-                {"role": "agent", "content": response_text}
-            ],
-            "analise_emocional": "Neutro", # Placeholder
-            "precisa_intervencao_humana": False
-        }
-        await run_in_threadpool(db.save_chat_interaction, new_interaction)
-
-        # 4. Update User Interaction State
-        await run_in_threadpool(db.update_user_interaction, user_id, reset_followup_count=True)
-
-        # 5. Send Response via Meta Graph API
-        if platform == "whatsapp":
-            await meta_service.send_whatsapp_message(user_id, response_text)
-        elif platform == "instagram" or platform == "facebook_page":
-            await meta_service.send_instagram_message(user_id, response_text)
-
-        # 6. Analyze Lead Qualification (Async)
-        # We append the latest interaction to history for analysis
-        gemini_history.append({"role": "user", "parts": [text]})
-        gemini_history.append({"role": "model", "parts": [response_text]})
-
-        analysis = await run_in_threadpool(agent.analyze_lead_qualification, gemini_history)
-        if analysis:
-            analysis["id"] = user_id
-            # Save user profile (merges with existing)
-            await run_in_threadpool(db.save_user, analysis)
+    with tracer.start_span(
+        "meta.message",
+        {"user.id": user_id, "channel": platform},
+        message_id=message_id or new_message_id()
+    ) as span, usage_tracker.attribute_to(user_id):
+        try:
+            logger.info(f"Handling message from {user_id} on {platform}: {text}")
+
+            if not db:
+                logger.error("Firestore client not initialized.")
+                return
+
+            # 1. Fetch History
+            # We use the user_id (phone or IGSID) as the Firestore document ID.
+            # This assumes phone numbers are unique enough (they are) and IGSIDs are unique (they are).
+            # Older turns are covered by the rolling summary stored on the user document.
+            with tracer.start_span("history.fetch"):
+                user_data = await run_in_threadpool(db.get_user, user_id)
+                # Replies go to the channel id; everything else uses the canonical (merged) user
+                channel_id = user_id
+                user_id, user_data = await run_in_threadpool(identity_service.resolve, db, user_id, user_data)
+                previous_classification = user_data.get("classificacao_lead") if isinstance(user_data, dict) else None
+                analytics.record("messages", platform)
+                if user_data is None:
+                    analytics.record("new_leads", platform)
+                if platform == "whatsapp" and normalize_phone(channel_id):
+                    # The WhatsApp id is the phone, verified by the channel: index it so other
+                    # channels' leads sharing it can be merged into this one
+                    phone_key = f"phone:{normalize_phone(channel_id)}"
+                    if user_data is None:
+                        await run_in_threadpool(db.save_lead, {
+                            "id": user_id, "telefone": channel_id, "verified_identities": [phone_key]
+                        })
+                    elif isinstance(user_data, dict) and phone_key not in (user_data.get("verified_identities") or []):
+                        await run_in_threadpool(db.verify_identity, user_id, "phone", channel_id)
+                raw_history = await run_in_threadpool(db.get_chat_history, user_id, limit=summary_service.recent_interactions)
+
+                # Convert to Gemini format
+                gemini_history = agent.format_history(raw_history)
+
+            # 2. Generate Response
+            # Note: 'gemini_history' might be empty for new users.
+            # AgentCore handles system prompt injection (via system_instruction or fallback).
+            # We run this in a threadpool as it is a blocking sync call.
+            response_text = await run_in_threadpool(
+                agent.generate_response, text, gemini_history,
+                user_id=user_id, user_profile=user_data or {}, summary=summary_service.get_summary(user_data)
+            )
 
-    except Exception as e:
-        logger.error(f"Error in handle_message: {e}")
+            # 3. Save Interaction (User Message + Agent Response)
+            new_interaction = {
+                "id_usuario": user_id,
+                "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                "origem": platform,
+                "mensagens": [
+                    {"role": "user", "content": text},
+                    {"role": "agent", "content": response_text}
+                ],
+                "analise_emocional": "Neutro", # Placeholder
+                "precisa_intervencao_humana": False
+            }
+            with tracer.start_span("chat.save"):
+                await run_in_threadpool(db.save_chat_interaction, new_interaction)
+
+                # 4. Update User Interaction State
+                await run_in_threadpool(db.update_user_interaction, user_id, reset_followup_count=True)
+
+            # 5. Send Response via Meta Graph API
+            with tracer.start_span("meta.send", {"channel": platform}):
+                if platform == "whatsapp":
+                    await meta_service.send_whatsapp_message(channel_id, response_text)
+                elif platform == "instagram" or platform == "facebook_page":
+                    await meta_service.send_instagram_message(channel_id, response_text)
+
+            # 6. Analyze Lead Qualification (Async)
+            # We append the latest interaction to history for analysis
+            gemini_history.append({"role": "user", "parts": [text]})
+            gemini_history.append({"role": "model", "parts": [response_text]})
+
+            with tracer.start_span("analysis.qualification"):
+                analysis = await run_in_threadpool(agent.analyze_lead_qualification, gemini_history)
+                if analysis:
+                    analysis["id"] = user_id
+                    # Save user profile (merges with existing)
+                    await run_in_threadpool(db.save_user, analysis)
+
+            # 7. Rolling conversation summary (only every N turns)
+            # Re-read once: the qualification above may have changed the classification
+            user_data = await run_in_threadpool(db.get_user, user_id) or {}
+            if isinstance(user_data, dict):
+                analytics.record_classification(previous_classification, user_data.get("classificacao_lead"))
+            with tracer.start_span("analysis.summary"):
+                await run_in_threadpool(summary_service.update_summary, db, agent, user_id, user_data)
+
+            # 8. Lead insights for the admin page (A/B leads, once stale)
+            with tracer.start_span("analysis.insights"):
+                await run_in_threadpool(insights_service.update_if_due, db, agent, user_id, user_data)
+
+            # 9. Merge with other channels' leads sharing this email / phone (runs last: may move the user)
+            with tracer.start_span("identity.link"):
+                await run_in_threadpool(identity_service.link, db, user_id, user_data)
+
+            # 10. Token usage and analytics rollups (batched; written every N events or seconds)
+            if usage_tracker.is_due():
+                await run_in_threadpool(usage_tracker.flush, db)
+            if analytics.is_due():
+                await run_in_threadpool(analytics.flush, db)
+
+        except Exception as e:
+            span.record_exception(e)
+            logger.error(f"Error in handle_message: {e}")
@@ -0,0 +1,50 @@
+"""
+Migration: fills 'identity_index' (normalized email / phone -> user id) for users
+saved before the index existed. Safe to re-run; entries are merged.
+
+Usage (from backend/):
+    python -m scripts.backfill_identity_index --dry-run
+    python -m scripts.backfill_identity_index
+"""
+import os
+import sys
+import argparse
+import logging
+from typing import Dict
+
+# Add backend to path for imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from database import FirestoreClient, normalize_email, normalize_phone
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+
+def backfill(db: FirestoreClient, dry_run: bool = False) -> Dict[str, int]:
+    stats = {"users": 0, "emails": 0, "phones": 0}
+    for doc in db.db.collection("usuarios").stream():
+        user = doc.to_dict() or {}
+        email, phone = normalize_email(user.get("email")), normalize_phone(user.get("telefone"))
+        if not email and not phone:
+            continue
+        if not dry_run:
+            db._index_identities(doc.id, email=email, phone=phone)
+        stats["users"] += 1
+        stats["emails"] += 1 if email else 0
+        stats["phones"] += 1 if phone else 0
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill the email / phone identity index")
+    parser.add_argument("--dry-run", action="store_true", help="Count what would be written")
+    args = parser.parse_args()
+
+    stats = backfill(FirestoreClient(), dry_run=args.dry_run)
+    prefix = "Would index" if args.dry_run else "Indexed"
+    logger.info(f"{prefix} {stats['emails']} emails and {stats['phones']} phones for {stats['users']} users.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Migration: gives legacy documents the fields the indexed listings filter on, so
+get_users_needing_followup and get_knowledge_files can query server-side:
+  - usuarios with a last_interaction_timestamp but no numeric follow_up_count -> 0
+  - knowledge_base documents without a type -> "knowledge"
+Safe to re-run; documents already normalized are left alone.
+
+Listings scan by default (LEGACY_QUERY_FALLBACK=true). Deploy firestore.indexes.json,
+run this, then set LEGACY_QUERY_FALLBACK=false to switch them to indexed queries.
+
+Usage (from backend/):
+    python -m scripts.backfill_query_fields --dry-run
+    python -m scripts.backfill_query_fields
+"""
+import os
+import sys
+import argparse
+import logging
+from typing import Dict
+
+# Add backend to path for imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from database import FirestoreClient
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+# Firestore batches hold at most 500 writes
+BATCH_SIZE = 500
+
+
+def _needs_followup_count(user: Dict) -> bool:
+    count = user.get("follow_up_count")
+    return bool(user.get("last_interaction_timestamp")) and (not isinstance(count, int) or isinstance(count, bool))
+
+
+def backfill(db: FirestoreClient, dry_run: bool = False) -> Dict[str, int]:
+    stats = {"users": 0, "knowledge_files": 0}
+    batch, pending = db.db.batch(), 0
+
+    def queue(reference, data):
+        nonlocal batch, pending
+        if dry_run:
+            return
+        batch.set(reference, data, merge=True)
+        pending += 1
+        if pending >= BATCH_SIZE:
+            batch.commit()
+            batch, pending = db.db.batch(), 0
+
+    for doc in db.db.collection("usuarios").stream():
+        user = doc.to_dict() or {}
+        if _needs_followup_count(user):
+            count = user.get("follow_up_count")
+            # Numeric strings from old imports keep their value
+            value = int(count) if isinstance(count, str) and count.strip().isdigit() else 0
+            queue(doc.reference, {"follow_up_count": value})
+            stats["users"] += 1
+
+    for doc in db.db.collection("knowledge_base").stream():
+        if not (doc.to_dict() or {}).get("type"):
+            queue(doc.reference, {"type": "knowledge"})
+            stats["knowledge_files"] += 1
+
+    if pending:
+        batch.commit()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill follow_up_count and knowledge base type fields")
+    parser.add_argument("--dry-run", action="store_true", help="Count what would be written")
+    args = parser.parse_args()
+
+    stats = backfill(FirestoreClient(), dry_run=args.dry_run)
+    prefix = "Would update" if args.dry_run else "Updated"
+    logger.info(f"{prefix} {stats['users']} users and {stats['knowledge_files']} knowledge base files.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Benchmark: Firestore operations per chat turn for each chat storage layout.
+
+Replays the storage side of a turn (load the recent history, save the new
+interaction) against the in-memory Firestore backend, for the legacy layout
+(one 'interacoes_chat' document per turn) and per-user chunk documents.
+
+Usage (from backend/):
+    python -m scripts.benchmark_chat_layout
+    python -m scripts.benchmark_chat_layout --users 50 --turns 60 --history 10 --chunk-size 20 --output chat_layout.json
+"""
+import os
+import sys
+import json
+import argparse
+import datetime
+from typing import Any, Dict
+
+# Add backend to path for imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from database import FirestoreClient
+from memory_store import InMemoryFirestore
+
+
+def run_layout(layout: str, users: int, turns: int, history: int, chunk_size: int) -> Dict[str, Any]:
+    store = InMemoryFirestore()
+    db = FirestoreClient(backend=store)
+    db.chat_layout = layout
+    db.chat_chunk_size = chunk_size
+
+    start_time = datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc)
+    read_stats = {"round_trips": 0, "reads": 0}
+    for turn in range(turns):
+        for user in range(users):
+            user_id = f"user_{user}"
+            before = store.get_stats()["totals"]
+            db.get_chat_history(user_id, limit=history)
+            after = store.get_stats()["totals"]
+            read_stats["round_trips"] += after["round_trips"] - before["round_trips"]
+            read_stats["reads"] += after["reads"] - before["reads"]
+
+            db.save_chat_interaction({
+                "id_usuario": user_id,
+                "timestamp": (start_time + datetime.timedelta(minutes=turn)).isoformat(),
+                "origem": "web_chat",
+                "mensagens": [{"role": "user", "content": f"mensagem {turn}"}, {"role": "agent", "content": "resposta"}],
+            })
+
+    totals = store.get_stats()["totals"]
+    count = users * turns
+    return {
+        "layout": layout,
+        "turns": count,
+        "history_reads_per_turn": round(read_stats["reads"] / count, 2),
+        "history_round_trips_per_turn": round(read_stats["round_trips"] / count, 2),
+        "reads_per_turn": round(totals["reads"] / count, 2),
+        "writes_per_turn": round(totals["writes"] / count, 2),
+        "round_trips_per_turn": round(totals["round_trips"] / count, 2),
+        "documents_stored": sum(len(docs) for docs in store.dump().values()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chat storage layout benchmark")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=50, help="Turns per user")
+    parser.add_argument("--history", type=int, default=10, help="Interactions loaded per turn")
+    parser.add_argument("--chunk-size", type=int, default=20)
+    parser.add_argument("--output", help="Optional path to write the results as JSON")
+    args = parser.parse_args()
+
+    results = [run_layout(layout, args.users, args.turns, args.history, args.chunk_size)
+               for layout in ("interactions", "chunks")]
+
+    print(f"{'layout':>12} | {'history reads':>13} | {'reads/turn':>10} | {'writes/turn':>11} | {'rt/turn':>7} | {'docs':>6}")
+    print("-" * 75)
+    for r in results:
+        print(f"{r['layout']:>12} | {r['history_reads_per_turn']:>13} | {r['reads_per_turn']:>10} | "
+              f"{r['writes_per_turn']:>11} | {r['round_trips_per_turn']:>7} | {r['documents_stored']:>6}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"benchmark": "chat_layout", "results": results}, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
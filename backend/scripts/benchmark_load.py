@@ -0,0 +1,461 @@
+"""
+End-to-end load benchmark for /chat and /webhook/meta.
+
+Boots the FastAPI app with uvicorn against a fake Gemini model (configurable
+latency and token rate) and the in-memory Firestore backend, drives traffic
+at a configurable concurrency and reports latency percentiles, throughput,
+model calls per message and Firestore operations per message.
+
+/chat latency is the HTTP response time. /webhook/meta is acknowledged
+immediately, so its latency is measured until the reply reaches the (fake)
+Meta API; the acknowledgement time is reported separately.
+
+Usage (from backend/):
+    python -m scripts.benchmark_load
+    python -m scripts.benchmark_load --users 20 --messages 5 --concurrency 10 --model-latency-ms 800
+    python -m scripts.benchmark_load --output load.json --baseline previous_load.json
+"""
+import os
+import sys
+import json
+import time
+import hmac
+import random
+import asyncio
+import hashlib
+import argparse
+import logging
+import threading
+import zlib
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+# Add backend to path for imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+BENCH_APP_SECRET = "benchmark_app_secret"
+
+MESSAGES = [
+    "Oi, tudo bem? Vi seu vídeo sobre dólar",
+    "Tô com medo da inflação comer meu dinheiro, o real só desvaloriza",
+    "Como faço o Pix para a Bybit? Não achei a opção de converter para USDC",
+    "Posso salvar minha frase de recuperação no Google Drive?",
+    "Qual a diferença entre a mentoria e o curso?",
+    "Isso não é pirâmide né? Tenho medo de cair em golpe",
+    "Meu nome é Carla, meu email é carla@example.com",
+    "Preciso declarar cripto no imposto de renda?",
+    "Tenho uns 50 mil guardados, faz sentido dolarizar uma parte?",
+    "O que é USDC? É seguro?",
+]
+
+
+def message_for(user_id: str, turn: int) -> str:
+    # crc32, not hash(): str hashes change with PYTHONHASHSEED, so runs wouldn't replay the same messages
+    return MESSAGES[(zlib.crc32(user_id.encode("utf-8")) + turn) % len(MESSAGES)]
+
+ANALYSIS_JSON = json.dumps({
+    "nome": None,
+    "email": None,
+    "dor_principal": "Medo da inflação",
+    "maturidade": "Iniciante",
+    "compromisso": "Busca método",
+    "classificacao_lead": "Perfil B (Morno/Em educação)",
+    "summary": "Lead em educação.",
+    "objection": "Segurança",
+    "sales_angle": "Proteção patrimonial"
+})
+
+
+# --- Fake Gemini model ---
+
+class FakeModelStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls: Counter = Counter()
+
+    def record(self, kind: str) -> None:
+        with self._lock:
+            self.calls[kind] += 1
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.calls)
+
+
+class FakeModelConfig:
+    first_token_ms = 400.0
+    tokens_per_second = 150.0
+    output_tokens = 120
+    jitter = 0.2
+    stats = FakeModelStats()
+
+    @classmethod
+    def simulate(cls, output_tokens: int) -> None:
+        delay = cls.first_token_ms / 1000 + output_tokens / cls.tokens_per_second
+        delay *= 1 + random.uniform(-cls.jitter, cls.jitter)
+        time.sleep(max(delay, 0))
+
+
+class _FakePart:
+    def __init__(self, text: str):
+        self.text = text
+        self.function_call = None
+
+
+class _FakeUsage:
+    def __init__(self, prompt_tokens: int, output_tokens: int):
+        self.prompt_token_count = prompt_tokens
+        self.candidates_token_count = output_tokens
+        self.total_token_count = prompt_tokens + output_tokens
+
+
+class FakeResponse:
+    def __init__(self, text: str, prompt_tokens: int, output_tokens: int):
+        self.text = text
+        self.parts = [_FakePart(text)]
+        self.candidates = []
+        self.usage_metadata = _FakeUsage(prompt_tokens, output_tokens)
+
+
+def _prompt_tokens(content: Any) -> int:
+    from services.token_budget import estimate_tokens
+    return estimate_tokens(content)
+
+
+class FakeChatSession:
+    def __init__(self, history: Optional[List[Any]] = None):
+        self.history = list(history or [])
+
+    def send_message(self, content: Any, **kwargs) -> FakeResponse:
+        FakeModelConfig.stats.record("chat_send")
+        FakeModelConfig.simulate(FakeModelConfig.output_tokens)
+        text = "Entendo. A dolarização é um processo de proteção, não de especulação. Posso te explicar o método?"
+        return FakeResponse(text, _prompt_tokens(self.history) + _prompt_tokens(content), FakeModelConfig.output_tokens)
+
+
+class FakeGenerativeModel:
+    """Stands in for genai.GenerativeModel: no network, configurable latency."""
+
+    def __init__(self, model_name: str = "fake", system_instruction: Any = None, tools: Any = None,
+                 generation_config: Optional[Dict[str, Any]] = None, **kwargs):
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+        self.tools = tools
+        self.generation_config = generation_config or {}
+
+    def start_chat(self, history: Optional[List[Any]] = None, **kwargs) -> FakeChatSession:
+        return FakeChatSession(history)
+
+    def generate_content(self, contents: Any, **kwargs) -> FakeResponse:
+        FakeModelConfig.stats.record("generate_content")
+        output_tokens = FakeModelConfig.output_tokens // 2
+        FakeModelConfig.simulate(output_tokens)
+        wants_json = self.generation_config.get("response_mime_type") == "application/json" or "JSON" in str(contents)
+        text = ANALYSIS_JSON if wants_json else "Resumo: lead interessado em proteção contra inflação."
+        return FakeResponse(text, _prompt_tokens(contents), output_tokens)
+
+    def count_tokens(self, contents: Any, **kwargs):
+        FakeModelConfig.stats.record("count_tokens")
+        return type("CountTokensResponse", (), {"total_tokens": _prompt_tokens(contents)})()
+
+
+# --- Fake Meta API ---
+
+class FakeMetaService:
+    """Records when each reply would have been delivered, and wakes the waiting client."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waiters: Dict[str, Any] = {}
+        self.sent = 0
+
+    def expect(self, user_id: str, loop: asyncio.AbstractEventLoop) -> asyncio.Future:
+        future = loop.create_future()
+        with self._lock:
+            self._waiters[user_id] = (loop, future)
+        return future
+
+    def _deliver(self, user_id: str) -> None:
+        now = time.perf_counter()
+        with self._lock:
+            self.sent += 1
+            waiter = self._waiters.pop(user_id, None)
+        if waiter:
+            loop, future = waiter
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(now))
+
+    async def send_whatsapp_message(self, to_number: str, text: str) -> Dict[str, Any]:
+        self._deliver(to_number)
+        return {"messages": [{"id": "fake"}]}
+
+    async def send_instagram_message(self, recipient_id: str, text: str) -> Dict[str, Any]:
+        self._deliver(recipient_id)
+        return {"message_id": "fake"}
+
+
+# --- Reporting ---
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, int(round(pct / 100 * len(ordered) + 0.5 - 1e-9)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def summarize_latencies(latencies_ms: List[float]) -> Dict[str, float]:
+    return {
+        "p50_ms": round(percentile(latencies_ms, 50), 1),
+        "p95_ms": round(percentile(latencies_ms, 95), 1),
+        "p99_ms": round(percentile(latencies_ms, 99), 1),
+        "max_ms": round(max(latencies_ms), 1) if latencies_ms else 0.0,
+        "mean_ms": round(sum(latencies_ms) / len(latencies_ms), 1) if latencies_ms else 0.0,
+    }
+
+
+def diff_counts(after: Dict[str, int], before: Dict[str, int]) -> Dict[str, int]:
+    return {key: after.get(key, 0) - before.get(key, 0) for key in set(after) | set(before)}
+
+
+# --- Harness ---
+
+class LoadHarness:
+    def __init__(self, port: int):
+        self.port = port
+        self.base_url = f"http://127.0.0.1:{port}"
+        self.server = None
+        self.thread = None
+        self.meta = FakeMetaService()
+
+    def boot(self) -> None:
+        """Imports the app with fakes in place and starts uvicorn in a background thread."""
+        import google.generativeai as genai
+        genai.GenerativeModel = FakeGenerativeModel
+
+        import uvicorn
+        import agent_core
+        import main
+        from routers import webhooks
+        from memory_store import get_shared_store
+
+        agent_core.is_genai_configured = True
+        agent_core.agent.refresh_knowledge_base()
+        webhooks.meta_service = self.meta
+        webhooks.META_APP_SECRET = BENCH_APP_SECRET
+
+        self.store = get_shared_store()
+        logging.getLogger().setLevel(logging.WARNING)
+
+        config = uvicorn.Config(main.app, host="127.0.0.1", port=self.port, log_level="warning", access_log=False)
+        self.server = uvicorn.Server(config)
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+        self.thread.start()
+        deadline = time.time() + 10
+        while not self.server.started:
+            if time.time() > deadline:
+                raise RuntimeError("uvicorn did not start")
+            time.sleep(0.05)
+
+    def shutdown(self) -> None:
+        if self.server:
+            self.server.should_exit = True
+            self.thread.join(timeout=10)
+
+    def counters(self) -> Dict[str, Any]:
+        return {"model": FakeModelConfig.stats.snapshot(), "firestore": self.store.get_stats()["totals"]}
+
+    def wait_for_quiescence(self, timeout: float = 60.0, settle: float = 0.5) -> None:
+        """Background tasks keep running after responses; wait until nothing changes for `settle` seconds."""
+        deadline = time.time() + timeout
+        last = self.counters()
+        stable_since = time.time()
+        while time.time() < deadline:
+            time.sleep(0.05)
+            current = self.counters()
+            if current != last:
+                last = current
+                stable_since = time.time()
+            elif time.time() - stable_since >= settle:
+                return
+
+    @staticmethod
+    def meta_payload(user_id: str, text: str) -> bytes:
+        payload = {
+            "object": "whatsapp_business_account",
+            "entry": [{"changes": [{"value": {"messages": [{"from": user_id, "type": "text", "text": {"body": text}}]}}]}]
+        }
+        return json.dumps(payload).encode("utf-8")
+
+    async def _chat_user(self, client, user_id: str, messages: int, semaphore: asyncio.Semaphore,
+                         latencies: List[float], errors: Counter) -> None:
+        async with semaphore:
+            for i in range(messages):
+                text = message_for(user_id, i)
+                start = time.perf_counter()
+                try:
+                    response = await client.post("/chat", json={"message": text, "user_id": user_id})
+                    if response.status_code != 200:
+                        errors[str(response.status_code)] += 1
+                        continue
+                except Exception as e:
+                    errors[type(e).__name__] += 1
+                    continue
+                latencies.append((time.perf_counter() - start) * 1000)
+
+    async def _webhook_user(self, client, user_id: str, messages: int, semaphore: asyncio.Semaphore,
+                            latencies: List[float], ack_latencies: List[float], errors: Counter, reply_timeout: float) -> None:
+        loop = asyncio.get_running_loop()
+        async with semaphore:
+            for i in range(messages):
+                body = self.meta_payload(user_id, message_for(user_id, i))
+                signature = "sha256=" + hmac.new(BENCH_APP_SECRET.encode("utf-8"), body, hashlib.sha256).hexdigest()
+                reply = self.meta.expect(user_id, loop)
+                start = time.perf_counter()
+                try:
+                    response = await client.post(
+                        "/webhook/meta", content=body,
+                        headers={"Content-Type": "application/json", "X-Hub-Signature-256": signature}
+                    )
+                    ack_latencies.append((time.perf_counter() - start) * 1000)
+                    if response.status_code != 200:
+                        errors[str(response.status_code)] += 1
+                        continue
+                    delivered_at = await asyncio.wait_for(reply, timeout=reply_timeout)
+                except asyncio.TimeoutError:
+                    errors["reply_timeout"] += 1
+                    continue
+                except Exception as e:
+                    errors[type(e).__name__] += 1
+                    continue
+                latencies.append((delivered_at - start) * 1000)
+
+    async def run_scenario(self, name: str, users: int, messages: int, concurrency: int, reply_timeout: float) -> Dict[str, Any]:
+        import httpx
+
+        self.wait_for_quiescence()
+        before = self.counters()
+        latencies: List[float] = []
+        ack_latencies: List[float] = []
+        errors: Counter = Counter()
+        semaphore = asyncio.Semaphore(concurrency)
+        limits = httpx.Limits(max_connections=concurrency * 2, max_keepalive_connections=concurrency * 2)
+
+        start = time.perf_counter()
+        async with httpx.AsyncClient(base_url=self.base_url, timeout=reply_timeout, limits=limits) as client:
+            tasks = []
+            for u in range(users):
+                user_id = f"bench_{name}_{u:04d}" if name == "chat" else f"55119{u:08d}"
+                if name == "chat":
+                    tasks.append(self._chat_user(client, user_id, messages, semaphore, latencies, errors))
+                else:
+                    tasks.append(self._webhook_user(client, user_id, messages, semaphore, latencies, ack_latencies, errors, reply_timeout))
+            await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+
+        # Background work (entity extraction, qualification, summaries) is part of the cost of a message
+        self.wait_for_quiescence()
+        after = self.counters()
+        completed = len(latencies)
+        model_calls = diff_counts(after["model"], before["model"])
+        firestore = diff_counts(after["firestore"], before["firestore"])
+
+        result = {
+            "messages_sent": users * messages,
+            "messages_completed": completed,
+            "errors": dict(errors),
+            "elapsed_s": round(elapsed, 2),
+            "throughput_msg_s": round(completed / elapsed, 2) if elapsed else 0.0,
+            "latency": summarize_latencies(latencies),
+            "model_calls_per_message": {k: round(v / max(completed, 1), 2) for k, v in sorted(model_calls.items())},
+            "firestore_per_message": {k: round(v / max(completed, 1), 2) for k, v in sorted(firestore.items())},
+        }
+        if ack_latencies:
+            result["ack_latency"] = summarize_latencies(ack_latencies)
+        return result
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any]) -> None:
+    """Prints the change of the headline metrics against a previous run."""
+    print("\nComparison with baseline:")
+    for scenario, current in results["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(scenario)
+        if not previous:
+            continue
+        for label, path in [("p50", ("latency", "p50_ms")), ("p95", ("latency", "p95_ms")), ("p99", ("latency", "p99_ms")),
+                            ("throughput", ("throughput_msg_s",)), ("firestore round trips", ("firestore_per_message", "round_trips"))]:
+            old, new = previous, current
+            for key in path:
+                old = old.get(key, 0) if isinstance(old, dict) else 0
+                new = new.get(key, 0) if isinstance(new, dict) else 0
+            change = ((new - old) / old * 100) if old else 0.0
+            print(f"  {scenario:>12} {label:<22} {old:>10} -> {new:<10} ({change:+.1f}%)")
+
+
+def print_report(results: Dict[str, Any]) -> None:
+    print(f"\n{'scenario':>12} | {'done':>6} | {'err':>4} | {'msg/s':>7} | {'p50 ms':>8} | {'p95 ms':>8} | {'p99 ms':>8} | {'model/msg':>9} | {'fs rt/msg':>9}")
+    print("-" * 100)
+    for name, r in results["scenarios"].items():
+        model_per_msg = sum(v for k, v in r["model_calls_per_message"].items() if k != "count_tokens")
+        print(f"{name:>12} | {r['messages_completed']:>6} | {sum(r['errors'].values()):>4} | {r['throughput_msg_s']:>7} | "
+              f"{r['latency']['p50_ms']:>8} | {r['latency']['p95_ms']:>8} | {r['latency']['p99_ms']:>8} | "
+              f"{round(model_per_msg, 2):>9} | {r['firestore_per_message'].get('round_trips', 0):>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end load benchmark for /chat and /webhook/meta")
+    parser.add_argument("--scenarios", nargs="+", choices=["chat", "webhook"], default=["chat", "webhook"])
+    parser.add_argument("--users", type=int, default=10, help="Virtual users per scenario")
+    parser.add_argument("--messages", type=int, default=3, help="Messages sent by each user, one after the other")
+    parser.add_argument("--concurrency", type=int, default=5, help="Users active at the same time")
+    parser.add_argument("--model-latency-ms", type=float, default=400.0, help="Fake model time to first token")
+    parser.add_argument("--model-tokens-per-s", type=float, default=150.0, help="Fake model output rate")
+    parser.add_argument("--model-output-tokens", type=int, default=120, help="Tokens per fake chat reply")
+    parser.add_argument("--firestore-latency-ms", type=float, default=5.0, help="Injected latency per Firestore round trip")
+    parser.add_argument("--reply-timeout", type=float, default=120.0)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Optional path to write the results as JSON")
+    parser.add_argument("--baseline", help="Previous results JSON to compare against")
+    args = parser.parse_args()
+
+    # Must be set before the app (and its FirestoreClient instances) is imported
+    os.environ["FIRESTORE_BACKEND"] = "memory"
+    os.environ["FIRESTORE_LATENCY_MS"] = str(args.firestore_latency_ms)
+    os.environ.setdefault("GOOGLE_API_KEY", "benchmark-fake-key-0000000000000000")
+
+    random.seed(args.seed)
+    FakeModelConfig.first_token_ms = args.model_latency_ms
+    FakeModelConfig.tokens_per_second = args.model_tokens_per_s
+    FakeModelConfig.output_tokens = args.model_output_tokens
+
+    harness = LoadHarness(args.port)
+    harness.boot()
+    try:
+        results = {
+            "benchmark": "load",
+            "config": {k: v for k, v in vars(args).items() if k not in ("output", "baseline")},
+            "scenarios": {}
+        }
+        for scenario in args.scenarios:
+            name = "chat" if scenario == "chat" else "webhook_meta"
+            results["scenarios"][name] = asyncio.run(
+                harness.run_scenario(name, args.users, args.messages, args.concurrency, args.reply_timeout)
+            )
+    finally:
+        harness.shutdown()
+
+    print_report(results)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
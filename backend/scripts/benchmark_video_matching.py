@@ -0,0 +1,159 @@
+"""
+Benchmark: prompt tokens spent on the video catalogue per turn.
+
+Compares the legacy layout (whole catalogue dumped into the system instruction,
+sent on every turn) with local trigger matching (static rules + the top
+candidates injected into the turn) for synthetic catalogues of several sizes.
+
+Usage (from backend/):
+    python -m scripts.benchmark_video_matching
+    python -m scripts.benchmark_video_matching --sizes 10 100 1000 --output video_matching.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+from typing import Any, Dict, List
+
+# Add backend to path for imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from services.video_matcher import VideoMatcher, format_video_line
+from services.token_budget import estimate_tokens
+
+LEGACY_HEADER = (
+    "\n\n--- CATÁLOGO DE VÍDEOS (FERRAMENTA DISPONÍVEL) ---\n"
+    "Você tem acesso à ferramenta `recommend_video(video_id)`. "
+    "Use esta ferramenta quando o contexto da conversa corresponder a um dos itens abaixo, "
+    "MAS APENAS SE O USUÁRIO FOR PERFIL A OU B (Qualificado/Morno).\n"
+    "Leads Perfil C (Frio/Curioso) NÃO devem receber vídeos, a menos que o contexto seja técnico (suporte).\n"
+    "ATENÇÃO: Conforme a Regra 9, ao recomendar um vídeo, você deve usar `youtube_transcription_tool` na URL do vídeo e responder usando a transcrição exata.\n\n"
+    "IDs DISPONÍVEIS:\n"
+)
+
+MATCHED_HEADER = (
+    "\n\n--- CATÁLOGO DE VÍDEOS (FERRAMENTA DISPONÍVEL) ---\n"
+    "Você tem acesso à ferramenta `recommend_video(video_id)`. "
+    "Quando a mensagem do usuário trouxer um bloco 'VÍDEOS CANDIDATOS PARA ESTA MENSAGEM', "
+    "use esta ferramenta se o contexto da conversa corresponder ao Gatilho de um dos itens, "
+    "MAS APENAS SE O USUÁRIO FOR PERFIL A OU B (Qualificado/Morno).\n"
+    "Leads Perfil C (Frio/Curioso) NÃO devem receber vídeos, a menos que o contexto seja técnico (suporte).\n"
+    "Use SOMENTE IDs listados nesse bloco. Se não houver bloco, não recomende vídeos.\n"
+    "ATENÇÃO: Conforme a Regra 9, ao recomendar um vídeo, você deve usar `youtube_transcription_tool` na URL do vídeo e responder usando a transcrição exata.\n"
+    "---------------------------------------------------\n"
+)
+
+TOPICS = [
+    ("Pix na Bybit", "Usuário com dúvida sobre como fazer depósito via Pix na Bybit e converter para USDC"),
+    ("Verificação KYC", "Usuário travado na verificação de identidade (KYC) da corretora"),
+    ("Ativando o 2FA", "Usuário perguntando sobre Google Authenticator ou autenticação em dois fatores"),
+    ("Cartão Bybit", "Usuário quer usar o cartão Bybit para gastar em dólar"),
+    ("Phantom Wallet", "Usuário com medo de perder a carteira Phantom ou a frase de recuperação"),
+    ("Recovery Phrase", "Usuário quer tirar print ou salvar a recovery phrase na nuvem"),
+    ("Inflação e Real", "Usuário preocupado com a inflação e a desvalorização do real"),
+    ("Reserva em dólar", "Usuário quer começar uma reserva de emergência em dólar"),
+    ("Autocustódia", "Usuário não entende a diferença entre corretora e carteira de autocustódia"),
+    ("Medo de golpe", "Usuário com medo de golpe ou pirâmide financeira em cripto"),
+    ("Day trade não", "Usuário pedindo dicas de day trade ou operações de curto prazo"),
+    ("Stablecoins", "Usuário perguntando o que é USDC, USDT ou stablecoin lastreada"),
+    ("Imposto de renda", "Usuário com dúvida sobre declarar criptomoedas no imposto de renda"),
+    ("Mentoria", "Usuário quer saber a diferença entre curso, imersão e mentoria"),
+    ("Remessa internacional", "Usuário quer enviar dinheiro para o exterior ou pagar em dólar"),
+]
+
+MESSAGES = [
+    "Como faço o Pix para a Bybit? Não achei a opção de converter para USDC",
+    "Tô com medo da inflação comer meu dinheiro, o real só desvaloriza",
+    "Posso salvar minha frase de recuperação no Google Drive?",
+    "Me passa uma dica de day trade pra hoje",
+    "Qual a diferença entre a mentoria e o curso?",
+    "Minha verificação de identidade na corretora travou",
+    "Isso não é pirâmide né? Tenho medo de cair em golpe",
+    "Oi, tudo bem?",
+    "Preciso declarar cripto no imposto de renda?",
+    "O que é USDC? É seguro?",
+]
+
+
+def build_catalogue(size: int, seed: int = 42) -> List[Dict[str, Any]]:
+    """Synthetic catalogue: base topics repeated with variations so triggers overlap realistically."""
+    rng = random.Random(seed)
+    qualifiers = ["iniciante", "avançado", "passo a passo", "erros comuns", "na prática", "em 5 minutos",
+                  "para família", "para empresas", "parte 2", "atualizado", "ao vivo", "perguntas frequentes"]
+    videos = []
+    for i in range(size):
+        title, trigger = TOPICS[i % len(TOPICS)]
+        qualifier = rng.choice(qualifiers)
+        videos.append({
+            "id": f"video_{i:04d}",
+            "title": f"{title} - {qualifier}",
+            "url": f"https://youtu.be/vid{i:05d}",
+            "trigger_context": f"{trigger} ({qualifier})",
+            "active": True
+        })
+    return videos
+
+
+def run_size(size: int) -> Dict[str, Any]:
+    videos = build_catalogue(size)
+
+    legacy_section = LEGACY_HEADER + "".join(format_video_line(v) for v in videos) + "---------------------------------------------------\n"
+    legacy_tokens = estimate_tokens(legacy_section)
+
+    start = time.perf_counter()
+    matcher = VideoMatcher(videos)
+    build_ms = (time.perf_counter() - start) * 1000
+
+    static_tokens = estimate_tokens(MATCHED_HEADER)
+    candidate_tokens = []
+    match_us = []
+    hits = 0
+    for message in MESSAGES:
+        start = time.perf_counter()
+        candidates = matcher.match(message)
+        match_us.append((time.perf_counter() - start) * 1e6)
+        block = VideoMatcher.format_candidates(candidates)
+        candidate_tokens.append(estimate_tokens(block) if block else 0)
+        hits += 1 if candidates else 0
+
+    avg_candidate_tokens = sum(candidate_tokens) / len(candidate_tokens)
+    matched_tokens = static_tokens + avg_candidate_tokens
+
+    return {
+        "catalogue_size": size,
+        "legacy_tokens_per_turn": legacy_tokens,
+        "matched_tokens_per_turn": round(matched_tokens, 1),
+        "tokens_saved_per_turn": round(legacy_tokens - matched_tokens, 1),
+        "savings_pct": round((1 - matched_tokens / legacy_tokens) * 100, 1),
+        "messages_with_candidates": hits,
+        "messages": len(MESSAGES),
+        "index_build_ms": round(build_ms, 2),
+        "avg_match_us": round(sum(match_us) / len(match_us), 1),
+        "max_match_us": round(max(match_us), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Video catalogue prompt token benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--output", help="Optional path to write the results as JSON")
+    args = parser.parse_args()
+
+    results = [run_size(size) for size in args.sizes]
+
+    print(f"{'videos':>7} | {'legacy tok/turn':>15} | {'matched tok/turn':>16} | {'saved':>8} | {'saved %':>7} | {'avg match':>10}")
+    print("-" * 80)
+    for r in results:
+        print(f"{r['catalogue_size']:>7} | {r['legacy_tokens_per_turn']:>15} | {r['matched_tokens_per_turn']:>16} | "
+              f"{r['tokens_saved_per_turn']:>8} | {r['savings_pct']:>6}% | {r['avg_match_us']:>8}us")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"benchmark": "video_matching", "results": results}, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
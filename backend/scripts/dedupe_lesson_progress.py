@@ -0,0 +1,96 @@
+"""
+Migration: moves 'progresso_aulas' records to their deterministic ids
+(database.lesson_progress_id), merging duplicates of the same user/module/lesson
+that concurrent saves created, and rebuilds the per-user 'progresso_resumo'
+documents used by dashboards. Safe to re-run.
+
+Duplicates are merged oldest first (by updated_at when present), so later
+records win field by field.
+
+Usage (from backend/):
+    python -m scripts.dedupe_lesson_progress --dry-run
+    python -m scripts.dedupe_lesson_progress
+"""
+import os
+import sys
+import argparse
+import logging
+from typing import Any, Dict, List, Tuple
+
+# Add backend to path for imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from database import FirestoreClient, lesson_progress_id
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+# Firestore batches hold at most 500 writes
+BATCH_SIZE = 500
+
+
+def dedupe(db: FirestoreClient, dry_run: bool = False) -> Dict[str, int]:
+    stats = {"records": 0, "lessons": 0, "duplicates_removed": 0, "users": 0}
+    groups: Dict[Tuple[str, str, str], List[Any]] = {}
+    for doc in db.db.collection("progresso_aulas").stream():
+        data = doc.to_dict() or {}
+        stats["records"] += 1
+        key = (data.get("id_usuario"), data.get("modulo"), data.get("aula"))
+        if not all(key):
+            logger.warning(f"Skipping incomplete progress record {doc.id}")
+            continue
+        groups.setdefault(key, []).append(doc)
+
+    collection = db.db.collection("progresso_aulas")
+    batch, pending = db.db.batch(), 0
+    summaries: Dict[str, Dict[str, Dict[str, Any]]] = {}
+
+    def queue(method: str, reference, *args, **kwargs):
+        nonlocal batch, pending
+        if dry_run:
+            return
+        getattr(batch, method)(reference, *args, **kwargs)
+        pending += 1
+        if pending >= BATCH_SIZE:
+            batch.commit()
+            batch, pending = db.db.batch(), 0
+
+    for (user_id, modulo, aula), docs in groups.items():
+        progress_id = lesson_progress_id(user_id, modulo, aula)
+        docs.sort(key=lambda d: (d.to_dict() or {}).get("updated_at") or "")
+        merged: Dict[str, Any] = {}
+        for doc in docs:
+            merged.update(doc.to_dict() or {})
+
+        stale = [doc for doc in docs if doc.id != progress_id]
+        if stale:
+            queue("set", collection.document(progress_id), merged)
+            for doc in stale:
+                queue("delete", doc.reference)
+        stats["lessons"] += 1
+        stats["duplicates_removed"] += len(docs) - 1
+        summaries.setdefault(user_id, {})[progress_id] = merged
+
+    for user_id, lessons in summaries.items():
+        queue("set", db.db.collection("progresso_resumo").document(user_id),
+              db._lesson_summary_update(user_id, lessons))
+        stats["users"] += 1
+
+    if pending:
+        batch.commit()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Deduplicate lesson progress and rebuild progress summaries")
+    parser.add_argument("--dry-run", action="store_true", help="Count what would be written")
+    args = parser.parse_args()
+
+    stats = dedupe(FirestoreClient(), dry_run=args.dry_run)
+    prefix = "Would keep" if args.dry_run else "Kept"
+    logger.info(f"{prefix} {stats['lessons']} lessons from {stats['records']} records "
+                f"({stats['duplicates_removed']} duplicates) for {stats['users']} users.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Imports leads from a CSV (with header) or NDJSON export of a spreadsheet / other CRM.
+
+Phones and emails are normalized, rows are deduplicated within the file and
+against existing users (identity_index), and leads are written in batches of
+500 with several batches in flight. Rows not imported are written with a
+reason to the rejected-rows CSV (default: <input>.rejected.csv).
+
+Usage (from backend/):
+    python -m scripts.import_leads leads.csv --dry-run
+    python -m scripts.import_leads leads.ndjson --on-duplicate merge --source hubspot
+"""
+import os
+import sys
+import argparse
+import logging
+
+# Add backend to path for imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from database import FirestoreClient
+from services.analytics import analytics
+from services.lead_import import LeadImporter, read_rows, DUPLICATE_POLICIES, IMPORT_WRITE_WORKERS
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import leads from CSV or NDJSON")
+    parser.add_argument("path", help="CSV (with header) or NDJSON file")
+    parser.add_argument("--format", choices=["csv", "ndjson"], help="Input format (default: from the file extension)")
+    parser.add_argument("--on-duplicate", choices=DUPLICATE_POLICIES, default="skip",
+                        help="Leads matching an existing user: skip them, or merge to fill in only the fields "
+                             "that user is missing (existing values are kept, tags are added)")
+    parser.add_argument("--source", default="import", help="Stored on new users as origem_importacao")
+    parser.add_argument("--rejected", help="Rejected-rows CSV (default: <input>.rejected.csv)")
+    parser.add_argument("--workers", type=int, default=IMPORT_WRITE_WORKERS, help="Batches committed concurrently")
+    parser.add_argument("--dry-run", action="store_true", help="Validate and deduplicate without writing")
+    args = parser.parse_args()
+
+    fmt = args.format or ("ndjson" if args.path.endswith((".ndjson", ".jsonl")) else "csv")
+    rejected_path = args.rejected or f"{os.path.splitext(args.path)[0]}.rejected.csv"
+    db = FirestoreClient()
+
+    with open(args.path, newline="", encoding="utf-8-sig") as source, \
+            open(rejected_path, "w", newline="", encoding="utf-8") as rejected:
+        report = LeadImporter(workers=args.workers).run(
+            db, read_rows(source, fmt), rejected=rejected,
+            on_duplicate=args.on_duplicate, source=args.source, dry_run=args.dry_run
+        )
+
+    if report["imported"] and not args.dry_run:
+        analytics.record("new_leads", "import", count=report["imported"])
+        analytics.flush(db)
+
+    prefix = "Would import" if args.dry_run else "Imported"
+    logger.info(f"{prefix} {report['imported']} new leads, merged {report['merged']}, "
+                f"{report['duplicates']} duplicates, {report['rejected']} rejected "
+                f"out of {report['rows']} rows in {report['seconds']}s ({report['rows_per_second']} rows/s, "
+                f"{report['retries']} retries).")
+    if report["rejected"]:
+        logger.info(f"Rejected rows written to {rejected_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Migration: copies chat history from one document per turn ('interacoes_chat')
+into per-user chunk documents ('conversas/{user_id}/chunks/{seq}').
+
+Old documents are left in place. Run it, set CHAT_STORAGE_LAYOUT=chunks,
+then run it again with --users for anyone who chatted in between.
+Users that already have chunks are skipped unless --force is given
+(--force rewrites their chunks from 'interacoes_chat' only).
+
+Usage (from backend/):
+    python -m scripts.migrate_chat_layout --dry-run
+    python -m scripts.migrate_chat_layout --chunk-size 20
+    python -m scripts.migrate_chat_layout --users 5511999999999 5511888888888 --force
+"""
+import os
+import sys
+import argparse
+import logging
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+# Add backend to path for imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from database import FirestoreClient
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+
+def load_interactions(db: FirestoreClient, user_ids: Optional[List[str]] = None) -> Dict[str, List[Dict[str, Any]]]:
+    """Groups 'interacoes_chat' documents by user."""
+    by_user: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    collection = db.db.collection("interacoes_chat")
+    if user_ids:
+        docs = (doc for user_id in user_ids
+                for doc in collection.where(field_path="id_usuario", op_string="==", value=user_id).stream())
+    else:
+        docs = collection.stream()
+    for doc in docs:
+        data = doc.to_dict()
+        if data.get("id_usuario"):
+            by_user[data["id_usuario"]].append(data)
+    return by_user
+
+
+def migrate(db: FirestoreClient, user_ids: Optional[List[str]] = None, force: bool = False,
+            dry_run: bool = False) -> Dict[str, int]:
+    stats = {"users": 0, "skipped": 0, "interactions": 0, "chunks": 0}
+    for user_id, interactions in load_interactions(db, user_ids).items():
+        if not force and list(db._chat_chunks(user_id).limit(1).stream()):
+            stats["skipped"] += 1
+            continue
+        chunk_count = -(-len(interactions) // max(db.chat_chunk_size, 1))
+        if not dry_run:
+            chunk_count = db.write_chat_chunks(user_id, interactions)
+        stats["users"] += 1
+        stats["interactions"] += len(interactions)
+        stats["chunks"] += chunk_count
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate chat history to per-user chunk documents")
+    parser.add_argument("--users", nargs="+", help="Only migrate these user ids")
+    parser.add_argument("--chunk-size", type=int, help="Interactions per chunk (default CHAT_CHUNK_SIZE)")
+    parser.add_argument("--force", action="store_true", help="Rewrite users that already have chunks")
+    parser.add_argument("--dry-run", action="store_true", help="Count what would be written")
+    args = parser.parse_args()
+
+    db = FirestoreClient()
+    if args.chunk_size:
+        db.chat_chunk_size = args.chunk_size
+
+    stats = migrate(db, user_ids=args.users, force=args.force, dry_run=args.dry_run)
+    prefix = "Would migrate" if args.dry_run else "Migrated"
+    logger.info(f"{prefix} {stats['interactions']} interactions for {stats['users']} users "
+                f"into {stats['chunks']} chunks ({stats['skipped']} users already migrated).")
+
+
+if __name__ == "__main__":
+    main()
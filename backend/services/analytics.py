@@ -0,0 +1,163 @@
+import os
+import re
+import time
+import logging
+import datetime
+import threading
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Pending counters are written to Firestore after this many events or seconds, whichever comes first
+ANALYTICS_FLUSH_EVERY_EVENTS = int(os.environ.get("ANALYTICS_FLUSH_EVERY_EVENTS", "50"))
+ANALYTICS_FLUSH_INTERVAL_SECONDS = float(os.environ.get("ANALYTICS_FLUSH_INTERVAL_SECONDS", "60"))
+
+# Bucket id format per granularity (UTC)
+GRANULARITIES = {"hour": "%Y-%m-%dT%H", "day": "%Y-%m-%d"}
+
+# Counted events; each is stored as a map {dimension: count, "total": count}
+#   messages: inbound user messages, by channel
+#   new_leads: first contact, by channel
+#   classification_changes: lead tier transitions, e.g. "C->A"
+#   followups_sent: follow-up messages, by channel
+#   conversions: upgrades to Aluno, by payment provider
+EVENTS = ("messages", "new_leads", "classification_changes", "followups_sent", "conversions")
+
+_TIER = re.compile(r"\bPerfil\s+([ABC])\b|^([ABC])\b")
+
+
+def classification_tier(classification: Any) -> str:
+    """'Perfil A (Qualificado/Quente)' -> 'A'; unclassified -> 'none'."""
+    if isinstance(classification, str):
+        match = _TIER.search(classification.strip())
+        if match:
+            return match.group(1) or match.group(2)
+    return "none"
+
+
+def _bucket(at: datetime.datetime, granularity: str) -> str:
+    return at.astimezone(datetime.timezone.utc).strftime(GRANULARITIES[granularity])
+
+
+class AnalyticsRollups:
+    """
+    Incremental analytics: events are counted in memory into hourly and daily
+    buckets as they happen, and flush_if_due adds them to the 'analytics_rollups'
+    documents ('<granularity>_<bucket>') with field increments from background
+    work. /admin/analytics then reads one document per bucket instead of
+    scanning users or interactions.
+    """
+
+    def __init__(self, flush_every_events: int = ANALYTICS_FLUSH_EVERY_EVENTS,
+                 flush_interval_seconds: float = ANALYTICS_FLUSH_INTERVAL_SECONDS):
+        self.flush_every_events = flush_every_events
+        self.flush_interval_seconds = flush_interval_seconds
+        self._lock = threading.Lock()
+        self._pending: Dict[tuple, Dict[str, Dict[str, int]]] = {}
+        self._pending_events = 0
+        self._last_flush = time.monotonic()
+
+    def record(self, event: str, dimension: Optional[str] = None, count: int = 1,
+               at: Optional[datetime.datetime] = None) -> None:
+        if event not in EVENTS:
+            raise ValueError(f"Unknown analytics event: {event}")
+        at = at or datetime.datetime.now(datetime.timezone.utc)
+        with self._lock:
+            for granularity in GRANULARITIES:
+                counters = self._pending.setdefault((granularity, _bucket(at, granularity)), {})
+                values = counters.setdefault(event, {})
+                values["total"] = values.get("total", 0) + count
+                if dimension:
+                    values[dimension] = values.get(dimension, 0) + count
+            self._pending_events += 1
+
+    def record_classification(self, previous: Any, current: Any) -> bool:
+        """Counts a tier transition if the lead's classification tier changed."""
+        before, after = classification_tier(previous), classification_tier(current)
+        if after == "none" or before == after:
+            return False
+        self.record("classification_changes", f"{before}->{after}")
+        return True
+
+    def is_due(self) -> bool:
+        with self._lock:
+            if not self._pending:
+                return False
+            return (
+                self._pending_events >= self.flush_every_events
+                or time.monotonic() - self._last_flush >= self.flush_interval_seconds
+            )
+
+    def flush(self, db: Any) -> int:
+        """Writes pending counters to Firestore. Returns the number of documents written."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._pending_events = 0
+            self._last_flush = time.monotonic()
+        if not pending:
+            return 0
+
+        try:
+            db.increment_analytics_rollups([
+                {"granularity": granularity, "bucket": bucket, "counters": counters}
+                for (granularity, bucket), counters in pending.items()
+            ])
+        except Exception as e:
+            logger.error(f"Error writing analytics rollups ({len(pending)} documents): {e}")
+            # Put the counts back so the next flush retries them
+            with self._lock:
+                for key, counters in pending.items():
+                    current = self._pending.setdefault(key, {})
+                    for event, values in counters.items():
+                        target = current.setdefault(event, {})
+                        for dimension, count in values.items():
+                            target[dimension] = target.get(dimension, 0) + count
+            return 0
+        return len(pending)
+
+    def flush_if_due(self, db: Any) -> int:
+        if not self.is_due():
+            return 0
+        return self.flush(db)
+
+    def pending_rollups(self, granularity: str) -> List[Dict[str, Any]]:
+        """Counters not yet written to Firestore, in the same shape as stored rollups."""
+        with self._lock:
+            return [
+                {"granularity": g, "bucket": bucket, **{event: dict(values) for event, values in counters.items()}}
+                for (g, bucket), counters in self._pending.items() if g == granularity
+            ]
+
+    @staticmethod
+    def series(rollups: List[Dict[str, Any]], granularity: str, since: datetime.datetime,
+               until: datetime.datetime) -> Dict[str, Any]:
+        """
+        Time series over [since, until]: one point per bucket (empty buckets included)
+        with each event's counters, plus totals over the whole range.
+        """
+        by_bucket: Dict[str, Dict[str, Dict[str, int]]] = {}
+        for rollup in rollups:
+            point = by_bucket.setdefault(rollup["bucket"], {})
+            for event in EVENTS:
+                for dimension, count in (rollup.get(event) or {}).items():
+                    values = point.setdefault(event, {})
+                    values[dimension] = values.get(dimension, 0) + count
+
+        step = datetime.timedelta(hours=1) if granularity == "hour" else datetime.timedelta(days=1)
+        points, totals = [], {event: {"total": 0} for event in EVENTS}
+        at = since
+        while _bucket(at, granularity) <= _bucket(until, granularity):
+            bucket = _bucket(at, granularity)
+            counters = by_bucket.get(bucket, {})
+            point = {"bucket": bucket}
+            for event in EVENTS:
+                values = dict(counters.get(event) or {"total": 0})
+                point[event] = values
+                for dimension, count in values.items():
+                    totals[event][dimension] = totals[event].get(dimension, 0) + count
+            points.append(point)
+            at += step
+        return {"granularity": granularity, "points": points, "totals": totals}
+
+
+analytics = AnalyticsRollups()
@@ -0,0 +1,79 @@
+import os
+import logging
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Raw interactions (user message + agent reply) sent verbatim with each generation.
+# Everything older is represented by the rolling summary on the user document.
+RECENT_INTERACTIONS = int(os.environ.get("SUMMARY_RECENT_INTERACTIONS", "4"))
+
+# The summary is refreshed once this many new turns have accumulated since the last refresh
+SUMMARY_EVERY_N_TURNS = int(os.environ.get("SUMMARY_EVERY_N_TURNS", "6"))
+
+# How far back the first summary of an existing conversation looks
+SUMMARY_BACKFILL_LIMIT = 20
+
+
+class ConversationSummaryService:
+    """
+    Keeps a rolling summary of each conversation on the user document.
+
+    Generation sends the summary plus the last RECENT_INTERACTIONS raw turns, so
+    per-turn input stays constant however long the conversation gets. The summary
+    is updated in the background every SUMMARY_EVERY_N_TURNS turns by folding in
+    the interactions that have left the raw window.
+    """
+
+    def __init__(self, recent_interactions: int = RECENT_INTERACTIONS, every_n_turns: int = SUMMARY_EVERY_N_TURNS):
+        self.recent_interactions = recent_interactions
+        self.every_n_turns = every_n_turns
+
+    @staticmethod
+    def get_summary(user_data: Optional[Dict[str, Any]]) -> Optional[str]:
+        """Returns the stored summary, if any."""
+        summary = (user_data or {}).get("conversation_summary")
+        return summary if isinstance(summary, str) and summary else None
+
+    def is_due(self, user_data: Optional[Dict[str, Any]]) -> bool:
+        """True when enough turns have accumulated since the last summary."""
+        turns = (user_data or {}).get("turns_since_summary", 0)
+        return isinstance(turns, int) and turns >= self.every_n_turns
+
+    def update_summary(self, db: Any, agent: Any, user_id: str, user_data: Optional[Dict[str, Any]] = None) -> bool:
+        """
+        Folds the interactions that left the raw window into the stored summary.
+        Returns True if a new summary was saved.
+        """
+        if user_data is None:
+            user_data = db.get_user(user_id) or {}
+        if not self.is_due(user_data):
+            return False
+
+        covered_until = user_data.get("summary_covered_until")
+        limit = self.recent_interactions + user_data.get("turns_since_summary", 0)
+        if not covered_until:
+            limit = max(limit, SUMMARY_BACKFILL_LIMIT)
+
+        # Most recent first; the newest ones are still sent raw, so they are not summarized yet
+        raw_history = db.get_chat_history(user_id, limit=limit)
+        to_fold = [
+            interaction for interaction in raw_history[self.recent_interactions:]
+            if not covered_until or interaction.get("timestamp", "") > covered_until
+        ]
+        if not to_fold:
+            db.save_conversation_summary(user_id, self.get_summary(user_data), covered_until)
+            return False
+
+        history = agent.format_history(to_fold)
+        summary = agent.summarize_conversation(history, previous_summary=self.get_summary(user_data))
+        if not summary:
+            return False
+
+        newest = max(interaction.get("timestamp", "") for interaction in to_fold)
+        db.save_conversation_summary(user_id, summary, newest)
+        logger.info(f"Conversation summary updated for {user_id}: folded {len(to_fold)} interactions.")
+        return True
+
+
+summary_service = ConversationSummaryService()
@@ -0,0 +1,68 @@
+import io
+import csv
+import json
+import itertools
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence
+
+# Output formats: media type and file extension
+FORMATS = {"csv": ("text/csv", "csv"), "ndjson": ("application/x-ndjson", "ndjson")}
+
+# Default columns when the admin doesn't pick fields
+USER_EXPORT_FIELDS = (
+    "id", "nome", "email", "telefone", "status", "classificacao_lead", "tags",
+    "follow_up_count", "last_interaction_timestamp", "payment_date",
+)
+CONVERSATION_EXPORT_FIELDS = (
+    "id", "id_usuario", "timestamp", "origem", "mensagens", "precisa_intervencao_humana",
+)
+
+# Rows encoded per chunk handed to the response (keeps writes large without buffering the export)
+ROWS_PER_CHUNK = 100
+
+
+def parse_fields(fields: Optional[str], default: Sequence[str]) -> List[str]:
+    """'id, email,nome' -> ['id', 'email', 'nome']; empty -> the default columns."""
+    selected = [f.strip() for f in (fields or "").split(",") if f.strip()]
+    return list(dict.fromkeys(selected)) or list(default)
+
+
+def _cell(value: Any) -> Any:
+    # Lists and maps (tags, mensagens) are embedded as JSON in CSV cells
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, ensure_ascii=False, default=str)
+    return "" if value is None else value
+
+
+def encode_rows(rows: Iterable[Dict[str, Any]], fields: Sequence[str], fmt: str) -> Iterator[str]:
+    """Encodes rows lazily as CSV (with header) or NDJSON, ROWS_PER_CHUNK rows per yielded string."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if fmt == "csv" else None
+    if writer:
+        writer.writerow(fields)
+
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, ROWS_PER_CHUNK))
+        for row in batch:
+            if writer:
+                writer.writerow([_cell(row.get(field)) for field in fields])
+            else:
+                buffer.write(json.dumps({field: row.get(field) for field in fields}, ensure_ascii=False, default=str))
+                buffer.write("\n")
+        if buffer.tell():
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if len(batch) < ROWS_PER_CHUNK:
+            return
+
+
+def prime(rows: Iterator[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    """
+    Fetches the first row now, so invalid filters or cursors fail before the response
+    starts (as an HTTP error rather than a truncated download). The rest stays lazy.
+    """
+    first = next(rows, None)
+    return rows if first is None else itertools.chain([first], rows)
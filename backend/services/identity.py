@@ -0,0 +1,103 @@
+import logging
+from typing import Any, Dict, List, Optional, Set, Tuple
+from database import normalize_email, normalize_phone
+
+logger = logging.getLogger(__name__)
+
+# Pointer hops followed when resolving a merged user (merges of merges)
+MAX_MERGE_HOPS = 3
+
+
+class IdentityService:
+    """
+    Links the channel identities of one person (WhatsApp phone, Instagram IGSID,
+    Telegram chat id, web uid) to a single canonical user.
+
+    Channel ids stay the 'usuarios' document ids. When two users turn out to share
+    an email or phone (via 'identity_index'), the newer one is merged into the
+    first one seen and its document becomes a stub with merged_into. Resolving a
+    channel id therefore costs nothing extra on the hot path: the user document
+    is read anyway, and only merged stubs need one more read.
+
+    Users are only merged automatically when both hold the shared identity as
+    verified by a channel (verified_identities: the WhatsApp sender phone, the
+    Stripe checkout email). An email typed in chat proves nothing, so a match on
+    it is queued in 'merge_requests' for an admin to confirm instead.
+    """
+
+    @staticmethod
+    def identity_keys(user_data: Optional[Dict[str, Any]]) -> List[str]:
+        user_data = user_data or {}
+        keys = []
+        email, phone = normalize_email(user_data.get("email")), normalize_phone(user_data.get("telefone"))
+        if email:
+            keys.append(f"email:{email}")
+        if phone:
+            keys.append(f"phone:{phone}")
+        return keys
+
+    @staticmethod
+    def verified_keys(user_data: Optional[Dict[str, Any]]) -> Set[str]:
+        if not isinstance(user_data, dict):
+            return set()
+        return set(user_data.get("verified_identities") or [])
+
+    def resolve(self, db: Any, user_id: str, user_data: Optional[Dict[str, Any]]) -> Tuple[str, Optional[Dict[str, Any]]]:
+        """Returns (canonical user id, canonical user data) for the user document read for user_id."""
+        for _ in range(MAX_MERGE_HOPS):
+            target = user_data.get("merged_into") if isinstance(user_data, dict) else None
+            if not target or target == user_id:
+                break
+            user_id, user_data = target, db.get_user(target)
+        return user_id, user_data
+
+    def link(self, db: Any, user_id: str, user_data: Optional[Dict[str, Any]] = None) -> str:
+        """
+        Background hook after a turn: merges users sharing this user's verified email
+        or phone, and queues a merge request when the shared identity isn't verified
+        on both of them. Identities already checked are remembered on the user
+        (identities_linked), so this reads nothing until a new email or phone shows up.
+        Returns the canonical user id.
+        """
+        if user_data is None:
+            user_data = db.get_user(user_id) or {}
+        if not isinstance(user_data, dict) or user_data.get("merged_into"):
+            return user_id
+        candidates = self.identity_keys(user_data) + sorted(self.verified_keys(user_data))
+        keys = [k for k in dict.fromkeys(candidates) if k not in (user_data.get("identities_linked") or [])]
+        if not keys:
+            return user_id
+
+        canonical, merged = user_id, False
+        verified = {user_id: self.verified_keys(user_data)}
+        for key in keys:
+            entry = db.get_identity(key) or {}
+            # First-seen order; the first user with the identity stays canonical
+            users = []
+            for other in entry.get("user_ids") or []:
+                other, other_data = self.resolve(db, other, db.get_user(other))
+                users.append(other)
+                verified.setdefault(other, self.verified_keys(other_data))
+            users = list(dict.fromkeys(users + [canonical]))
+            first = users[0]
+            for other in users[1:]:
+                if key not in verified[first] or key not in verified[other]:
+                    if db.queue_merge_request(other, first, key):
+                        logger.info(f"Queued merge of user {other} into {first} for review (unverified {key.split(':')[0]}).")
+                    continue
+                if db.merge_users(other, first):
+                    merged = True
+                    verified[first] |= verified[other]
+                    logger.info(f"Merged user {other} into {first} (shared {key.split(':')[0]}).")
+                    if other == canonical:
+                        canonical = first
+
+        if merged:
+            # Identities copied over from the merged users are covered by this check too
+            canonical_data = db.get_user(canonical)
+            keys = list(dict.fromkeys(keys + self.identity_keys(canonical_data) + sorted(self.verified_keys(canonical_data))))
+        db.mark_identities_linked(canonical, keys)
+        return canonical
+
+
+identity_service = IdentityService()
@@ -0,0 +1,281 @@
+import os
+import csv
+import json
+import time
+import hashlib
+import logging
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
+from google.api_core import exceptions as api_exceptions
+from database import normalize_email, normalize_phone
+
+logger = logging.getLogger(__name__)
+
+# Writes per committed batch (Firestore's limit); a lead costs 1 user write + 1-2 index writes
+IMPORT_BATCH_WRITES = 500
+# Batches committed concurrently, and attempts per batch on transient errors
+IMPORT_WRITE_WORKERS = int(os.environ.get("IMPORT_WRITE_WORKERS", "4"))
+IMPORT_MAX_ATTEMPTS = int(os.environ.get("IMPORT_MAX_ATTEMPTS", "5"))
+
+# Errors worth retrying a batch commit for (batch commits are atomic, and the writes are merges)
+RETRYABLE_ERRORS = (
+    api_exceptions.ServiceUnavailable, api_exceptions.DeadlineExceeded, api_exceptions.Aborted,
+    api_exceptions.ResourceExhausted, api_exceptions.InternalServerError,
+)
+
+# Source column names (lowercased) accepted for each user field
+FIELD_ALIASES = {
+    "nome": ("nome", "name", "full_name", "nome_completo"),
+    "email": ("email", "e-mail", "mail"),
+    "telefone": ("telefone", "phone", "phone_number", "celular", "whatsapp"),
+    "classificacao_lead": ("classificacao_lead", "classificacao", "classification", "perfil"),
+    "status": ("status",),
+    "tags": ("tags", "labels"),
+    "dor_principal": ("dor_principal",),
+    "maturidade": ("maturidade",),
+}
+_COLUMN_FIELDS = {alias: field for field, aliases in FIELD_ALIASES.items() for alias in aliases}
+
+DUPLICATE_POLICIES = ("skip", "merge")
+REJECTED_COLUMNS = ("row", "reason", "data")
+
+
+def read_rows(stream: TextIO, fmt: str) -> Iterator[Dict[str, Any]]:
+    """Yields source rows one at a time from a CSV (with header) or NDJSON text stream."""
+    if fmt == "csv":
+        yield from csv.DictReader(stream)
+    elif fmt == "ndjson":
+        for line in stream:
+            if line.strip():
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    row = {"_invalid": line.strip()}
+                yield row if isinstance(row, dict) else {"_invalid": line.strip()}
+    else:
+        raise ValueError(f"Unknown import format: {fmt}")
+
+
+def normalize_lead(row: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """Maps source columns to user fields. Returns (lead, None) or (None, rejection reason)."""
+    if "_invalid" in row:
+        return None, "invalid_json"
+    lead: Dict[str, Any] = {}
+    for column, value in row.items():
+        field = _COLUMN_FIELDS.get(str(column or "").strip().lower())
+        if field and value not in (None, ""):
+            lead[field] = value.strip() if isinstance(value, str) else value
+
+    if "email" in lead:
+        email = normalize_email(lead["email"])
+        if not email:
+            return None, "invalid_email"
+        lead["email"] = email
+    if "telefone" in lead:
+        phone = normalize_phone(lead["telefone"])
+        if not phone:
+            return None, "invalid_phone"
+        lead["telefone"] = phone
+    if not lead.get("email") and not lead.get("telefone"):
+        return None, "missing_email_and_phone"
+    if isinstance(lead.get("tags"), str):
+        lead["tags"] = [t.strip() for t in lead["tags"].replace(";", ",").split(",") if t.strip()]
+    return lead, None
+
+
+def lead_user_id(lead: Dict[str, Any]) -> str:
+    """
+    Deterministic ids make re-imports idempotent. The phone is the WhatsApp user id,
+    so a lead with a phone is the same document its first WhatsApp message will use.
+    """
+    if lead.get("telefone"):
+        return lead["telefone"]
+    return "import_" + hashlib.sha1(lead["email"].encode("utf-8")).hexdigest()[:16]
+
+
+def identity_keys(lead: Dict[str, Any]) -> List[str]:
+    keys = []
+    if lead.get("email"):
+        keys.append(f"email:{lead['email']}")
+    if lead.get("telefone"):
+        keys.append(f"phone:{lead['telefone']}")
+    return keys
+
+
+def fill_missing(lead: Dict[str, Any], user: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Merge policy for leads matching an existing user: only fields the user doesn't have
+    yet are taken from the lead, so live data (a name or classification the agent
+    updated) is never overwritten. Imported tags are added to the user's tags.
+    """
+    data = {k: v for k, v in lead.items() if k != "tags" and user.get(k) in (None, "", [], {})}
+    tags = user.get("tags") if isinstance(user.get("tags"), list) else []
+    new_tags = [t for t in lead.get("tags") or [] if t not in tags]
+    if new_tags:
+        data["tags"] = tags + new_tags
+    return data
+
+
+class LeadImporter:
+    """
+    Imports leads from spreadsheets and other CRMs into 'usuarios'.
+
+    Rows are streamed and processed one write batch at a time: normalized,
+    deduplicated within the file and against existing users (one batched
+    'identity_index' read per batch), then committed as batched writes of up to
+    500 documents, several batches in flight, each retried with backoff on
+    transient errors. Rows that are not imported go to the rejected-rows CSV
+    with a reason. Leads matching an existing user are skipped, or with
+    on_duplicate="merge" fill in the fields that user is missing (fill_missing).
+    """
+
+    def __init__(self, workers: int = IMPORT_WRITE_WORKERS, max_attempts: int = IMPORT_MAX_ATTEMPTS,
+                 batch_writes: int = IMPORT_BATCH_WRITES, retry_base_seconds: float = 0.5):
+        self.workers = max(workers, 1)
+        self.max_attempts = max(max_attempts, 1)
+        self.batch_writes = batch_writes
+        self.retry_base_seconds = retry_base_seconds
+
+    def run(self, db: Any, rows: Iterable[Dict[str, Any]], rejected: Optional[TextIO] = None,
+            on_duplicate: str = "skip", source: str = "import", dry_run: bool = False) -> Dict[str, Any]:
+        if on_duplicate not in DUPLICATE_POLICIES:
+            raise ValueError(f"on_duplicate must be one of {DUPLICATE_POLICIES}")
+        report = {"rows": 0, "imported": 0, "merged": 0, "duplicates": 0, "rejected": 0,
+                  "batches": 0, "retries": 0}
+        lock = threading.Lock()
+        rejects = csv.writer(rejected) if rejected else None
+        if rejects:
+            rejects.writerow(REJECTED_COLUMNS)
+
+        def reject(row_number: int, reason: str, row: Dict[str, Any]) -> None:
+            with lock:
+                report["rejected"] += 1
+                if rejects:
+                    rejects.writerow([row_number, reason, json.dumps(row, ensure_ascii=False, default=str)])
+
+        # Identity keys already taken by an earlier row of this file -> that row's user id
+        seen: Dict[str, str] = {}
+        start = time.perf_counter()
+        pending: List[Tuple[int, Dict[str, Any], Dict[str, Any]]] = []
+        writes = 0
+        futures = []
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            def drain(limit: int) -> None:
+                while len(futures) > limit:
+                    futures.pop(0).result()
+
+            def submit(batch_rows):
+                # At most 2 batches per worker in flight keeps memory flat on large files
+                drain(self.workers * 2 - 1)
+                futures.append(executor.submit(self._write, db, batch_rows, on_duplicate, source, dry_run,
+                                               report, lock, reject))
+
+            for row_number, row in enumerate(rows, start=1):
+                report["rows"] += 1
+                lead, reason = normalize_lead(row)
+                if reason:
+                    reject(row_number, reason, row)
+                    continue
+                keys = identity_keys(lead)
+                duplicate_of = next((seen[k] for k in keys if k in seen), None)
+                if duplicate_of:
+                    with lock:
+                        report["duplicates"] += 1
+                    reject(row_number, f"duplicate_in_file:{duplicate_of}", row)
+                    continue
+                user_id = lead_user_id(lead)
+                seen.update({k: user_id for k in keys})
+
+                pending.append((row_number, row, lead))
+                writes += 1 + len(keys)
+                if writes + 3 > self.batch_writes:
+                    submit(pending)
+                    pending, writes = [], 0
+            if pending:
+                submit(pending)
+            drain(0)
+
+        seconds = time.perf_counter() - start
+        report["seconds"] = round(seconds, 3)
+        report["rows_per_second"] = round(report["rows"] / seconds, 1) if seconds > 0 else None
+        return report
+
+    def _write(self, db: Any, batch_rows: List[tuple], on_duplicate: str, source: str, dry_run: bool,
+               report: Dict[str, Any], lock: threading.Lock, reject) -> None:
+        keys = [k for _, _, lead in batch_rows for k in identity_keys(lead)]
+        existing = self._with_retry(lambda: db.find_user_ids_by_identity(keys), report, lock)
+        if existing is None:
+            for row_number, row, _ in batch_rows:
+                reject(row_number, "lookup_failed", row)
+            return
+        users: Dict[str, Dict[str, Any]] = {}
+        if on_duplicate == "merge" and existing:
+            # Merged leads only fill gaps, so the matched users are read (one batched read)
+            users = self._with_retry(lambda: db.get_users(list(existing.values())), report, lock)
+            if users is None:
+                for row_number, row, _ in batch_rows:
+                    reject(row_number, "lookup_failed", row)
+                return
+        timestamp = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        writes, rows, imported, merged = [], [], 0, 0
+
+        for row_number, row, lead in batch_rows:
+            keys = identity_keys(lead)
+            existing_id = next((existing[k] for k in keys if k in existing), None)
+            if existing_id:
+                with lock:
+                    report["duplicates"] += 1
+                if on_duplicate == "skip":
+                    reject(row_number, f"existing_user:{existing_id}", row)
+                    continue
+                user_id, data = existing_id, fill_missing(lead, users.get(existing_id) or {})
+                merged += 1
+                if not data:
+                    continue
+                # Only identities the user now holds are pointed at it
+                keys = identity_keys(data)
+            else:
+                user_id = lead_user_id(lead)
+                data = dict(lead, origem_importacao=source, data_criacao=timestamp)
+                imported += 1
+            data["updated_at"] = timestamp
+            writes.extend(db.user_writes(user_id, data, keys))
+            rows.append((row_number, row))
+
+        if writes and not dry_run and self._with_retry(lambda: self._commit(db, writes), report, lock) is None:
+            for row_number, row in rows:
+                reject(row_number, "write_failed", row)
+            return
+        with lock:
+            report["batches"] += 1 if writes else 0
+            report["imported"] += imported
+            report["merged"] += merged
+
+    @staticmethod
+    def _commit(db: Any, writes: List[tuple]) -> bool:
+        # One atomic batch of merge writes: safe to retry as a whole
+        db.commit_writes(writes)
+        return True
+
+    def _with_retry(self, call: Callable[[], Any], report: Dict[str, Any], lock: threading.Lock) -> Any:
+        """Runs call with exponential backoff on transient errors. Returns None if it failed."""
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                return call()
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_attempts:
+                    logger.error(f"Lead import batch failed after {attempt} attempts: {e}")
+                    return None
+                with lock:
+                    report["retries"] += 1
+                time.sleep(self.retry_base_seconds * (2 ** (attempt - 1)))
+            except Exception as e:
+                logger.error(f"Lead import batch failed: {e}")
+                return None
+        return None
+
+
+lead_importer = LeadImporter()
@@ -0,0 +1,164 @@
+import os
+import logging
+import datetime
+import threading
+from typing import Any, Dict, Optional
+from services.usage_tracker import usage_tracker
+
+logger = logging.getLogger(__name__)
+
+# Insights are regenerated once this many user turns have arrived since they were generated
+INSIGHTS_EVERY_N_TURNS = int(os.environ.get("INSIGHTS_EVERY_N_TURNS", "3"))
+
+# Interactions sent to the strategy analysis
+INSIGHTS_HISTORY_LIMIT = int(os.environ.get("INSIGHTS_HISTORY_LIMIT", "50"))
+
+# After an analysis that returned nothing, the lead isn't retried in the background for this long
+INSIGHTS_RETRY_COOLDOWN_SECONDS = float(os.environ.get("INSIGHTS_RETRY_COOLDOWN_SECONDS", "3600"))
+
+# Leads whose insights are kept fresh in the background (values of classificacao_lead)
+PRIORITY_CLASSIFICATIONS = ("Perfil A (Qualificado/Quente)", "Perfil B (Morno/Em educação)")
+
+
+class LeadInsightsService:
+    """
+    Precomputes the sales insights (summary, objection, sales angle) shown on the lead page.
+
+    Insights live on the user document next to their staleness markers: the
+    classification they were generated for and a counter of user turns since
+    then (bumped by update_user_interaction). They are regenerated in the
+    background after a turn, for A/B leads, once they go stale; the admin page
+    always serves the stored version at once and queues a refresh if it is stale.
+    A failed analysis is recorded (insights_attempted_at) so the lead waits out a
+    cooldown instead of costing a model call on every turn.
+    """
+
+    def __init__(self, every_n_turns: int = INSIGHTS_EVERY_N_TURNS, history_limit: int = INSIGHTS_HISTORY_LIMIT,
+                 retry_cooldown_seconds: float = INSIGHTS_RETRY_COOLDOWN_SECONDS):
+        self.every_n_turns = every_n_turns
+        self.history_limit = history_limit
+        self.retry_cooldown_seconds = retry_cooldown_seconds
+        self._in_flight = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_insights(user_data: Optional[Dict[str, Any]]) -> Dict[str, Optional[str]]:
+        user_data = user_data or {}
+        return {
+            "summary": user_data.get("insights_summary"),
+            "objection": user_data.get("insights_objection"),
+            "sales_angle": user_data.get("insights_sales_angle")
+        }
+
+    def stale_reason(self, user_data: Optional[Dict[str, Any]]) -> Optional[str]:
+        """Why the stored insights are out of date ("missing", "classification_changed", "new_messages"), or None."""
+        user_data = user_data or {}
+        if not all(self.get_insights(user_data).values()):
+            return "missing"
+        if user_data.get("classificacao_lead") != user_data.get("insights_classification"):
+            return "classification_changed"
+        turns = user_data.get("turns_since_insights", 0)
+        if isinstance(turns, int) and turns >= self.every_n_turns:
+            return "new_messages"
+        return None
+
+    @staticmethod
+    def is_priority_lead(user_data: Optional[Dict[str, Any]]) -> bool:
+        return (user_data or {}).get("classificacao_lead") in PRIORITY_CLASSIFICATIONS
+
+    def in_retry_cooldown(self, user_data: Optional[Dict[str, Any]]) -> bool:
+        """True while a recent failed analysis (insights_attempted_at) holds back retries."""
+        attempted = (user_data or {}).get("insights_attempted_at")
+        if not isinstance(attempted, str):
+            return False
+        try:
+            attempted_at = datetime.datetime.fromisoformat(attempted)
+        except ValueError:
+            return False
+        if attempted_at.tzinfo is None:
+            attempted_at = attempted_at.replace(tzinfo=datetime.timezone.utc)
+        elapsed = datetime.datetime.now(datetime.timezone.utc) - attempted_at
+        return elapsed.total_seconds() < self.retry_cooldown_seconds
+
+    def is_due(self, user_data: Optional[Dict[str, Any]]) -> bool:
+        """True when a background refresh should run after this turn."""
+        return (
+            self.is_priority_lead(user_data)
+            and self.stale_reason(user_data) is not None
+            and not self.in_retry_cooldown(user_data)
+        )
+
+    def status(self, user_id: str, user_data: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        reason = self.stale_reason(user_data)
+        with self._lock:
+            refreshing = user_id in self._in_flight
+        return {
+            "generated_at": (user_data or {}).get("insights_generated_at"),
+            "stale": reason is not None,
+            "stale_reason": reason,
+            "refreshing": refreshing,
+            "retry_cooldown": reason is not None and self.in_retry_cooldown(user_data)
+        }
+
+    def refresh(self, db: Any, agent: Any, user_id: str, user_data: Optional[Dict[str, Any]] = None) -> bool:
+        """
+        Regenerates and stores a lead's insights. Returns True if new insights were saved.
+        Concurrent refreshes of the same lead are collapsed into one.
+        """
+        with self._lock:
+            if user_id in self._in_flight:
+                return False
+            self._in_flight.add(user_id)
+        try:
+            if user_data is None:
+                user_data = db.get_user(user_id) or {}
+            raw_history = db.get_chat_history(user_id, limit=self.history_limit)
+            if not raw_history:
+                return False
+
+            with usage_tracker.attribute_to(user_id):
+                insights = agent.analyze_lead_strategy(agent.format_history(raw_history))
+            if not insights or not insights.get("summary"):
+                # Without a marker the lead would stay stale and be retried on every turn
+                db.save_lead_insights_failure(user_id)
+                logger.warning(f"Lead insights analysis returned nothing for {user_id}; retrying after the cooldown.")
+                return False
+
+            db.save_lead_insights(user_id, insights, user_data.get("classificacao_lead"))
+            logger.info(f"Lead insights refreshed for {user_id} ({self.stale_reason(user_data) or 'forced'}).")
+            return True
+        finally:
+            with self._lock:
+                self._in_flight.discard(user_id)
+
+    def update_if_due(self, db: Any, agent: Any, user_id: str, user_data: Optional[Dict[str, Any]] = None) -> bool:
+        """Background hook after a turn: refreshes the insights of A/B leads once they are stale."""
+        if user_data is None:
+            user_data = db.get_user(user_id) or {}
+        if not self.is_due(user_data):
+            return False
+        return self.refresh(db, agent, user_id, user_data)
+
+    def precompute(self, db: Any, agent: Any, stale_only: bool = True, limit: Optional[int] = None) -> Dict[str, int]:
+        """Bulk job: (re)generates insights for every A/B lead. Returns counts."""
+        stats = {"checked": 0, "refreshed": 0, "skipped": 0, "failed": 0}
+        for user_data in db.get_users_by_classification(list(PRIORITY_CLASSIFICATIONS)):
+            if limit is not None and stats["refreshed"] >= limit:
+                break
+            stats["checked"] += 1
+            if stale_only and (self.stale_reason(user_data) is None or self.in_retry_cooldown(user_data)):
+                stats["skipped"] += 1
+                continue
+            try:
+                if self.refresh(db, agent, user_data["id"], user_data):
+                    stats["refreshed"] += 1
+                else:
+                    stats["skipped"] += 1
+            except Exception as e:
+                stats["failed"] += 1
+                logger.error(f"Error precomputing insights for {user_data.get('id')}: {e}", exc_info=True)
+        logger.info(f"Lead insights precompute finished: {stats}")
+        return stats
+
+
+insights_service = LeadInsightsService()
@@ -1,7 +1,9 @@
 import httpx
 import os
+import time
 import logging
 from typing import Optional
+from services.metrics import META_SENDS, META_SEND_LATENCY
 
 logger = logging.getLogger(__name__)
 
@@ -35,15 +37,22 @@ class MetaService:
             "text": {"body": text}
         }
 
+        start = time.perf_counter()
+        status = "ok"
         async with httpx.AsyncClient() as client:
             try:
                 response = await client.post(url, json=payload, headers=headers)
                 response.raise_for_status()
                 logger.info(f"WhatsApp message sent to {to}")
             except httpx.HTTPStatusError as e:
+                status = "http_error"
                 logger.error(f"Failed to send WhatsApp message: {e.response.text}")
             except Exception as e:
+                status = "error"
                 logger.error(f"Error sending WhatsApp message: {e}")
+            finally:
+                META_SENDS.inc(channel="whatsapp", status=status)
+                META_SEND_LATENCY.observe(time.perf_counter() - start, channel="whatsapp")
 
     async def send_instagram_message(self, to: str, text: str):
         """
@@ -67,14 +76,21 @@ class MetaService:
             "message": {"text": text}
         }
 
+        start = time.perf_counter()
+        status = "ok"
         async with httpx.AsyncClient() as client:
             try:
                 response = await client.post(url, json=payload, headers=headers)
                 response.raise_for_status()
                 logger.info(f"Instagram message sent to {to}")
             except httpx.HTTPStatusError as e:
+                status = "http_error"
                 logger.error(f"Failed to send Instagram message: {e.response.text}")
             except Exception as e:
+                status = "error"
                 logger.error(f"Error sending Instagram message: {e}")
+            finally:
+                META_SENDS.inc(channel="instagram", status=status)
+                META_SEND_LATENCY.observe(time.perf_counter() - start, channel="instagram")
 
 meta_service = MetaService()
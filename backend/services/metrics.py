@@ -0,0 +1,275 @@
+import time
+import asyncio
+import bisect
+import functools
+import threading
+from contextlib import ContextDecorator
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+# Latency buckets (seconds): sub-ms Firestore/cache hits up to slow multi-round model turns
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{_escape(extra[1])}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], Any] = {}
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._values = {}
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def total(self) -> float:
+        with self._lock:
+            return sum(self._values.values())
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}" for key, value in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class _Timer(ContextDecorator):
+    def __init__(self, histogram: "Histogram", labels: Dict[str, Any]):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self._start, **self.labels)
+        return False
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            if index < len(self.buckets):
+                entry["counts"][index] += 1
+            entry["sum"] += value
+            entry["count"] += 1
+
+    def time(self, **labels) -> _Timer:
+        """Context manager / decorator observing the elapsed time."""
+        return _Timer(self, labels)
+
+    def get(self, **labels) -> Dict[str, float]:
+        """Returns {'count', 'sum'} for a label set."""
+        with self._lock:
+            entry = self._values.get(self._key(labels))
+            return {"count": entry["count"], "sum": entry["sum"]} if entry else {"count": 0, "sum": 0.0}
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, {"counts": list(v["counts"]), "sum": v["sum"], "count": v["count"]}) for key, v in self._values.items())
+        lines = []
+        for key, entry in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, entry["counts"]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, ('le', _format_value(bound)))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, ('le', '+Inf'))} {entry['count']}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {_format_value(entry['sum'])}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {entry['count']}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    In-process metrics in the Prometheus text exposition format.
+
+    Metrics are created once at import time and shared by the whole app;
+    tests read them with .get() and clear them with reset().
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> Any:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, help_text: str, labels: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, help_text, labels))
+
+    def gauge(self, name: str, help_text: str, labels: Tuple[str, ...] = ()) -> Gauge:
+        return self._register(Gauge(name, help_text, labels))
+
+    def histogram(self, name: str, help_text: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, labels, buckets))
+
+    def get(self, name: str) -> Optional[_Metric]:
+        return self._metrics.get(name)
+
+    def reset(self) -> None:
+        for metric in list(self._metrics.values()):
+            metric.reset()
+
+    def render(self) -> str:
+        lines = []
+        for name in sorted(self._metrics):
+            metric = self._metrics[name]
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+# --- HTTP ---
+HTTP_REQUESTS = registry.counter("http_requests_total", "HTTP requests by route and status.", ("method", "route", "status"))
+HTTP_LATENCY = registry.histogram("http_request_duration_seconds", "HTTP request latency by route.", ("method", "route"))
+
+# --- Gemini ---
+MODEL_CALLS = registry.counter("gemini_calls_total", "Gemini calls by purpose and outcome.", ("purpose", "status"))
+MODEL_LATENCY = registry.histogram("gemini_call_duration_seconds", "Gemini call latency by purpose.", ("purpose",))
+MODEL_TOKENS = registry.counter("gemini_tokens_total", "Gemini tokens by purpose and kind (prompt, cached, output).", ("purpose", "kind"))
+MODEL_FALLBACKS = registry.counter("gemini_fallbacks_total", "Calls moved to the next model in the chain, by failed model.", ("purpose", "model", "reason"))
+MODEL_RETRIES = registry.counter("gemini_retries_total", "Gemini calls retried after a retryable error.", ("purpose",))
+MODEL_TIMEOUTS = registry.counter("gemini_timeouts_total", "Gemini attempts that hit their deadline.", ("purpose",))
+MODEL_HEDGES = registry.counter("gemini_hedges_total", "Hedged reply requests (launched, won).", ("purpose", "result"))
+MODEL_BREAKER_STATE = registry.gauge("gemini_circuit_state", "Circuit breaker state per model (0 closed, 1 half-open, 2 open).", ("model",))
+MODEL_BREAKER_REJECTIONS = registry.counter("gemini_circuit_rejections_total", "Calls rejected by an open circuit.", ("purpose",))
+MODEL_FALLBACK_REPLIES = registry.counter("gemini_fallback_replies_total", "Canned replies sent because no model could answer.")
+MODEL_QUEUE_WAIT = registry.histogram("gemini_queue_wait_seconds", "Time calls waited for a scheduler slot, by priority class.", ("priority",))
+MODEL_QUEUE_DEPTH = registry.gauge("gemini_queue_depth", "Calls waiting for a scheduler slot, by priority class.", ("priority",))
+MODEL_IN_FLIGHT = registry.gauge("gemini_calls_in_flight", "Gemini calls holding a scheduler slot, by priority class.", ("priority",))
+MODEL_QUEUE_TIMEOUTS = registry.counter("gemini_queue_timeouts_total", "Calls that ran out of deadline waiting for a slot.", ("priority",))
+MODEL_COST = registry.counter("gemini_cost_usd_total", "Estimated Gemini cost in USD by purpose.", ("purpose",))
+
+# --- Firestore ---
+FIRESTORE_OPERATIONS = registry.counter("firestore_operations_total", "Firestore round trips by collection and operation.", ("collection", "op"))
+FIRESTORE_DOCUMENTS = registry.counter("firestore_documents_total", "Firestore documents read or written by collection.", ("collection", "op"))
+FIRESTORE_LATENCY = registry.histogram("firestore_operation_duration_seconds", "Firestore round-trip latency by operation.", ("op",))
+
+# --- Meta ---
+META_SENDS = registry.counter("meta_send_total", "Messages sent through the Meta Graph API.", ("channel", "status"))
+META_SEND_LATENCY = registry.histogram("meta_send_duration_seconds", "Meta Graph API send latency.", ("channel",))
+
+# --- Background work ---
+BACKGROUND_TASKS = registry.gauge("background_tasks_in_flight", "Background tasks queued or running.", ("task",))
+BACKGROUND_TASK_LATENCY = registry.histogram("background_task_duration_seconds", "Background task run time.", ("task",))
+
+# --- Agent ---
+RESPONSE_CACHE = registry.counter("response_cache_lookups_total", "Response cache lookups by result (hit, miss, skip).", ("result",))
+KNOWLEDGE_REFRESH = registry.histogram("knowledge_refresh_duration_seconds", "Time to rebuild the agent's knowledge base and model.")
+
+
+def record_model_call(purpose: str, status: str, seconds: float) -> None:
+    MODEL_CALLS.inc(purpose=purpose, status=status)
+    MODEL_LATENCY.observe(seconds, purpose=purpose)
+
+
+def record_firestore_operation(op: str, collection: str, documents: int, seconds: Optional[float]) -> None:
+    """
+    Observer for database.add_operation_observer. seconds is None for writes that shared
+    a round trip (batched) with an operation already recorded.
+    """
+    if seconds is not None:
+        FIRESTORE_OPERATIONS.inc(collection=collection, op=op)
+        FIRESTORE_LATENCY.observe(seconds, op=op)
+    if documents:
+        FIRESTORE_DOCUMENTS.inc(documents, collection=collection, op=op)
+
+
+def queued_task(name: str, func: Callable) -> Callable:
+    """
+    Wraps a function handed to BackgroundTasks so background_tasks_in_flight covers it
+    from the moment it is queued until it finishes.
+    """
+    BACKGROUND_TASKS.inc(task=name)
+
+    if asyncio.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                BACKGROUND_TASKS.dec(task=name)
+                BACKGROUND_TASK_LATENCY.observe(time.perf_counter() - start, task=name)
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            BACKGROUND_TASKS.dec(task=name)
+            BACKGROUND_TASK_LATENCY.observe(time.perf_counter() - start, task=name)
+    return wrapper
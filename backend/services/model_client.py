@@ -0,0 +1,235 @@
+import os
+import time
+import random
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Callable, Dict, Optional
+from google.api_core import exceptions as google_exceptions
+from services.model_scheduler import ModelScheduler, QueueTimeout, model_scheduler
+from services.metrics import MODEL_RETRIES, MODEL_TIMEOUTS, MODEL_HEDGES, MODEL_BREAKER_STATE, MODEL_BREAKER_REJECTIONS
+
+logger = logging.getLogger(__name__)
+
+# Total time budget per call (all attempts), in seconds. Override with MODEL_DEADLINE_<PURPOSE>.
+DEFAULT_DEADLINES = {
+    "response": 30.0,
+    "followup": 20.0,
+    "qualification": 20.0,
+    "extraction": 10.0,
+    "summary": 30.0,
+    "insights": 45.0,
+    "token_count": 5.0,
+}
+DEFAULT_DEADLINE = 30.0
+
+MODEL_MAX_RETRIES = int(os.environ.get("MODEL_MAX_RETRIES", "2"))
+MODEL_RETRY_BASE_SECONDS = float(os.environ.get("MODEL_RETRY_BASE_SECONDS", "0.5"))
+MODEL_RETRY_MAX_SECONDS = float(os.environ.get("MODEL_RETRY_MAX_SECONDS", "4"))
+
+# Reply path only: a second identical request is started if the first hasn't answered by then (0 = off)
+MODEL_HEDGE_AFTER_MS = float(os.environ.get("MODEL_HEDGE_AFTER_MS", "0"))
+
+# Consecutive failures that open a model's circuit, and how long it stays open before a trial call
+MODEL_BREAKER_FAILURES = int(os.environ.get("MODEL_BREAKER_FAILURES", "5"))
+MODEL_BREAKER_RESET_SECONDS = float(os.environ.get("MODEL_BREAKER_RESET_SECONDS", "30"))
+
+# Sent to the customer when no model could answer
+FALLBACK_REPLY = os.environ.get(
+    "MODEL_FALLBACK_REPLY",
+    "Desculpe, estou com uma instabilidade momentânea aqui. Pode me mandar sua mensagem de novo em alguns instantes?"
+)
+
+RETRYABLE_ERRORS = (
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.InternalServerError,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.Aborted,
+    google_exceptions.GatewayTimeout,
+    TimeoutError,
+    ConnectionError,
+)
+
+# Errors that say the model is unusable right now (as opposed to a bad request)
+BREAKER_ERRORS = RETRYABLE_ERRORS + (google_exceptions.NotFound, google_exceptions.PermissionDenied)
+
+TIMEOUT_ERRORS = (google_exceptions.DeadlineExceeded, google_exceptions.GatewayTimeout, TimeoutError)
+
+
+class CircuitOpenError(Exception):
+    """Raised without calling the model while its circuit is open."""
+
+
+class ModelDeadlineExceeded(TimeoutError):
+    """The purpose's deadline ran out before any attempt succeeded."""
+
+
+def deadline_for(purpose: str) -> float:
+    value = os.environ.get(f"MODEL_DEADLINE_{purpose.upper()}")
+    return float(value) if value else DEFAULT_DEADLINES.get(purpose, DEFAULT_DEADLINE)
+
+
+class CircuitBreaker:
+    """closed -> open after N consecutive failures -> half-open (one trial call) after a cool-off."""
+
+    def __init__(self, name: str, failure_threshold: int = MODEL_BREAKER_FAILURES,
+                 reset_seconds: float = MODEL_BREAKER_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_seconds:
+                self._set_state("half_open")
+            if self.state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._trial_in_flight = False
+            if self.state != "closed":
+                logger.info(f"Circuit for {self.name} closed again.")
+                self._set_state("closed")
+
+    def release(self) -> None:
+        """Gives back a half-open trial slot when the call never reached the model."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self.state == "half_open" or self._failures >= self.failure_threshold:
+                if self.state != "open":
+                    logger.warning(f"Circuit for {self.name} opened after {self._failures} consecutive failures.")
+                self._opened_at = time.monotonic()
+                self._set_state("open")
+
+    def _set_state(self, state: str) -> None:
+        self.state = state
+        MODEL_BREAKER_STATE.set({"closed": 0, "half_open": 1, "open": 2}[state], model=self.name)
+
+
+class ModelClient:
+    """
+    Resilience layer for Gemini calls.
+
+    call() enforces the purpose's deadline (passed to the SDK as request_options.timeout),
+    retries retryable errors with exponential backoff and jitter, and keeps one circuit
+    breaker per model so a failing model is skipped quickly (the router then falls back).
+    Every attempt first waits for a ModelScheduler slot, within the same deadline.
+    hedged() races a second request for latency-sensitive paths.
+    """
+
+    def __init__(self, max_retries: int = MODEL_MAX_RETRIES, retry_base_seconds: float = MODEL_RETRY_BASE_SECONDS,
+                 retry_max_seconds: float = MODEL_RETRY_MAX_SECONDS, hedge_after_ms: float = MODEL_HEDGE_AFTER_MS,
+                 sleep: Callable[[float], None] = time.sleep, scheduler: Optional[ModelScheduler] = None):
+        self.max_retries = max_retries
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self.hedge_after_ms = hedge_after_ms
+        self._sleep = sleep
+        self.scheduler = scheduler or model_scheduler
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+        self._hedge_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="model-hedge")
+
+    def breaker(self, model_name: str) -> CircuitBreaker:
+        with self._lock:
+            breaker = self._breakers.get(model_name)
+            if breaker is None:
+                breaker = self._breakers[model_name] = CircuitBreaker(model_name)
+            return breaker
+
+    def _backoff(self, attempt: int) -> float:
+        delay = min(self.retry_base_seconds * (2 ** attempt), self.retry_max_seconds)
+        return delay * random.uniform(0.5, 1.0)
+
+    def call(self, purpose: str, fn: Callable[..., Any], *args, model_name: Optional[str] = None, **kwargs) -> Any:
+        """Calls fn(*args, request_options={"timeout": ...}, **kwargs) with retries inside the deadline."""
+        breaker = self.breaker(model_name or "default")
+        if not breaker.allow():
+            MODEL_BREAKER_REJECTIONS.inc(purpose=purpose)
+            raise CircuitOpenError(f"Circuit open for {breaker.name}")
+
+        deadline = time.monotonic() + deadline_for(purpose)
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    raise ModelDeadlineExceeded(f"{purpose} exceeded its {deadline_for(purpose)}s deadline")
+                with self.scheduler.slot(purpose, timeout=remaining):
+                    remaining = max(deadline - time.monotonic(), 0.001)
+                    result = fn(*args, request_options={"timeout": remaining}, **kwargs)
+                breaker.record_success()
+                return result
+            except QueueTimeout:
+                # Local congestion says nothing about the model's health
+                breaker.release()
+                raise
+            except Exception as e:
+                if isinstance(e, TIMEOUT_ERRORS):
+                    MODEL_TIMEOUTS.inc(purpose=purpose)
+                delay = self._backoff(attempt)
+                can_retry = (
+                    isinstance(e, RETRYABLE_ERRORS)
+                    and not isinstance(e, ModelDeadlineExceeded)
+                    and attempt < self.max_retries
+                    and deadline - time.monotonic() > delay
+                )
+                if not can_retry:
+                    if isinstance(e, BREAKER_ERRORS):
+                        breaker.record_failure()
+                    else:
+                        # The model answered; the request itself was the problem
+                        breaker.record_success()
+                    raise
+                attempt += 1
+                MODEL_RETRIES.inc(purpose=purpose)
+                logger.warning(f"Retrying {purpose} call in {delay:.2f}s after {type(e).__name__}: {e}")
+                self._sleep(delay)
+
+    def hedged(self, purpose: str, fn: Callable[[], Any], hedge_after_ms: Optional[float] = None) -> Any:
+        """
+        Runs fn(); if it hasn't finished after hedge_after_ms, starts a second fn() and
+        returns whichever succeeds first. fn must be safe to run twice (e.g. a fresh chat
+        session per run). The slower request is left to finish on its own.
+        """
+        hedge_after_ms = self.hedge_after_ms if hedge_after_ms is None else hedge_after_ms
+        if hedge_after_ms <= 0:
+            return fn()
+
+        # Each run keeps the caller's context (trace span, usage attribution)
+        primary = self._hedge_executor.submit(contextvars.copy_context().run, fn)
+        done, _ = wait([primary], timeout=hedge_after_ms / 1000)
+        if done:
+            return primary.result()
+
+        MODEL_HEDGES.inc(purpose=purpose, result="launched")
+        hedge = self._hedge_executor.submit(contextvars.copy_context().run, fn)
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        MODEL_HEDGES.inc(purpose=purpose, result="won")
+                    return future.result()
+                error = future.exception()
+        raise error
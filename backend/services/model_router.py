@@ -0,0 +1,123 @@
+import os
+import time
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional
+from google.api_core import exceptions as google_exceptions
+from services.metrics import MODEL_FALLBACKS
+from services.model_scheduler import QueueTimeout
+
+logger = logging.getLogger(__name__)
+
+# Model behind the customer-facing replies (carries the full system prompt and tools)
+MODEL_MAIN = os.environ.get("MODEL_MAIN", "gemini-2.5-flash")
+# Cheaper model for internal classification / extraction calls
+MODEL_LIGHT = os.environ.get("MODEL_LIGHT", "gemini-2.5-flash-lite")
+
+# Ordered fallback chain per purpose. Override with
+# MODEL_ROUTES="qualification=gemini-2.5-flash-lite>gemini-2.5-flash;response=gemini-2.5-pro>gemini-2.5-flash"
+DEFAULT_ROUTES = {
+    "response": [MODEL_MAIN, MODEL_LIGHT],
+    "followup": [MODEL_MAIN, MODEL_LIGHT],
+    "insights": [MODEL_MAIN, MODEL_LIGHT],
+    "qualification": [MODEL_LIGHT, MODEL_MAIN],
+    "extraction": [MODEL_LIGHT, MODEL_MAIN],
+    "summary": [MODEL_LIGHT, MODEL_MAIN],
+}
+
+# A model that ran out of quota is skipped for this long before it is tried again
+MODEL_QUOTA_COOLDOWN_SECONDS = float(os.environ.get("MODEL_QUOTA_COOLDOWN_SECONDS", "60"))
+
+# Internal calls don't need the André Digital persona, rules, catalogue or tools
+LEAN_INSTRUCTION = (
+    "Você é um assistente interno de análise da Dolarize. "
+    "Siga exatamente o formato de resposta pedido, sem comentários extras."
+)
+
+
+def parse_routes(spec: Optional[str]) -> Dict[str, List[str]]:
+    """Parses 'purpose=model_a>model_b;purpose2=model_c' into {purpose: [models]}."""
+    routes = {}
+    for item in (spec or "").split(";"):
+        if "=" not in item:
+            continue
+        purpose, chain = item.split("=", 1)
+        models = [m.strip() for m in chain.split(">") if m.strip()]
+        if purpose.strip() and models:
+            routes[purpose.strip()] = models
+    return routes
+
+
+def is_quota_error(exc: BaseException) -> bool:
+    return isinstance(exc, google_exceptions.ResourceExhausted)
+
+
+class ModelRouter:
+    """
+    Chooses the Gemini model for each call purpose and falls back along a chain.
+
+    The reply path builds its own heavy model (system prompt + tools) per model name;
+    every other purpose gets a lean instance from lean_model(), built once per
+    (purpose, model) and reused. Models that hit quota limits sit out a cooldown.
+    model_factory builds the lean models (genai.GenerativeModel in AgentCore).
+    """
+
+    def __init__(self, model_factory: Callable[..., Any], routes: Optional[Dict[str, List[str]]] = None,
+                 quota_cooldown_seconds: float = MODEL_QUOTA_COOLDOWN_SECONDS):
+        self.model_factory = model_factory
+        self.routes = {purpose: list(chain) for purpose, chain in DEFAULT_ROUTES.items()}
+        self.routes.update(routes if routes is not None else parse_routes(os.environ.get("MODEL_ROUTES")))
+        self.quota_cooldown_seconds = quota_cooldown_seconds
+        self._profiles: Dict[str, Dict[str, Any]] = {}
+        self._lean_models: Dict[tuple, Any] = {}
+        self._cooldown_until: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def chain(self, purpose: str) -> List[str]:
+        """Model names to try for a purpose, skipping models cooling down after quota errors."""
+        chain = self.routes.get(purpose) or [MODEL_MAIN]
+        now = time.monotonic()
+        available = [m for m in chain if self._cooldown_until.get(m, 0) <= now]
+        # Everything cooling down: try the chain anyway rather than fail without a call
+        return available or list(chain)
+
+    def primary(self, purpose: str) -> str:
+        return (self.routes.get(purpose) or [MODEL_MAIN])[0]
+
+    def register_profile(self, purpose: str, system_instruction: Optional[str] = None,
+                         generation_config: Optional[Dict[str, Any]] = None) -> None:
+        """Sets the instruction / generation config of the lean models built for a purpose."""
+        with self._lock:
+            self._profiles[purpose] = {"system_instruction": system_instruction, "generation_config": generation_config}
+            self._lean_models = {k: v for k, v in self._lean_models.items() if k[0] != purpose}
+
+    def lean_model(self, purpose: str, model_name: str) -> Any:
+        with self._lock:
+            model = self._lean_models.get((purpose, model_name))
+            if model is None:
+                profile = self._profiles.get(purpose, {})
+                kwargs = {"model_name": model_name, "system_instruction": profile.get("system_instruction") or LEAN_INSTRUCTION}
+                if profile.get("generation_config"):
+                    kwargs["generation_config"] = profile["generation_config"]
+                model = self._lean_models[(purpose, model_name)] = self.model_factory(**kwargs)
+            return model
+
+    def run(self, purpose: str, attempt: Callable[[str], Any]) -> Any:
+        """
+        Calls attempt(model_name) along the purpose's chain until one succeeds.
+        Re-raises the last error when every model fails.
+        """
+        chain = self.chain(purpose)
+        for index, model_name in enumerate(chain):
+            try:
+                return attempt(model_name)
+            except QueueTimeout:
+                # Every model waits on the same scheduler slots; another one won't be quicker
+                raise
+            except Exception as e:
+                if is_quota_error(e):
+                    self._cooldown_until[model_name] = time.monotonic() + self.quota_cooldown_seconds
+                if index == len(chain) - 1:
+                    raise
+                MODEL_FALLBACKS.inc(purpose=purpose, model=model_name, reason=type(e).__name__)
+                logger.warning(f"Model {model_name} failed for {purpose} ({type(e).__name__}: {e}); trying {chain[index + 1]}.")
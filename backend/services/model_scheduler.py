@@ -0,0 +1,170 @@
+import os
+import time
+import logging
+import threading
+import itertools
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, List, Optional, Tuple
+from services.metrics import MODEL_QUEUE_WAIT, MODEL_QUEUE_DEPTH, MODEL_IN_FLIGHT, MODEL_QUEUE_TIMEOUTS
+
+logger = logging.getLogger(__name__)
+
+# Priority classes, highest first
+PRIORITIES = ("live", "followup", "analysis", "insights")
+
+PURPOSE_PRIORITY = {
+    "response": "live",
+    "token_count": "live",
+    "followup": "followup",
+    "qualification": "analysis",
+    "extraction": "analysis",
+    "summary": "analysis",
+    "insights": "insights",
+}
+
+# Slots shared by every class. Background classes are capped well below it, so
+# live replies always find free slots. Override with MODEL_CONCURRENCY_<CLASS>.
+MODEL_MAX_CONCURRENCY = int(os.environ.get("MODEL_MAX_CONCURRENCY", "16"))
+DEFAULT_CONCURRENCY = {"live": 16, "followup": 4, "analysis": 4, "insights": 2}
+
+# Calls started per minute, process-wide and per class (0 = unlimited).
+# Override with MODEL_RPM and MODEL_RPM_<CLASS>.
+MODEL_RPM = int(os.environ.get("MODEL_RPM", "0"))
+DEFAULT_RPM = {"live": 0, "followup": 0, "analysis": 0, "insights": 0}
+
+RATE_WINDOW_SECONDS = 60.0
+
+
+class QueueTimeout(TimeoutError):
+    """No slot became free before the call's deadline."""
+
+
+def priority_for(purpose: str) -> str:
+    return PURPOSE_PRIORITY.get(purpose, "analysis")
+
+
+def _class_setting(prefix: str, defaults: Dict[str, int]) -> Dict[str, int]:
+    return {cls: int(os.environ.get(f"{prefix}_{cls.upper()}", defaults[cls])) for cls in PRIORITIES}
+
+
+class ModelScheduler:
+    """
+    Process-wide admission control for Gemini calls.
+
+    Each call takes a slot for its priority class before it is sent. A class is
+    limited by its own concurrency and calls-per-minute, and by the shared totals.
+    When a slot frees up it goes to the highest-priority waiter that is allowed to
+    run (FIFO within a class); a class held back by its own limit doesn't block
+    lower classes.
+    """
+
+    def __init__(self, max_concurrency: int = MODEL_MAX_CONCURRENCY, concurrency: Optional[Dict[str, int]] = None,
+                 rpm: int = MODEL_RPM, class_rpm: Optional[Dict[str, int]] = None):
+        self.max_concurrency = max_concurrency
+        self.concurrency = concurrency or _class_setting("MODEL_CONCURRENCY", DEFAULT_CONCURRENCY)
+        self.rpm = rpm
+        self.class_rpm = class_rpm or _class_setting("MODEL_RPM", DEFAULT_RPM)
+        self._active: Dict[str, int] = {cls: 0 for cls in PRIORITIES}
+        self._starts: Dict[str, Deque[float]] = {cls: deque() for cls in PRIORITIES}
+        self._all_starts: Deque[float] = deque()
+        self._waiters: List[Tuple[int, int, str]] = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    def _prune(self, now: float) -> None:
+        cutoff = now - RATE_WINDOW_SECONDS
+        for starts in list(self._starts.values()) + [self._all_starts]:
+            while starts and starts[0] <= cutoff:
+                starts.popleft()
+
+    def _rate_wait(self, cls: str, now: float) -> float:
+        """Seconds until the class may start another call under the rate limits (0 = now)."""
+        wait = 0.0
+        for limit, starts in ((self.class_rpm.get(cls, 0), self._starts[cls]), (self.rpm, self._all_starts)):
+            if limit > 0 and len(starts) >= limit:
+                wait = max(wait, starts[len(starts) - limit] + RATE_WINDOW_SECONDS - now)
+        return wait
+
+    def _can_start(self, cls: str, now: float) -> bool:
+        return (
+            sum(self._active.values()) < self.max_concurrency
+            and self._active[cls] < self.concurrency.get(cls, 1)
+            and self._rate_wait(cls, now) <= 0
+        )
+
+    def _is_next(self, waiter: Tuple[int, int, str], now: float) -> bool:
+        for other in sorted(self._waiters):
+            if other == waiter:
+                return self._can_start(waiter[2], now)
+            if self._can_start(other[2], now):
+                # Someone ahead of us can go first
+                return False
+        return False
+
+    def acquire(self, purpose: str, timeout: Optional[float] = None) -> str:
+        """Blocks until the purpose's class may start a call; returns the class. Raises QueueTimeout."""
+        cls = priority_for(purpose)
+        waiter = (PRIORITIES.index(cls), next(self._seq), cls)
+        start = time.monotonic()
+        deadline = start + timeout if timeout is not None else None
+        with self._cond:
+            self._waiters.append(waiter)
+            MODEL_QUEUE_DEPTH.inc(priority=cls)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._prune(now)
+                    if self._is_next(waiter, now):
+                        break
+                    remaining = deadline - now if deadline is not None else None
+                    if remaining is not None and remaining <= 0:
+                        MODEL_QUEUE_TIMEOUTS.inc(priority=cls)
+                        raise QueueTimeout(f"No {cls} model slot free within {timeout:.1f}s")
+                    # Rate-limited waiters wake up when the window frees a start
+                    rate_wait = self._rate_wait(cls, now)
+                    waits = [w for w in (remaining, rate_wait or None) if w is not None]
+                    self._cond.wait(min(waits) if waits else None)
+            finally:
+                self._waiters.remove(waiter)
+                MODEL_QUEUE_DEPTH.dec(priority=cls)
+                # Our leaving may unblock someone behind us
+                self._cond.notify_all()
+
+            self._active[cls] += 1
+            now = time.monotonic()
+            self._starts[cls].append(now)
+            self._all_starts.append(now)
+        MODEL_IN_FLIGHT.inc(priority=cls)
+        MODEL_QUEUE_WAIT.observe(now - start, priority=cls)
+        return cls
+
+    def release(self, cls: str) -> None:
+        with self._cond:
+            self._active[cls] -= 1
+            self._cond.notify_all()
+        MODEL_IN_FLIGHT.dec(priority=cls)
+
+    @contextmanager
+    def slot(self, purpose: str, timeout: Optional[float] = None):
+        cls = self.acquire(purpose, timeout)
+        try:
+            yield cls
+        finally:
+            self.release(cls)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        with self._cond:
+            self._prune(time.monotonic())
+            return {
+                cls: {
+                    "active": self._active[cls],
+                    "waiting": sum(1 for w in self._waiters if w[2] == cls),
+                    "started_last_minute": len(self._starts[cls]),
+                }
+                for cls in PRIORITIES
+            }
+
+
+# Shared by every AgentCore / background path in the process
+model_scheduler = ModelScheduler()
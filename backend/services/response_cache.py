@@ -0,0 +1,165 @@
+import os
+import time
+import random
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, FrozenSet, List, Optional
+from services.video_matcher import normalize_text, stem_tokens
+from services.metrics import RESPONSE_CACHE
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_ENABLED = os.environ.get("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+
+# Only turns with at most this many history messages are cached (0 = first message only)
+RESPONSE_CACHE_MAX_HISTORY = int(os.environ.get("RESPONSE_CACHE_MAX_HISTORY", "0"))
+
+# Fresh answers generated per question before the cache starts serving; hits pick one at random
+RESPONSE_CACHE_VARIANTS = int(os.environ.get("RESPONSE_CACHE_VARIANTS", "3"))
+
+RESPONSE_CACHE_TTL_SECONDS = float(os.environ.get("RESPONSE_CACHE_TTL_SECONDS", str(6 * 3600)))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", "500"))
+
+# Longer messages are specific questions, not FAQ openers
+MAX_MESSAGE_CHARS = 120
+MAX_KEY_TERMS = 6
+
+# Stem-set overlap (Jaccard) needed to reuse an entry whose key isn't an exact match
+MIN_SIMILARITY = 0.75
+
+# Words that don't change what an opener asks ("oi, boa tarde, quanto custa?" == "quanto custa?")
+FILLER_WORDS = {
+    "oi", "oie", "oii", "ola", "opa", "eai", "bom", "boa", "dia", "tarde", "noite", "tudo", "bem",
+    "obrigado", "obrigada", "favor", "gostaria", "saber", "queria", "poderia", "consegue", "me",
+    "hello", "hi", "hey", "please",
+}
+
+GREETING_KEY = "__saudacao__"
+
+
+@dataclass
+class _Entry:
+    terms: FrozenSet[str]
+    variants: List[str] = field(default_factory=list)
+    # Answers generated so far (identical answers are stored once)
+    samples: int = 0
+    created_at: float = field(default_factory=time.monotonic)
+    hits: int = 0
+
+
+def similarity_terms(message: str) -> Optional[FrozenSet[str]]:
+    """
+    Stem set that identifies what an opener asks. Returns None for messages that
+    are too long or too specific to share an answer.
+    """
+    if not message or len(message) > MAX_MESSAGE_CHARS:
+        return None
+    words = normalize_text(message).split()
+    if not words:
+        return None
+    meaningful = [w for w in words if w not in FILLER_WORDS]
+    if not meaningful:
+        return frozenset([GREETING_KEY])
+    terms = frozenset(stem_tokens(" ".join(meaningful)))
+    if not terms or len(terms) > MAX_KEY_TERMS:
+        return None
+    return terms
+
+
+def _jaccard(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    return len(a & b) / len(a | b) if a or b else 0.0
+
+
+class ResponseCache:
+    """
+    Answers for near-identical first messages ("quanto custa?", "como funciona?").
+
+    Entries are keyed by the stem set of the message and belong to one knowledge
+    base version; refresh_knowledge_base moves the cache to the new version, which
+    drops every answer generated with the old prompt. Each question collects a few
+    fresh answers before it is served, so repeated openers don't all get the same text.
+    """
+
+    def __init__(self, enabled: bool = RESPONSE_CACHE_ENABLED, max_history: int = RESPONSE_CACHE_MAX_HISTORY,
+                 variants: int = RESPONSE_CACHE_VARIANTS, ttl_seconds: float = RESPONSE_CACHE_TTL_SECONDS,
+                 max_entries: int = RESPONSE_CACHE_MAX_ENTRIES):
+        self.enabled = enabled
+        self.max_history = max_history
+        self.variants = max(variants, 1)
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.version: Optional[str] = None
+        self._entries: Dict[FrozenSet[str], _Entry] = {}
+        self._lock = threading.Lock()
+
+    def set_version(self, version: str) -> None:
+        """Switches to a knowledge base version; answers from other versions are dropped."""
+        with self._lock:
+            if version != self.version:
+                if self._entries:
+                    logger.info(f"Response cache invalidated ({len(self._entries)} entries): knowledge base changed.")
+                self._entries = {}
+                self.version = version
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries = {}
+
+    def cache_terms(self, message: str, history: Optional[List[Any]] = None, summary: Optional[str] = None) -> Optional[FrozenSet[str]]:
+        """Similarity key for a turn, or None if the turn isn't cacheable."""
+        if not self.enabled or summary or len(history or []) > self.max_history:
+            return None
+        return similarity_terms(message)
+
+    def _find(self, terms: FrozenSet[str]) -> Optional[_Entry]:
+        entry = self._entries.get(terms)
+        if entry is None:
+            best = 0.0
+            for candidate in self._entries.values():
+                score = _jaccard(terms, candidate.terms)
+                if score >= MIN_SIMILARITY and score > best:
+                    entry, best = candidate, score
+        if entry is not None and time.monotonic() - entry.created_at > self.ttl_seconds:
+            self._entries.pop(entry.terms, None)
+            return None
+        return entry
+
+    def get(self, terms: Optional[FrozenSet[str]]) -> Optional[str]:
+        """Returns a cached answer once the question has all its variants; None otherwise."""
+        if terms is None:
+            RESPONSE_CACHE.inc(result="skip")
+            return None
+        with self._lock:
+            entry = self._find(terms)
+            if entry is None or entry.samples < self.variants:
+                RESPONSE_CACHE.inc(result="miss")
+                return None
+            entry.hits += 1
+            RESPONSE_CACHE.inc(result="hit")
+            return random.choice(entry.variants)
+
+    def put(self, terms: Optional[FrozenSet[str]], response_text: str) -> None:
+        if terms is None or not isinstance(response_text, str) or not response_text.strip():
+            return
+        with self._lock:
+            entry = self._find(terms)
+            if entry is None:
+                if len(self._entries) >= self.max_entries:
+                    # Evict the least used entry
+                    coldest = min(self._entries.values(), key=lambda e: (e.hits, e.created_at))
+                    self._entries.pop(coldest.terms, None)
+                entry = self._entries[terms] = _Entry(terms=terms)
+            if entry.samples < self.variants:
+                entry.samples += 1
+                if response_text not in entry.variants:
+                    entry.variants.append(response_text)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "version": self.version,
+                "entries": len(self._entries),
+                "ready": sum(1 for e in self._entries.values() if e.samples >= self.variants),
+                "hits": sum(e.hits for e in self._entries.values()),
+            }
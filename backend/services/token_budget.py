@@ -0,0 +1,204 @@
+import os
+import math
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Local estimate: Gemini averages ~4 characters per token on pt/en prose
+CHARS_PER_TOKEN = 4
+
+# Native Gemini files (PDF, image, audio) can't be measured locally.
+# Used when the file object doesn't expose a token count of its own.
+DEFAULT_FILE_TOKENS = 1500
+
+# Rough cost of one tool declaration in the request
+TOOL_DECLARATION_TOKENS = 120
+
+# Total input budget per request and the share each component may claim when they compete.
+# Whatever a component doesn't use is redistributed to the others.
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", "32000"))
+RESPONSE_TOKEN_RESERVE = int(os.environ.get("RESPONSE_TOKEN_RESERVE", "2048"))
+DEFAULT_SHARES = {"knowledge": 0.55, "summary": 0.10, "history": 0.35}
+
+# "estimate" (default) or "exact" (one extra count_tokens call per request, for auditing)
+TOKEN_COUNT_MODE = os.environ.get("TOKEN_COUNT_MODE", "estimate")
+
+
+def estimate_tokens(content: Any) -> int:
+    """
+    Estimates the token count of a prompt part without calling the API.
+    Accepts text, lists of parts, history messages and Gemini file objects.
+    """
+    if content is None:
+        return 0
+    if isinstance(content, str):
+        return math.ceil(len(content) / CHARS_PER_TOKEN) if content else 0
+    if isinstance(content, dict):
+        return estimate_tokens(content.get("parts", []))
+    if isinstance(content, (list, tuple)):
+        return sum(estimate_tokens(part) for part in content)
+
+    token_count = getattr(content, "token_count", None)
+    if isinstance(token_count, int):
+        return token_count
+    return DEFAULT_FILE_TOKENS
+
+
+def _truncate_to_tokens(text: str, max_tokens: int) -> str:
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars]
+
+
+@dataclass
+class AssembledContext:
+    history: List[Dict[str, Any]]
+    context_files: List[Any]
+    summary: Optional[str]
+    accounting: Dict[str, Any] = field(default_factory=dict)
+
+
+class ContextAssembler:
+    """
+    Fits system prompt, knowledge files, conversation summary and recent turns
+    into a fixed input token budget.
+
+    Trimming is deterministic: knowledge files are kept in priority order
+    (persona before knowledge, then the order they were loaded) and history
+    is trimmed oldest turn first.
+    """
+
+    def __init__(self, budget: int = CONTEXT_TOKEN_BUDGET, response_reserve: int = RESPONSE_TOKEN_RESERVE,
+                 shares: Optional[Dict[str, float]] = None, count_mode: str = TOKEN_COUNT_MODE):
+        self.budget = budget
+        self.response_reserve = response_reserve
+        self.shares = dict(shares or DEFAULT_SHARES)
+        self.count_mode = count_mode
+
+    def _allocate(self, available: int, needs: Dict[str, int]) -> Dict[str, int]:
+        """
+        Water-filling allocation: every component gets min(need, share); leftover budget
+        from components that need less than their share goes to the ones that need more.
+        """
+        allocation = {name: 0 for name in needs}
+        remaining = max(available, 0)
+        pending = {name for name, need in needs.items() if need > 0}
+
+        while pending and remaining > 0:
+            total_share = sum(self.shares.get(name, 0) for name in pending) or 1.0
+            satisfied = set()
+            granted_total = 0
+            for name in sorted(pending):
+                slice_ = int(remaining * self.shares.get(name, 0) / total_share)
+                grant = min(slice_, needs[name] - allocation[name])
+                allocation[name] += grant
+                granted_total += grant
+                if allocation[name] >= needs[name]:
+                    satisfied.add(name)
+            remaining -= granted_total
+            pending -= satisfied
+            if not satisfied:
+                break
+
+        return allocation
+
+    def assemble(self, user_message: str, history: List[Dict[str, Any]], system_tokens: int = 0,
+                 context_files: Optional[List[Any]] = None, summary: Optional[str] = None,
+                 extra_parts: Optional[List[Any]] = None) -> AssembledContext:
+        """
+        Returns the history, context files and summary that fit the budget, plus token accounting.
+
+        Args:
+            user_message: The current message (always sent in full).
+            history: Gemini-format history, oldest first.
+            system_tokens: Estimated size of system instruction + tool declarations.
+            context_files: Persona/knowledge parts in priority order (text or Gemini files).
+            summary: Rolling conversation summary, if any.
+            extra_parts: Other per-turn parts that are always sent (e.g. video candidates).
+        """
+        context_files = context_files or []
+        fixed_tokens = system_tokens + estimate_tokens(user_message) + estimate_tokens(extra_parts or [])
+        available = self.budget - self.response_reserve - fixed_tokens
+
+        file_tokens = [estimate_tokens(f) for f in context_files]
+        turn_tokens = [estimate_tokens(msg) for msg in history]
+        summary_tokens = estimate_tokens(summary)
+
+        needs = {"knowledge": sum(file_tokens), "summary": summary_tokens, "history": sum(turn_tokens)}
+        allocation = self._allocate(available, needs)
+
+        # Knowledge: keep files in priority order; the first text file that doesn't fit is truncated,
+        # native files are either sent whole or skipped.
+        kept_files = []
+        used = 0
+        dropped_files = 0
+        for item, tokens in zip(context_files, file_tokens):
+            room = allocation["knowledge"] - used
+            if tokens <= room:
+                kept_files.append(item)
+                used += tokens
+            elif isinstance(item, str) and room >= 200:
+                truncated = _truncate_to_tokens(item, room)
+                kept_files.append(truncated)
+                used += estimate_tokens(truncated)
+            else:
+                dropped_files += 1
+        knowledge_used = used
+
+        # Summary: trimmed from the start so the most recent facts survive
+        kept_summary = summary
+        if summary and summary_tokens > allocation["summary"]:
+            max_chars = allocation["summary"] * CHARS_PER_TOKEN
+            kept_summary = summary[-max_chars:] if max_chars > 0 else None
+
+        # History: newest turns first until the budget runs out, then restore chronological order
+        kept_history = []
+        used = 0
+        for msg, tokens in zip(reversed(history), reversed(turn_tokens)):
+            if used + tokens > allocation["history"]:
+                break
+            kept_history.append(msg)
+            used += tokens
+        kept_history.reverse()
+        history_used = used
+
+        summary_used = estimate_tokens(kept_summary)
+        accounting = {
+            "budget": self.budget,
+            "system": system_tokens,
+            "message": fixed_tokens - system_tokens,
+            "knowledge": knowledge_used,
+            "knowledge_requested": needs["knowledge"],
+            "files_dropped": dropped_files,
+            "summary": summary_used,
+            "history": history_used,
+            "history_requested": needs["history"],
+            "turns_kept": len(kept_history),
+            "turns_dropped": len(history) - len(kept_history),
+            "total": fixed_tokens + knowledge_used + summary_used + history_used,
+        }
+        return AssembledContext(history=kept_history, context_files=kept_files, summary=kept_summary, accounting=accounting)
+
+    def log_accounting(self, accounting: Dict[str, Any], user_id: Optional[str] = None,
+                       exact_counter: Optional[Callable[[], int]] = None) -> None:
+        """
+        Logs the per-request token accounting. In 'exact' mode also asks the API for the real count.
+        """
+        if self.count_mode == "exact" and exact_counter is not None:
+            try:
+                accounting["exact_total"] = exact_counter()
+            except Exception as e:
+                logger.warning(f"Exact token count failed: {e}")
+
+        logger.info(
+            f"Token accounting user={user_id}: total={accounting['total']}/{accounting['budget']} "
+            f"system={accounting['system']} message={accounting['message']} "
+            f"knowledge={accounting['knowledge']}/{accounting['knowledge_requested']} (files dropped={accounting['files_dropped']}) "
+            f"summary={accounting['summary']} "
+            f"history={accounting['history']}/{accounting['history_requested']} "
+            f"(turns kept={accounting['turns_kept']}, dropped={accounting['turns_dropped']})"
+            + (f" exact_total={accounting['exact_total']}" if "exact_total" in accounting else "")
+        )
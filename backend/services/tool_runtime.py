@@ -0,0 +1,136 @@
+import time
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from services.tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on tool calls executed concurrently for a single model turn.
+MAX_PARALLEL_TOOL_CALLS = 4
+
+
+@dataclass
+class ToolContext:
+    """
+    Per-request state handed to every tool invocation.
+
+    Built once by the request handler so tools don't have to rediscover the
+    caller through context variables or re-fetch data the handler already has.
+    """
+    user_id: Optional[str] = None
+    user_profile: Optional[Dict[str, Any]] = None
+    db: Any = None
+    calendar: Any = None
+    _profile_lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def get_profile(self) -> Dict[str, Any]:
+        """
+        Returns the user profile, loading it from the database at most once.
+        Handlers pass {} for users known not to exist, which skips the lookup.
+        """
+        with self._profile_lock:
+            if self.user_profile is None and self.db and self.user_id:
+                try:
+                    self.user_profile = self.db.get_user(self.user_id) or {}
+                except Exception as e:
+                    logger.error(f"Error loading user profile for tool context: {e}")
+                    self.user_profile = {}
+            return self.user_profile or {}
+
+    def update_profile(self, data: Dict[str, Any]) -> None:
+        """Keeps the cached profile in sync with writes made by tools."""
+        with self._profile_lock:
+            if self.user_profile is None:
+                self.user_profile = {}
+            self.user_profile.update({k: v for k, v in data.items() if v is not None})
+
+
+class ToolRuntime:
+    """
+    Executes the function calls emitted by the model.
+
+    Calls emitted in the same model turn are independent by construction, so
+    they run in parallel on a small thread pool. Latency is recorded per tool.
+    """
+
+    def __init__(self, max_workers: int = MAX_PARALLEL_TOOL_CALLS):
+        self._handlers: Dict[str, Callable[..., Any]] = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="agent-tool")
+        self._stats: Dict[str, Dict[str, float]] = {}
+        self._stats_lock = threading.Lock()
+
+    def register(self, name: str, handler: Callable[..., Any]) -> None:
+        """Registers a handler called as handler(ctx, **args)."""
+        self._handlers[name] = handler
+
+    def clear(self) -> None:
+        self._handlers = {}
+
+    def has_tool(self, name: str) -> bool:
+        return name in self._handlers
+
+    def run(self, name: str, args: Dict[str, Any], ctx: ToolContext) -> Tuple[str, Any]:
+        """
+        Runs a single tool call and returns (name, result).
+        Errors are returned to the model as text instead of raised.
+        """
+        handler = self._handlers.get(name)
+        if handler is None:
+            logger.warning(f"Model requested unknown tool: {name}")
+            return name, f"Erro: ferramenta '{name}' não disponível."
+
+        start = time.perf_counter()
+        ok = True
+        with tracer.start_span(f"tool.{name}", {"tool.name": name, "user.id": ctx.user_id}) as span:
+            try:
+                result = handler(ctx, **args)
+            except Exception as e:
+                ok = False
+                logger.error(f"Error executing tool {name}: {e}")
+                result = f"Erro ao executar a ferramenta {name}."
+                span.record_exception(e)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        self._record(name, elapsed_ms, ok)
+        logger.info(f"Tool {name} finished in {elapsed_ms:.1f}ms (ok={ok})")
+        return name, result
+
+    def run_calls(self, calls: List[Tuple[str, Dict[str, Any]]], ctx: ToolContext) -> List[Tuple[str, Any]]:
+        """
+        Runs all calls from one model turn, preserving the order of results.
+        """
+        if not calls:
+            return []
+        if len(calls) == 1:
+            name, args = calls[0]
+            return [self.run(name, args, ctx)]
+
+        futures = [
+            self._executor.submit(contextvars.copy_context().run, self.run, name, args, ctx)
+            for name, args in calls
+        ]
+        return [future.result() for future in futures]
+
+    def _record(self, name: str, elapsed_ms: float, ok: bool) -> None:
+        with self._stats_lock:
+            stats = self._stats.setdefault(name, {"calls": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0})
+            stats["calls"] += 1
+            if not ok:
+                stats["errors"] += 1
+            stats["total_ms"] += elapsed_ms
+            stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+
+    def get_stats(self) -> Dict[str, Dict[str, float]]:
+        """Returns per-tool call counts and latency (avg/max in milliseconds)."""
+        with self._stats_lock:
+            result = {}
+            for name, stats in self._stats.items():
+                result[name] = {
+                    **stats,
+                    "avg_ms": stats["total_ms"] / stats["calls"] if stats["calls"] else 0.0
+                }
+            return result
@@ -0,0 +1,247 @@
+import os
+import time
+import uuid
+import logging
+import secrets
+import functools
+import asyncio
+import threading
+import contextvars
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# "log" (default) writes finished spans to the log; "memory" keeps spans for tests; "none" disables export
+TRACING_EXPORTER = os.environ.get("TRACING_EXPORTER", "log")
+
+# Child spans slower than this are logged at INFO; the rest at DEBUG (root spans always at INFO)
+TRACING_SLOW_SPAN_MS = float(os.environ.get("TRACING_SLOW_SPAN_MS", "1000"))
+
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+
+
+def _new_trace_id() -> str:
+    return secrets.token_hex(16)
+
+
+def _new_span_id() -> str:
+    return secrets.token_hex(8)
+
+
+def new_message_id() -> str:
+    return uuid.uuid4().hex
+
+
+@dataclass
+class SpanContext:
+    """Identifies a span across threads, background tasks and services (W3C trace context)."""
+    trace_id: str
+    span_id: str
+    message_id: Optional[str] = None
+
+    def to_traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+
+def parse_traceparent(header: Optional[str]) -> Optional[SpanContext]:
+    """Parses a W3C traceparent header ('00-<trace_id>-<span_id>-<flags>')."""
+    if not header:
+        return None
+    parts = header.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        int(parts[1], 16)
+        int(parts[2], 16)
+    except ValueError:
+        return None
+    return SpanContext(trace_id=parts[1], span_id=parts[2])
+
+
+@dataclass
+class Span:
+    """
+    A timed operation. Field names and status values follow the OpenTelemetry data model,
+    so spans can be exported to any OTLP backend.
+    """
+    name: str
+    trace_id: str
+    span_id: str
+    parent_span_id: Optional[str] = None
+    start_time_ns: int = field(default_factory=time.time_ns)
+    end_time_ns: Optional[int] = None
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    events: List[Dict[str, Any]] = field(default_factory=list)
+    status: str = "UNSET"
+    status_description: Optional[str] = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def set_attributes(self, attributes: Dict[str, Any]) -> None:
+        self.attributes.update(attributes)
+
+    def add_event(self, name: str, attributes: Optional[Dict[str, Any]] = None) -> None:
+        self.events.append({"name": name, "timestamp_ns": time.time_ns(), "attributes": dict(attributes or {})})
+
+    def record_exception(self, exc: BaseException) -> None:
+        self.add_event("exception", {"exception.type": type(exc).__name__, "exception.message": str(exc)})
+        self.status = "ERROR"
+        self.status_description = str(exc)
+
+    @property
+    def context(self) -> SpanContext:
+        return SpanContext(self.trace_id, self.span_id, self.attributes.get("message.id"))
+
+    @property
+    def duration_ms(self) -> Optional[float]:
+        if self.end_time_ns is None:
+            return None
+        return (self.end_time_ns - self.start_time_ns) / 1e6
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "context": {"trace_id": self.trace_id, "span_id": self.span_id},
+            "parent_id": self.parent_span_id,
+            "start_time_ns": self.start_time_ns,
+            "end_time_ns": self.end_time_ns,
+            "duration_ms": self.duration_ms,
+            "attributes": dict(self.attributes),
+            "events": list(self.events),
+            "status": {"status_code": self.status, "description": self.status_description},
+        }
+
+
+class InMemorySpanExporter:
+    """Keeps finished spans in memory (tests, local debugging)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._spans: List[Span] = []
+
+    def export(self, span: Span) -> None:
+        with self._lock:
+            self._spans.append(span)
+
+    def get_finished_spans(self, message_id: Optional[str] = None) -> List[Span]:
+        with self._lock:
+            spans = list(self._spans)
+        if message_id is not None:
+            spans = [s for s in spans if s.attributes.get("message.id") == message_id]
+        return spans
+
+    def clear(self) -> None:
+        with self._lock:
+            self._spans = []
+
+
+class LoggingSpanExporter:
+    """One log line per finished span; grep by message_id to see where a turn spent its time."""
+
+    def export(self, span: Span) -> None:
+        is_root = span.parent_span_id is None
+        level = logging.INFO if is_root or (span.duration_ms or 0) >= TRACING_SLOW_SPAN_MS else logging.DEBUG
+        if not logger.isEnabledFor(level):
+            return
+        logger.log(
+            level,
+            f"span name={span.name} duration_ms={span.duration_ms:.1f} status={span.status} "
+            f"message_id={span.attributes.get('message.id')} trace_id={span.trace_id} "
+            f"span_id={span.span_id} parent_id={span.parent_span_id}"
+        )
+
+
+class Tracer:
+    def __init__(self, exporters: Optional[List[Any]] = None):
+        self.exporters = list(exporters or [])
+
+    def add_exporter(self, exporter: Any) -> None:
+        self.exporters.append(exporter)
+
+    def remove_exporter(self, exporter: Any) -> None:
+        if exporter in self.exporters:
+            self.exporters.remove(exporter)
+
+    @contextmanager
+    def start_span(self, name: str, attributes: Optional[Dict[str, Any]] = None,
+                   parent: Optional[SpanContext] = None, message_id: Optional[str] = None) -> Iterator[Span]:
+        """
+        Starts a span as a child of the current span (or of `parent`, for work resumed
+        elsewhere). Every span carries the message.id of the turn it belongs to.
+        """
+        current = _current_span.get()
+        if parent is None and current is not None:
+            parent = current.context
+
+        message_id = message_id or (parent.message_id if parent else None)
+        span = Span(
+            name=name,
+            trace_id=parent.trace_id if parent else _new_trace_id(),
+            span_id=_new_span_id(),
+            parent_span_id=parent.span_id if parent else None,
+            attributes=dict(attributes or {})
+        )
+        if message_id:
+            span.attributes["message.id"] = message_id
+
+        span_token = _current_span.set(span)
+        try:
+            yield span
+            if span.status == "UNSET":
+                span.status = "OK"
+        except BaseException as e:
+            span.record_exception(e)
+            raise
+        finally:
+            span.end_time_ns = time.time_ns()
+            _current_span.reset(span_token)
+            for exporter in self.exporters:
+                try:
+                    exporter.export(span)
+                except Exception as e:
+                    logger.warning(f"Span export failed: {e}")
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def current_context() -> Optional[SpanContext]:
+    """Context of the active span, to hand to work that runs later (background tasks)."""
+    span = _current_span.get()
+    return span.context if span else None
+
+
+def traced_task(name: str, func: Callable, parent: Optional[SpanContext] = None) -> Callable:
+    """
+    Wraps a function handed to BackgroundTasks so it runs in its own span, linked to the
+    request that queued it (the request span has usually finished by then).
+    """
+    parent = parent or current_context()
+
+    if asyncio.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            with tracer.start_span(name, parent=parent):
+                return await func(*args, **kwargs)
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with tracer.start_span(name, parent=parent):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def _default_exporters() -> List[Any]:
+    if TRACING_EXPORTER == "memory":
+        return [InMemorySpanExporter()]
+    if TRACING_EXPORTER == "log":
+        return [LoggingSpanExporter()]
+    return []
+
+
+tracer = Tracer(_default_exporters())
@@ -0,0 +1,151 @@
+import logging
+import threading
+import datetime
+import urllib.parse as urlparse
+from collections import OrderedDict
+from typing import Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LANGUAGES = ("pt", "en")
+
+# Firestore documents are capped at 1 MiB; longer transcripts are only cached in-process.
+MAX_PERSISTED_CHARS = 900000
+
+
+def parse_video_id(url: str) -> Optional[str]:
+    """
+    Extracts the video ID from a youtube.com or youtu.be URL.
+    Returns None if the URL is not recognised.
+    """
+    if not url:
+        return None
+
+    parsed = urlparse.urlparse(url.strip())
+    video_id = None
+    if "youtube.com" in parsed.netloc:
+        qs = urlparse.parse_qs(parsed.query)
+        if "v" in qs:
+            video_id = qs["v"][0]
+        elif parsed.path.startswith(("/shorts/", "/embed/", "/live/")):
+            video_id = parsed.path.split("/")[2]
+    elif "youtu.be" in parsed.netloc:
+        video_id = parsed.path.lstrip("/").split("/")[0]
+
+    return video_id or None
+
+
+class TranscriptService:
+    """
+    Transcript cache keyed by video ID and language preference.
+
+    Lookups go to an in-process LRU first, then to the 'youtube_transcripts'
+    Firestore collection, and only then to YouTube. Transcripts never change
+    once published, so entries don't expire.
+    """
+
+    def __init__(self, db=None, max_entries: int = 256):
+        # Firestore handle; attached by AgentCore at startup. Without it only the LRU is used.
+        self.db = db
+        self.max_entries = max_entries
+        self._lru: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "firestore_hits": 0, "fetches": 0}
+
+    @staticmethod
+    def _cache_key(video_id: str, languages: Sequence[str]) -> str:
+        return f"{video_id}_{'-'.join(languages)}"
+
+    def get_transcript(self, video_id: str, languages: Sequence[str] = DEFAULT_LANGUAGES) -> str:
+        """
+        Returns the full transcript text for a video.
+        Raises if the transcript is not cached and cannot be fetched from YouTube.
+        """
+        key = self._cache_key(video_id, languages)
+
+        with self._lock:
+            if key in self._lru:
+                self._lru.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return self._lru[key]
+
+        text = None
+        if self.db:
+            try:
+                cached = self.db.get_cached_transcript(key)
+                if cached and cached.get("text"):
+                    text = cached["text"]
+                    self.stats["firestore_hits"] += 1
+            except Exception as e:
+                logger.error(f"Error reading transcript cache for {video_id}: {e}")
+
+        if text is None:
+            text, language = self._fetch_remote(video_id, languages)
+            self.stats["fetches"] += 1
+            self._persist(key, video_id, language, text)
+
+        self._remember(key, text)
+        return text
+
+    def prewarm(self, url: str) -> bool:
+        """
+        Populates the cache for a video URL. Safe to run as a background task.
+        """
+        video_id = parse_video_id(url)
+        if not video_id:
+            logger.warning(f"Cannot prewarm transcript cache, invalid YouTube URL: {url}")
+            return False
+        try:
+            self.get_transcript(video_id)
+            logger.info(f"Transcript cache warmed for video {video_id}")
+            return True
+        except Exception as e:
+            logger.warning(f"Failed to prewarm transcript for video {video_id}: {e}")
+            return False
+
+    def clear_memory(self) -> None:
+        with self._lock:
+            self._lru.clear()
+
+    def _remember(self, key: str, text: str) -> None:
+        with self._lock:
+            self._lru[key] = text
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.max_entries:
+                self._lru.popitem(last=False)
+
+    def _persist(self, key: str, video_id: str, language: Optional[str], text: str) -> None:
+        if not self.db:
+            return
+        if len(text) > MAX_PERSISTED_CHARS:
+            logger.warning(f"Transcript for {video_id} too large to persist ({len(text)} chars). Caching in memory only.")
+            return
+        try:
+            self.db.save_cached_transcript(key, {
+                "video_id": video_id,
+                "language": language,
+                "text": text,
+                "fetched_at": datetime.datetime.now(datetime.timezone.utc).isoformat()
+            })
+        except Exception as e:
+            logger.error(f"Error saving transcript cache for {video_id}: {e}")
+
+    @staticmethod
+    def _fetch_remote(video_id: str, languages: Sequence[str]) -> Tuple[str, Optional[str]]:
+        """
+        Fetches a transcript from YouTube. Returns (text, language_code).
+        Supports both the legacy class-level API and the instance API of youtube-transcript-api.
+        """
+        from youtube_transcript_api import YouTubeTranscriptApi
+
+        if hasattr(YouTubeTranscriptApi, "get_transcript"):
+            transcript_list = YouTubeTranscriptApi.get_transcript(video_id, languages=list(languages))
+            return " ".join([item['text'] for item in transcript_list]), None
+
+        fetched = YouTubeTranscriptApi().fetch(video_id, languages=list(languages))
+        text = " ".join([snippet.text for snippet in fetched])
+        return text, getattr(fetched, "language_code", None)
+
+
+# Singleton instance
+transcript_service = TranscriptService()
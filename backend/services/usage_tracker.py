@@ -0,0 +1,230 @@
+import os
+import time
+import logging
+import datetime
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from services.metrics import MODEL_TOKENS, MODEL_COST
+from services.model_router import MODEL_MAIN
+
+logger = logging.getLogger(__name__)
+
+# USD per 1M tokens (input, output, cached input) per model, from the Gemini list prices;
+# cached prompt tokens are billed at the cached rate. Override or add models with
+# MODEL_PRICES="gemini-2.5-flash=0.30/2.50/0.075;my-tuned-model=0.10/0.40/0.025"
+DEFAULT_MODEL_PRICES = {
+    "gemini-2.5-pro": (1.25, 10.00, 0.31),
+    "gemini-2.5-flash": (0.30, 2.50, 0.075),
+    "gemini-2.5-flash-lite": (0.10, 0.40, 0.025),
+}
+
+# Pending usage is written to Firestore after this many calls or seconds, whichever comes first
+USAGE_FLUSH_EVERY_CALLS = int(os.environ.get("USAGE_FLUSH_EVERY_CALLS", "25"))
+USAGE_FLUSH_INTERVAL_SECONDS = float(os.environ.get("USAGE_FLUSH_INTERVAL_SECONDS", "60"))
+
+# Calls made outside a user scope (admin tools, knowledge refresh) are attributed to this id
+UNATTRIBUTED = "_unattributed"
+
+TOKEN_FIELDS = ("calls", "prompt_tokens", "cached_tokens", "output_tokens", "cost_usd")
+
+_current_user: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("usage_user", default=None)
+
+
+def _count(usage: Any, name: str) -> int:
+    value = getattr(usage, name, None)
+    return value if isinstance(value, int) and not isinstance(value, bool) else 0
+
+
+def extract_usage(response: Any) -> Optional[Dict[str, int]]:
+    """
+    Reads usage_metadata from a generate_content / send_message response.
+    Returns None for responses that carry no usage (e.g. count_tokens).
+    """
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return None
+    counts = {
+        "prompt_tokens": _count(usage, "prompt_token_count"),
+        "cached_tokens": _count(usage, "cached_content_token_count"),
+        # Thinking tokens are billed as output
+        "output_tokens": _count(usage, "candidates_token_count") + _count(usage, "thoughts_token_count"),
+    }
+    if not any(counts.values()):
+        return None
+    return counts
+
+
+def parse_prices(spec: Optional[str]) -> Dict[str, Tuple[float, float, float]]:
+    """Parses 'model=input/output/cached;model2=...' (USD per 1M tokens) into {model: prices}."""
+    prices = {}
+    for item in (spec or "").split(";"):
+        model, _, values = item.partition("=")
+        try:
+            input_price, output_price, cached_price = (float(v) for v in values.split("/"))
+        except ValueError:
+            continue
+        if model.strip():
+            prices[model.strip()] = (input_price, output_price, cached_price)
+    return prices
+
+
+MODEL_PRICES = {**DEFAULT_MODEL_PRICES, **parse_prices(os.environ.get("MODEL_PRICES"))}
+
+
+def model_prices(model_name: Optional[str]) -> Tuple[float, float, float]:
+    """Prices for model_name; calls without a model (or with an unpriced one) are priced as MODEL_MAIN."""
+    if model_name in MODEL_PRICES:
+        return MODEL_PRICES[model_name]
+    if model_name:
+        logger.debug(f"No price for model {model_name}; using {MODEL_MAIN} prices.")
+    return MODEL_PRICES.get(MODEL_MAIN, DEFAULT_MODEL_PRICES["gemini-2.5-flash"])
+
+
+def estimate_cost(prompt_tokens: int, cached_tokens: int, output_tokens: int, model_name: Optional[str] = None) -> float:
+    input_price, output_price, cached_price = model_prices(model_name)
+    uncached = max(prompt_tokens - cached_tokens, 0)
+    return (
+        uncached * input_price
+        + cached_tokens * cached_price
+        + output_tokens * output_price
+    ) / 1_000_000
+
+
+def _empty_totals() -> Dict[str, float]:
+    return {name: 0 for name in TOKEN_FIELDS}
+
+
+def _add(totals: Dict[str, float], other: Dict[str, float]) -> None:
+    for name in TOKEN_FIELDS:
+        totals[name] = totals.get(name, 0) + other.get(name, 0)
+
+
+class UsageTracker:
+    """
+    Token accounting for every Gemini call, per user and per purpose.
+
+    AgentCore._call_model reports each response here. Usage is counted in-process
+    (Prometheus counters) and buffered into daily per-user rollups that flush_if_due
+    writes to the 'usage_rollups' collection from background work, off the reply path.
+    """
+
+    def __init__(self, flush_every_calls: int = USAGE_FLUSH_EVERY_CALLS,
+                 flush_interval_seconds: float = USAGE_FLUSH_INTERVAL_SECONDS):
+        self.flush_every_calls = flush_every_calls
+        self.flush_interval_seconds = flush_interval_seconds
+        self._lock = threading.Lock()
+        self._pending: Dict[tuple, Dict[str, Any]] = {}
+        self._pending_calls = 0
+        self._last_flush = time.monotonic()
+
+    @contextmanager
+    def attribute_to(self, user_id: Optional[str]) -> Iterator[None]:
+        """Model calls made inside this block are charged to user_id (None keeps the outer scope)."""
+        token = _current_user.set(user_id or _current_user.get())
+        try:
+            yield
+        finally:
+            _current_user.reset(token)
+
+    def record(self, purpose: str, response: Any, user_id: Optional[str] = None,
+               model_name: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Records the usage carried by a model response, priced for the model that served it.
+        Returns the counted usage, if any.
+        """
+        counts = extract_usage(response)
+        if counts is None:
+            return None
+
+        user_id = user_id or _current_user.get() or UNATTRIBUTED
+        usage = dict(counts, calls=1, cost_usd=estimate_cost(**counts, model_name=model_name))
+
+        for kind in ("prompt", "cached", "output"):
+            MODEL_TOKENS.inc(usage[f"{kind}_tokens"], purpose=purpose, kind=kind)
+        MODEL_COST.inc(usage["cost_usd"], purpose=purpose)
+
+        day = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d")
+        with self._lock:
+            entry = self._pending.get((day, user_id))
+            if entry is None:
+                entry = self._pending[(day, user_id)] = {"totals": _empty_totals(), "by_purpose": {}}
+            _add(entry["totals"], usage)
+            _add(entry["by_purpose"].setdefault(purpose, _empty_totals()), usage)
+            self._pending_calls += 1
+        return usage
+
+    def is_due(self) -> bool:
+        with self._lock:
+            if not self._pending:
+                return False
+            return (
+                self._pending_calls >= self.flush_every_calls
+                or time.monotonic() - self._last_flush >= self.flush_interval_seconds
+            )
+
+    def flush(self, db: Any) -> int:
+        """Writes pending rollups to Firestore. Returns the number of documents written."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._pending_calls = 0
+            self._last_flush = time.monotonic()
+        if not pending:
+            return 0
+
+        try:
+            db.increment_usage_rollups([
+                {"day": day, "user_id": user_id, **entry} for (day, user_id), entry in pending.items()
+            ])
+        except Exception as e:
+            logger.error(f"Error writing usage rollups ({len(pending)} documents): {e}")
+            # Put the usage back so the next flush retries it
+            with self._lock:
+                for key, entry in pending.items():
+                    current = self._pending.setdefault(key, {"totals": _empty_totals(), "by_purpose": {}})
+                    _add(current["totals"], entry["totals"])
+                    for purpose, totals in entry["by_purpose"].items():
+                        _add(current["by_purpose"].setdefault(purpose, _empty_totals()), totals)
+            return 0
+        return len(pending)
+
+    def flush_if_due(self, db: Any) -> int:
+        if not self.is_due():
+            return 0
+        return self.flush(db)
+
+    def pending_rollups(self) -> List[Dict[str, Any]]:
+        """Usage not yet written to Firestore, in the same shape as stored rollups."""
+        with self._lock:
+            return [
+                {"day": day, "user_id": user_id, **entry["totals"],
+                 "by_purpose": {p: dict(t) for p, t in entry["by_purpose"].items()}}
+                for (day, user_id), entry in self._pending.items()
+            ]
+
+    @staticmethod
+    def summarize(rollups: List[Dict[str, Any]], top_n: int = 20) -> Dict[str, Any]:
+        """Aggregates rollup documents into totals, per-purpose totals and the top users by cost."""
+        totals = _empty_totals()
+        by_purpose: Dict[str, Dict[str, float]] = {}
+        by_user: Dict[str, Dict[str, float]] = {}
+
+        for rollup in rollups:
+            _add(totals, rollup)
+            _add(by_user.setdefault(rollup.get("user_id") or UNATTRIBUTED, _empty_totals()), rollup)
+            for purpose, purpose_totals in (rollup.get("by_purpose") or {}).items():
+                _add(by_purpose.setdefault(purpose, _empty_totals()), purpose_totals)
+
+        def ranked(items: Dict[str, Dict[str, float]], key: str) -> List[Dict[str, Any]]:
+            rows = [{key: name, **values} for name, values in items.items()]
+            return sorted(rows, key=lambda row: (row["cost_usd"], row["prompt_tokens"]), reverse=True)
+
+        return {
+            "totals": totals,
+            "by_purpose": ranked(by_purpose, "purpose"),
+            "top_users": ranked(by_user, "user_id")[:top_n],
+        }
+
+
+usage_tracker = UsageTracker()
@@ -0,0 +1,138 @@
+import re
+import math
+import unicodedata
+from typing import Any, Dict, List, Optional, Set
+
+# Number of candidate videos injected into a turn
+DEFAULT_TOP_K = 3
+
+# Stems are word prefixes: cheap, language-agnostic and good enough for short trigger texts
+# ("investir", "investimento", "investimentos" -> "invest")
+STEM_LENGTH = 6
+
+# Bonus for a multi-word trigger phrase appearing verbatim in the message
+PHRASE_BONUS = 2.0
+
+# Candidates scoring below this fraction of the best match are dropped (weak single-word overlaps)
+MIN_RELATIVE_SCORE = 0.35
+
+STOPWORDS = {
+    # Portuguese
+    "a", "o", "as", "os", "um", "uma", "uns", "umas", "de", "do", "da", "dos", "das", "em", "no", "na",
+    "nos", "nas", "por", "para", "pra", "pro", "com", "sem", "sob", "sobre", "que", "quem", "qual",
+    "quais", "como", "quando", "onde", "porque", "e", "ou", "mas", "se", "nao", "sim", "eu",
+    "voce", "voces", "ele", "ela", "eles", "elas", "meu", "minha", "meus", "minhas", "seu", "sua", "seus",
+    "suas", "isso", "isto", "esse", "essa", "este", "esta", "aquele", "aquela", "ja", "mais", "menos",
+    "muito", "muita", "pouco", "tem", "ter", "ser", "estar", "estou", "sou", "foi", "vai", "vou",
+    "quero", "queria", "pode", "posso", "tambem", "entao", "ainda", "aqui", "ali", "la", "tudo",
+    "todo", "toda", "todos", "todas", "ate", "apos", "quanto", "usuario", "duvida", "duvidas", "geral",
+    # English
+    "the", "and", "for", "with", "about", "what", "how", "when", "this", "that", "user", "asks",
+}
+
+_NON_WORD = re.compile(r"[^a-z0-9\s]")
+_PHRASE_SPLIT = re.compile(r"[,;|/\n]+")
+
+
+def normalize_text(text: str) -> str:
+    """Lowercases, strips accents and punctuation, and collapses whitespace."""
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = _NON_WORD.sub(" ", text)
+    return " ".join(text.split())
+
+
+def stem_tokens(text: str) -> List[str]:
+    """Returns the stems of the meaningful words in a text."""
+    stems = []
+    for word in normalize_text(text).split():
+        if len(word) < 3 or word in STOPWORDS:
+            continue
+        stems.append(word[:STEM_LENGTH])
+    return stems
+
+
+def format_video_line(video: Dict[str, Any]) -> str:
+    """Single catalogue line, in the format the agent prompt has always used."""
+    return f"- ID: {video.get('id')} | Título: {video.get('title', 'Sem Título')} | Gatilho: {video.get('trigger_context', 'Geral')}\n"
+
+
+class VideoMatcher:
+    """
+    Inverted index over the video catalogue's trigger_context and title.
+
+    Built once per knowledge refresh; matching a message only touches the
+    postings of the words it contains instead of scanning every trigger.
+    """
+
+    def __init__(self, videos: Optional[List[Dict[str, Any]]] = None):
+        self.videos: Dict[str, Dict[str, Any]] = {}
+        self._postings: Dict[str, Set[str]] = {}
+        self._phrases: Dict[str, List[str]] = {}
+        self._idf: Dict[str, float] = {}
+
+        for video in videos or []:
+            video_id = video.get("id")
+            if not video_id:
+                continue
+            self.videos[video_id] = video
+
+            text = f"{video.get('trigger_context', '')} {video.get('title', '')}"
+            for stem in set(stem_tokens(text)):
+                self._postings.setdefault(stem, set()).add(video_id)
+
+            phrases = []
+            for phrase in _PHRASE_SPLIT.split(video.get("trigger_context", "") or ""):
+                normalized = normalize_text(phrase)
+                if len(normalized.split()) >= 2:
+                    phrases.append(normalized)
+            self._phrases[video_id] = phrases
+
+        total = len(self.videos)
+        for stem, video_ids in self._postings.items():
+            self._idf[stem] = math.log(1 + total / len(video_ids))
+
+    def __len__(self) -> int:
+        return len(self.videos)
+
+    def match(self, text: str, top_k: int = DEFAULT_TOP_K) -> List[Dict[str, Any]]:
+        """
+        Returns up to top_k videos whose trigger matches the text, best first.
+        Each result is the stored video dict plus a 'score' key.
+        """
+        if not self.videos or not text:
+            return []
+
+        scores: Dict[str, float] = {}
+        for stem in set(stem_tokens(text)):
+            for video_id in self._postings.get(stem, ()):
+                scores[video_id] = scores.get(video_id, 0.0) + self._idf[stem]
+
+        if not scores:
+            return []
+
+        normalized = f" {normalize_text(text)} "
+        for video_id in scores:
+            for phrase in self._phrases.get(video_id, []):
+                if f" {phrase} " in normalized:
+                    scores[video_id] += PHRASE_BONUS
+
+        best = max(scores.values())
+        ranked = sorted(
+            ((video_id, score) for video_id, score in scores.items() if score >= best * MIN_RELATIVE_SCORE),
+            key=lambda item: (-item[1], str(item[0]))
+        )[:top_k]
+        return [{**self.videos[video_id], "score": round(score, 3)} for video_id, score in ranked]
+
+    @staticmethod
+    def format_candidates(candidates: List[Dict[str, Any]]) -> str:
+        """Prompt block listing the candidate videos for the current turn."""
+        if not candidates:
+            return ""
+        block = "\n--- VÍDEOS CANDIDATOS PARA ESTA MENSAGEM (CATÁLOGO) ---\n"
+        for video in candidates:
+            block += format_video_line(video)
+        block += "---------------------------------------------------\n"
+        return block
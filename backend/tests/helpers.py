@@ -0,0 +1,40 @@
+"""Shared fixtures for tests that build a real AgentCore without Gemini or Firestore."""
+from unittest.mock import patch
+import sys
+import os
+
+# Ensure backend directory is in sys.path
+backend_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if backend_path not in sys.path:
+    sys.path.insert(0, backend_path)
+
+import agent_core
+
+
+def patch_agent_dependencies(test, videos=None):
+    """
+    Patches genai, FirestoreClient and the genai config flag in agent_core until the
+    test ends (stopped via test.addCleanup). The mock db serves no knowledge files,
+    the given videos and the default text for every config key.
+    Returns (mock_genai, mock_db).
+    """
+    patchers = [
+        patch('agent_core.genai'),
+        patch('agent_core.FirestoreClient'),
+        patch('agent_core.is_genai_configured', True),
+    ]
+    mock_genai, mock_firestore, _ = [p.start() for p in patchers]
+    for patcher in patchers:
+        test.addCleanup(patcher.stop)
+
+    mock_db = mock_firestore.return_value
+    mock_db.get_knowledge_files.return_value = []
+    mock_db.get_videos.return_value = videos if videos is not None else []
+    mock_db.get_config_content.side_effect = lambda key, default: default
+    return mock_genai, mock_db
+
+
+def make_agent(test, videos=None):
+    """AgentCore built on patch_agent_dependencies. Returns (agent, mock_genai, mock_db)."""
+    mock_genai, mock_db = patch_agent_dependencies(test, videos=videos)
+    return agent_core.AgentCore(), mock_genai, mock_db
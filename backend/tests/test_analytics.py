@@ -0,0 +1,89 @@
+import unittest
+import datetime
+from unittest.mock import MagicMock
+import sys
+import os
+
+# Ensure backend directory is in sys.path
+backend_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if backend_path not in sys.path:
+    sys.path.insert(0, backend_path)
+
+from memory_store import InMemoryFirestore
+from database import FirestoreClient
+from services.analytics import AnalyticsRollups, classification_tier
+
+UTC = datetime.timezone.utc
+
+
+def at(day, hour=12):
+    return datetime.datetime(2026, 1, day, hour, tzinfo=UTC)
+
+
+class TestAnalyticsRollups(unittest.TestCase):
+    def setUp(self):
+        self.store = InMemoryFirestore()
+        self.client = FirestoreClient(backend=self.store)
+        self.analytics = AnalyticsRollups(flush_every_events=3, flush_interval_seconds=3600)
+
+    def test_classification_tiers(self):
+        self.assertEqual(classification_tier("Perfil A (Qualificado/Quente)"), "A")
+        self.assertEqual(classification_tier("B"), "B")
+        self.assertEqual(classification_tier(""), "none")
+        self.assertEqual(classification_tier(None), "none")
+
+        self.assertTrue(self.analytics.record_classification(None, "Perfil C (Frio/Curioso)"))
+        self.assertTrue(self.analytics.record_classification("Perfil C (Frio/Curioso)", "Perfil A (Qualificado/Quente)"))
+        self.assertFalse(self.analytics.record_classification("Perfil A (Qualificado/Quente)", "Perfil A (Qualificado/Quente)"))
+        self.assertFalse(self.analytics.record_classification("Perfil B (Morno/Em educação)", None))
+        changes = self.analytics.pending_rollups("day")[0]["classification_changes"]
+        self.assertEqual(changes, {"total": 2, "none->C": 1, "C->A": 1})
+
+    def test_flush_increments_hourly_and_daily_documents(self):
+        self.analytics.record("messages", "whatsapp", at=at(1, 9))
+        self.analytics.record("messages", "web_chat", at=at(1, 10))
+        self.assertFalse(self.analytics.is_due())
+        self.analytics.record("conversions", "stripe", at=at(1, 10))
+        self.assertTrue(self.analytics.is_due())
+        self.assertEqual(self.analytics.flush_if_due(self.client), 3)  # 2 hours + 1 day
+
+        self.analytics.record("messages", "whatsapp", at=at(1, 23))
+        self.analytics.flush(self.client)
+
+        day = self.store.dump()["analytics_rollups"]["day_2026-01-01"]
+        self.assertEqual(day["messages"], {"total": 3, "whatsapp": 2, "web_chat": 1})
+        self.assertEqual(day["conversions"], {"total": 1, "stripe": 1})
+        hours = self.client.get_analytics_rollups("hour", "2026-01-01T10")
+        self.assertEqual(sorted(r["bucket"] for r in hours), ["2026-01-01T10", "2026-01-01T23"])
+
+    def test_series_reads_one_query_and_fills_gaps(self):
+        self.analytics.record("new_leads", "instagram", at=at(2))
+        self.analytics.record("followups_sent", "whatsapp", at=at(4))
+        self.analytics.flush(self.client)
+        self.analytics.record("new_leads", "whatsapp", at=at(4))  # not flushed yet
+        self.store.stats.reset()
+
+        rollups = self.client.get_analytics_rollups("day", "2026-01-01") + self.analytics.pending_rollups("day")
+        self.assertEqual(self.store.get_stats()["totals"]["round_trips"], 1)
+        series = self.analytics.series(rollups, "day", at(1), at(4))
+        self.assertEqual([p["bucket"] for p in series["points"]], ["2026-01-01", "2026-01-02", "2026-01-03", "2026-01-04"])
+        self.assertEqual(series["points"][0]["new_leads"], {"total": 0})
+        self.assertEqual(series["points"][3]["new_leads"], {"total": 1, "whatsapp": 1})
+        self.assertEqual(series["totals"]["new_leads"], {"total": 2, "instagram": 1, "whatsapp": 1})
+        self.assertEqual(series["totals"]["followups_sent"], {"total": 1, "whatsapp": 1})
+
+    def test_failed_flush_keeps_counts(self):
+        db = MagicMock()
+        db.increment_analytics_rollups.side_effect = Exception("unavailable")
+        self.analytics.record("messages", "telegram", at=at(1))
+        self.assertEqual(self.analytics.flush(db), 0)
+        self.analytics.record("messages", "telegram", at=at(1))
+
+        self.analytics.flush(self.client)
+        self.assertEqual(self.store.dump()["analytics_rollups"]["day_2026-01-01"]["messages"]["telegram"], 2)
+        with self.assertRaises(ValueError):
+            self.analytics.record("page_views")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import unittest
+import sys
+import os
+
+# Ensure backend directory is in sys.path
+backend_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if backend_path not in sys.path:
+    sys.path.insert(0, backend_path)
+
+from memory_store import InMemoryFirestore
+from database import FirestoreClient
+from scripts.migrate_chat_layout import migrate
+
+
+def interaction(user_id, minute):
+    return {"id_usuario": user_id, "timestamp": f"2026-01-01T00:{minute:02d}:00", "mensagens": [{"role": "user", "content": str(minute)}]}
+
+
+class TestChatChunks(unittest.TestCase):
+    def setUp(self):
+        self.store = InMemoryFirestore()
+        self.client = FirestoreClient(backend=self.store)
+        self.client.chat_layout = "chunks"
+        self.client.chat_chunk_size = 3
+
+    def test_appends_roll_over_into_new_chunks(self):
+        for minute in range(7):
+            self.client.save_chat_interaction(interaction("u1", minute))
+
+        chunks = self.store.dump()["conversas/u1/chunks"]
+        self.assertEqual(sorted(chunks), ["000000", "000001", "000002"])
+        self.assertEqual([c["count"] for _, c in sorted(chunks.items())], [3, 3, 1])
+
+        history = self.client.get_chat_history("u1", limit=4)
+        self.assertEqual([h["timestamp"][-5:-3] for h in history], ["06", "05", "04", "03"])
+
+    def test_history_is_one_query_over_few_documents(self):
+        for minute in range(30):
+            self.client.save_chat_interaction(interaction("u1", minute))
+        self.store.stats.reset()
+
+        self.assertEqual(len(self.client.get_chat_history("u1", limit=3)), 3)
+        stats = self.store.get_stats()["totals"]
+        self.assertEqual(stats["round_trips"], 1)
+        self.assertLessEqual(stats["reads"], 2)
+
+    def test_migration_matches_legacy_history(self):
+        legacy = FirestoreClient(backend=self.store)
+        legacy.chat_layout = "interactions"
+        for minute in (4, 0, 2, 1, 3):
+            legacy.save_chat_interaction(interaction("u1", minute))
+        legacy.save_chat_interaction(interaction("u2", 9))
+
+        stats = migrate(self.client)
+        self.assertEqual(stats, {"users": 2, "skipped": 0, "interactions": 6, "chunks": 3})
+        self.assertEqual(self.client.get_chat_history("u1", limit=10), legacy.get_chat_history("u1", limit=10))
+
+        # Already migrated users are left alone
+        self.assertEqual(migrate(self.client)["skipped"], 2)
+
+
+class TestChatHistoryPages(unittest.TestCase):
+    def check_layout(self, layout):
+        client = FirestoreClient(backend=InMemoryFirestore())
+        client.chat_layout = layout
+        client.chat_chunk_size = 3
+        for minute in range(10):
+            client.save_chat_interaction(interaction("u1", minute))
+        minutes = lambda page: [int(i["timestamp"][-5:-3]) for i in page]
+
+        latest = client.get_chat_history_page("u1", limit=4)
+        self.assertEqual(minutes(latest), [9, 8, 7, 6])
+        older = client.get_chat_history_page("u1", limit=4, before=latest[-1]["timestamp"])
+        self.assertEqual(minutes(older), [5, 4, 3, 2])
+        oldest = client.get_chat_history_page("u1", limit=4, before=older[-1]["timestamp"])
+        self.assertEqual(minutes(oldest), [1, 0])
+        newer = client.get_chat_history_page("u1", limit=4, after=oldest[0]["timestamp"])
+        self.assertEqual(minutes(newer), [5, 4, 3, 2])
+
+    def test_interactions_layout(self):
+        self.check_layout("interactions")
+
+    def test_chunks_layout(self):
+        self.check_layout("chunks")
+
+
+if __name__ == '__main__':
+    unittest.main()
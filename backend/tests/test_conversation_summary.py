@@ -0,0 +1,80 @@
+import unittest
+from unittest.mock import MagicMock
+import sys
+import os
+
+# Ensure backend directory is in sys.path
+backend_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if backend_path not in sys.path:
+    sys.path.insert(0, backend_path)
+
+from services.conversation_summary import ConversationSummaryService
+import agent_core
+from helpers import make_agent
+
+
+def make_interactions(count):
+    """Most recent first, as returned by get_chat_history."""
+    return [
+        {
+            "timestamp": f"2026-01-01T00:{i:02d}:00",
+            "mensagens": [{"role": "user", "content": f"pergunta {i}"}, {"role": "agent", "content": f"resposta {i}"}]
+        }
+        for i in reversed(range(count))
+    ]
+
+
+class TestConversationSummaryService(unittest.TestCase):
+    def setUp(self):
+        self.service = ConversationSummaryService(recent_interactions=2, every_n_turns=3)
+        self.db = MagicMock()
+        self.agent = MagicMock()
+        self.agent.format_history.side_effect = agent_core.AgentCore.format_history
+        self.agent.summarize_conversation.return_value = "novo resumo"
+
+    def test_not_due(self):
+        self.assertFalse(self.service.update_summary(self.db, self.agent, "u1", {"turns_since_summary": 2}))
+        self.db.get_chat_history.assert_not_called()
+
+    def test_folds_only_turns_outside_raw_window(self):
+        self.db.get_chat_history.return_value = make_interactions(5)
+        user_data = {"turns_since_summary": 3, "conversation_summary": "resumo antigo", "summary_covered_until": "2026-01-01T00:00:00"}
+
+        self.assertTrue(self.service.update_summary(self.db, self.agent, "u1", user_data))
+
+        self.db.get_chat_history.assert_called_once_with("u1", limit=5)
+        folded = self.agent.format_history.call_args[0][0]
+        # Interactions 3 and 4 are still sent raw; 0 is already in the summary
+        self.assertEqual([i["timestamp"][-5:] for i in folded], ["02:00", "01:00"])
+        self.assertEqual(self.agent.summarize_conversation.call_args[1]["previous_summary"], "resumo antigo")
+        self.db.save_conversation_summary.assert_called_once_with("u1", "novo resumo", "2026-01-01T00:02:00")
+
+    def test_first_summary_backfills(self):
+        self.db.get_chat_history.return_value = make_interactions(3)
+        self.assertTrue(self.service.update_summary(self.db, self.agent, "u1", {"turns_since_summary": 3}))
+        self.assertEqual(self.db.get_chat_history.call_args[1]["limit"], 20)
+
+    def test_get_summary(self):
+        self.assertEqual(ConversationSummaryService.get_summary({"conversation_summary": "abc"}), "abc")
+        self.assertIsNone(ConversationSummaryService.get_summary(None))
+        self.assertIsNone(ConversationSummaryService.get_summary({"conversation_summary": ""}))
+
+
+class TestAgentSummaryInjection(unittest.TestCase):
+    def setUp(self):
+        self.agent, self.mock_genai, self.mock_db = make_agent(self)
+
+    def test_summary_sent_with_message(self):
+        mock_chat = MagicMock()
+        mock_chat.send_message.return_value.parts = []
+        self.agent.model.start_chat.return_value = mock_chat
+
+        self.agent.generate_response("oi", [], user_id="user_1", user_profile={}, summary="Usuário quer reserva em dólar.")
+
+        payload = mock_chat.send_message.call_args[0][0]
+        self.assertEqual(payload[0], "oi")
+        self.assertIn("Usuário quer reserva em dólar.", payload[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+import unittest
+from unittest.mock import MagicMock, patch
+import json
+import tracemalloc
+import sys
+import os
+
+# Ensure backend directory is in sys.path
+backend_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if backend_path not in sys.path:
+    sys.path.insert(0, backend_path)
+
+from memory_store import InMemoryFirestore
+from database import FirestoreClient
+from services.crm_export import encode_rows, parse_fields
+
+# Mock FirestoreClient to prevent connection attempt during import
+with patch('database.FirestoreClient') as MockFirestore:
+    MockFirestore.return_value = MagicMock()
+    from main import app
+
+from fastapi.testclient import TestClient
+
+
+def interaction(user_id, minute, origem="whatsapp"):
+    return {"id_usuario": user_id, "timestamp": f"2026-01-01T00:{minute:02d}:00", "origem": origem,
+            "mensagens": [{"role": "user", "content": f"msg {minute}"}]}
+
+
+class TestCrmExport(unittest.TestCase):
+    def setUp(self):
+        self.store = InMemoryFirestore()
+        self.client = FirestoreClient(backend=self.store)
+
+    def test_encoding(self):
+        rows = [{"id": "u1", "nome": "Ana, A.", "tags": ["a", "b"]}, {"id": "u2"}]
+        fields = parse_fields(" id,nome , tags,id", ())
+        self.assertEqual(fields, ["id", "nome", "tags"])
+
+        csv_text = "".join(encode_rows(iter(rows), fields, "csv"))
+        self.assertEqual(csv_text.splitlines(), ["id,nome,tags", 'u1,"Ana, A.","[""a"", ""b""]"', "u2,,"])
+        lines = "".join(encode_rows(iter(rows), ["id", "tags"], "ndjson")).splitlines()
+        self.assertEqual([json.loads(line) for line in lines], [{"id": "u1", "tags": ["a", "b"]}, {"id": "u2", "tags": None}])
+
+    def test_users_are_paged_filtered_and_resumable(self):
+        for i in range(7):
+            self.client.save_user({"id": f"u{i}", "status": "Aluno" if i % 2 else "Lead"})
+        self.store.stats.reset()
+
+        ids = [u["id"] for u in self.client.iter_users(status="Lead", page_size=2)]
+        self.assertEqual(ids, ["u0", "u2", "u4", "u6"])
+        self.assertEqual(self.store.get_stats()["totals"]["round_trips"], 3)
+        self.assertEqual([u["id"] for u in self.client.iter_users(status="Lead", start_after="u2", page_size=2)], ["u4", "u6"])
+        with self.assertRaises(ValueError):
+            self.client.iter_users(start_after="missing")
+
+    def test_conversations_in_both_layouts(self):
+        for layout in ("interactions", "chunks"):
+            client = FirestoreClient(backend=InMemoryFirestore())
+            client.chat_layout, client.chat_chunk_size = layout, 2
+            for minute in range(5):
+                client.save_chat_interaction(interaction("u1", minute, "web_chat" if minute == 3 else "whatsapp"))
+            client.save_chat_interaction(interaction("u2", 9))
+            client.save_user({"id": "u1"})
+            client.save_user({"id": "u2"})
+
+            rows = client.iter_chat_interactions(since="2026-01-01T00:01:00", until="2026-01-01T00:09:00",
+                                                 origem="whatsapp", page_size=2)
+            self.assertEqual([r["timestamp"][-5:-3] for r in rows], ["01", "02", "04"], layout)
+            self.assertEqual(len(list(client.iter_chat_interactions(user_id="u2"))), 1, layout)
+
+    def test_memory_stays_flat_on_large_export(self):
+        users = self.store.collection("usuarios")
+        total = 6000
+        for i in range(total):
+            users.document(f"u{i:05d}").set({"nome": f"Lead {i}", "email": f"lead{i}@example.com",
+                                             "tags": ["quer_renda"], "status": "Lead"})
+
+        tracemalloc.start()
+        try:
+            chunks = encode_rows(self.client.iter_users(page_size=500), ["id", "nome", "email", "tags"], "csv")
+            sent, samples = 0, []
+            for index, chunk in enumerate(chunks):
+                sent += chunk.count("\n")
+                if index in (10, 50):
+                    samples.append(tracemalloc.get_traced_memory()[0])
+        finally:
+            tracemalloc.stop()
+
+        self.assertEqual(sent, total + 1)
+        # 4000 more rows went out between the samples; a buffering export would have grown by them
+        self.assertLess(samples[1] - samples[0], 64 * 1024)
+
+    def test_endpoints_stream_downloads(self):
+        for i in range(3):
+            self.client.save_user({"id": f"u{i}", "email": f"u{i}@example.com", "classificacao_lead": "Perfil A"})
+        self.client.save_chat_interaction(interaction("u1", 0))
+
+        with patch('main.db', self.client):
+            http = TestClient(app)
+            response = http.get("/admin/export/users", params={"fields": "id,email", "start_after": "u0"})
+            self.assertEqual(response.status_code, 200)
+            self.assertIn("attachment", response.headers["content-disposition"])
+            self.assertEqual(response.text.splitlines(), ["id,email", "u1,u1@example.com", "u2,u2@example.com"])
+
+            response = http.get("/admin/export/conversations", params={"user_id": "u1", "fields": "id_usuario,origem"})
+            self.assertEqual(response.headers["content-type"], "application/x-ndjson")
+            self.assertEqual(json.loads(response.text), {"id_usuario": "u1", "origem": "whatsapp"})
+
+            self.assertEqual(http.get("/admin/export/users", params={"format": "xlsx"}).status_code, 400)
+            self.assertEqual(http.get("/admin/export/users", params={"start_after": "nope"}).status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
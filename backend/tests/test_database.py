@@ -138,19 +138,19 @@ class TestFirestoreClient(unittest.TestCase):
             "status": "concluido"
         }
 
-        # Mock query returning empty list (no existing record)
-        # collection() -> where() -> where() -> where()
-
-        col_ref = self.mock_db.collection.return_value
-        q1 = col_ref.where.return_value
-        q2 = q1.where.return_value
-        q3 = q2.where.return_value
-        q3.stream.return_value = []
-
         self.client.save_lesson_progress(progress_data)
 
-        # Verify add was called on collection ref
-        col_ref.add.assert_called_with(progress_data)
+        # Upsert by deterministic id: no lookup query, no auto-id add
+        col_ref = self.mock_db.collection.return_value
+        col_ref.where.assert_not_called()
+        col_ref.add.assert_not_called()
+        batch = self.mock_db.batch.return_value
+        self.assertEqual(batch.set.call_count, 2)
+        _, saved = batch.set.call_args_list[0].args
+        self.assertEqual(saved["status"], "concluido")
+        self.assertIn("updated_at", saved)
+        self.assertEqual(batch.set.call_args_list[0].kwargs, {"merge": True})
+        batch.commit.assert_called_once()
 
     def test_save_lesson_progress_update(self):
         progress_data = {
@@ -160,21 +160,14 @@ class TestFirestoreClient(unittest.TestCase):
             "status": "concluido"
         }
 
-        # Mock query returning existing document
-        mock_doc = MagicMock()
-        mock_doc.reference = MagicMock()
-
-        # Mock the chain
-        col_ref = self.mock_db.collection.return_value
-        q1 = col_ref.where.return_value
-        q2 = q1.where.return_value
-        q3 = q2.where.return_value
-        q3.stream.return_value = [mock_doc] # Found existing
-
         self.client.save_lesson_progress(progress_data)
+        self.client.save_lesson_progress(dict(progress_data, status="em_andamento"))
 
-        mock_doc.reference.set.assert_called_with(progress_data, merge=True)
-        col_ref.add.assert_not_called()
+        # Both saves address the same document
+        col_ref = self.mock_db.collection.return_value
+        progress_ids = [c.args[0] for c in col_ref.document.call_args_list if c.args[0] != "user123"]
+        self.assertEqual(len(progress_ids), 2)
+        self.assertEqual(progress_ids[0], progress_ids[1])
 
     def test_get_all_users(self):
         mock_doc1 = MagicMock()
@@ -204,23 +197,47 @@ class TestFirestoreClient(unittest.TestCase):
         self.assertEqual(kwargs["merge"], True)
 
     def test_get_users_needing_followup(self):
+        # Indexed path (after scripts/backfill_query_fields.py)
+        self.client.legacy_query_fallback = False
         # Mock query
         mock_query = MagicMock()
 
         mock_doc1 = MagicMock()
         mock_doc1.id = "user1"
-        mock_doc1.to_dict.return_value = {"nome": "Inactive User"}
+        mock_doc1.to_dict.return_value = {"nome": "Inactive User", "follow_up_count": 1}
 
         mock_query.stream.return_value = [mock_doc1]
 
-        self.mock_db.collection.return_value.where.return_value = mock_query
+        self.mock_db.collection.return_value.where.return_value.where.return_value = mock_query
 
         users = self.client.get_users_needing_followup(hours_inactive=24)
 
         self.assertEqual(len(users), 1)
         self.assertEqual(users[0]["id"], "user1")
         self.mock_db.collection.assert_called_with("usuarios")
-        self.mock_db.collection.return_value.where.assert_called()
+        # The follow-up cap is filtered server-side
+        self.mock_db.collection.return_value.where.assert_called_with(
+            field_path="follow_up_count", op_string="in", value=[0, 1, 2])
+
+    def test_get_users_needing_followup_legacy_fallback(self):
+        self.client.legacy_query_fallback = True
+        mock_query = MagicMock()
+
+        mock_doc1 = MagicMock()
+        mock_doc1.id = "user1"
+        mock_doc1.to_dict.return_value = {"nome": "Inactive User"}
+        mock_doc2 = MagicMock()
+        mock_doc2.id = "user2"
+        mock_doc2.to_dict.return_value = {"nome": "Spammed User", "follow_up_count": 3}
+
+        mock_query.stream.return_value = [mock_doc1, mock_doc2]
+
+        self.mock_db.collection.return_value.where.return_value = mock_query
+
+        users = self.client.get_users_needing_followup(hours_inactive=24)
+
+        self.assertEqual([u["id"] for u in users], ["user1"])
+        self.mock_db.collection.return_value.where.assert_called_once()
 
 if __name__ == '__main__':
     unittest.main()
@@ -52,7 +52,25 @@ class TestDatabaseFiles(unittest.TestCase):
         saved_data = args[0]
         self.assertEqual(saved_data["type"], "persona")
 
+    def test_get_knowledge_files_filter_server_side(self):
+        # Indexed path (after scripts/backfill_query_fields.py)
+        self.db.legacy_query_fallback = False
+        doc = MagicMock()
+        doc.id = "3"
+        doc.to_dict.return_value = {"name": "p1.txt", "type": "persona"}
+        query = self.mock_client.collection.return_value.where.return_value.order_by.return_value
+        query.stream.return_value = [doc]
+
+        files = self.db.get_knowledge_files(file_type="persona")
+
+        self.assertEqual([f["id"] for f in files], ["3"])
+        self.mock_client.collection.return_value.where.assert_called_once_with(
+            field_path="type", op_string="==", value="persona")
+
     def test_get_knowledge_files_filter(self):
+        # Legacy scan used while the type backfill is pending
+        self.db.legacy_query_fallback = True
+
         # Mock query stream
         mock_docs = []
 
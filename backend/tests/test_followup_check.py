@@ -0,0 +1,57 @@
+import unittest
+from unittest.mock import MagicMock, patch
+import asyncio
+import datetime
+import sys
+import os
+
+# Ensure backend directory is in sys.path
+backend_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if backend_path not in sys.path:
+    sys.path.insert(0, backend_path)
+
+from services import usage_tracker
+
+# Mock FirestoreClient to prevent connection attempt during import
+with patch('database.FirestoreClient') as MockFirestore:
+    MockFirestore.return_value = MagicMock()
+    from main import app
+
+from fastapi.testclient import TestClient
+
+
+class TestFollowupCheck(unittest.TestCase):
+    def setUp(self):
+        self.client = TestClient(app)
+
+    @patch('main.db')
+    @patch('main.agent')
+    def test_followup_generated_off_the_event_loop(self, mock_agent, mock_db):
+        inactive_since = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(hours=48)
+        mock_db.get_pending_followups.return_value = [{"id": "t1", "user_id": "user1", "trigger_type": "inactivity_check"}]
+        mock_db.get_user.return_value = {"nome": "Ana", "follow_up_count": 0,
+                                         "last_interaction_timestamp": inactive_since.isoformat()}
+        seen = {}
+
+        def generate(user):
+            # A worker thread has no running event loop; the event loop thread does
+            try:
+                asyncio.get_running_loop()
+                seen["on_event_loop"] = True
+            except RuntimeError:
+                seen["on_event_loop"] = False
+            seen["charged_to"] = usage_tracker._current_user.get()
+            return "Oi Ana, conseguiu avançar?"
+
+        mock_agent.generate_followup_message.side_effect = generate
+
+        response = self.client.post("/admin/trigger-followup-check", json={"hours_inactive": 24})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(seen, {"on_event_loop": False, "charged_to": "user1"})
+        mock_db.update_user_interaction.assert_called_once_with("user1", increment_followup_count=True)
+        mock_db.mark_followup_processed.assert_called_once_with("t1", status="completed")
+
+
+if __name__ == '__main__':
+    unittest.main()
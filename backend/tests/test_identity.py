@@ -0,0 +1,158 @@
+import unittest
+from unittest.mock import patch
+import sys
+import os
+
+# Ensure backend directory is in sys.path
+backend_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if backend_path not in sys.path:
+    sys.path.insert(0, backend_path)
+
+from memory_store import InMemoryFirestore
+from database import FirestoreClient
+from services.identity import IdentityService
+
+
+def say(client, user_id, minute, text):
+    client.save_chat_interaction({"id_usuario": user_id, "timestamp": f"2026-01-01T00:{minute:02d}:00",
+                                  "origem": "test", "mensagens": [{"role": "user", "content": text}]})
+
+
+class TestIdentityMerge(unittest.TestCase):
+    def setUp(self):
+        self.store = InMemoryFirestore()
+        self.client = FirestoreClient(backend=self.store)
+        self.service = IdentityService()
+
+    def two_channel_lead(self, verified=True):
+        # Same person: first on Instagram, later on WhatsApp, same email given on both.
+        # verified: both paid a Stripe checkout with it, so the email is channel-verified.
+        self.client.save_user({"id": "ig_123", "nome": "Ana", "email": "ana@example.com", "tags": ["quer_renda"],
+                               "classificacao_lead": "Perfil B (Morno/Em educação)"})
+        say(self.client, "ig_123", 0, "oi pelo instagram")
+        self.client.save_lead({"id": "5511999999999", "telefone": "5511999999999", "email": "ANA@example.com ",
+                               "tags": ["whatsapp"]})
+        say(self.client, "5511999999999", 5, "oi pelo whatsapp")
+        self.client.add_scheduled_followup("5511999999999", "2026-01-02T00:00:00", reason="24h Inactivity Check")
+        if verified:
+            self.client.verify_identity("ig_123", "email", "ana@example.com")
+            self.client.verify_identity("5511999999999", "email", "ana@example.com")
+
+    def test_link_merges_into_first_seen_user(self):
+        self.two_channel_lead()
+
+        canonical = self.service.link(self.client, "5511999999999")
+        self.assertEqual(canonical, "ig_123")
+
+        merged = self.client.get_user("ig_123")
+        self.assertEqual(merged["telefone"], "5511999999999")
+        self.assertEqual(sorted(merged["tags"]), ["quer_renda", "whatsapp"])
+        self.assertEqual(merged["merged_user_ids"], ["5511999999999"])
+        history = self.client.get_chat_history("ig_123", limit=10)
+        self.assertEqual([h["mensagens"][0]["content"] for h in history], ["oi pelo whatsapp", "oi pelo instagram"])
+        self.assertEqual(self.client.get_chat_history("5511999999999", limit=10), [])
+
+        # The WhatsApp id now resolves to the canonical lead, and so do its email and phone
+        user_id, user_data = self.service.resolve(self.client, "5511999999999", self.client.get_user("5511999999999"))
+        self.assertEqual((user_id, user_data["nome"]), ("ig_123", "Ana"))
+        self.assertEqual(self.client.find_user_id_by_phone("+55 11 99999-9999"), "ig_123")
+        self.assertEqual(self.client.find_user_id_by_email("ana@example.com"), "ig_123")
+        self.assertNotIn("5511999999999_inactivity_check", self.store.dump().get("follow_up_queue", {}))
+
+    def test_unverified_email_is_queued_for_review(self):
+        # An email typed in chat could be anyone's: no automatic merge
+        self.two_channel_lead(verified=False)
+
+        self.assertEqual(self.service.link(self.client, "5511999999999"), "5511999999999")
+        self.assertNotIn("merged_into", self.client.get_user("5511999999999"))
+        self.assertEqual(len(self.client.get_chat_history("5511999999999", limit=10)), 1)
+        requests = self.client.get_merge_requests()
+        self.assertEqual([(r["source_id"], r["target_id"], r["key"]) for r in requests],
+                         [("5511999999999", "ig_123", "email:ana@example.com")])
+
+        # Queued once; later turns don't read the identity again
+        user = self.client.get_user("5511999999999")
+        self.store.stats.reset()
+        self.service.link(self.client, "5511999999999", user)
+        self.assertEqual(self.store.get_stats()["totals"]["reads"], 0)
+
+        approved = self.client.resolve_merge_request(requests[0]["id"], approve=True)
+        self.assertEqual((approved["status"], approved["merged"]), ("approved", True))
+        self.assertEqual(self.client.get_user("5511999999999")["merged_into"], "ig_123")
+        self.assertEqual(len(self.client.get_chat_history("ig_123", limit=10)), 2)
+        self.assertEqual(self.client.get_merge_requests(), [])
+
+    def test_stripe_email_verification(self):
+        self.two_channel_lead(verified=False)
+        self.assertTrue(self.client.update_user_status_by_email("ana@example.com", "Aluno", verify_email=True))
+        user = self.client.get_user(self.client.find_user_id_by_email("ana@example.com"))
+        self.assertEqual((user["status"], user["verified_identities"]), ("Aluno", ["email:ana@example.com"]))
+
+    def test_rejected_merge_request_keeps_users_apart(self):
+        self.two_channel_lead(verified=False)
+        self.service.link(self.client, "5511999999999")
+        request_id = self.client.get_merge_requests()[0]["id"]
+
+        self.assertEqual(self.client.resolve_merge_request(request_id, approve=False)["status"], "rejected")
+        self.assertNotIn("merged_into", self.client.get_user("5511999999999"))
+        self.assertFalse(self.client.queue_merge_request("5511999999999", "ig_123", "email:ana@example.com"))
+
+    def test_verified_later_is_merged(self):
+        # The WhatsApp lead later pays with the email: Stripe verifies it and the next turn merges
+        self.two_channel_lead(verified=False)
+        self.client.verify_identity("ig_123", "email", "ana@example.com")
+        self.service.link(self.client, "5511999999999")
+        self.assertNotIn("merged_into", self.client.get_user("5511999999999"))
+
+        self.client.verify_identity("5511999999999", "email", "ana@example.com")
+        self.assertEqual(self.service.link(self.client, "5511999999999"), "ig_123")
+        self.assertEqual(self.client.get_user("5511999999999")["merged_into"], "ig_123")
+
+    def test_checked_identities_cost_no_reads(self):
+        self.two_channel_lead()
+        self.service.link(self.client, "ig_123")
+        user = self.client.get_user("ig_123")
+        self.store.stats.reset()
+
+        self.assertEqual(self.service.link(self.client, "ig_123", user), "ig_123")
+        self.assertEqual(self.store.get_stats()["totals"]["reads"], 0)
+
+    def test_merge_with_chunked_history(self):
+        self.client.chat_layout = "chunks"
+        self.client.chat_chunk_size = 2
+        self.two_channel_lead()
+        say(self.client, "ig_123", 7, "de novo no instagram")
+
+        self.assertTrue(self.client.merge_users("5511999999999", "ig_123"))
+        history = self.client.get_chat_history("ig_123", limit=10)
+        self.assertEqual([h["timestamp"][-5:-3] for h in history], ["07", "05", "00"])
+        self.assertFalse(self.client.merge_users("5511999999999", "ig_123"))
+
+    def test_merge_source_without_tags(self):
+        # The usual case: a WhatsApp lead and a web user with no tags at all
+        self.client.save_user({"id": "web_1", "email": "bia@example.com"})
+        self.client.save_lead({"id": "5511988887777", "telefone": "5511988887777", "email": "bia@example.com"})
+
+        self.assertTrue(self.client.merge_users("5511988887777", "web_1"))
+        merged = self.client.get_user("web_1")
+        self.assertEqual(merged["telefone"], "5511988887777")
+        self.assertNotIn("tags", merged)
+
+    def test_failed_chunk_merge_keeps_source_history(self):
+        self.client.chat_layout = "chunks"
+        self.two_channel_lead()
+
+        with patch.object(self.client, "write_chat_chunks", side_effect=Exception("unavailable")):
+            with self.assertRaises(Exception):
+                self.client.merge_users("5511999999999", "ig_123")
+        history = self.client.get_chat_history("5511999999999", limit=10)
+        self.assertEqual([h["mensagens"][0]["content"] for h in history], ["oi pelo whatsapp"])
+        self.assertNotIn("merged_into", self.client.get_user("5511999999999"))
+
+        self.assertTrue(self.client.merge_users("5511999999999", "ig_123"))
+        self.assertEqual(self.client.get_chat_history("5511999999999", limit=10), [])
+        self.assertEqual(len(self.client.get_chat_history("ig_123", limit=10)), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+import sys
+import os
+
+# Ensure backend directory is in sys.path
+backend_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if backend_path not in sys.path:
+    sys.path.insert(0, backend_path)
+
+from memory_store import InMemoryFirestore
+from database import FirestoreClient, normalize_email, normalize_phone
+from scripts.backfill_identity_index import backfill
+
+
+class TestIdentityIndex(unittest.TestCase):
+    def setUp(self):
+        self.store = InMemoryFirestore()
+        self.client = FirestoreClient(backend=self.store)
+
+    def test_normalization(self):
+        self.assertEqual(normalize_email("  Ana.Silva@Example.COM "), "ana.silva@example.com")
+        self.assertIsNone(normalize_email("sem email"))
+        self.assertEqual(normalize_phone("+55 (11) 99999-9999"), "5511999999999")
+        self.assertIsNone(normalize_phone("123"))
+
+    def test_writes_maintain_index(self):
+        self.client.save_user({"id": "u1", "telefone": "+5511999999999"})
+        self.client.save_lead({"id": "u2", "email": "Carla@Example.com", "nome": None})
+        self.client.update_user_contact_info("u3", email=" bruno@example.com")
+
+        self.assertEqual(self.client.find_user_id_by_phone("5511999999999"), "u1")
+        self.assertEqual(self.client.find_user_id_by_email("carla@example.com"), "u2")
+        self.assertEqual(self.client.find_user_id_by_email("BRUNO@example.com"), "u3")
+        self.assertIsNone(self.client.find_user_id_by_email("ninguem@example.com"))
+
+    def test_payment_lookup_is_one_read(self):
+        self.client.save_user({"id": "u1", "email": "ana@example.com"})
+        self.store.stats.reset()
+
+        self.assertTrue(self.client.update_user_status_by_email(" ANA@example.com", "Aluno", {"payment_provider": "stripe"}))
+        stats = self.store.get_stats()["collections"]
+        self.assertEqual(stats["identity_index"]["reads"], 1)
+        self.assertEqual(stats["usuarios"]["reads"], 0)
+        self.assertEqual(self.client.get_user("u1")["status"], "Aluno")
+
+    def test_legacy_users_found_and_backfilled(self):
+        # Written before the index existed
+        self.store.collection("usuarios").document("old").set({"email": "old@example.com", "telefone": "5511888888888"})
+
+        self.assertTrue(self.client.update_user_status_by_email("old@example.com", "Aluno"))
+        self.assertEqual(self.client.find_user_id_by_email("old@example.com"), "old")
+
+        self.assertEqual(backfill(self.client), {"users": 1, "emails": 1, "phones": 1})
+        self.assertEqual(self.client.find_user_id_by_phone("+55 11 88888-8888"), "old")
+
+
+if __name__ == '__main__':
+    unittest.main()
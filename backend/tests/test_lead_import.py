@@ -0,0 +1,137 @@
+import unittest
+from unittest.mock import MagicMock, patch
+import io
+import csv
+import sys
+import os
+
+# Ensure backend directory is in sys.path
+backend_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if backend_path not in sys.path:
+    sys.path.insert(0, backend_path)
+
+from google.api_core.exceptions import ServiceUnavailable
+from memory_store import InMemoryFirestore
+from database import FirestoreClient
+from services.lead_import import LeadImporter, normalize_lead, read_rows
+
+# Mock FirestoreClient to prevent connection attempt during import
+with patch('database.FirestoreClient') as MockFirestore:
+    MockFirestore.return_value = MagicMock()
+    from main import app
+
+from fastapi.testclient import TestClient
+
+CSV_TEXT = """Name,E-mail,WhatsApp,Tags,Perfil
+Ana,ANA@example.com ,+55 (11) 99999-0001,renda; cripto,Perfil A (Qualificado/Quente)
+Bruno,bruno@example.com,,,
+Sem contato,,,,
+Email ruim,nao-e-email,,,
+Ana de novo,ana@example.com,,,
+Carla,carla@example.com,5511999990003,,
+"""
+
+
+class TestLeadImport(unittest.TestCase):
+    def setUp(self):
+        self.store = InMemoryFirestore()
+        self.client = FirestoreClient(backend=self.store)
+        self.importer = LeadImporter(workers=2, retry_base_seconds=0)
+
+    def run_import(self, text, **kwargs):
+        rejected = io.StringIO()
+        report = self.importer.run(self.client, read_rows(io.StringIO(text), "csv"), rejected=rejected, **kwargs)
+        return report, list(csv.DictReader(io.StringIO(rejected.getvalue())))
+
+    def test_normalization(self):
+        lead, reason = normalize_lead({"Nome": " Ana ", "Celular": "+55 11 99999-0001", "tags": "a;b"})
+        self.assertIsNone(reason)
+        self.assertEqual(lead, {"nome": "Ana", "telefone": "5511999990001", "tags": ["a", "b"]})
+        self.assertEqual(normalize_lead({"email": "x"})[1], "invalid_email")
+        self.assertEqual(normalize_lead({"nome": "Ana"})[1], "missing_email_and_phone")
+        rows = list(read_rows(io.StringIO('{"email": "a@b.com"}\nnot json\n'), "ndjson"))
+        self.assertEqual([normalize_lead(r)[1] for r in rows], [None, "invalid_json"])
+
+    def test_import_dedups_and_reports_rejected_rows(self):
+        # Carla already talked to the bot on WhatsApp
+        self.client.save_lead({"id": "5511999990003", "telefone": "5511999990003", "nome": "Carla"})
+
+        report, rejected = self.run_import(CSV_TEXT)
+
+        self.assertEqual({k: report[k] for k in ("rows", "imported", "duplicates", "rejected")},
+                         {"rows": 6, "imported": 2, "duplicates": 2, "rejected": 4})
+        self.assertEqual([(r["row"], r["reason"].split(":")[0]) for r in rejected],
+                         [("3", "missing_email_and_phone"), ("4", "invalid_email"),
+                          ("5", "duplicate_in_file"), ("6", "existing_user")])
+        ana = self.client.get_user("5511999990001")
+        self.assertEqual((ana["email"], ana["tags"], ana["origem_importacao"]),
+                         ("ana@example.com", ["renda", "cripto"], "import"))
+        self.assertIsNotNone(self.client.find_user_id_by_email("bruno@example.com"))
+
+        # Re-running is idempotent: everything is now a duplicate
+        report, _ = self.run_import(CSV_TEXT)
+        self.assertEqual((report["imported"], report["duplicates"]), (0, 4))
+
+    def test_merge_policy_fills_only_missing_fields(self):
+        self.client.save_user({"id": "ig_1", "email": "bruno@example.com", "nome": "B."})
+        self.client.save_user({"id": "wa_1", "email": "carla@example.com", "nome": "Carla S.",
+                               "classificacao_lead": "Perfil A (Qualificado/Quente)", "tags": ["quente"]})
+        report, _ = self.run_import(CSV_TEXT, on_duplicate="merge")
+        self.assertEqual((report["imported"], report["merged"]), (1, 2))
+
+        # Live values win; only the missing phone is filled in, and indexed
+        carla = self.client.get_user("wa_1")
+        self.assertEqual((carla["nome"], carla["telefone"]), ("Carla S.", "5511999990003"))
+        self.assertEqual(self.client.find_user_id_by_phone("5511999990003"), "wa_1")
+        # Bruno's existing name is kept: nothing new to write
+        self.assertEqual(self.client.get_user("ig_1")["nome"], "B.")
+        self.assertNotIn("updated_at", self.client.get_user("ig_1"))
+
+    def test_merge_adds_tags_and_keeps_classification(self):
+        self.client.save_user({"id": "wa_1", "email": "dani@example.com", "tags": ["quente"],
+                               "classificacao_lead": "Perfil A (Qualificado/Quente)"})
+        rows = "email,tags,perfil\ndani@example.com,quente; vip,Perfil C (Frio/Curioso)\n"
+        report, _ = self.run_import(rows, on_duplicate="merge")
+        self.assertEqual(report["merged"], 1)
+        dani = self.client.get_user("wa_1")
+        self.assertEqual(dani["tags"], ["quente", "vip"])
+        self.assertEqual(dani["classificacao_lead"], "Perfil A (Qualificado/Quente)")
+
+    def test_batches_retry_transient_failures(self):
+        rows = "email\n" + "".join(f"lead{i}@example.com\n" for i in range(100))
+        importer = LeadImporter(workers=3, batch_writes=20, retry_base_seconds=0)
+        real_commit, failures = importer._commit, []
+
+        def flaky_commit(db, writes):
+            if len(failures) < 2:
+                failures.append(1)
+                raise ServiceUnavailable("try again")
+            return real_commit(db, writes)
+
+        self.store.stats.reset()
+        with patch.object(importer, "_commit", side_effect=flaky_commit):
+            report = importer.run(self.client, read_rows(io.StringIO(rows), "csv"))
+
+        self.assertEqual((report["imported"], report["retries"], report["rejected"]), (100, 2, 0))
+        self.assertEqual(report["batches"], 12)  # 9 leads (18 writes) per batch
+        self.assertEqual(len(self.store.dump()["usuarios"]), 100)
+        # One batched identity lookup and one commit per write batch
+        self.assertEqual(self.store.get_stats()["totals"]["round_trips"], 12 + 12)
+
+    def test_endpoint_upload_and_rejected_download(self):
+        with patch('main.db', self.client):
+            http = TestClient(app)
+            response = http.post("/admin/import/leads", files={"file": ("leads.csv", CSV_TEXT.encode(), "text/csv")})
+            self.assertEqual(response.status_code, 200)
+            report = response.json()
+            self.assertEqual((report["imported"], report["rejected"]), (3, 3))
+            self.assertGreater(report["rows_per_second"], 0)
+
+            rejected = http.get(report["rejected_url"])
+            self.assertEqual(rejected.status_code, 200)
+            self.assertEqual(len(rejected.text.strip().splitlines()), 4)
+            self.assertEqual(http.get("/admin/import/../rejected").status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
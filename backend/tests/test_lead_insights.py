@@ -0,0 +1,109 @@
+import unittest
+from unittest.mock import MagicMock
+import sys
+import os
+
+# Ensure backend directory is in sys.path
+backend_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if backend_path not in sys.path:
+    sys.path.insert(0, backend_path)
+
+from services.lead_insights import LeadInsightsService
+from memory_store import InMemoryFirestore
+from database import FirestoreClient
+
+PERFIL_A = "Perfil A (Qualificado/Quente)"
+PERFIL_C = "Perfil C (Frio/Curioso)"
+
+
+def fresh_user(**overrides):
+    user = {
+        "classificacao_lead": PERFIL_A,
+        "insights_summary": "Lead quer proteger patrimônio.",
+        "insights_objection": "Segurança",
+        "insights_sales_angle": "Proteção contra a inflação",
+        "insights_classification": PERFIL_A,
+        "turns_since_insights": 0,
+    }
+    user.update(overrides)
+    return user
+
+
+class TestLeadInsightsService(unittest.TestCase):
+    def setUp(self):
+        self.service = LeadInsightsService(every_n_turns=3)
+        self.agent = MagicMock()
+        self.agent.analyze_lead_strategy.return_value = {"summary": "novo", "objection": "preço", "sales_angle": "valor"}
+
+    def test_stale_reasons(self):
+        self.assertIsNone(self.service.stale_reason(fresh_user()))
+        self.assertEqual(self.service.stale_reason({}), "missing")
+        self.assertEqual(self.service.stale_reason(fresh_user(turns_since_insights=3)), "new_messages")
+        self.assertEqual(self.service.stale_reason(fresh_user(classificacao_lead="Perfil B (Morno/Em educação)")),
+                         "classification_changed")
+
+    def test_background_refresh_only_for_stale_priority_leads(self):
+        db = MagicMock()
+        db.get_chat_history.return_value = [{"timestamp": "t", "mensagens": [{"role": "user", "content": "oi"}]}]
+
+        self.assertFalse(self.service.update_if_due(db, self.agent, "u1", fresh_user(turns_since_insights=2)))
+        self.assertFalse(self.service.update_if_due(db, self.agent, "u1", {"classificacao_lead": PERFIL_C}))
+        self.agent.analyze_lead_strategy.assert_not_called()
+
+        self.assertTrue(self.service.update_if_due(db, self.agent, "u1", fresh_user(turns_since_insights=3)))
+        db.save_lead_insights.assert_called_once_with("u1", self.agent.analyze_lead_strategy.return_value, PERFIL_A)
+
+    def test_failed_analysis_keeps_previous_insights(self):
+        db = MagicMock()
+        db.get_chat_history.return_value = [{"timestamp": "t", "mensagens": []}]
+        self.agent.analyze_lead_strategy.return_value = {}
+        self.assertFalse(self.service.refresh(db, self.agent, "u1", fresh_user()))
+        db.save_lead_insights.assert_not_called()
+        db.save_lead_insights_failure.assert_called_once_with("u1")
+
+    def test_failed_analysis_waits_out_cooldown(self):
+        client = FirestoreClient(backend=InMemoryFirestore())
+        client.save_user({"id": "a1", "classificacao_lead": PERFIL_A})
+        client.save_chat_interaction({"id_usuario": "a1", "timestamp": "2026-01-01T00:00:00",
+                                      "mensagens": [{"role": "user", "content": "oi"}]})
+        self.agent.analyze_lead_strategy.return_value = {}
+
+        self.assertFalse(self.service.update_if_due(client, self.agent, "a1"))
+        user = client.get_user("a1")
+        self.assertEqual(self.service.stale_reason(user), "missing")
+        self.assertFalse(self.service.is_due(user))
+        self.assertTrue(self.service.status("a1", user)["retry_cooldown"])
+        # Later turns inside the cooldown make no model call
+        self.assertFalse(self.service.update_if_due(client, self.agent, "a1"))
+        self.assertEqual(self.agent.analyze_lead_strategy.call_count, 1)
+
+        # Once the cooldown has passed the lead is retried, and success clears the marker
+        self.service.retry_cooldown_seconds = 0
+        self.agent.analyze_lead_strategy.return_value = {"summary": "novo", "objection": "preço", "sales_angle": "valor"}
+        self.assertTrue(self.service.update_if_due(client, self.agent, "a1"))
+        user = client.get_user("a1")
+        self.assertIsNone(user["insights_attempted_at"])
+        self.assertIsNone(self.service.stale_reason(user))
+
+    def test_markers_round_trip_and_precompute(self):
+        client = FirestoreClient(backend=InMemoryFirestore())
+        client.save_user({"id": "a1", "classificacao_lead": PERFIL_A})
+        client.save_user({"id": "c1", "classificacao_lead": PERFIL_C})
+        for user_id in ("a1", "c1"):
+            client.save_chat_interaction({"id_usuario": user_id, "timestamp": "2026-01-01T00:00:00",
+                                          "mensagens": [{"role": "user", "content": "oi"}]})
+
+        stats = self.service.precompute(client, self.agent)
+        self.assertEqual(stats, {"checked": 1, "refreshed": 1, "skipped": 0, "failed": 0})
+        self.assertIsNone(self.service.stale_reason(client.get_user("a1")))
+
+        # New user turns age the insights until they are regenerated
+        for _ in range(3):
+            client.update_user_interaction("a1", reset_followup_count=True)
+        self.assertEqual(self.service.stale_reason(client.get_user("a1")), "new_messages")
+        self.assertEqual(self.service.precompute(client, self.agent)["refreshed"], 1)
+        self.assertEqual(client.get_user("a1")["turns_since_insights"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import unittest
+import sys
+import os
+
+# Ensure backend directory is in sys.path
+backend_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if backend_path not in sys.path:
+    sys.path.insert(0, backend_path)
+
+from memory_store import InMemoryFirestore
+from database import FirestoreClient, lesson_progress_id
+from scripts.dedupe_lesson_progress import dedupe
+
+
+class TestLessonProgress(unittest.TestCase):
+    def setUp(self):
+        self.store = InMemoryFirestore()
+        self.client = FirestoreClient(backend=self.store)
+
+    def test_repeated_saves_upsert_one_record_without_queries(self):
+        lesson = {"id_usuario": "u1", "modulo": "Módulo 1", "aula": "1.3: Segurança / 2FA"}
+        self.client.save_lesson_progress(dict(lesson, status="em_andamento"))
+        self.store.stats.reset()
+        self.client.save_lesson_progress(dict(lesson, status="concluido", resultado_quiz_pontuacao=80))
+
+        totals = self.store.get_stats()["totals"]
+        self.assertEqual(totals["reads"], 0)
+        self.assertEqual(totals["round_trips"], 1)
+        records = self.client.get_lesson_progress("u1")
+        self.assertEqual(len(records), 1)
+        self.assertEqual((records[0]["status"], records[0]["resultado_quiz_pontuacao"]), ("concluido", 80))
+
+    def test_summary_is_one_read(self):
+        self.client.save_lesson_progress({"id_usuario": "u1", "modulo": "M1", "aula": "A1", "status": "concluido",
+                                          "resultado_quiz_pontuacao": 80})
+        self.client.save_lesson_progress({"id_usuario": "u1", "modulo": "M1", "aula": "A2", "status": "concluido",
+                                          "resultado_quiz_pontuacao": 90})
+        self.client.save_lesson_progress({"id_usuario": "u1", "modulo": "M2", "aula": "A1", "status": "em_andamento"})
+        self.store.stats.reset()
+
+        summary = self.client.get_lesson_progress_summary("u1")
+        self.assertEqual((summary["total_aulas"], summary["aulas_concluidas"], summary["media_quiz"]), (3, 2, 85.0))
+        self.assertEqual(summary["aulas"][0]["modulo"], "M2")
+        self.assertEqual(self.store.get_stats()["totals"]["reads"], 1)
+        self.assertEqual(self.client.get_lesson_progress_summary("nobody")["total_aulas"], 0)
+
+    def test_dedupe_merges_legacy_duplicates(self):
+        legacy = self.store.collection("progresso_aulas")
+        legacy.add({"id_usuario": "u1", "modulo": "M1", "aula": "A1", "status": "em_andamento",
+                    "recomendacao_ai": "Rever o passo 2", "updated_at": "2026-01-01T00:00:00"})
+        legacy.add({"id_usuario": "u1", "modulo": "M1", "aula": "A1", "status": "concluido",
+                    "updated_at": "2026-01-02T00:00:00"})
+        legacy.add({"id_usuario": "u2", "modulo": "M1", "aula": "A1", "status": "concluido"})
+
+        self.assertEqual(dedupe(self.client, dry_run=True)["duplicates_removed"], 1)
+        self.assertEqual(len(self.store.dump()["progresso_aulas"]), 3)
+
+        self.assertEqual(dedupe(self.client), {"records": 3, "lessons": 2, "duplicates_removed": 1, "users": 2})
+        records = self.store.dump()["progresso_aulas"]
+        self.assertEqual(sorted(records), sorted([lesson_progress_id("u1", "M1", "A1"), lesson_progress_id("u2", "M1", "A1")]))
+        merged = records[lesson_progress_id("u1", "M1", "A1")]
+        self.assertEqual((merged["status"], merged["recomendacao_ai"]), ("concluido", "Rever o passo 2"))
+        self.assertEqual(self.client.get_lesson_progress_summary("u1")["aulas_concluidas"], 1)
+
+        # Re-running finds nothing left to merge
+        self.assertEqual(dedupe(self.client)["duplicates_removed"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
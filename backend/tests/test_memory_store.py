@@ -0,0 +1,128 @@
+import unittest
+from unittest.mock import patch
+import sys
+import os
+import time
+
+# Ensure backend directory is in sys.path
+backend_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if backend_path not in sys.path:
+    sys.path.insert(0, backend_path)
+
+from google.cloud import firestore as google_firestore
+from google.api_core.exceptions import NotFound
+from memory_store import InMemoryFirestore
+from database import FirestoreClient
+
+
+class TestInMemoryFirestore(unittest.TestCase):
+    def setUp(self):
+        self.store = InMemoryFirestore()
+        self.users = self.store.collection("usuarios")
+
+    def test_set_merge_and_transforms(self):
+        ref = self.users.document("u1")
+        ref.set({"nome": "Ana", "perfil": {"a": 1}, "tags": ["x"]})
+        ref.set({"perfil": {"b": 2}, "count": google_firestore.Increment(2)}, merge=True)
+        ref.update({"tags": google_firestore.ArrayUnion(["x", "y"]), "count": google_firestore.Increment(1), "perfil.a": 5})
+
+        data = ref.get().to_dict()
+        self.assertEqual(data["perfil"], {"a": 5, "b": 2})
+        self.assertEqual(data["count"], 3)
+        self.assertEqual(data["tags"], ["x", "y"])
+
+        ref.set({"nome": "Bia"})
+        self.assertEqual(ref.get().to_dict(), {"nome": "Bia"})
+
+    def test_update_missing_document_raises(self):
+        with self.assertRaises(NotFound):
+            self.users.document("nope").update({"a": 1})
+        self.assertFalse(self.users.document("nope").get().exists)
+
+    def test_query_filters_order_limit(self):
+        for i, status in enumerate(["pending", "pending", "done", "pending"]):
+            self.store.collection("fila").document(f"t{i}").set({"status": status, "trigger_time": f"2026-01-0{4 - i}"})
+        self.store.collection("fila").document("no_time").set({"status": "pending"})
+
+        docs = (
+            self.store.collection("fila")
+            .where(field_path="status", op_string="==", value="pending")
+            .where(field_path="trigger_time", op_string="<=", value="2026-01-03")
+            .order_by("trigger_time")
+            .limit(5)
+            .stream()
+        )
+        self.assertEqual([d.id for d in docs], ["t3", "t1"])
+
+        docs = self.store.collection("fila").order_by("trigger_time", direction=google_firestore.Query.DESCENDING).get()
+        self.assertEqual([d.id for d in docs], ["t0", "t1", "t2", "t3"])
+
+        docs = self.store.collection("fila").where(field_path="status", op_string="in", value=["done"]).get()
+        self.assertEqual([d.id for d in docs], ["t2"])
+
+    def test_start_after_pagination(self):
+        for i in range(5):
+            self.users.document(f"u{i}").set({"n": i})
+        page1 = self.users.order_by("n").limit(2).get()
+        page2 = self.users.order_by("n").start_after(page1[-1]).limit(2).get()
+        self.assertEqual([d.id for d in page2], ["u2", "u3"])
+
+    def test_batch_is_one_round_trip(self):
+        batch = self.store.batch()
+        for i in range(3):
+            batch.set(self.users.document(f"u{i}"), {"n": i})
+        batch.commit()
+
+        stats = self.store.get_stats()
+        self.assertEqual(stats["collections"]["usuarios"]["writes"], 3)
+        self.assertEqual(stats["totals"]["round_trips"], 1)
+
+    def test_get_all_is_one_round_trip(self):
+        self.users.document("u1").set({"n": 1})
+        self.store.stats.reset()
+
+        snapshots = list(self.store.get_all([self.users.document("u1"), self.users.document("missing")]))
+        self.assertEqual([(s.id, s.exists) for s in snapshots], [("u1", True), ("missing", False)])
+        self.assertEqual(self.store.get_stats()["totals"], {"round_trips": 1, "reads": 2, "writes": 0, "deletes": 0})
+
+    def test_injected_latency(self):
+        store = InMemoryFirestore(latency_ms=20)
+        start = time.perf_counter()
+        store.collection("usuarios").document("u1").get()
+        self.assertGreaterEqual(time.perf_counter() - start, 0.02)
+
+
+class TestFirestoreClientMemoryBackend(unittest.TestCase):
+    def setUp(self):
+        self.store = InMemoryFirestore()
+        self.client = FirestoreClient(backend=self.store)
+
+    def test_client_methods_run_against_memory(self):
+        self.client.save_user({"id": "u1", "nome": "Ana"})
+        self.client.update_user_interaction("u1", reset_followup_count=True)
+        self.client.add_tag("u1", "quer_renda")
+
+        user = self.client.get_user("u1")
+        self.assertEqual(user["turns_since_summary"], 1)
+        self.assertEqual(user["tags"], ["quer_renda"])
+
+        for i in range(3):
+            self.client.save_chat_interaction({"id_usuario": "u1", "timestamp": f"2026-01-01T00:0{i}:00", "mensagens": []})
+        history = self.client.get_chat_history("u1", limit=2)
+        self.assertEqual([h["timestamp"] for h in history], ["2026-01-01T00:02:00", "2026-01-01T00:01:00"])
+
+        stats = self.store.get_stats()["collections"]
+        self.assertEqual(stats["interacoes_chat"]["writes"], 3)
+        self.assertEqual(stats["interacoes_chat"]["reads"], 2)
+
+    def test_env_selects_shared_store(self):
+        with patch.dict(os.environ, {"FIRESTORE_BACKEND": "memory"}):
+            first = FirestoreClient()
+            second = FirestoreClient()
+        # FirestoreClient wraps the backend for operation metering
+        self.assertIsInstance(first.db._raw, InMemoryFirestore)
+        self.assertIs(first.db._raw, second.db._raw)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import unittest
+from unittest.mock import MagicMock
+import sys
+import os
+
+# Ensure backend directory is in sys.path
+backend_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if backend_path not in sys.path:
+    sys.path.insert(0, backend_path)
+
+from services import metrics
+from services.metrics import MetricsRegistry
+from memory_store import InMemoryFirestore
+from database import FirestoreClient, add_operation_observer
+from helpers import make_agent
+
+
+class TestMetricsRegistry(unittest.TestCase):
+    def test_render_prometheus_text(self):
+        registry = MetricsRegistry()
+        counter = registry.counter("demo_total", "Demo counter.", ("route",))
+        histogram = registry.histogram("demo_seconds", "Demo latency.", buckets=(0.1, 1.0))
+
+        counter.inc(route="/chat")
+        counter.inc(2, route="/chat")
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+
+        text = registry.render()
+        self.assertIn("# TYPE demo_total counter", text)
+        self.assertIn('demo_total{route="/chat"} 3', text)
+        self.assertIn('demo_seconds_bucket{le="0.1"} 1', text)
+        self.assertIn('demo_seconds_bucket{le="+Inf"} 2', text)
+        self.assertIn("demo_seconds_count 2", text)
+
+    def test_wrong_labels_rejected(self):
+        counter = MetricsRegistry().counter("demo_total", "Demo.", ("route",))
+        with self.assertRaises(ValueError):
+            counter.inc(path="/chat")
+
+    def test_queued_task_tracks_in_flight(self):
+        metrics.registry.reset()
+        seen = []
+        task = metrics.queued_task("demo", lambda: seen.append(metrics.BACKGROUND_TASKS.get(task="demo")))
+
+        self.assertEqual(metrics.BACKGROUND_TASKS.get(task="demo"), 1)
+        task()
+        self.assertEqual(seen, [1])
+        self.assertEqual(metrics.BACKGROUND_TASKS.get(task="demo"), 0)
+        self.assertEqual(metrics.BACKGROUND_TASK_LATENCY.get(task="demo")["count"], 1)
+
+
+class TestFirestoreMetering(unittest.TestCase):
+    def setUp(self):
+        metrics.registry.reset()
+        add_operation_observer(metrics.record_firestore_operation)
+        self.client = FirestoreClient(backend=InMemoryFirestore())
+
+    def test_operations_counted_per_collection(self):
+        self.client.save_user({"id": "u1", "nome": "Ana"})
+        self.client.get_user("u1")
+        for i in range(3):
+            self.client.save_chat_interaction({"id_usuario": "u1", "timestamp": f"2026-01-01T00:0{i}:00", "mensagens": []})
+        self.client.get_chat_history("u1", limit=10)
+
+        ops = metrics.FIRESTORE_OPERATIONS
+        docs = metrics.FIRESTORE_DOCUMENTS
+        self.assertEqual(ops.get(collection="usuarios", op="write"), 1)
+        self.assertEqual(ops.get(collection="usuarios", op="read"), 1)
+        self.assertEqual(ops.get(collection="interacoes_chat", op="write"), 3)
+        self.assertEqual(ops.get(collection="interacoes_chat", op="query"), 1)
+        self.assertEqual(docs.get(collection="interacoes_chat", op="query"), 3)
+
+    def test_batch_counts_one_round_trip(self):
+        batch = self.client.db.batch()
+        for i in range(3):
+            batch.set(self.client.db.collection("usuarios").document(f"u{i}"), {"n": i})
+        batch.commit()
+
+        self.assertEqual(metrics.FIRESTORE_OPERATIONS.get(collection="usuarios", op="write"), 1)
+        self.assertEqual(metrics.FIRESTORE_DOCUMENTS.get(collection="usuarios", op="write"), 3)
+
+
+class TestModelCallMetrics(unittest.TestCase):
+    def setUp(self):
+        metrics.registry.reset()
+        self.agent, self.mock_genai, self.mock_db = make_agent(self)
+
+    def test_calls_recorded_by_purpose(self):
+        mock_chat = MagicMock()
+        mock_chat.send_message.return_value.parts = []
+        self.agent.model.start_chat.return_value = mock_chat
+        self.agent.model.generate_content.return_value.text = '{"nome": null, "email": null}'
+
+        self.agent.generate_response("oi", [], user_id="user_1", user_profile={})
+        self.agent.extract_contact_info("oi")
+        self.agent.model.generate_content.side_effect = Exception("quota")
+        self.agent.generate_followup_message({})
+
+        self.assertEqual(metrics.MODEL_CALLS.get(purpose="response", status="ok"), 1)
+        self.assertEqual(metrics.MODEL_CALLS.get(purpose="extraction", status="ok"), 1)
+        # The follow-up failed on every model of its fallback chain
+        self.assertEqual(metrics.MODEL_CALLS.get(purpose="followup", status="error"), 2)
+        self.assertEqual(metrics.MODEL_FALLBACKS.total(), 1)
+        self.assertEqual(metrics.KNOWLEDGE_REFRESH.get()["count"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import unittest
+from unittest.mock import MagicMock
+import sys
+import os
+import time
+
+# Ensure backend directory is in sys.path
+backend_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if backend_path not in sys.path:
+    sys.path.insert(0, backend_path)
+
+from google.api_core import exceptions as google_exceptions
+from services.model_client import ModelClient, CircuitBreaker, CircuitOpenError, FALLBACK_REPLY
+from services.metrics import MODEL_RETRIES, MODEL_HEDGES
+from helpers import make_agent
+
+
+class TestModelClient(unittest.TestCase):
+    def setUp(self):
+        self.client = ModelClient(max_retries=2, sleep=lambda seconds: None)
+
+    def test_retries_retryable_errors(self):
+        before = MODEL_RETRIES.total()
+        fn = MagicMock(side_effect=[google_exceptions.ServiceUnavailable("busy"), "ok"])
+
+        self.assertEqual(self.client.call("qualification", fn, "prompt", model_name="m"), "ok")
+        self.assertEqual(fn.call_count, 2)
+        self.assertEqual(MODEL_RETRIES.total() - before, 1)
+        # The remaining deadline is handed to the SDK
+        timeout = fn.call_args.kwargs["request_options"]["timeout"]
+        self.assertTrue(0 < timeout <= 20)
+
+    def test_bad_request_not_retried(self):
+        fn = MagicMock(side_effect=ValueError("bad prompt"))
+        with self.assertRaises(ValueError):
+            self.client.call("extraction", fn, "prompt", model_name="m")
+        self.assertEqual(fn.call_count, 1)
+        self.assertEqual(self.client.breaker("m").state, "closed")
+
+    def test_breaker_opens_and_recovers(self):
+        breaker = self.client._breakers["m"] = CircuitBreaker("m", failure_threshold=2, reset_seconds=60)
+        failing = MagicMock(side_effect=google_exceptions.NotFound("no such model"))
+        for _ in range(2):
+            with self.assertRaises(google_exceptions.NotFound):
+                self.client.call("response", failing, model_name="m")
+        self.assertEqual(breaker.state, "open")
+
+        healthy = MagicMock(return_value="ok")
+        with self.assertRaises(CircuitOpenError):
+            self.client.call("response", healthy, model_name="m")
+        healthy.assert_not_called()
+
+        # After the cool-off one trial call goes through and closes the circuit
+        breaker.reset_seconds = 0
+        self.assertEqual(self.client.call("response", healthy, model_name="m"), "ok")
+        self.assertEqual(breaker.state, "closed")
+
+    def test_hedge_returns_faster_request(self):
+        before = MODEL_HEDGES.total()
+        calls = []
+
+        def fn():
+            calls.append(1)
+            if len(calls) == 1:
+                time.sleep(0.5)
+                return "slow"
+            return "fast"
+
+        self.assertEqual(self.client.hedged("response", fn, hedge_after_ms=20), "fast")
+        self.assertEqual(MODEL_HEDGES.total() - before, 2)  # launched + won
+
+    def test_hedging_off_by_default(self):
+        fn = MagicMock(return_value="ok")
+        self.assertEqual(self.client.hedged("response", fn, hedge_after_ms=0), "ok")
+        fn.assert_called_once_with()
+
+
+class TestAgentFallbackReply(unittest.TestCase):
+    def setUp(self):
+        self.agent, self.mock_genai, self.mock_db = make_agent(self)
+        self.agent.model_client._sleep = lambda seconds: None
+
+    def test_canned_reply_when_every_model_fails(self):
+        # Every reply model shares the mocked GenerativeModel instance
+        self.agent.model.start_chat.return_value.send_message.side_effect = google_exceptions.ServiceUnavailable("down")
+
+        response = self.agent.generate_response("Oi, quero dolarizar meu patrimônio", [], user_id="u1", user_profile={})
+        self.assertEqual(response, FALLBACK_REPLY)
+        self.assertNotIn("DEBUG", response)
+
+
+if __name__ == '__main__':
+    unittest.main()
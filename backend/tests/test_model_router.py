@@ -0,0 +1,151 @@
+import unittest
+from unittest.mock import MagicMock
+import sys
+import os
+
+# Ensure backend directory is in sys.path
+backend_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if backend_path not in sys.path:
+    sys.path.insert(0, backend_path)
+
+from google.api_core import exceptions as google_exceptions
+from services.model_router import ModelRouter, parse_routes, LEAN_INSTRUCTION, MODEL_MAIN, MODEL_LIGHT
+import agent_core
+from helpers import patch_agent_dependencies
+
+
+class TestModelRouter(unittest.TestCase):
+    def setUp(self):
+        self.factory = MagicMock(side_effect=lambda **kwargs: MagicMock(name=kwargs["model_name"]))
+        self.router = ModelRouter(self.factory, routes={"qualification": ["lite", "main"]})
+
+    def test_parse_routes(self):
+        self.assertEqual(
+            parse_routes("qualification=a>b; response = c ;bad"),
+            {"qualification": ["a", "b"], "response": ["c"]}
+        )
+
+    def test_lean_models_built_once(self):
+        first = self.router.lean_model("qualification", "lite")
+        self.assertIs(self.router.lean_model("qualification", "lite"), first)
+        self.factory.assert_called_once_with(model_name="lite", system_instruction=LEAN_INSTRUCTION)
+
+        self.router.register_profile("qualification", system_instruction="JSON only", generation_config={"temperature": 0})
+        self.router.lean_model("qualification", "lite")
+        self.factory.assert_called_with(model_name="lite", system_instruction="JSON only", generation_config={"temperature": 0})
+
+    def test_fallback_chain(self):
+        tried = []
+
+        def attempt(model_name):
+            tried.append(model_name)
+            if model_name == "lite":
+                raise google_exceptions.ServiceUnavailable("down")
+            return "ok"
+
+        self.assertEqual(self.router.run("qualification", attempt), "ok")
+        self.assertEqual(tried, ["lite", "main"])
+
+    def test_quota_error_cools_model_down(self):
+        def attempt(model_name):
+            if model_name == "lite":
+                raise google_exceptions.ResourceExhausted("quota")
+            return model_name
+
+        self.router.run("qualification", attempt)
+        self.assertEqual(self.router.chain("qualification"), ["main"])
+
+    def test_last_error_raised(self):
+        def attempt(model_name):
+            raise ValueError(model_name)
+
+        with self.assertRaises(ValueError) as ctx:
+            self.router.run("qualification", attempt)
+        self.assertEqual(str(ctx.exception), "main")
+
+
+class TestAgentRouting(unittest.TestCase):
+    def setUp(self):
+        self.mock_genai, self.mock_db = patch_agent_dependencies(self)
+
+        # One mock per model name so calls can be told apart
+        self.models = {}
+
+        def build(**kwargs):
+            key = (kwargs["model_name"], "reply" if "tools" in kwargs else "lean")
+            return self.models.setdefault(key, MagicMock(name=str(key)))
+
+        self.mock_genai.GenerativeModel.side_effect = build
+        self.agent = agent_core.AgentCore()
+
+    def test_extraction_uses_lean_model(self):
+        lean = self.agent.router.lean_model("extraction", MODEL_LIGHT)
+        lean.generate_content.return_value.text = '{"nome": "Ana", "email": null}'
+
+        self.assertEqual(self.agent.extract_contact_info("sou a Ana")["nome"], "Ana")
+        self.agent.model.generate_content.assert_not_called()
+        lean_kwargs = [c.kwargs for c in self.mock_genai.GenerativeModel.call_args_list if c.kwargs["model_name"] == MODEL_LIGHT]
+        self.assertEqual(lean_kwargs[0]["system_instruction"], agent_core.ANALYSIS_PROFILES["extraction"]["system_instruction"])
+        self.assertNotIn("tools", lean_kwargs[0])
+        config = lean_kwargs[0]["generation_config"]
+        self.assertEqual(config["response_mime_type"], "application/json")
+        self.assertEqual(config["response_schema"]["required"], ["nome", "email"])
+
+    def test_qualification_prompt_is_transcript_only(self):
+        lean = self.agent.router.lean_model("qualification", MODEL_LIGHT)
+        lean.generate_content.return_value.text = (
+            '{"dor_principal": "inflação", "maturidade": null, "compromisso": null, '
+            '"classificacao_lead": "Perfil B (Morno/Em educação)"}'
+        )
+
+        result = self.agent.analyze_lead_qualification([{"role": "user", "parts": ["tenho medo da inflação"]}])
+        self.assertEqual(result["classificacao_lead"], "Perfil B (Morno/Em educação)")
+        prompt = lean.generate_content.call_args.args[0]
+        self.assertIn("tenho medo da inflação", prompt)
+        self.assertNotIn("Responda APENAS", prompt)
+
+    def test_parse_json_response(self):
+        self.assertEqual(agent_core.parse_json_response('```json\n{"a": 1}\n```'), {"a": 1})
+        with self.assertRaises(ValueError):
+            agent_core.parse_json_response('Claro! {"a": 1}')
+
+    def test_reply_falls_back_to_next_model(self):
+        self.agent.model.start_chat.return_value.send_message.side_effect = google_exceptions.ResourceExhausted("quota")
+        fallback = self.agent._reply_model(MODEL_LIGHT)
+        fallback.start_chat.return_value.send_message.return_value.parts = []
+        fallback.start_chat.return_value.send_message.return_value.text = "Resposta do modelo reserva"
+
+        response = self.agent.generate_response("Tenho 10 mil reais, como começo a dolarizar?", [], user_id="u1", user_profile={})
+        self.assertEqual(response, "Resposta do modelo reserva")
+        # The fallback reply model carries the same system prompt and tools
+        self.assertIn("tools", self.mock_genai.GenerativeModel.call_args.kwargs)
+
+    def test_followup_uses_persona_prompt(self):
+        # The primary model fails, so both models of the follow-up chain are used
+        self.agent.model.generate_content.side_effect = google_exceptions.ResourceExhausted("quota")
+        fallback = self.agent._reply_model(MODEL_LIGHT)
+        fallback.generate_content.return_value.text = " Oi Ana, conseguiu avançar? "
+
+        self.assertEqual(self.agent.generate_followup_message({"nome": "Ana"}), "Oi Ana, conseguiu avançar?")
+        for model in (self.agent.model, fallback):
+            self.assertEqual(model.generate_content.call_args.kwargs["tool_config"], agent_core.NO_TOOL_CALLS)
+        # Built with SYSTEM_PROMPT (the André persona and hard rules), never the lean instruction
+        for call in self.mock_genai.GenerativeModel.call_args_list:
+            if call.kwargs["model_name"] in (MODEL_MAIN, MODEL_LIGHT) and "tools" in call.kwargs:
+                instruction = "".join(call.kwargs["system_instruction"])
+                for section in (agent_core.DEFAULT_IDENTITY, agent_core.DEFAULT_NUCLEAR, agent_core.DEFAULT_LOGIC):
+                    self.assertIn(section.strip(), instruction)
+                self.assertNotIn(LEAN_INSTRUCTION, instruction)
+        self.assertFalse([key for key in self.models if key[1] == "lean"])
+
+    def test_followup_without_knowledge_base_uses_system_prompt(self):
+        self.agent._reply_model_kwargs = {"system_instruction": agent_core.SYSTEM_PROMPT}
+        self.agent.model.generate_content.side_effect = google_exceptions.ResourceExhausted("quota")
+        self.agent._reply_model(MODEL_LIGHT).generate_content.return_value.text = "Oi!"
+
+        self.assertEqual(self.agent.generate_followup_message({}), "Oi!")
+        self.assertEqual(self.mock_genai.GenerativeModel.call_args.kwargs["system_instruction"], agent_core.SYSTEM_PROMPT)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import unittest
+from unittest.mock import MagicMock, patch
+import sys
+import os
+import time
+import threading
+
+# Ensure backend directory is in sys.path
+backend_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if backend_path not in sys.path:
+    sys.path.insert(0, backend_path)
+
+from services.model_scheduler import ModelScheduler, QueueTimeout, priority_for
+from services.model_client import ModelClient
+
+ALL_CLASSES = {"live": 4, "followup": 4, "analysis": 4, "insights": 4}
+
+
+class TestModelScheduler(unittest.TestCase):
+    def test_purpose_classes(self):
+        self.assertEqual(priority_for("response"), "live")
+        self.assertEqual(priority_for("followup"), "followup")
+        self.assertEqual(priority_for("qualification"), "analysis")
+        self.assertEqual(priority_for("insights"), "insights")
+
+    def test_live_reply_jumps_the_queue(self):
+        scheduler = ModelScheduler(max_concurrency=1, concurrency=ALL_CLASSES, rpm=0, class_rpm={})
+        held = scheduler.acquire("summary")
+        order = []
+
+        def wait_for_slot(purpose):
+            with scheduler.slot(purpose, timeout=5):
+                order.append(purpose)
+
+        threads = [threading.Thread(target=wait_for_slot, args=(p,)) for p in ("insights", "qualification", "response")]
+        for thread in threads:
+            thread.start()
+            time.sleep(0.05)
+
+        scheduler.release(held)
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(order, ["response", "qualification", "insights"])
+
+    def test_class_cap_leaves_room_for_live(self):
+        scheduler = ModelScheduler(max_concurrency=3, concurrency={"live": 3, "followup": 1, "analysis": 1, "insights": 1},
+                                   rpm=0, class_rpm={})
+        scheduler.acquire("insights")
+        with self.assertRaises(QueueTimeout):
+            scheduler.acquire("insights", timeout=0.05)
+        # A blocked insights call doesn't hold up other classes
+        self.assertEqual(scheduler.acquire("response", timeout=0.05), "live")
+        self.assertEqual(scheduler.stats()["insights"]["active"], 1)
+
+    def test_rate_limit_per_class(self):
+        scheduler = ModelScheduler(max_concurrency=10, concurrency=ALL_CLASSES, rpm=0,
+                                   class_rpm={"followup": 2})
+        for _ in range(2):
+            scheduler.release(scheduler.acquire("followup"))
+        with self.assertRaises(QueueTimeout):
+            scheduler.acquire("followup", timeout=0.05)
+        self.assertEqual(scheduler.acquire("response", timeout=0.05), "live")
+
+    def test_queue_timeout_does_not_trip_breaker(self):
+        scheduler = ModelScheduler(max_concurrency=1, concurrency=ALL_CLASSES, rpm=0, class_rpm={})
+        scheduler.acquire("response")
+        client = ModelClient(sleep=lambda seconds: None, scheduler=scheduler)
+        fn = MagicMock(return_value="ok")
+
+        with patch.dict(os.environ, {"MODEL_DEADLINE_EXTRACTION": "0.05"}):
+            with self.assertRaises(QueueTimeout):
+                client.call("extraction", fn, "prompt", model_name="m")
+        fn.assert_not_called()
+        self.assertEqual(client.breaker("m").state, "closed")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+import datetime
+import sys
+import os
+
+# Ensure backend directory is in sys.path
+backend_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if backend_path not in sys.path:
+    sys.path.insert(0, backend_path)
+
+from memory_store import InMemoryFirestore
+from database import FirestoreClient
+from scripts.backfill_query_fields import backfill
+
+OLD = (datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(hours=48)).isoformat()
+
+
+class TestIndexedListings(unittest.TestCase):
+    def setUp(self):
+        self.store = InMemoryFirestore()
+        self.client = FirestoreClient(backend=self.store)
+        users = self.store.collection("usuarios")
+        users.document("fresh").set({"last_interaction_timestamp": OLD, "follow_up_count": 0})
+        users.document("capped").set({"last_interaction_timestamp": OLD, "follow_up_count": 3})
+        users.document("legacy").set({"last_interaction_timestamp": OLD})
+        files = self.store.collection("knowledge_base")
+        files.document("k_old").set({"name": "old.txt", "created_at": "2025-01-01T00:00:00"})
+        files.document("p1").set({"name": "p.txt", "type": "persona", "created_at": "2025-02-01T00:00:00"})
+
+    def followup_ids(self):
+        return sorted(u["id"] for u in self.client.get_users_needing_followup(hours_inactive=24))
+
+    def test_fallback_finds_legacy_documents_until_backfill(self):
+        # Default: scan, so legacy documents are found before the backfill
+        self.assertEqual(self.followup_ids(), ["fresh", "legacy"])
+        self.assertEqual([f["id"] for f in self.client.get_knowledge_files("knowledge")], ["k_old"])
+
+        # Indexed queries skip them until the backfill has run
+        self.client.legacy_query_fallback = False
+        self.assertEqual(self.followup_ids(), ["fresh"])
+        self.assertEqual([f["id"] for f in self.client.get_knowledge_files("knowledge")], [])
+
+    def test_backfill_then_indexed_queries_read_only_matches(self):
+        self.assertEqual(backfill(self.client, dry_run=True), {"users": 1, "knowledge_files": 1})
+        self.assertEqual(backfill(self.client), {"users": 1, "knowledge_files": 1})
+        self.assertEqual(backfill(self.client), {"users": 0, "knowledge_files": 0})
+
+        self.client.legacy_query_fallback = False
+        self.store.stats.reset()
+        self.assertEqual(self.followup_ids(), ["fresh", "legacy"])
+        self.assertEqual([f["id"] for f in self.client.get_knowledge_files("persona")], ["p1"])
+        collections = self.store.get_stats()["collections"]
+        self.assertEqual(collections["usuarios"]["reads"], 2)
+        self.assertEqual(collections["knowledge_base"]["reads"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
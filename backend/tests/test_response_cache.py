@@ -0,0 +1,88 @@
+import unittest
+from unittest.mock import MagicMock
+import sys
+import os
+
+# Ensure backend directory is in sys.path
+backend_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if backend_path not in sys.path:
+    sys.path.insert(0, backend_path)
+
+from services.response_cache import ResponseCache, similarity_terms, GREETING_KEY
+from helpers import make_agent
+
+
+class TestSimilarityTerms(unittest.TestCase):
+    def test_openers_normalize_to_same_key(self):
+        key = similarity_terms("Quanto custa?")
+        self.assertEqual(similarity_terms("oi, boa tarde! quanto CUSTA"), key)
+        self.assertEqual(similarity_terms("Olá, quanto custa??"), key)
+        self.assertEqual(similarity_terms("Oi, tudo bem?"), frozenset([GREETING_KEY]))
+
+    def test_long_or_specific_messages_not_cacheable(self):
+        self.assertIsNone(similarity_terms("x" * 200))
+        self.assertIsNone(similarity_terms("tenho 50 mil reais aplicados em CDB e quero saber se vale dolarizar parte"))
+        self.assertIsNone(similarity_terms("?!"))
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = ResponseCache(enabled=True, max_history=0, variants=2)
+        self.cache.set_version("v1")
+
+    def test_serves_after_variants_collected(self):
+        terms = self.cache.cache_terms("Quanto custa?", [])
+        self.assertIsNone(self.cache.get(terms))
+        self.cache.put(terms, "Resposta 1")
+        self.assertIsNone(self.cache.get(terms))
+        self.cache.put(terms, "Resposta 2")
+
+        answer = self.cache.get(self.cache.cache_terms("quanto custa", []))
+        self.assertIn(answer, ["Resposta 1", "Resposta 2"])
+
+    def test_only_empty_history_without_summary(self):
+        self.assertIsNone(self.cache.cache_terms("Quanto custa?", [{"role": "user", "parts": ["oi"]}]))
+        self.assertIsNone(self.cache.cache_terms("Quanto custa?", [], summary="Usuário perguntou do preço."))
+
+    def test_new_version_invalidates(self):
+        terms = self.cache.cache_terms("É seguro?", [])
+        self.cache.put(terms, "Sim")
+        self.cache.put(terms, "Sim")
+        self.assertEqual(self.cache.get(terms), "Sim")
+
+        self.cache.set_version("v1")
+        self.assertEqual(self.cache.get(terms), "Sim")
+        self.cache.set_version("v2")
+        self.assertIsNone(self.cache.get(terms))
+
+
+class TestAgentResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.agent, self.mock_genai, self.mock_db = make_agent(self)
+        self.agent.response_cache.enabled = True
+        self.agent.response_cache.variants = 1
+
+        self.mock_chat = MagicMock()
+        self.mock_chat.send_message.return_value.parts = []
+        self.mock_chat.send_message.return_value.text = "Custa R$ 997."
+        self.agent.model.start_chat.return_value = self.mock_chat
+
+    def test_first_message_cached_until_refresh(self):
+        self.assertEqual(self.agent.generate_response("Quanto custa?", [], user_id="u1", user_profile={}), "Custa R$ 997.")
+        self.assertEqual(self.agent.generate_response("quanto custa", [], user_id="u2", user_profile={}), "Custa R$ 997.")
+        self.assertEqual(self.mock_chat.send_message.call_count, 1)
+
+        # Returning users are never served from the cache
+        self.agent.generate_response("Quanto custa?", [{"role": "model", "parts": ["Olá!"]}], user_id="u3", user_profile={})
+        self.assertEqual(self.mock_chat.send_message.call_count, 2)
+
+        # A knowledge base change invalidates the cached answer
+        self.mock_db.get_config_content.side_effect = lambda key, default: default + " (v2)"
+        self.agent.refresh_knowledge_base()
+        self.agent.model.start_chat.return_value = self.mock_chat
+        self.agent.generate_response("Quanto custa?", [], user_id="u4", user_profile={})
+        self.assertEqual(self.mock_chat.send_message.call_count, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import unittest
+from unittest.mock import MagicMock
+import sys
+import os
+
+# Ensure backend directory is in sys.path
+backend_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if backend_path not in sys.path:
+    sys.path.insert(0, backend_path)
+
+from services.token_budget import ContextAssembler, estimate_tokens, DEFAULT_FILE_TOKENS
+from helpers import make_agent
+
+
+def make_history(turns, size=400):
+    return [{"role": "user" if i % 2 == 0 else "model", "parts": [f"turn {i} " + "x" * size]} for i in range(turns)]
+
+
+class TestEstimateTokens(unittest.TestCase):
+    def test_estimates(self):
+        self.assertEqual(estimate_tokens("abcd" * 10), 10)
+        self.assertEqual(estimate_tokens(""), 0)
+        self.assertEqual(estimate_tokens({"role": "user", "parts": ["abcd", "abcd"]}), 2)
+        self.assertEqual(estimate_tokens(object()), DEFAULT_FILE_TOKENS)
+
+
+class TestContextAssembler(unittest.TestCase):
+    def test_everything_fits(self):
+        assembler = ContextAssembler(budget=100000, response_reserve=0)
+        history = make_history(6)
+        result = assembler.assemble("oi", history, system_tokens=500, context_files=["a" * 400])
+
+        self.assertEqual(result.history, history)
+        self.assertEqual(result.context_files, ["a" * 400])
+        self.assertEqual(result.accounting["turns_dropped"], 0)
+
+    def test_history_trimmed_oldest_first(self):
+        assembler = ContextAssembler(budget=1000, response_reserve=0)
+        history = make_history(20)
+        result = assembler.assemble("oi", history)
+
+        self.assertLess(len(result.history), 20)
+        self.assertEqual(result.history, history[-len(result.history):])
+        self.assertLessEqual(result.accounting["total"], 1000)
+
+    def test_knowledge_priority_and_truncation(self):
+        assembler = ContextAssembler(budget=2000, response_reserve=0, shares={"knowledge": 1.0, "summary": 0, "history": 0})
+        persona = "p" * 4000       # 1000 tokens
+        knowledge = "k" * 8000     # 2000 tokens, doesn't fit whole
+        native_file = object()     # DEFAULT_FILE_TOKENS, can't be truncated
+
+        result = assembler.assemble("oi", [], context_files=[persona, knowledge, native_file])
+
+        self.assertEqual(result.context_files[0], persona)
+        self.assertTrue(result.context_files[1].startswith("k"))
+        self.assertLess(len(result.context_files[1]), len(knowledge))
+        self.assertEqual(len(result.context_files), 2)
+        self.assertEqual(result.accounting["files_dropped"], 1)
+
+    def test_unused_share_is_redistributed(self):
+        assembler = ContextAssembler(budget=4000, response_reserve=0)
+        history = make_history(20)
+        # No knowledge or summary: history can use the whole budget, not just its 35% share
+        result = assembler.assemble("oi", history)
+        self.assertGreater(result.accounting["history"], 4000 * 0.35)
+
+    def test_summary_keeps_most_recent_text(self):
+        assembler = ContextAssembler(budget=100, response_reserve=0, shares={"knowledge": 0, "summary": 1.0, "history": 0})
+        summary = "antigo " * 100 + "RECENTE"
+        result = assembler.assemble("oi", [], summary=summary)
+        self.assertTrue(result.summary.endswith("RECENTE"))
+        self.assertLess(len(result.summary), len(summary))
+
+    def test_exact_mode_logs_api_count(self):
+        assembler = ContextAssembler(count_mode="exact")
+        accounting = assembler.assemble("oi", []).accounting
+        assembler.log_accounting(accounting, exact_counter=lambda: 42)
+        self.assertEqual(accounting["exact_total"], 42)
+
+
+class TestAgentTokenBudget(unittest.TestCase):
+    def setUp(self):
+        self.agent, self.mock_genai, self.mock_db = make_agent(self)
+
+    def test_long_history_is_trimmed_before_sending(self):
+        self.agent.context_assembler = ContextAssembler(budget=self.agent.system_tokens + 2000, response_reserve=0)
+        mock_chat = MagicMock()
+        mock_chat.send_message.return_value.parts = []
+        self.agent.model.start_chat.return_value = mock_chat
+
+        history = make_history(50)
+        self.agent.generate_response("oi", history, user_id="user_1", user_profile={})
+
+        sent_history = self.agent.model.start_chat.call_args[1]["history"]
+        self.assertLess(len(sent_history), 50)
+        self.assertEqual(sent_history, history[-len(sent_history):])
+
+
+if __name__ == '__main__':
+    unittest.main()
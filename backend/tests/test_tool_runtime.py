@@ -0,0 +1,135 @@
+import unittest
+from unittest.mock import MagicMock
+import time
+import sys
+import os
+
+# Ensure backend directory is in sys.path
+backend_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if backend_path not in sys.path:
+    sys.path.insert(0, backend_path)
+
+from services.tool_runtime import ToolContext, ToolRuntime
+from helpers import make_agent
+from agent_core import MAX_TOOL_ROUNDS, NO_TOOL_CALLS
+
+
+class TestToolRuntime(unittest.TestCase):
+    def test_calls_in_same_turn_run_in_parallel(self):
+        runtime = ToolRuntime()
+
+        def slow_tool(ctx, value):
+            time.sleep(0.2)
+            return f"{ctx.user_id}:{value}"
+
+        runtime.register("slow_tool", slow_tool)
+        ctx = ToolContext(user_id="user_1")
+
+        start = time.perf_counter()
+        results = runtime.run_calls([("slow_tool", {"value": "a"}), ("slow_tool", {"value": "b"})], ctx)
+        elapsed = time.perf_counter() - start
+
+        self.assertEqual(results, [("slow_tool", "user_1:a"), ("slow_tool", "user_1:b")])
+        self.assertLess(elapsed, 0.35)
+
+        stats = runtime.get_stats()["slow_tool"]
+        self.assertEqual(stats["calls"], 2)
+        self.assertGreaterEqual(stats["max_ms"], 200)
+
+    def test_unknown_tool_and_errors_are_returned_as_text(self):
+        runtime = ToolRuntime()
+
+        def broken_tool(ctx):
+            raise RuntimeError("boom")
+
+        runtime.register("broken_tool", broken_tool)
+        ctx = ToolContext(user_id="user_1")
+
+        name, result = runtime.run("missing_tool", {}, ctx)
+        self.assertIn("não disponível", result)
+
+        name, result = runtime.run("broken_tool", {}, ctx)
+        self.assertIn("Erro", result)
+        self.assertEqual(runtime.get_stats()["broken_tool"]["errors"], 1)
+
+    def test_profile_is_loaded_once(self):
+        mock_db = MagicMock()
+        mock_db.get_user.return_value = {"classificacao_lead": "A"}
+        ctx = ToolContext(user_id="user_1", db=mock_db)
+
+        ctx.get_profile()
+        ctx.get_profile()
+        mock_db.get_user.assert_called_once_with("user_1")
+
+        # An explicitly provided profile (even empty) is never re-read
+        ctx = ToolContext(user_id="user_1", db=mock_db, user_profile={})
+        ctx.get_profile()
+        mock_db.get_user.assert_called_once()
+
+
+class TestAgentToolLoop(unittest.TestCase):
+    def setUp(self):
+        self.agent, self.mock_genai, self.mock_db = make_agent(self)
+        self.mock_calendar = MagicMock()
+        self.mock_calendar.get_free_slots.return_value = "14:00, 15:30"
+
+    def test_calendar_tool_uses_context_profile(self):
+        ctx = ToolContext(user_id="user_1", user_profile={"classificacao_lead": "A - Qualificado"}, db=self.mock_db, calendar=self.mock_calendar)
+
+        result = self.agent._run_check_calendar_availability(ctx, "tomorrow")
+
+        self.assertEqual(result, "14:00, 15:30")
+        self.mock_db.get_user.assert_not_called()
+
+    def test_generate_response_executes_function_calls(self):
+        function_call = MagicMock()
+        function_call.name = "extract_lead_info"
+        function_call.args = {"name": "Carlos", "profile_category": "A_ESTRUTURADO"}
+        tool_turn = MagicMock()
+        tool_turn.parts = [MagicMock(function_call=function_call)]
+
+        final_turn = MagicMock()
+        final_turn.parts = []
+        final_turn.text = "Olá Carlos!"
+
+        mock_chat = MagicMock()
+        mock_chat.send_message.side_effect = [tool_turn, final_turn]
+        self.agent.model.start_chat.return_value = mock_chat
+
+        result = self.agent.generate_response("Sou o Carlos", [], user_id="user_1", user_profile={})
+
+        self.assertEqual(result, "Olá Carlos!")
+        self.assertEqual(mock_chat.send_message.call_count, 2)
+        saved = self.mock_db.save_lead.call_args[0][0]
+        self.assertEqual(saved["id"], "user_1")
+        self.assertEqual(saved["nome"], "Carlos")
+        self.assertEqual(self.agent.tool_runtime.get_stats()["extract_lead_info"]["calls"], 1)
+
+    def test_last_tool_round_answers_without_tools(self):
+        function_call = MagicMock()
+        function_call.name = "extract_lead_info"
+        function_call.args = {"name": "Carlos"}
+        tool_turn = MagicMock()
+        tool_turn.parts = [MagicMock(function_call=function_call)]
+
+        final_turn = MagicMock()
+        final_turn.parts = []
+        final_turn.text = "Olá Carlos!"
+
+        # The model keeps asking for tools until they are switched off
+        mock_chat = MagicMock()
+        mock_chat.send_message.side_effect = lambda *args, **kwargs: final_turn if kwargs.get("tool_config") else tool_turn
+        self.agent.model.start_chat.return_value = mock_chat
+
+        result = self.agent.generate_response("Sou o Carlos", [], user_id="user_1", user_profile={})
+
+        self.assertEqual(result, "Olá Carlos!")
+        sends = mock_chat.send_message.call_args_list
+        self.assertEqual(len(sends), MAX_TOOL_ROUNDS + 1)
+        self.assertEqual([c.kwargs.get("tool_config") for c in sends],
+                         [None] * MAX_TOOL_ROUNDS + [NO_TOOL_CALLS])
+        self.assertEqual(self.agent.tool_runtime.get_stats()["extract_lead_info"]["calls"], MAX_TOOL_ROUNDS)
+
+
+if __name__ == '__main__':
+    unittest.main()
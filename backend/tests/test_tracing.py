@@ -0,0 +1,112 @@
+import unittest
+from unittest.mock import MagicMock
+import sys
+import os
+import asyncio
+
+# Ensure backend directory is in sys.path
+backend_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if backend_path not in sys.path:
+    sys.path.insert(0, backend_path)
+
+from services.tracing import tracer, traced_task, parse_traceparent, InMemorySpanExporter
+from services.tool_runtime import ToolRuntime, ToolContext
+from helpers import make_agent
+
+
+class TracingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.exporter = InMemorySpanExporter()
+        tracer.add_exporter(self.exporter)
+
+    def tearDown(self):
+        tracer.remove_exporter(self.exporter)
+
+    def spans_by_name(self):
+        return {s.name: s for s in self.exporter.get_finished_spans()}
+
+
+class TestTracer(TracingTestCase):
+    def test_nesting_and_message_id(self):
+        with tracer.start_span("root", message_id="msg-1") as root:
+            with tracer.start_span("child"):
+                pass
+
+        spans = self.spans_by_name()
+        self.assertEqual(spans["child"].parent_span_id, root.span_id)
+        self.assertEqual(spans["child"].trace_id, root.trace_id)
+        self.assertEqual(spans["child"].attributes["message.id"], "msg-1")
+        self.assertEqual(len(self.exporter.get_finished_spans(message_id="msg-1")), 2)
+        self.assertEqual(spans["root"].status, "OK")
+
+    def test_exception_marks_span_as_error(self):
+        with self.assertRaises(ValueError):
+            with tracer.start_span("boom"):
+                raise ValueError("bad")
+
+        span = self.spans_by_name()["boom"]
+        self.assertEqual(span.status, "ERROR")
+        self.assertEqual(span.events[0]["attributes"]["exception.type"], "ValueError")
+
+    def test_traced_task_links_to_request(self):
+        with tracer.start_span("request", message_id="msg-2"):
+            task = traced_task("background", lambda: None)
+            async_task = traced_task("background.async", asyncio.sleep)
+
+        task()
+        asyncio.run(async_task(0))
+
+        spans = self.exporter.get_finished_spans(message_id="msg-2")
+        request = next(s for s in spans if s.name == "request")
+        background = next(s for s in spans if s.name == "background")
+        self.assertEqual(background.parent_span_id, request.span_id)
+        self.assertIn("background.async", [s.name for s in spans])
+
+    def test_parse_traceparent(self):
+        ctx = parse_traceparent("00-" + "a" * 32 + "-" + "b" * 16 + "-01")
+        self.assertEqual(ctx.trace_id, "a" * 32)
+        self.assertEqual(ctx.to_traceparent(), "00-" + "a" * 32 + "-" + "b" * 16 + "-01")
+        self.assertIsNone(parse_traceparent("garbage"))
+
+        with tracer.start_span("resumed", parent=ctx):
+            pass
+        self.assertEqual(self.spans_by_name()["resumed"].parent_span_id, "b" * 16)
+
+
+class TestToolSpans(TracingTestCase):
+    def test_tool_failure_recorded_on_span(self):
+        runtime = ToolRuntime()
+        runtime.register("ok_tool", lambda ctx: "ok")
+        runtime.register("bad_tool", lambda ctx: 1 / 0)
+
+        with tracer.start_span("turn", message_id="msg-3"):
+            runtime.run_calls([("ok_tool", {}), ("bad_tool", {})], ToolContext(user_id="u1"))
+
+        spans = {s.name: s for s in self.exporter.get_finished_spans(message_id="msg-3")}
+        self.assertEqual(spans["tool.ok_tool"].status, "OK")
+        self.assertEqual(spans["tool.bad_tool"].status, "ERROR")
+        self.assertEqual(spans["tool.ok_tool"].parent_span_id, spans["turn"].span_id)
+
+
+class TestAgentSpans(TracingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.agent, self.mock_genai, self.mock_db = make_agent(self)
+
+    def test_generate_response_spans(self):
+        mock_chat = MagicMock()
+        mock_chat.send_message.return_value.parts = []
+        self.agent.model.start_chat.return_value = mock_chat
+
+        with tracer.start_span("chat.turn", message_id="msg-4"):
+            self.agent.generate_response("oi", [], user_id="user_1", user_profile={})
+
+        spans = {s.name: s for s in self.exporter.get_finished_spans(message_id="msg-4")}
+        self.assertIn("context.assemble", spans)
+        self.assertEqual(spans["model.response"].parent_span_id, spans["agent.generate_response"].span_id)
+        self.assertEqual(spans["agent.generate_response"].parent_span_id, spans["chat.turn"].span_id)
+        self.assertEqual(spans["agent.generate_response"].attributes["agent.tool_rounds"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
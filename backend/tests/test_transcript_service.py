@@ -0,0 +1,69 @@
+import unittest
+from unittest.mock import MagicMock, patch
+import sys
+import os
+
+# Ensure backend directory is in sys.path
+backend_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if backend_path not in sys.path:
+    sys.path.insert(0, backend_path)
+
+from services.transcript_service import TranscriptService, parse_video_id
+
+
+class TestParseVideoId(unittest.TestCase):
+    def test_supported_url_formats(self):
+        self.assertEqual(parse_video_id("https://www.youtube.com/watch?v=abc123&t=10"), "abc123")
+        self.assertEqual(parse_video_id("https://youtu.be/abc123?si=xyz"), "abc123")
+        self.assertEqual(parse_video_id("https://www.youtube.com/shorts/abc123"), "abc123")
+        self.assertIsNone(parse_video_id("https://example.com/video"))
+        self.assertIsNone(parse_video_id(""))
+
+
+class TestTranscriptService(unittest.TestCase):
+    def setUp(self):
+        self.mock_db = MagicMock()
+        self.mock_db.get_cached_transcript.return_value = None
+        self.service = TranscriptService(db=self.mock_db, max_entries=2)
+
+        self.patch_fetch = patch.object(TranscriptService, '_fetch_remote', return_value=("olá mundo", "pt"))
+        self.mock_fetch = self.patch_fetch.start()
+
+    def tearDown(self):
+        self.patch_fetch.stop()
+
+    def test_repeat_lookups_hit_memory(self):
+        self.assertEqual(self.service.get_transcript("vid1"), "olá mundo")
+        self.assertEqual(self.service.get_transcript("vid1"), "olá mundo")
+
+        self.mock_fetch.assert_called_once()
+        self.mock_db.get_cached_transcript.assert_called_once_with("vid1_pt-en")
+        self.mock_db.save_cached_transcript.assert_called_once()
+        saved = self.mock_db.save_cached_transcript.call_args[0][1]
+        self.assertEqual(saved["language"], "pt")
+        self.assertEqual(self.service.stats["memory_hits"], 1)
+
+    def test_firestore_hit_skips_youtube(self):
+        self.mock_db.get_cached_transcript.return_value = {"text": "cached text"}
+
+        self.assertEqual(self.service.get_transcript("vid2"), "cached text")
+        self.mock_fetch.assert_not_called()
+        self.mock_db.save_cached_transcript.assert_not_called()
+
+    def test_lru_evicts_oldest_entry(self):
+        for video_id in ("a", "b", "c"):
+            self.service.get_transcript(video_id)
+
+        self.service.get_transcript("a")
+        self.assertEqual(self.mock_fetch.call_count, 4)
+
+    def test_prewarm(self):
+        self.assertTrue(self.service.prewarm("https://youtu.be/vid3"))
+        self.assertFalse(self.service.prewarm("not a url"))
+
+        self.mock_fetch.side_effect = Exception("Transcripts disabled")
+        self.assertFalse(self.service.prewarm("https://youtu.be/vid4"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+import unittest
+from unittest.mock import MagicMock, patch
+from types import SimpleNamespace
+import sys
+import os
+
+# Ensure backend directory is in sys.path
+backend_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if backend_path not in sys.path:
+    sys.path.insert(0, backend_path)
+
+from services import metrics
+from services.usage_tracker import UsageTracker, UNATTRIBUTED, estimate_cost, extract_usage, parse_prices
+from services.model_router import MODEL_MAIN, MODEL_LIGHT
+from memory_store import InMemoryFirestore
+from database import FirestoreClient
+from helpers import make_agent
+
+
+def fake_response(prompt=100, output=20, cached=0):
+    return SimpleNamespace(usage_metadata=SimpleNamespace(
+        prompt_token_count=prompt, candidates_token_count=output, cached_content_token_count=cached
+    ))
+
+
+class TestUsageTracker(unittest.TestCase):
+    def setUp(self):
+        metrics.registry.reset()
+        self.tracker = UsageTracker(flush_every_calls=3, flush_interval_seconds=3600)
+        self.client = FirestoreClient(backend=InMemoryFirestore())
+
+    def test_extract_usage(self):
+        self.assertEqual(extract_usage(fake_response(100, 20, 40)), {"prompt_tokens": 100, "cached_tokens": 40, "output_tokens": 20})
+        self.assertIsNone(extract_usage(SimpleNamespace()))
+        # Mocks without real counts are ignored
+        self.assertIsNone(extract_usage(MagicMock()))
+
+    def test_cached_tokens_billed_at_cached_rate(self):
+        self.assertLess(estimate_cost(1000, 800, 0), estimate_cost(1000, 0, 0))
+
+    def test_cost_priced_per_model(self):
+        # The light model is several times cheaper; calls without a model are priced as the main one
+        self.assertLess(estimate_cost(1000, 0, 100, model_name=MODEL_LIGHT), estimate_cost(1000, 0, 100, model_name=MODEL_MAIN))
+        self.assertEqual(estimate_cost(1000, 0, 100), estimate_cost(1000, 0, 100, model_name=MODEL_MAIN))
+        self.assertEqual(estimate_cost(1000, 0, 100, model_name="unknown-model"), estimate_cost(1000, 0, 100))
+
+        light = self.tracker.record("extraction", fake_response(1000, 100), model_name=MODEL_LIGHT)
+        main = self.tracker.record("response", fake_response(1000, 100), model_name=MODEL_MAIN)
+        self.assertLess(light["cost_usd"], main["cost_usd"])
+
+    def test_parse_prices(self):
+        self.assertEqual(parse_prices("m1=1/2/0.5; m2 = 0.1/0.4/0.025;bad=1/2;=1/2/3"),
+                         {"m1": (1.0, 2.0, 0.5), "m2": (0.1, 0.4, 0.025)})
+
+    def test_attribution_and_counters(self):
+        with self.tracker.attribute_to("u1"):
+            self.tracker.record("response", fake_response(100, 20))
+            with self.tracker.attribute_to(None):
+                self.tracker.record("summary", fake_response(50, 10))
+        self.tracker.record("response", fake_response(10, 1))
+
+        pending = {r["user_id"]: r for r in self.tracker.pending_rollups()}
+        self.assertEqual(pending["u1"]["prompt_tokens"], 150)
+        self.assertEqual(pending["u1"]["by_purpose"]["summary"]["calls"], 1)
+        self.assertEqual(pending[UNATTRIBUTED]["calls"], 1)
+        self.assertEqual(metrics.MODEL_TOKENS.get(purpose="response", kind="prompt"), 110)
+
+    def test_flush_writes_rollups_when_due(self):
+        with self.tracker.attribute_to("u1"):
+            self.tracker.record("response", fake_response())
+            self.tracker.record("qualification", fake_response())
+        self.assertEqual(self.tracker.flush_if_due(self.client), 0)
+
+        with self.tracker.attribute_to("u2"):
+            self.tracker.record("response", fake_response(prompt=1000))
+        self.assertEqual(self.tracker.flush_if_due(self.client), 2)
+        self.assertEqual(self.tracker.pending_rollups(), [])
+
+        # Second flush increments the same daily documents
+        with self.tracker.attribute_to("u1"):
+            self.tracker.record("response", fake_response())
+        self.tracker.flush(self.client)
+
+        rollups = self.client.get_usage_rollups("2000-01-01")
+        report = UsageTracker.summarize(rollups)
+        self.assertEqual(len(rollups), 2)
+        self.assertEqual(report["totals"]["calls"], 4)
+        self.assertEqual(report["top_users"][0]["user_id"], "u2")
+        by_purpose = {row["purpose"]: row for row in report["by_purpose"]}
+        self.assertEqual(by_purpose["response"]["calls"], 3)
+        self.assertEqual(by_purpose["qualification"]["prompt_tokens"], 100)
+
+    def test_failed_flush_keeps_usage(self):
+        self.tracker.record("response", fake_response())
+        broken = MagicMock()
+        broken.increment_usage_rollups.side_effect = Exception("unavailable")
+
+        self.assertEqual(self.tracker.flush(broken), 0)
+        self.assertEqual(self.tracker.pending_rollups()[0]["calls"], 1)
+
+
+class TestAgentUsage(unittest.TestCase):
+    def setUp(self):
+        patcher_tracker = patch('agent_core.usage_tracker', UsageTracker())
+        self.tracker = patcher_tracker.start()
+        self.addCleanup(patcher_tracker.stop)
+        self.agent, self.mock_genai, self.mock_db = make_agent(self)
+
+    def test_response_usage_charged_to_user(self):
+        response = fake_response(300, 30)
+        response.parts = []
+        mock_chat = MagicMock()
+        mock_chat.send_message.return_value = response
+        self.agent.model.start_chat.return_value = mock_chat
+
+        self.agent.generate_response("oi", [], user_id="user_1", user_profile={})
+
+        pending = self.tracker.pending_rollups()
+        self.assertEqual(len(pending), 1)
+        self.assertEqual(pending[0]["user_id"], "user_1")
+        self.assertEqual(pending[0]["by_purpose"]["response"]["output_tokens"], 30)
+
+    def test_light_model_calls_priced_as_light(self):
+        lean = self.agent.router.lean_model("extraction", MODEL_LIGHT)
+        lean.generate_content.return_value = fake_response(1000, 100)
+        lean.generate_content.return_value.text = '{"nome": null, "email": null}'
+
+        self.agent.extract_contact_info("oi")
+
+        pending = self.tracker.pending_rollups()
+        self.assertAlmostEqual(pending[0]["by_purpose"]["extraction"]["cost_usd"],
+                               estimate_cost(1000, 0, 100, model_name=MODEL_LIGHT))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import unittest
+from unittest.mock import MagicMock
+import sys
+import os
+
+# Ensure backend directory is in sys.path
+backend_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if backend_path not in sys.path:
+    sys.path.insert(0, backend_path)
+
+from services.video_matcher import VideoMatcher, normalize_text, stem_tokens
+from helpers import make_agent
+
+VIDEOS = [
+    {"id": "pix", "title": "Pix na Bybit", "url": "https://youtu.be/pix", "trigger_context": "Usuário com dúvida sobre depósito via Pix, converter para USDC"},
+    {"id": "seed", "title": "Frase de recuperação", "url": "https://youtu.be/seed", "trigger_context": "Medo de perder a carteira Phantom, recovery phrase"},
+    {"id": "inflacao", "title": "Inflação", "url": "https://youtu.be/inf", "trigger_context": "Preocupação com a inflação e desvalorização do real"},
+]
+
+
+class TestVideoMatcher(unittest.TestCase):
+    def test_normalization(self):
+        self.assertEqual(normalize_text("Inflação, DÓLAR!"), "inflacao dolar")
+        self.assertEqual(stem_tokens("Os investimentos em dólar"), ["invest", "dolar"])
+
+    def test_matches_relevant_video_first(self):
+        matcher = VideoMatcher(VIDEOS)
+
+        candidates = matcher.match("Como faço o depósito por Pix para converter em USDC?")
+        self.assertEqual(candidates[0]["id"], "pix")
+
+        candidates = matcher.match("A inflação está desvalorizando meu dinheiro")
+        self.assertEqual([c["id"] for c in candidates], ["inflacao"])
+
+    def test_phrase_bonus(self):
+        matcher = VideoMatcher(VIDEOS)
+        with_phrase = matcher.match("minha recovery phrase sumiu")[0]["score"]
+        without_phrase = matcher.match("phrase recovery sumiu")[0]["score"]
+        self.assertGreater(with_phrase, without_phrase)
+
+    def test_no_match(self):
+        matcher = VideoMatcher(VIDEOS)
+        self.assertEqual(matcher.match("Oi, tudo bem?"), [])
+        self.assertEqual(VideoMatcher().match("Pix"), [])
+        self.assertEqual(VideoMatcher.format_candidates([]), "")
+
+    def test_top_k_limit(self):
+        videos = [{"id": f"v{i}", "title": "Pix", "trigger_context": "Pix na Bybit"} for i in range(10)]
+        self.assertEqual(len(VideoMatcher(videos).match("pix", top_k=3)), 3)
+
+
+class TestAgentVideoInjection(unittest.TestCase):
+    def setUp(self):
+        self.agent, self.mock_genai, self.mock_db = make_agent(self, videos=VIDEOS)
+
+    def test_catalogue_not_in_system_instruction(self):
+        system_instruction = "".join(self.mock_genai.GenerativeModel.call_args[1]["system_instruction"])
+        self.assertNotIn("https://youtu.be/pix", system_instruction)
+        self.assertNotIn("ID: pix", system_instruction)
+        self.assertIn("recommend_video", system_instruction)
+
+    def test_candidates_injected_into_turn(self):
+        mock_chat = MagicMock()
+        mock_chat.send_message.return_value.parts = []
+        self.agent.model.start_chat.return_value = mock_chat
+
+        self.agent.generate_response("Como faço Pix na Bybit?", [], user_id="user_1", user_profile={})
+
+        payload = mock_chat.send_message.call_args[0][0]
+        self.assertEqual(payload[0], "Como faço Pix na Bybit?")
+        self.assertIn("ID: pix", payload[1])
+        self.assertNotIn("ID: inflacao", payload[1])
+
+
+if __name__ == '__main__':
+    unittest.main()